@@ -18,16 +18,21 @@ from ltwin_manager.utils.config_manager import get_config_manager
 from ltwin_manager.ui.vm_config_dialog import VMConfigDialog
 from ltwin_manager.ui.system_check_dialog import SystemCheckDialog
 from ltwin_manager.ui.snapshot_dialog import SnapshotDialog
+from ltwin_manager.ui.backup_dialog import BackupDialog
 from ltwin_manager.ui.performance_report_dialog import PerformanceReportDialog
 from ltwin_manager.ui.settings_dialog import SettingsDialog
 from ltwin_manager.ui.vm_details_panel import VMDetailsPanel
 from ltwin_manager.ui.storage_management_dialog import StorageManagementDialog
 from ltwin_manager.ui.security_audit_dialog import SecurityAuditDialog
 from ltwin_manager.ui.security_config_dialog import SecurityConfigDialog
+from ltwin_manager.ui.diagnostics_dialog import DiagnosticsDialog, export_diagnostics
+from ltwin_manager.ui.image_library_dialog import ImageLibraryDialog
 from ltwin_manager.utils.clone_manager import get_clone_manager
 from ltwin_manager.utils.theme_manager import get_theme_manager
 from ltwin_manager.utils.storage_manager import get_storage_manager
+from ltwin_manager.utils.snapshot_scheduler import get_snapshot_scheduler
 from ltwin_manager.utils.permission_manager import get_permission_manager
+from ltwin_manager.utils.profiler import install_event_loop_probe
 
 from ltwin_manager.ui.dialogs.download_images_dialog import DownloadImagesDialog
 from ltwin_manager.ui.dialogs.vm_start_options_dialog import VMStartOptionsDialog
@@ -42,9 +47,13 @@ class MainWindow(QMainWindow):
         self.vm_controller = VMController(self.config_manager)
         self.clone_manager = get_clone_manager(self.config_manager)
         self.storage_manager = get_storage_manager(self.config_manager)
+        self.snapshot_scheduler = get_snapshot_scheduler(self.config_manager)
         self.permission_manager = get_permission_manager(self.config_manager)
         self.theme_manager = get_theme_manager(self.config_manager)
-        self.system_monitor = SystemMonitor()
+        self.system_monitor = SystemMonitor(self.config_manager)
+        
+        # 记录GUI线程事件循环延迟，用于定位界面卡顿
+        self.event_loop_probe = install_event_loop_probe(self)
         
         self.init_ui()
         self.setup_connections()
@@ -132,6 +141,10 @@ class MainWindow(QMainWindow):
         snapshot_action.triggered.connect(self.open_snapshot_manager)
         manager_menu.addAction(snapshot_action)
         
+        bulk_snapshot_action = QAction('批量快照(&A)', self)
+        bulk_snapshot_action.triggered.connect(self.snapshot_all_vms)
+        manager_menu.addAction(bulk_snapshot_action)
+        
         clone_action = QAction('克隆虚拟机(&C)', self)
         clone_action.triggered.connect(self.clone_selected_vm)
         manager_menu.addAction(clone_action)
@@ -178,6 +191,16 @@ class MainWindow(QMainWindow):
         performance_report_action.triggered.connect(self.open_performance_report)
         tools_menu.addAction(performance_report_action)
         
+        tools_menu.addSeparator()
+        
+        diagnostics_action = QAction('诊断信息(&D)', self)
+        diagnostics_action.triggered.connect(self.open_diagnostics)
+        tools_menu.addAction(diagnostics_action)
+        
+        dump_diagnostics_action = QAction('导出诊断数据(&E)', self)
+        dump_diagnostics_action.triggered.connect(lambda: export_diagnostics(self))
+        tools_menu.addAction(dump_diagnostics_action)
+        
         # 安全菜单
         security_menu = menubar.addMenu('安全(&S)')
         
@@ -334,10 +357,12 @@ class MainWindow(QMainWindow):
         self.cpu_label = QLabel('CPU: 0%')
         self.mem_label = QLabel('内存: 0GB/0GB')
         self.disk_label = QLabel('磁盘: 0GB/0GB')
+        self.io_label = QLabel('IO: -')
         
         self.status_bar.addPermanentWidget(self.cpu_label)
         self.status_bar.addPermanentWidget(self.mem_label)
         self.status_bar.addPermanentWidget(self.disk_label)
+        self.status_bar.addPermanentWidget(self.io_label)
         
         # 添加进度条
         self.progress_bar = QProgressBar()
@@ -377,10 +402,16 @@ class MainWindow(QMainWindow):
     def setup_connections(self):
         """设置信号连接"""
         self.tree_widget.itemClicked.connect(self.on_tree_item_clicked)
-        self.system_monitor.resource_updated.connect(self.update_resource_labels)
-        
-        # 启动系统监控
+        self.system_monitor.resource_delta.connect(self.apply_resource_delta)
+        self.system_monitor.disk_alert.connect(self.on_disk_alert)
+        self.system_monitor.pressure_alert.connect(self.on_pressure_alert)
+        self.system_monitor.set_vm_process_source(self.vm_controller.get_running_vm_pids)
+        self.storage_manager.job_queue.job_finished.connect(self.on_disk_job_finished)
+        self.snapshot_scheduler.snapshot_finished.connect(self.on_snapshot_finished)
+        
+        # 启动系统监控和快照计划
         self.system_monitor.start_monitoring()
+        self.snapshot_scheduler.start()
         
     def load_data(self):
         """加载数据"""
@@ -532,6 +563,27 @@ class MainWindow(QMainWindow):
         else:
             QMessageBox.warning(self, "警告", "请选择一个虚拟机")
     
+    def snapshot_all_vms(self):
+        """为所有虚拟机批量创建快照（后台依次错开执行）"""
+        if not self.snapshot_scheduler.snapshots_enabled():
+            QMessageBox.warning(self, "警告", "快照功能已在设置中禁用")
+            return
+        from datetime import datetime
+        default_name = f"批量快照 {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        snapshot_name, ok = QInputDialog.getText(self, "批量快照", "快照名称:", text=default_name)
+        if not ok or not snapshot_name.strip():
+            return
+        count = self.snapshot_scheduler.snapshot_all(snapshot_name=snapshot_name.strip())
+        self.statusBar().showMessage(f"已加入 {count} 台虚拟机的快照任务，将依次创建", 5000)
+    
+    def on_snapshot_finished(self, vm_name, success, message):
+        """计划或批量快照完成"""
+        if success:
+            self.statusBar().showMessage(f"{vm_name} {message}", 5000)
+        else:
+            self.statusBar().showMessage(f"{vm_name} {message}", 10000)
+            self.tray_icon.showMessage("自动快照失败", f"{vm_name} {message}", QSystemTrayIcon.MessageIcon.Warning)
+    
     def clone_selected_vm(self):
         """克隆选中的虚拟机"""
         current_item = self.tree_widget.currentItem()
@@ -728,8 +780,13 @@ class MainWindow(QMainWindow):
     
     def backup_vm(self):
         """备份虚拟机"""
-        # TODO: 实现虚拟机备份功能
-        QMessageBox.information(self, "备份虚拟机", "备份功能将在后续版本中实现")
+        current_item = self.tree_widget.currentItem()
+        data = current_item.data(0, Qt.ItemDataRole.UserRole) if current_item else None
+        if not data or data[0] != 'vm':
+            QMessageBox.warning(self, "警告", "请先选择一个虚拟机")
+            return
+        dialog = BackupDialog(data[1], self.config_manager, self)
+        dialog.exec()
     
     def manage_vm_configs(self):
         """管理虚拟机配置"""
@@ -759,14 +816,10 @@ class MainWindow(QMainWindow):
                 self.edit_selected_vm()
     
     def manage_image_configs(self):
-        """管理镜像文件配置"""
-        images = self.config_manager.list_images()
-        if not images:
-            QMessageBox.information(self, "镜像文件配置", "没有配置任何镜像文件")
-            return
-        
-        image_list = "\\n".join(images)
-        QMessageBox.information(self, "镜像文件配置", f"已配置的镜像文件:\\n{image_list}")
+        """管理镜像文件（去重镜像库）"""
+        dialog = ImageLibraryDialog(self.config_manager, self)
+        dialog.exec()
+        self.load_data()
     
     def open_system_check(self):
         """打开系统检测和修复工具"""
@@ -793,6 +846,11 @@ class MainWindow(QMainWindow):
         dialog = PerformanceReportDialog(self)
         dialog.exec()
     
+    def open_diagnostics(self):
+        """打开诊断信息"""
+        dialog = DiagnosticsDialog(self)
+        dialog.exec()
+    
     def open_settings(self):
         """打开设置"""
         dialog = SettingsDialog(self.config_manager, self)
@@ -830,21 +888,56 @@ class MainWindow(QMainWindow):
                          "LTWin Manager - 虚拟机管理软件\\n\\n版本: 1.0.0\\n\\n"
                          "一款基于PyQt6的虚拟机管理工具，用于管理QEMU/KVM虚拟机。")
     
-    def update_resource_labels(self, system_info):
-        """更新资源标签"""
-        if isinstance(system_info, dict):
-            cpu_percent = system_info.get('cpu_percent', 0)
-            mem_info = system_info.get('memory', {})
-            disk_info = system_info.get('disk', {})
+    def apply_resource_delta(self, delta):
+        """按增量更新资源标签，只刷新发生变化的标签"""
+        host_changes = delta.get('host')
+        if host_changes:
+            host = self.system_monitor.publisher.snapshot('host')
+            
+            if 'cpu_percent' in host_changes:
+                self.cpu_label.setText(f"CPU: {host.get('cpu_percent', 0):.1f}%")
+            
+            if 'memory.used_gb' in host_changes or 'memory.total_gb' in host_changes:
+                self.mem_label.setText(
+                    f"内存: {host.get('memory.used_gb', 0):.1f}GB/{host.get('memory.total_gb', 0):.1f}GB"
+                )
             
-            mem_used = mem_info.get('used_gb', 0)
-            mem_total = mem_info.get('total_gb', 0)
-            disk_used = disk_info.get('used_gb', 0)
-            disk_total = disk_info.get('total_gb', 0)
+            if 'disk.used_gb' in host_changes or 'disk.total_gb' in host_changes:
+                self.disk_label.setText(
+                    f"磁盘: {host.get('disk.used_gb', 0):.1f}GB/{host.get('disk.total_gb', 0):.1f}GB"
+                )
             
-            self.cpu_label.setText(f'CPU: {cpu_percent:.1f}%')
-            self.mem_label.setText(f'内存: {mem_used:.1f}GB/{mem_total:.1f}GB')
-            self.disk_label.setText(f'磁盘: {disk_used:.1f}GB/{disk_total:.1f}GB')
+            if any(key.startswith('disk_io.') for key in host_changes):
+                self.update_io_label(host)
+        
+        # 只把当前显示的虚拟机的变化交给详情面板
+        vm_name = self.vm_details_panel.vm_name
+        if vm_name and f"vm:{vm_name}" in delta:
+            vm_changes = delta[f"vm:{vm_name}"]
+            vm_metrics = self.system_monitor.publisher.snapshot(f"vm:{vm_name}") if vm_changes else {}
+            self.vm_details_panel.apply_vm_metrics(vm_changes, vm_metrics)
+    
+    def update_io_label(self, host):
+        """更新虚拟机存储所在设备的IO标签"""
+        for key, roles in host.items():
+            if key.startswith('disk_io.') and key.endswith('.roles') and 'vm_storage' in roles:
+                prefix = key[:-len('roles')]
+                iops = host.get(f'{prefix}read_iops', 0) + host.get(f'{prefix}write_iops', 0)
+                self.io_label.setText(
+                    f"IO: {iops:.0f} IOPS {host.get(f'{prefix}await_ms', 0):.1f}ms "
+                    f"Q{host.get(f'{prefix}queue_depth', 0):.1f}"
+                )
+                return
+    
+    def on_disk_alert(self, device, message):
+        """磁盘IO告警"""
+        self.status_bar.showMessage(f"⚠ {message}", 10000)
+    
+    def on_pressure_alert(self, key, message):
+        """资源压力告警"""
+        self.status_bar.showMessage(f"⚠ {message}", 10000)
+        if self.tray_icon.isVisible():
+            self.tray_icon.showMessage("资源压力告警", message, QSystemTrayIcon.MessageIcon.Warning)
     
     def tray_icon_activated(self, reason):
         """处理托盘图标激活事件"""
@@ -853,6 +946,15 @@ class MainWindow(QMainWindow):
             self.raise_()
             self.activateWindow()
     
+    def on_disk_job_finished(self, job_id, success, message):
+        """后台磁盘任务结束（存储管理对话框关闭后也会通知）"""
+        job = self.storage_manager.job_queue.get_job(job_id)
+        description = job['description'] if job else job_id
+        if success:
+            self.statusBar().showMessage(f"{description}: {message}", 5000)
+        elif job and job['status'] != 'cancelled':
+            self.statusBar().showMessage(f"{description} 失败: {message}", 10000)
+    
     def closeEvent(self, event):
         """关闭事件处理"""
         # 最小化到系统托盘而不是直接退出
@@ -862,4 +964,6 @@ class MainWindow(QMainWindow):
         else:
             # 停止监控
             self.system_monitor.stop_monitoring()
+            self.snapshot_scheduler.stop()
+            self.storage_manager.job_queue.cancel_all()
             event.accept()
\ No newline at end of file
@@ -7,6 +7,7 @@
 import subprocess
 import json
 import os
+import shlex
 from pathlib import Path
 from typing import Dict, List, Optional
 from dataclasses import dataclass
@@ -30,19 +31,30 @@ class VMConfig:
     last_started: str = ""
 
 
-from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+from ltwin_manager.utils.snapshot_manager import get_snapshot_manager, vm_drives
+from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+from ltwin_manager.utils.backup_manager import get_backup_manager
+from ltwin_manager.utils.qmp_client import qmp_command_args
+from ltwin_manager.utils.guest_agent import guest_agent_command_args
+from ltwin_manager.utils.qcow2_reader import is_qcow2
 from ltwin_manager.utils.network_manager import get_network_manager
 from ltwin_manager.utils.performance_optimizer import get_performance_optimizer
+from ltwin_manager.utils.profiler import timed
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
 
 class VMController:
+    DEFAULT_DISK_SIZE_GB = 20  # 新建虚拟机时自动创建的磁盘容量
+    
     def __init__(self, config_manager=None):
         self.vms: Dict[str, VMConfig] = {}
         self.running_processes: Dict[str, subprocess.Popen] = {}
         self.config_file = Path.home() / '.ltwin' / 'vms.json'
         self.config_manager = config_manager
         self.snapshot_manager = None
+        self.capacity_planner = None
         if config_manager:
             self.snapshot_manager = get_snapshot_manager(config_manager)
+            self.capacity_planner = get_capacity_planner(config_manager)
         self.network_manager = get_network_manager()
         self.performance_optimizer = get_performance_optimizer()
         self.load_configs()
@@ -72,6 +84,7 @@ class VMController:
             except Exception as e:
                 print(f"加载配置文件失败: {e}")
     
+    @timed("vm_controller.save_configs")
     def save_configs(self):
         """保存虚拟机配置到文件"""
         config_dir = self.config_file.parent
@@ -105,7 +118,11 @@ class VMController:
             
             # 创建虚拟磁盘（如果不存在）
             if not os.path.exists(config.disk_path):
-                self.create_disk_image(config.disk_path, size_gb=20)
+                self.create_disk_image(config.disk_path, size_gb=self.DEFAULT_DISK_SIZE_GB)
+            
+            # 登记到容量台账
+            if self.capacity_planner:
+                self.capacity_planner.register(config.disk_path, 'disk', config.name)
             
             # 保存配置
             self.vms[config.name] = config
@@ -127,10 +144,15 @@ class VMController:
         if config.memory_mb * 1024 * 1024 > available_memory:
             raise ValueError("内存不足")
         
-        # 检查磁盘空间
-        disk_usage = psutil.disk_usage(os.path.dirname(config.disk_path))
-        if 20 * 1024 * 1024 * 1024 > disk_usage.free:  # 假设最小20GB
-            raise ValueError("磁盘空间不足")
+        # 检查磁盘容量: 新磁盘按虚拟容量计入所在存储池的承诺容量，超出超配比例时拒绝
+        if not os.path.exists(config.disk_path):
+            virtual_size = self.DEFAULT_DISK_SIZE_GB * 1024**3
+            if self.capacity_planner:
+                self.capacity_planner.enforce(config.disk_path, virtual_size)
+            else:
+                disk_usage = psutil.disk_usage(os.path.dirname(config.disk_path))
+                if virtual_size > disk_usage.free:
+                    raise ValueError("磁盘空间不足")
         
         return True
     
@@ -144,8 +166,12 @@ class VMController:
         ]
         subprocess.run(cmd, check=True)
     
+    @timed("vm_controller.start_vm_with_config")
     def start_vm_with_config(self, config: dict) -> bool:
         """使用配置字典启动虚拟机"""
+        if self._chain_job_blocks_start(config.get('name', '')):
+            return False
+        
         # 构建QEMU命令
         cmd = [
             'qemu-system-x86_64',
@@ -153,12 +179,21 @@ class VMController:
             '-cpu', 'host',
         ]
         
+        # 磁盘和QMP控制通道
+        cmd.extend(self._disk_and_control_args(config))
+        
         # 使用性能优化器优化命令
         config_with_name = config.copy() if isinstance(config, dict) else {**config}
         if 'name' not in config_with_name:
             config_with_name['name'] = config_with_name.get('name', 'unnamed')
         cmd = self.performance_optimizer.optimize_qemu_command(cmd, config_with_name)
         
+        # 恢复含内存的快照后从保存的内存状态继续运行（以配置管理器中的为准，界面持有的配置可能是旧的）
+        name = config.get('name', '')
+        stored_config = self.config_manager.get_vm_config(name) if self.config_manager and name else None
+        resume_state = (stored_config or config).get('resume_state') or {}
+        cmd.extend(self._resume_args(resume_state))
+        
         # 添加ISO镜像（如果有）
         iso_path = config.get('iso_path')
         if iso_path and os.path.exists(iso_path):
@@ -190,6 +225,12 @@ class VMController:
             
             self.running_processes[config.get('name')] = process
             config['status'] = "running"
+            if resume_state:
+                # 内存状态只在恢复快照后的第一次启动时使用
+                config.pop('resume_state', None)
+                if stored_config is not None:
+                    stored_config.pop('resume_state', None)
+                    self.config_manager.set_vm_config(name, stored_config)
             
             return True
         except Exception as e:
@@ -197,12 +238,64 @@ class VMController:
             config['status'] = "stopped"
             return False
     
+    def _chain_job_blocks_start(self, name: str) -> bool:
+        """离线缩短后端链（磁盘正在被 qemu-img 改写）或离线备份（正在读取各层）期间不能启动虚拟机"""
+        if self.config_manager and get_chain_maintenance(self.config_manager).offline_job_running(name):
+            print(f"虚拟机 '{name}' 的磁盘正在后台整理后端链，请稍后再启动")
+            return True
+        if self.config_manager and get_backup_manager(self.config_manager).backup_running(name, offline_only=True):
+            print(f"虚拟机 '{name}' 正在备份，请稍后再启动")
+            return True
+        return False
+    
+    def _disk_and_control_args(self, config: dict) -> List[str]:
+        """
+        磁盘、QMP和客户机代理通道参数
+        
+        每块磁盘用固定的 drive id（disk0, disk1, ...），在线快照通过 QMP 按 id 切换到新的覆盖层；
+        客户机代理通道（virtio-serial）默认启用，可用虚拟机配置 guest_agent 或全局配置 guest_agent_channel 关闭
+        """
+        args = []
+        for drive_id, path in vm_drives(config):
+            if not os.path.exists(path):
+                continue
+            disk_format = 'qcow2' if is_qcow2(path) else 'raw'
+            args.extend(['-drive', f'file={path},if=virtio,id={drive_id},format={disk_format}'])
+        args.extend(qmp_command_args(config.get('name', 'unnamed')))
+        guest_agent = config.get('guest_agent')
+        if guest_agent is None and self.config_manager:
+            guest_agent = self.config_manager.get_global_config("guest_agent_channel")
+        if guest_agent is not False:
+            args.extend(guest_agent_command_args(config.get('name', 'unnamed')))
+        return args
+    
+    @staticmethod
+    def _resume_args(resume_state: dict) -> List[str]:
+        """
+        恢复含内存的快照后，本次启动从保存的内存状态继续运行的参数
+        
+        resume_state 由快照恢复写入虚拟机配置：memory_state 为外部快照保存的内存文件（-incoming），
+        loadvm 为内部快照的标签（-loadvm）
+        """
+        memory_state = resume_state.get('memory_state')
+        if memory_state:
+            if os.path.exists(memory_state):
+                return ['-incoming', f"exec:cat {shlex.quote(memory_state)}"]
+            print(f"内存状态文件不存在，从磁盘正常启动: {memory_state}")
+            return []
+        if resume_state.get('loadvm'):
+            return ['-loadvm', resume_state['loadvm']]
+        return []
+    
+    @timed("vm_controller.start_vm")
     def start_vm(self, name: str) -> bool:
         """启动虚拟机"""
         if name not in self.vms:
             raise ValueError(f"虚拟机 '{name}' 不存在")
         
         config = self.vms[name]
+        if self._chain_job_blocks_start(name):
+            return False
         
         # 构建QEMU命令
         cmd = [
@@ -212,6 +305,7 @@ class VMController:
         ]
         
         # 使用性能优化器优化命令
+        resume_state = {}
         temp_config = {
             'cpu_cores': config.cpu_cores,
             'memory_mb': config.memory_mb,
@@ -219,7 +313,15 @@ class VMController:
             'vnc_port': config.vnc_port,
             'name': config.name
         }
+        if self.config_manager:
+            # 快照（包括计划快照）会把虚拟机切换到新的覆盖层，磁盘以配置管理器中的为准
+            stored_config = self.config_manager.get_vm_config(name) or {}
+            temp_config['disk_path'] = stored_config.get('disk_path') or config.disk_path
+            temp_config['extra_disks'] = stored_config.get('extra_disks', [])
+            resume_state = stored_config.get('resume_state') or {}
+        cmd.extend(self._disk_and_control_args(temp_config))
         cmd = self.performance_optimizer.optimize_qemu_command(cmd, temp_config)
+        cmd.extend(self._resume_args(resume_state))
         
         # 添加ISO镜像（如果有）
         if config.iso_path and os.path.exists(config.iso_path):
@@ -252,6 +354,10 @@ class VMController:
             self.running_processes[name] = process
             config.status = "running"
             self.save_configs()
+            if resume_state:
+                # 内存状态只在恢复快照后的第一次启动时使用
+                stored_config.pop('resume_state', None)
+                self.config_manager.set_vm_config(name, stored_config)
             
             return True
         except Exception as e:
@@ -259,6 +365,7 @@ class VMController:
             config.status = "stopped"
             return False
     
+    @timed("vm_controller.stop_vm")
     def stop_vm(self, name: str) -> bool:
         """停止虚拟机"""
         if name not in self.running_processes:
@@ -316,6 +423,14 @@ class VMController:
         
         return vms_list
     
+    def get_running_vm_pids(self) -> Dict[str, int]:
+        """获取正在运行的虚拟机进程ID"""
+        return {
+            name: process.pid
+            for name, process in list(self.running_processes.items())
+            if process.poll() is None
+        }
+    
     def get_vm_status(self, name: str) -> Optional[Dict]:
         """获取虚拟机状态"""
         if name not in self.vms:
@@ -332,13 +447,20 @@ class VMController:
             'disk_path': config.disk_path
         }
     
-    def create_vm_snapshot(self, vm_name: str, snapshot_name: str, description: str = "") -> bool:
+    def create_vm_snapshot(self, vm_name: str, snapshot_name: str, description: str = "",
+                           include_memory: bool = False) -> bool:
         """创建虚拟机快照"""
         if not self.snapshot_manager:
             print("快照功能未启用")
             return False
         
-        return self.snapshot_manager.create_snapshot(vm_name, snapshot_name, description)
+        created = self.snapshot_manager.create_snapshot(vm_name, snapshot_name, description, include_memory)
+        
+        # 创建快照后虚拟机改为写入新的覆盖层，同步内存中的配置
+        vm_config = self.config_manager.get_vm_config(vm_name) if created else None
+        if vm_config and vm_name in self.vms:
+            self.vms[vm_name].disk_path = vm_config.get('disk_path', self.vms[vm_name].disk_path)
+        return created
     
     def restore_vm_snapshot(self, vm_name: str, snapshot_id: str) -> bool:
         """恢复虚拟机快照"""
@@ -346,7 +468,13 @@ class VMController:
             print("快照功能未启用")
             return False
         
-        return self.snapshot_manager.restore_snapshot(vm_name, snapshot_id)
+        restored = self.snapshot_manager.restore_snapshot(vm_name, snapshot_id)
+        
+        # 外部快照恢复后虚拟机改为写入快照上的新覆盖层，同步内存中的配置
+        vm_config = self.config_manager.get_vm_config(vm_name) if restored else None
+        if vm_config and vm_name in self.vms:
+            self.vms[vm_name].disk_path = vm_config.get('disk_path', self.vms[vm_name].disk_path)
+        return restored
     
     def delete_vm_snapshot(self, vm_name: str, snapshot_id: str) -> bool:
         """删除虚拟机快照"""
@@ -364,6 +492,14 @@ class VMController:
         
         return self.snapshot_manager.list_snapshots(vm_name)
     
+    def get_vm_snapshot_tree(self, vm_name: str) -> List[Dict]:
+        """获取虚拟机快照树（根节点列表，每个节点含 children）"""
+        if not self.snapshot_manager:
+            print("快照功能未启用")
+            return []
+        
+        return self.snapshot_manager.snapshot_tree(vm_name)
+    
     def get_vm_snapshots_info(self, vm_name: str, snapshot_id: str) -> Optional[Dict]:
         """获取快照详细信息"""
         if not self.snapshot_manager:
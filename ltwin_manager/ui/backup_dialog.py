@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+备份对话框
+创建完整/增量备份，查看备份列表，校验、恢复和删除备份；备份在后台线程中执行
+"""
+
+import threading
+
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
+    QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox, QProgressBar, QFileDialog
+)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+
+from ltwin_manager.utils.backup_manager import get_backup_manager, BackupCancelled
+
+TYPE_NAMES = {'full': '完整', 'incremental': '增量'}
+METHOD_NAMES = {'bitmap': '脏位图', 'allocation': '簇分配表'}
+
+
+class BackupWorker(QThread):
+    """在后台执行备份、校验或恢复的工作线程"""
+
+    progress_signal = pyqtSignal(str, int)  # (状态消息, 进度百分比)
+    finished_signal = pyqtSignal(bool, str)  # (是否成功, 结果消息)
+
+    def __init__(self, manager, action: str, vm_name: str, **kwargs):
+        super().__init__()
+        self.manager = manager
+        self.action = action
+        self.vm_name = vm_name
+        self.kwargs = kwargs
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        """执行操作"""
+        try:
+            if self.action == 'backup':
+                manifest = self.manager.backup_vm(self.vm_name, progress_callback=self.progress_signal.emit,
+                                                  cancel_event=self.cancel_event, **self.kwargs)
+                stats = manifest['stats']
+                message = (f"{TYPE_NAMES[manifest['type']]}备份 {manifest['id']} 完成：读取 "
+                           f"{stats['read_bytes'] / 1024**2:.1f} MB，新增 {stats['stored_bytes'] / 1024**2:.1f} MB，"
+                           f"耗时 {manifest['duration']} 秒")
+                self.finished_signal.emit(True, message)
+            elif self.action == 'verify':
+                problems = self.manager.verify_backup(self.vm_name, progress_callback=self.progress_signal.emit,
+                                                      **self.kwargs)
+                if problems:
+                    self.finished_signal.emit(False, "备份已损坏:\n" + "\n".join(problems[:20]))
+                else:
+                    self.finished_signal.emit(True, "备份完整，所有数据块校验通过")
+            else:
+                restored = self.manager.restore_backup(self.vm_name, progress_callback=self.progress_signal.emit,
+                                                       cancel_event=self.cancel_event, **self.kwargs)
+                self.finished_signal.emit(True, "已恢复到:\n" + "\n".join(
+                    f"{drive_id}: {path}" for drive_id, path in restored.items()))
+        except BackupCancelled as e:
+            self.finished_signal.emit(False, str(e))
+        except Exception as e:
+            self.finished_signal.emit(False, f"操作失败: {e}")
+
+
+class BackupDialog(QDialog):
+    """备份对话框"""
+
+    def __init__(self, vm_name, config_manager, parent=None):
+        super().__init__(parent)
+        self.vm_name = vm_name
+        self.config_manager = config_manager
+        self.manager = get_backup_manager(config_manager)
+        self.worker = None
+
+        self.setWindowTitle(f"{vm_name} - 备份")
+        self.resize(850, 500)
+
+        self.init_ui()
+        self.load_backups()
+
+    def init_ui(self):
+        """初始化用户界面"""
+        layout = QVBoxLayout(self)
+
+        self.info_label = QLabel()
+        layout.addWidget(self.info_label)
+
+        self.backups_table = QTableWidget()
+        self.backups_table.setColumnCount(7)
+        self.backups_table.setHorizontalHeaderLabels(
+            ["备份ID", "时间", "类型", "方式", "读取数据", "新增存储", "耗时"])
+        self.backups_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.backups_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.backups_table.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
+        self.backups_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.backups_table)
+
+        self.progress_label = QLabel()
+        layout.addWidget(self.progress_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        button_layout = QHBoxLayout()
+        self.backup_btn = QPushButton("立即备份")
+        self.backup_btn.setToolTip("只保存自上次备份以来变化的数据")
+        self.backup_btn.clicked.connect(lambda: self.start_backup(full=False))
+        button_layout.addWidget(self.backup_btn)
+
+        self.full_backup_btn = QPushButton("完整备份")
+        self.full_backup_btn.setToolTip("重新读取整块磁盘（已存在的数据块不会重复保存）")
+        self.full_backup_btn.clicked.connect(lambda: self.start_backup(full=True))
+        button_layout.addWidget(self.full_backup_btn)
+
+        self.verify_btn = QPushButton("校验")
+        self.verify_btn.clicked.connect(self.verify_backup)
+        button_layout.addWidget(self.verify_btn)
+
+        self.restore_btn = QPushButton("恢复...")
+        self.restore_btn.clicked.connect(self.restore_backup)
+        button_layout.addWidget(self.restore_btn)
+
+        self.delete_btn = QPushButton("删除")
+        self.delete_btn.clicked.connect(self.delete_backup)
+        button_layout.addWidget(self.delete_btn)
+
+        self.cancel_btn = QPushButton("取消操作")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_operation)
+        button_layout.addWidget(self.cancel_btn)
+
+        button_layout.addStretch()
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+    def load_backups(self):
+        """加载备份列表"""
+        backups = self.manager.list_backups(self.vm_name)
+        self.backups_table.setRowCount(len(backups))
+        for row, item in enumerate(reversed(backups)):
+            stats = item.get('stats', {})
+            id_item = QTableWidgetItem(item['id'])
+            id_item.setData(Qt.ItemDataRole.UserRole, item['id'])
+            self.backups_table.setItem(row, 0, id_item)
+            self.backups_table.setItem(row, 1, QTableWidgetItem(item['created_at']))
+            self.backups_table.setItem(row, 2, QTableWidgetItem(TYPE_NAMES.get(item['type'], item['type'])))
+            self.backups_table.setItem(row, 3, QTableWidgetItem(METHOD_NAMES.get(item['method'], item['method'])))
+            self.backups_table.setItem(row, 4, QTableWidgetItem(f"{stats.get('read_bytes', 0) / 1024**2:.1f} MB"))
+            self.backups_table.setItem(row, 5, QTableWidgetItem(f"{stats.get('stored_bytes', 0) / 1024**2:.1f} MB"))
+            self.backups_table.setItem(row, 6, QTableWidgetItem(f"{item.get('duration', 0)} 秒"))
+
+        usage = self.manager.storage_usage(self.vm_name)
+        self.info_label.setText(f"共 {len(backups)} 个备份，占用 {usage / 1024**3:.2f} GB，"
+                                f"保存在 {self.manager.vm_dir(self.vm_name)}")
+
+    def selected_backup_id(self):
+        """当前选中的备份ID"""
+        row = self.backups_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "警告", "请先选择一个备份")
+            return None
+        return self.backups_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
+
+    def run_worker(self, action: str, **kwargs):
+        """在后台执行操作"""
+        self.worker = BackupWorker(self.manager, action, self.vm_name, **kwargs)
+        self.worker.progress_signal.connect(self.on_progress)
+        self.worker.finished_signal.connect(self.on_finished)
+        self.set_busy(True)
+        self.worker.start()
+
+    def set_busy(self, busy: bool):
+        for button in (self.backup_btn, self.full_backup_btn, self.verify_btn, self.restore_btn, self.delete_btn):
+            button.setEnabled(not busy)
+        self.cancel_btn.setEnabled(busy)
+        self.progress_bar.setVisible(busy)
+        self.progress_bar.setValue(0)
+
+    def start_backup(self, full: bool):
+        """创建备份"""
+        self.run_worker('backup', full=full)
+
+    def verify_backup(self):
+        """校验选中的备份"""
+        backup_id = self.selected_backup_id()
+        if backup_id:
+            self.run_worker('verify', backup_id=backup_id)
+
+    def restore_backup(self):
+        """把选中的备份恢复为新的磁盘文件"""
+        backup_id = self.selected_backup_id()
+        if not backup_id:
+            return
+        target_dir = QFileDialog.getExistingDirectory(self, "选择恢复到的目录")
+        if not target_dir:
+            return
+        vm_config = self.config_manager.get_vm_config(self.vm_name) or {}
+        apply = False
+        if vm_config.get('status') != 'running':
+            reply = QMessageBox.question(
+                self, "恢复备份",
+                "恢复完成后是否让虚拟机改用恢复出的磁盘？\n原磁盘文件会保留，不会被删除。",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel
+            )
+            if reply == QMessageBox.StandardButton.Cancel:
+                return
+            apply = reply == QMessageBox.StandardButton.Yes
+        self.run_worker('restore', backup_id=backup_id, target_dir=target_dir, apply=apply)
+
+    def delete_backup(self):
+        """删除选中的备份"""
+        backup_id = self.selected_backup_id()
+        if not backup_id:
+            return
+        reply = QMessageBox.question(
+            self, "确认删除", f"确定要删除备份 '{backup_id}' 吗？\n其他备份仍然可以单独恢复。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            if not self.manager.delete_backup(self.vm_name, backup_id):
+                QMessageBox.warning(self, "错误", "删除备份失败")
+            self.load_backups()
+
+    def cancel_operation(self):
+        """取消正在执行的操作"""
+        if self.worker and self.worker.isRunning():
+            self.worker.cancel_event.set()
+            self.cancel_btn.setEnabled(False)
+
+    def on_progress(self, message: str, percent: int):
+        self.progress_label.setText(message)
+        self.progress_bar.setValue(percent)
+
+    def on_finished(self, success: bool, message: str):
+        self.set_busy(False)
+        self.progress_label.setText("")
+        self.load_backups()
+        if success:
+            QMessageBox.information(self, "完成", message)
+        else:
+            QMessageBox.warning(self, "失败", message)
+
+    def closeEvent(self, event):
+        """操作进行中时关闭对话框先确认"""
+        if self.worker and self.worker.isRunning():
+            reply = QMessageBox.question(
+                self, "确认关闭", "操作仍在进行，关闭将取消该操作，是否继续？",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+            )
+            if reply != QMessageBox.StandardButton.Yes:
+                event.ignore()
+                return
+            self.worker.cancel_event.set()
+            self.worker.wait()
+        super().closeEvent(event)
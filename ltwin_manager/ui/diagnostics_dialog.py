@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+诊断对话框
+显示管理器自身热点路径的耗时统计和栈采样结果
+"""
+
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
+    QTableWidget, QTableWidgetItem, QHeaderView, QGroupBox,
+    QFileDialog, QMessageBox, QSplitter
+)
+from PyQt6.QtCore import Qt, QTimer
+from datetime import datetime
+from ltwin_manager.utils.profiler import get_timing_registry, get_stack_sampler, dump_diagnostics
+
+
+def export_diagnostics(parent):
+    """选择文件并导出诊断数据"""
+    file_path, _ = QFileDialog.getSaveFileName(
+        parent,
+        "导出诊断数据",
+        f"ltwin_diagnostics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        "JSON文件 (*.json)"
+    )
+    if not file_path:
+        return
+
+    if dump_diagnostics(file_path):
+        QMessageBox.information(parent, "成功", f"诊断数据已导出到 {file_path}")
+    else:
+        QMessageBox.critical(parent, "错误", "导出诊断数据失败")
+
+
+class DiagnosticsDialog(QDialog):
+    """诊断对话框"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timing_registry = get_timing_registry()
+        self.stack_sampler = get_stack_sampler()
+
+        self.setWindowTitle("诊断信息")
+        self.resize(900, 600)
+
+        self.init_ui()
+        self.refresh()
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+
+    def init_ui(self):
+        """初始化界面"""
+        layout = QVBoxLayout(self)
+        splitter = QSplitter(Qt.Orientation.Vertical)
+
+        # 耗时统计
+        timing_group = QGroupBox("耗时统计 (毫秒)")
+        timing_layout = QVBoxLayout(timing_group)
+        self.timing_table = QTableWidget(0, 8)
+        self.timing_table.setHorizontalHeaderLabels(
+            ["计时点", "次数", "平均", "P50", "P95", "P99", "最大", "总计"]
+        )
+        self.timing_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.timing_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.timing_table.setSortingEnabled(True)
+        timing_layout.addWidget(self.timing_table)
+        splitter.addWidget(timing_group)
+
+        # 栈采样
+        sampler_group = QGroupBox("栈采样")
+        sampler_layout = QVBoxLayout(sampler_group)
+
+        sampler_control = QHBoxLayout()
+        self.sampler_status_label = QLabel()
+        sampler_control.addWidget(self.sampler_status_label)
+        sampler_control.addStretch()
+
+        self.sampler_btn = QPushButton()
+        self.sampler_btn.clicked.connect(self.toggle_sampler)
+        sampler_control.addWidget(self.sampler_btn)
+
+        clear_sampler_btn = QPushButton("清空采样")
+        clear_sampler_btn.clicked.connect(self.clear_sampler)
+        sampler_control.addWidget(clear_sampler_btn)
+        sampler_layout.addLayout(sampler_control)
+
+        self.hot_frames_table = QTableWidget(0, 3)
+        self.hot_frames_table.setHorizontalHeaderLabels(["函数", "样本数", "占比 (%)"])
+        self.hot_frames_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.hot_frames_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        sampler_layout.addWidget(self.hot_frames_table)
+        splitter.addWidget(sampler_group)
+
+        layout.addWidget(splitter)
+
+        # 按钮
+        button_layout = QHBoxLayout()
+
+        reset_btn = QPushButton("重置统计")
+        reset_btn.clicked.connect(self.reset_timings)
+        button_layout.addWidget(reset_btn)
+
+        export_btn = QPushButton("导出诊断数据")
+        export_btn.clicked.connect(lambda: export_diagnostics(self))
+        button_layout.addWidget(export_btn)
+
+        button_layout.addStretch()
+
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.accept)
+        button_layout.addWidget(close_btn)
+
+        layout.addLayout(button_layout)
+
+    def refresh(self):
+        """刷新统计数据"""
+        timings = self.timing_registry.snapshot()
+        self.timing_table.setSortingEnabled(False)
+        self.timing_table.setRowCount(len(timings))
+        for row, (name, stats) in enumerate(sorted(timings.items())):
+            self.timing_table.setItem(row, 0, QTableWidgetItem(name))
+            count_item = QTableWidgetItem()
+            count_item.setData(Qt.ItemDataRole.DisplayRole, stats['count'])
+            self.timing_table.setItem(row, 1, count_item)
+            for col, key in enumerate(['avg', 'p50', 'p95', 'p99', 'max', 'total'], start=2):
+                item = QTableWidgetItem()
+                item.setData(Qt.ItemDataRole.DisplayRole, round(stats[key], 2))
+                self.timing_table.setItem(row, col, item)
+        self.timing_table.setSortingEnabled(True)
+
+        summary = self.stack_sampler.summary()
+        if summary['running']:
+            self.sampler_status_label.setText(
+                f"采样中 (间隔 {summary['interval_ms']:.0f}ms，已采样 {summary['sample_count']} 次)"
+            )
+            self.sampler_btn.setText("停止采样")
+        else:
+            self.sampler_status_label.setText(f"未运行 (已有样本 {summary['sample_count']} 次)")
+            self.sampler_btn.setText("开始采样")
+
+        hot_frames = self.stack_sampler.top_frames(30)
+        self.hot_frames_table.setRowCount(len(hot_frames))
+        for row, entry in enumerate(hot_frames):
+            self.hot_frames_table.setItem(row, 0, QTableWidgetItem(entry['frame']))
+            self.hot_frames_table.setItem(row, 1, QTableWidgetItem(str(entry['samples'])))
+            self.hot_frames_table.setItem(row, 2, QTableWidgetItem(f"{entry['percent']:.1f}"))
+
+    def toggle_sampler(self):
+        """开始/停止栈采样"""
+        if self.stack_sampler.is_running():
+            self.stack_sampler.stop()
+        else:
+            self.stack_sampler.start()
+        self.refresh()
+
+    def clear_sampler(self):
+        """清空栈采样数据"""
+        self.stack_sampler.clear()
+        self.refresh()
+
+    def reset_timings(self):
+        """重置耗时统计"""
+        self.timing_registry.reset()
+        self.refresh()
+
+    def closeEvent(self, event):
+        """关闭时停止刷新（采样器保持运行，便于复现卡顿后再查看）"""
+        self.refresh_timer.stop()
+        super().closeEvent(event)
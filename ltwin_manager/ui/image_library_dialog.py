@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+镜像库对话框
+导入ISO和基础磁盘镜像（按内容去重），查看共享情况和去重节省的空间，扫描重复文件
+"""
+
+import os
+import threading
+
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QCheckBox,
+    QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox, QProgressBar,
+    QFileDialog, QInputDialog
+)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+
+from ltwin_manager.utils.image_library import get_image_library, HashCancelled
+
+
+class ImageImportWorker(QThread):
+    """镜像导入/重复扫描工作线程"""
+
+    progress_signal = pyqtSignal(str, int)  # (状态消息, 进度百分比)
+    result_signal = pyqtSignal(object)  # 导入结果字典或重复分组列表
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, library, source_path: str = None, name: str = None, remove_source: bool = False):
+        super().__init__()
+        self.library = library
+        self.source_path = source_path  # 为空时执行重复扫描
+        self.name = name
+        self.remove_source = remove_source
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        try:
+            if self.source_path:
+                result = self.library.import_image(
+                    self.source_path, self.name, self.remove_source,
+                    progress_callback=self._on_hash_progress, cancel_event=self.cancel_event
+                )
+            else:
+                result = self.library.scan_duplicates(
+                    progress_callback=lambda path, percent: self.progress_signal.emit(f"扫描 {path}", percent),
+                    cancel_event=self.cancel_event
+                )
+            self.result_signal.emit(result)
+        except HashCancelled:
+            self.error_signal.emit("操作已取消")
+        except Exception as e:
+            self.error_signal.emit(str(e))
+
+    def _on_hash_progress(self, done: int, total: int):
+        self.progress_signal.emit(f"计算哈希 {done / (1024**2):.0f}/{total / (1024**2):.0f} MB",
+                                  int(done * 100 / total) if total else 100)
+
+    def cancel(self):
+        """请求取消"""
+        self.cancel_event.set()
+
+
+class ImageLibraryDialog(QDialog):
+    """镜像库对话框"""
+
+    def __init__(self, config_manager, parent=None):
+        super().__init__(parent)
+        self.config_manager = config_manager
+        self.library = get_image_library(config_manager)
+        self.worker = None
+
+        self.setWindowTitle("镜像库")
+        self.resize(950, 600)
+
+        self.init_ui()
+        self.load_images()
+
+    def init_ui(self):
+        """初始化用户界面"""
+        layout = QVBoxLayout(self)
+
+        self.images_table = QTableWidget()
+        self.images_table.setColumnCount(6)
+        self.images_table.setHorizontalHeaderLabels(["名称", "类型", "格式", "大小", "共享的虚拟机", "内容哈希"])
+        header = self.images_table.horizontalHeader()
+        for column in range(5):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(5, QHeaderView.ResizeMode.Stretch)
+        self.images_table.setAlternatingRowColors(True)
+        self.images_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.images_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.images_table)
+
+        self.report_label = QLabel()
+        self.report_label.setWordWrap(True)
+        layout.addWidget(self.report_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        button_layout = QHBoxLayout()
+        self.import_btn = QPushButton("导入镜像...")
+        self.import_btn.clicked.connect(self.import_image)
+        button_layout.addWidget(self.import_btn)
+        self.remove_source_check = QCheckBox("导入后删除源文件")
+        button_layout.addWidget(self.remove_source_check)
+        self.remove_btn = QPushButton("移除")
+        self.remove_btn.clicked.connect(self.remove_image)
+        button_layout.addWidget(self.remove_btn)
+        self.scan_btn = QPushButton("扫描重复文件")
+        self.scan_btn.clicked.connect(self.scan_duplicates)
+        button_layout.addWidget(self.scan_btn)
+        self.cancel_btn = QPushButton("取消")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_worker)
+        button_layout.addWidget(self.cancel_btn)
+        button_layout.addStretch()
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+    def load_images(self):
+        """加载镜像列表和去重统计"""
+        rows = []
+        for entry in self.library.list_entries():
+            for name in entry['names']:
+                rows.append((name, entry))
+        # 未入库（没有内容哈希）的旧镜像配置也显示出来
+        for name, config in self.config_manager.images_config.items():
+            if not config.get('content_hash'):
+                rows.append((name, {'type': '', 'format': '', 'size': 0, 'vms': [],
+                                    'content_hash': '未入库', 'path': config.get('path', '')}))
+
+        self.images_table.setRowCount(len(rows))
+        for row, (name, entry) in enumerate(rows):
+            values = [
+                name,
+                {'iso': 'ISO', 'disk': '磁盘'}.get(entry['type'], entry['type']),
+                entry['format'],
+                f"{entry['size'] / (1024**3):.2f} GB",
+                ", ".join(entry['vms']),
+                entry['content_hash'].split(':', 1)[-1][:16]
+            ]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setToolTip(entry['path'])
+                if column == 0:
+                    item.setData(Qt.ItemDataRole.UserRole, name)
+                self.images_table.setItem(row, column, item)
+
+        report = self.library.dedup_report()
+        self.report_label.setText(
+            f"库中 {report['unique_images']} 份内容，{report['names']} 个镜像名，"
+            f"{report['overlay_vms']} 台虚拟机共享基础镜像；实际占用 {report['stored_bytes'] / (1024**3):.2f} GB，"
+            f"不去重需要 {report['logical_bytes'] / (1024**3):.2f} GB，"
+            f"节省 {report['saved_bytes'] / (1024**3):.2f} GB（{report['ratio']:.1f}x）"
+        )
+
+    def set_busy(self, busy: bool):
+        """切换后台任务状态"""
+        self.import_btn.setEnabled(not busy)
+        self.remove_btn.setEnabled(not busy)
+        self.scan_btn.setEnabled(not busy)
+        self.cancel_btn.setEnabled(busy)
+        self.progress_bar.setVisible(busy)
+        self.progress_bar.setValue(0)
+
+    def start_worker(self, worker: ImageImportWorker):
+        self.worker = worker
+        self.worker.progress_signal.connect(self.on_progress)
+        self.worker.error_signal.connect(self.on_error)
+        self.set_busy(True)
+        self.worker.start()
+
+    def import_image(self):
+        """选择并导入镜像"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "选择镜像文件", str(self.config_manager.get_default_iso_storage_path()),
+            "镜像文件 (*.iso *.img *.raw *.qcow2 *.vmdk *.vdi *.vhdx);;所有文件 (*)"
+        )
+        if not file_path:
+            return
+        name, ok = QInputDialog.getText(self, "镜像名称", "镜像名称:", text=os.path.basename(file_path))
+        if not ok or not name.strip():
+            return
+        worker = ImageImportWorker(self.library, file_path, name.strip(), self.remove_source_check.isChecked())
+        worker.result_signal.connect(self.on_imported)
+        self.start_worker(worker)
+
+    def on_imported(self, result: dict):
+        self.set_busy(False)
+        self.status_label.setText("")
+        if result['deduplicated']:
+            QMessageBox.information(self, "导入完成",
+                                    f"镜像 '{result['name']}' 与库中已有内容相同，未重复保存")
+        else:
+            QMessageBox.information(self, "导入完成", f"镜像 '{result['name']}' 已存入 {result['path']}")
+        self.load_images()
+
+    def remove_image(self):
+        """移除选中的镜像名称"""
+        row = self.images_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "警告", "请先选择一个镜像")
+            return
+        name = self.images_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
+        reply = QMessageBox.question(
+            self, "确认移除",
+            f"确定要移除镜像 '{name}' 吗？没有其他名称或虚拟机使用时会删除库中的文件。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            self.library.remove_image(name)
+        except (ValueError, OSError) as e:
+            QMessageBox.warning(self, "无法移除", str(e))
+        self.load_images()
+
+    def scan_duplicates(self):
+        """扫描ISO目录和虚拟机目录中的重复镜像"""
+        worker = ImageImportWorker(self.library)
+        worker.result_signal.connect(self.on_scanned)
+        self.start_worker(worker)
+
+    def on_scanned(self, groups: list):
+        self.set_busy(False)
+        self.status_label.setText("")
+        if not groups:
+            QMessageBox.information(self, "扫描完成", "没有发现重复的镜像文件")
+            return
+        total = sum(group['reclaimable'] for group in groups)
+        lines = []
+        for group in groups:
+            location = f"（库中已有: {group['in_library']}）" if group['in_library'] else ""
+            lines.append(f"{group['size'] / (1024**3):.2f} GB{location}\n  " + "\n  ".join(group['paths']))
+        QMessageBox.information(
+            self, "扫描完成",
+            f"发现 {len(groups)} 组重复镜像，导入镜像库后可节省 {total / (1024**3):.2f} GB:\n\n" + "\n".join(lines)
+        )
+
+    def on_progress(self, message: str, percent: int):
+        self.status_label.setText(message)
+        self.progress_bar.setValue(percent)
+
+    def on_error(self, message: str):
+        self.set_busy(False)
+        self.status_label.setText("")
+        QMessageBox.warning(self, "失败", message)
+
+    def cancel_worker(self):
+        if self.worker and self.worker.isRunning():
+            self.worker.cancel()
+
+    def closeEvent(self, event):
+        """关闭时取消后台任务"""
+        if self.worker and self.worker.isRunning():
+            self.worker.cancel()
+            self.worker.wait()
+        super().closeEvent(event)
@@ -7,11 +7,48 @@
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QTextEdit, QPushButton,
     QTabWidget, QWidget, QFormLayout, QLabel, QProgressBar,
-    QGroupBox, QListWidget
+    QGroupBox, QListWidget, QTableWidget, QTableWidgetItem, QHeaderView,
+    QComboBox, QFileDialog, QMessageBox
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer, QThread, pyqtSignal
+import time
+from datetime import datetime
 from ltwin_manager.utils.performance_optimizer import get_performance_optimizer
 from ltwin_manager.utils.system_monitor import SystemMonitor
+from ltwin_manager.utils.pressure_monitor import PressureMonitor, PRESSURE_RESOURCES
+from ltwin_manager.utils.metrics_store import get_metrics_store
+from ltwin_manager.utils.performance_report import ReportEngine, EXPORTERS, metric_label
+
+
+class ReportWorker(QThread):
+    """历史报告生成线程"""
+    
+    progress_signal = pyqtSignal(int)  # 进度百分比
+    result_signal = pyqtSignal(object)  # PerformanceReport，被取消时为None
+    error_signal = pyqtSignal(str)  # 错误信息
+    
+    def __init__(self, metrics_store, start_ts, end_ts):
+        super().__init__()
+        self.engine = ReportEngine(metrics_store)
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self._cancelled = False
+    
+    def run(self):
+        """流式聚合指定时间窗口的指标"""
+        try:
+            report = self.engine.generate(
+                self.start_ts, self.end_ts,
+                progress_callback=self.progress_signal.emit,
+                is_cancelled=lambda: self._cancelled
+            )
+            self.result_signal.emit(report)
+        except Exception as e:
+            self.error_signal.emit(str(e))
+    
+    def cancel(self):
+        """取消生成"""
+        self._cancelled = True
 
 
 class PerformanceReportDialog(QDialog):
@@ -21,12 +58,21 @@ class PerformanceReportDialog(QDialog):
         super().__init__(parent)
         self.performance_optimizer = get_performance_optimizer()
         self.system_monitor = SystemMonitor()
+        self.pressure_monitor = PressureMonitor()
+        self.report_worker = None
+        self.history_report = None
         
         self.setWindowTitle("系统性能报告")
         self.resize(800, 600)
         
         self.init_ui()
         self.generate_report()
+        
+        # 定时刷新资源压力面板
+        self.pressure_timer = QTimer(self)
+        self.pressure_timer.timeout.connect(self.refresh_pressure)
+        self.pressure_timer.start(2000)
+        self.refresh_pressure()
     
     def init_ui(self):
         """初始化用户界面"""
@@ -43,6 +89,14 @@ class PerformanceReportDialog(QDialog):
         recommendations_tab = self.create_recommendations_tab()
         tab_widget.addTab(recommendations_tab, "性能建议")
         
+        # 历史报告标签页
+        history_tab = self.create_history_tab()
+        tab_widget.addTab(history_tab, "历史报告")
+        
+        # 资源压力标签页
+        pressure_tab = self.create_pressure_tab()
+        tab_widget.addTab(pressure_tab, "资源压力")
+        
         # 详细信息标签页
         details_tab = self.create_details_tab()
         tab_widget.addTab(details_tab, "详细信息")
@@ -72,7 +126,8 @@ class PerformanceReportDialog(QDialog):
         cpu_layout = QFormLayout(cpu_group)
         cpu_layout.addRow("架构:", QLabel(system_info.get('system_machine', 'Unknown')))
         cpu_layout.addRow("处理器:", QLabel(system_info.get('system_processor', 'Unknown')))
-        cpu_layout.addRow("核心数:", QLabel(str(system_info.get('process_count', 'Unknown'))))
+        cpu_layout.addRow("物理核心数:", QLabel(str(system_info.get('cpu_count', 'Unknown'))))
+        cpu_layout.addRow("逻辑核心数:", QLabel(str(system_info.get('cpu_logical_count', 'Unknown'))))
         
         layout.addWidget(cpu_group)
         
@@ -135,6 +190,230 @@ class PerformanceReportDialog(QDialog):
         
         return widget
     
+    def create_history_tab(self):
+        """创建历史报告标签页"""
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        
+        # 时间窗口选择
+        control_layout = QHBoxLayout()
+        control_layout.addWidget(QLabel("时间窗口:"))
+        
+        self.window_combo = QComboBox()
+        self.history_windows = [
+            ("最近1小时", 3600),
+            ("最近24小时", 86400),
+            ("最近7天", 7 * 86400),
+            ("最近30天", 30 * 86400),
+        ]
+        for label, _ in self.history_windows:
+            self.window_combo.addItem(label)
+        self.window_combo.setCurrentIndex(1)
+        control_layout.addWidget(self.window_combo)
+        
+        self.generate_history_btn = QPushButton("生成报告")
+        self.generate_history_btn.clicked.connect(self.generate_history_report)
+        control_layout.addWidget(self.generate_history_btn)
+        
+        self.history_progress = QProgressBar()
+        self.history_progress.setRange(0, 100)
+        control_layout.addWidget(self.history_progress)
+        
+        self.export_combo = QComboBox()
+        self.export_combo.addItems(["CSV", "JSON", "HTML"])
+        control_layout.addWidget(self.export_combo)
+        
+        self.export_history_btn = QPushButton("导出")
+        self.export_history_btn.setEnabled(False)
+        self.export_history_btn.clicked.connect(self.export_history_report)
+        control_layout.addWidget(self.export_history_btn)
+        
+        layout.addLayout(control_layout)
+        
+        # 统计表格
+        self.history_table = QTableWidget(0, 6)
+        self.history_table.setHorizontalHeaderLabels(["范围", "指标", "最小", "平均", "P95", "最大"])
+        header = self.history_table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        self.history_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.history_table)
+        
+        # 资源消耗排名
+        layout.addWidget(QLabel("资源消耗排名:"))
+        self.top_consumers_list = QListWidget()
+        self.top_consumers_list.setMaximumHeight(120)
+        layout.addWidget(self.top_consumers_list)
+        
+        return widget
+    
+    def generate_history_report(self):
+        """在后台线程生成历史报告"""
+        if self.report_worker and self.report_worker.isRunning():
+            return
+        
+        _, window_seconds = self.history_windows[self.window_combo.currentIndex()]
+        end_ts = time.time()
+        metrics_store = get_metrics_store(self.system_monitor.config_manager)
+        
+        self.generate_history_btn.setEnabled(False)
+        self.export_history_btn.setEnabled(False)
+        self.history_progress.setValue(0)
+        
+        self.report_worker = ReportWorker(metrics_store, end_ts - window_seconds, end_ts)
+        self.report_worker.progress_signal.connect(self.history_progress.setValue)
+        self.report_worker.result_signal.connect(self.display_history_report)
+        self.report_worker.error_signal.connect(self.history_report_failed)
+        self.report_worker.finished.connect(lambda: self.generate_history_btn.setEnabled(True))
+        self.report_worker.start()
+    
+    def display_history_report(self, report):
+        """显示历史报告"""
+        if report is None:
+            return
+        
+        self.history_report = report
+        rows = [('主机', metric, stats) for metric, stats in report.host.items()]
+        for vm_name in sorted(report.vms):
+            rows.extend((vm_name, metric, stats) for metric, stats in report.vms[vm_name].items())
+        
+        self.history_table.setRowCount(len(rows))
+        for row, (scope, metric, stats) in enumerate(rows):
+            self.history_table.setItem(row, 0, QTableWidgetItem(scope))
+            self.history_table.setItem(row, 1, QTableWidgetItem(metric_label(metric)))
+            for col, key in enumerate(['min', 'avg', 'p95', 'max'], start=2):
+                self.history_table.setItem(row, col, QTableWidgetItem(f"{stats[key]:.2f}"))
+        
+        self.top_consumers_list.clear()
+        for metric, ranking in report.top_consumers.items():
+            for position, entry in enumerate(ranking, start=1):
+                self.top_consumers_list.addItem(
+                    f"{metric_label(metric)} #{position}: {entry['vm']} ({entry['basis']} {entry['value']:.2f})"
+                )
+        if not rows:
+            self.top_consumers_list.addItem("所选时间窗口内没有历史数据")
+        
+        self.export_history_btn.setEnabled(bool(rows))
+    
+    def history_report_failed(self, message):
+        """历史报告生成失败"""
+        QMessageBox.critical(self, "错误", f"生成历史报告失败:\n{message}")
+    
+    def export_history_report(self):
+        """导出历史报告"""
+        if not self.history_report:
+            return
+        
+        export_format = self.export_combo.currentText().lower()
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "导出性能报告",
+            f"ltwin_performance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}",
+            f"{export_format.upper()}文件 (*.{export_format})"
+        )
+        if not file_path:
+            return
+        
+        try:
+            EXPORTERS[export_format](self.history_report, file_path)
+            QMessageBox.information(self, "成功", f"报告已导出到 {file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出报告失败:\n{str(e)}")
+    
+    def closeEvent(self, event):
+        """关闭时停止后台任务"""
+        self.pressure_timer.stop()
+        if self.report_worker and self.report_worker.isRunning():
+            self.report_worker.cancel()
+            self.report_worker.wait()
+        super().closeEvent(event)
+    
+    def create_pressure_tab(self):
+        """创建资源压力标签页"""
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        
+        # PSI表格
+        psi_group = QGroupBox("压力停顿信息 (PSI)")
+        psi_layout = QVBoxLayout(psi_group)
+        
+        self.psi_table = QTableWidget(len(PRESSURE_RESOURCES), 6)
+        self.psi_table.setHorizontalHeaderLabels([
+            "some avg10", "some avg60", "some avg300",
+            "full avg10", "full avg60", "full avg300"
+        ])
+        self.psi_table.setVerticalHeaderLabels(["CPU", "内存", "IO"])
+        self.psi_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.psi_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        psi_layout.addWidget(self.psi_table)
+        
+        self.psi_status_label = QLabel("")
+        psi_layout.addWidget(self.psi_status_label)
+        
+        layout.addWidget(psi_group)
+        
+        # CPU争用
+        contention_group = QGroupBox("CPU争用")
+        contention_layout = QFormLayout(contention_group)
+        
+        self.steal_label = QLabel("-")
+        contention_layout.addRow("Steal (平均/最高):", self.steal_label)
+        
+        self.iowait_label = QLabel("-")
+        contention_layout.addRow("IOWait (平均/最高):", self.iowait_label)
+        
+        self.per_cpu_steal_label = QLabel("-")
+        self.per_cpu_steal_label.setWordWrap(True)
+        contention_layout.addRow("各CPU Steal:", self.per_cpu_steal_label)
+        
+        layout.addWidget(contention_group)
+        
+        # 告警记录
+        alert_group = QGroupBox("压力告警")
+        alert_layout = QVBoxLayout(alert_group)
+        self.pressure_alert_list = QListWidget()
+        alert_layout.addWidget(self.pressure_alert_list)
+        layout.addWidget(alert_group)
+        
+        return widget
+    
+    def refresh_pressure(self):
+        """刷新资源压力面板"""
+        pressure = self.pressure_monitor.sample()
+        psi = pressure.get('psi', {})
+        
+        if psi:
+            self.psi_status_label.setText("")
+        else:
+            self.psi_status_label.setText("当前内核不支持PSI (/proc/pressure)")
+        
+        columns = ['some_avg10', 'some_avg60', 'some_avg300', 'full_avg10', 'full_avg60', 'full_avg300']
+        for row, resource in enumerate(PRESSURE_RESOURCES):
+            values = psi.get(resource, {})
+            for col, key in enumerate(columns):
+                text = f"{values[key]:.2f}%" if key in values else "-"
+                self.psi_table.setItem(row, col, QTableWidgetItem(text))
+        
+        steal = pressure['cpu_steal']
+        iowait = pressure['cpu_iowait']
+        self.steal_label.setText(f"{steal['avg']:.1f}% / {steal['max']:.1f}%")
+        self.iowait_label.setText(f"{iowait['avg']:.1f}% / {iowait['max']:.1f}%")
+        if steal['per_cpu']:
+            self.per_cpu_steal_label.setText(
+                "  ".join(f"CPU{i}: {value:.1f}%" for i, value in enumerate(steal['per_cpu']))
+            )
+        
+        # 使用全局阈值判断持续压力
+        config_manager = self.system_monitor.config_manager
+        thresholds = {
+            'psi_percent': config_manager.get_global_config("psi_alert_percent"),
+            'steal_percent': config_manager.get_global_config("steal_alert_percent"),
+            'iowait_percent': config_manager.get_global_config("iowait_alert_percent"),
+            'sustain_seconds': config_manager.get_global_config("pressure_sustain_seconds")
+        }
+        for message in self.pressure_monitor.check_alerts(pressure, thresholds).values():
+            self.pressure_alert_list.addItem(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
+    
     def create_details_tab(self):
         """创建详细信息标签页"""
         widget = QWidget()
@@ -168,7 +447,9 @@ class PerformanceReportDialog(QDialog):
                 f"  启动时间: {system_info.get('boot_time', 'Unknown')}",
                 "",
                 "CPU信息:",
-                f"  逻辑核心数: {system_info.get('process_count', 'Unknown')}",
+                f"  物理核心数: {system_info.get('cpu_count', 'Unknown')}",
+                f"  逻辑核心数: {system_info.get('cpu_logical_count', 'Unknown')}",
+                f"  进程数: {system_info.get('process_count', 'Unknown')}",
                 "",
                 "内存信息:",
                 f"  总内存: {system_info.get('memory_info', {}).get('total', 0) / (1024**3):.2f} GB",
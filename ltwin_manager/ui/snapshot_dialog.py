@@ -7,12 +7,21 @@
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, 
     QLineEdit, QTextEdit, QPushButton, QLabel, 
-    QTableWidget, QTableWidgetItem, QHeaderView,
-    QGroupBox, QMessageBox, QSplitter, QWidget
+    QHeaderView,
+    QGroupBox, QMessageBox, QSplitter, QWidget, QCheckBox,
+    QTreeWidget, QTreeWidgetItem
 )
 from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QFont
 from datetime import datetime
 
+from ltwin_manager.utils.snapshot_backends import BACKEND_NAMES
+from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+from ltwin_manager.utils.clone_manager import get_clone_manager
+from ltwin_manager.utils.snapshot_scheduler import (
+    get_snapshot_scheduler, get_vm_schedule, set_vm_schedule, SnapshotSchedule
+)
+
 
 class SnapshotDialog(QDialog):
     """快照管理对话框"""
@@ -26,6 +35,7 @@ class SnapshotDialog(QDialog):
         self.resize(800, 600)
         
         self.init_ui()
+        self.load_schedule()
         self.load_snapshots()
     
     def init_ui(self):
@@ -45,6 +55,10 @@ class SnapshotDialog(QDialog):
         self.create_snapshot_btn.clicked.connect(self.create_snapshot)
         operation_layout.addWidget(self.create_snapshot_btn)
         
+        self.include_memory_check = QCheckBox("保存内存状态")
+        self.include_memory_check.setToolTip("运行中的虚拟机在保存内存期间会暂停；不勾选时只做崩溃一致的磁盘快照")
+        operation_layout.addWidget(self.include_memory_check)
+        
         operation_layout.addStretch()
         
         layout.addWidget(operation_group)
@@ -58,22 +72,55 @@ class SnapshotDialog(QDialog):
         
         layout.addLayout(desc_layout)
         
-        # 快照列表
-        self.snapshots_table = QTableWidget()
-        self.snapshots_table.setColumnCount(5)
-        self.snapshots_table.setHorizontalHeaderLabels(["ID", "名称", "描述", "创建时间", "操作"])
-        header = self.snapshots_table.horizontalHeader()
-        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        # 自动快照计划
+        schedule_group = QGroupBox("自动快照")
+        schedule_layout = QHBoxLayout(schedule_group)
+        self.schedule_enabled_check = QCheckBox("按计划创建")
+        schedule_layout.addWidget(self.schedule_enabled_check)
+        self.schedule_cron_edit = QLineEdit()
+        self.schedule_cron_edit.setPlaceholderText("分 时 日 月 星期，如 0 2 * * * 或 @daily")
+        self.schedule_cron_edit.setToolTip("cron格式: 分 时 日 月 星期，支持 * , - / 以及 @hourly/@daily/@weekly/@monthly")
+        schedule_layout.addWidget(self.schedule_cron_edit)
+        self.schedule_memory_check = QCheckBox("含内存")
+        schedule_layout.addWidget(self.schedule_memory_check)
+        self.before_risky_check = QCheckBox("恢复快照/调整磁盘前自动快照")
+        schedule_layout.addWidget(self.before_risky_check)
+        self.next_run_label = QLabel()
+        schedule_layout.addWidget(self.next_run_label)
+        save_schedule_btn = QPushButton("保存计划")
+        save_schedule_btn.clicked.connect(self.save_schedule)
+        schedule_layout.addWidget(save_schedule_btn)
+        layout.addWidget(schedule_group)
+        
+        # 快照树（子快照显示在父快照下面，恢复旧快照后再创建的快照形成新分支）
+        self.snapshots_tree = QTreeWidget()
+        self.snapshots_tree.setColumnCount(5)
+        self.snapshots_tree.setHeaderLabels(["名称", "ID", "描述", "创建时间", "操作"])
+        header = self.snapshots_tree.header()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
         header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
         header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
         header.setSectionResizeMode(3, QHeaderView.ResizeMode.ResizeToContents)
         header.setSectionResizeMode(4, QHeaderView.ResizeMode.ResizeToContents)
         
-        self.snapshots_table.setAlternatingRowColors(True)
-        self.snapshots_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.snapshots_tree.setAlternatingRowColors(True)
         
-        layout.addWidget(QLabel("快照列表:"))
-        layout.addWidget(self.snapshots_table)
+        layout.addWidget(QLabel("快照树（粗体为当前位置）:"))
+        layout.addWidget(self.snapshots_tree)
+        
+        chain_layout = QHBoxLayout()
+        self.chain_label = QLabel()
+        chain_layout.addWidget(self.chain_label)
+        chain_layout.addStretch()
+        self.maintain_chain_btn = QPushButton("立即整理后端链")
+        self.maintain_chain_btn.setToolTip("后端链超过上限时在后台合并无主中间层或把较深的层复制进当前磁盘，不等待空闲时段")
+        self.maintain_chain_btn.clicked.connect(self.maintain_chain)
+        chain_layout.addWidget(self.maintain_chain_btn)
+        self.flatten_btn = QPushButton("完全展开磁盘")
+        self.flatten_btn.setToolTip("把整条后端链复制进当前磁盘（链接克隆脱离基础镜像），快照不受影响")
+        self.flatten_btn.clicked.connect(self.flatten_disks)
+        chain_layout.addWidget(self.flatten_btn)
+        layout.addLayout(chain_layout)
         
         # 按钮布局
         button_layout = QHBoxLayout()
@@ -91,35 +138,113 @@ class SnapshotDialog(QDialog):
         layout.addLayout(button_layout)
     
     def load_snapshots(self):
-        """加载快照列表"""
-        snapshots = self.vm_controller.list_vm_snapshots(self.vm_name)
-        
-        self.snapshots_table.setRowCount(len(snapshots))
-        
-        for row, snapshot in enumerate(snapshots):
-            self.snapshots_table.setItem(row, 0, QTableWidgetItem(snapshot['id']))
-            self.snapshots_table.setItem(row, 1, QTableWidgetItem(snapshot['name']))
-            self.snapshots_table.setItem(row, 2, QTableWidgetItem(snapshot['description']))
-            self.snapshots_table.setItem(row, 3, QTableWidgetItem(snapshot['created_at']))
-            
-            # 操作按钮
-            btn_widget = QWidget()
-            btn_layout = QHBoxLayout(btn_widget)
-            btn_layout.setContentsMargins(2, 2, 2, 2)
-            
-            restore_btn = QPushButton("恢复")
-            restore_btn.clicked.connect(lambda _, s=snapshot['id']: self.restore_snapshot(s))
-            restore_btn.setStyleSheet("QPushButton { color: blue; }")
-            
-            delete_btn = QPushButton("删除")
-            delete_btn.clicked.connect(lambda _, s=snapshot['id']: self.delete_snapshot(s))
-            delete_btn.setStyleSheet("QPushButton { color: red; }")
-            
-            btn_layout.addWidget(restore_btn)
-            btn_layout.addWidget(delete_btn)
-            btn_layout.addStretch()
-            
-            self.snapshots_table.setCellWidget(row, 4, btn_widget)
+        """加载快照树"""
+        self.snapshots_tree.clear()
+        for node in self.vm_controller.get_vm_snapshot_tree(self.vm_name):
+            self.add_snapshot_item(self.snapshots_tree, node)
+        self.snapshots_tree.expandAll()
+        
+        manager = self.vm_controller.snapshot_manager
+        if manager:
+            depths = manager.chain_depths(self.vm_name)
+            text = "后端链长度: " + "，".join(f"{drive_id} {depth}" for drive_id, depth in depths.items())
+            if manager.chain_job_running(self.vm_name):
+                text += "（正在后台缩短）"
+            self.chain_label.setText(text if depths else "")
+    
+    def add_snapshot_item(self, parent, snapshot):
+        """添加快照节点及其子节点"""
+        item = QTreeWidgetItem(parent)
+        item.setText(0, snapshot['name'] + (" [含内存]" if snapshot.get('has_memory') else ""))
+        item.setText(1, snapshot['id'])
+        item.setText(2, snapshot['description'])
+        item.setText(3, snapshot['created_at'])
+        if snapshot.get('pause_ms') is not None:
+            item.setToolTip(0, f"{BACKEND_NAMES.get(snapshot['backend'], snapshot['backend'])}，"
+                               f"创建时虚拟机状态: {snapshot['vm_state']}，暂停 {snapshot['pause_ms']} ms")
+        if snapshot.get('is_current'):
+            font = QFont()
+            font.setBold(True)
+            for column in range(4):
+                item.setFont(column, font)
+            item.setText(0, item.text(0) + " ← 当前")
+        
+        # 操作按钮
+        btn_widget = QWidget()
+        btn_layout = QHBoxLayout(btn_widget)
+        btn_layout.setContentsMargins(2, 2, 2, 2)
+        
+        restore_btn = QPushButton("恢复")
+        restore_btn.clicked.connect(lambda _, s=snapshot['id']: self.restore_snapshot(s))
+        restore_btn.setStyleSheet("QPushButton { color: blue; }")
+        
+        delete_btn = QPushButton("删除")
+        delete_btn.clicked.connect(lambda _, s=snapshot['id']: self.delete_snapshot(s))
+        delete_btn.setStyleSheet("QPushButton { color: red; }")
+        
+        btn_layout.addWidget(restore_btn)
+        btn_layout.addWidget(delete_btn)
+        btn_layout.addStretch()
+        
+        self.snapshots_tree.setItemWidget(item, 4, btn_widget)
+        
+        for child in snapshot['children']:
+            self.add_snapshot_item(item, child)
+    
+    def load_schedule(self):
+        """加载虚拟机的快照计划"""
+        config_manager = self.vm_controller.config_manager
+        schedule = get_vm_schedule(config_manager, self.vm_name)
+        self.schedule_enabled_check.setChecked(schedule.enabled)
+        self.schedule_cron_edit.setText(schedule.cron)
+        self.schedule_memory_check.setChecked(schedule.include_memory)
+        self.before_risky_check.setChecked(schedule.before_risky)
+        next_run = get_snapshot_scheduler(config_manager).next_run(self.vm_name)
+        self.next_run_label.setText(f"下次: {next_run.strftime('%Y-%m-%d %H:%M')}" if next_run else "")
+    
+    def save_schedule(self):
+        """保存快照计划"""
+        config_manager = self.vm_controller.config_manager
+        schedule = get_vm_schedule(config_manager, self.vm_name)
+        schedule.enabled = self.schedule_enabled_check.isChecked()
+        schedule.cron = self.schedule_cron_edit.text().strip() or SnapshotSchedule.cron
+        schedule.include_memory = self.schedule_memory_check.isChecked()
+        schedule.before_risky = self.before_risky_check.isChecked()
+        try:
+            saved = set_vm_schedule(config_manager, self.vm_name, schedule)
+        except ValueError as e:
+            QMessageBox.warning(self, "计划无效", str(e))
+            return
+        if saved:
+            QMessageBox.information(self, "成功", "快照计划已保存")
+            self.load_schedule()
+        else:
+            QMessageBox.warning(self, "失败", "保存快照计划失败")
+    
+    def maintain_chain(self):
+        """立即提交后端链整理任务"""
+        job_ids = get_chain_maintenance(self.vm_controller.config_manager).maintain(self.vm_name, urgent=True)
+        if job_ids:
+            QMessageBox.information(self, "已提交", "整理任务已加入磁盘任务队列，可在存储管理中查看进度")
+        else:
+            QMessageBox.information(self, "无需整理", "后端链未超过上限，或已有整理任务在进行")
+        self.load_snapshots()
+    
+    def flatten_disks(self):
+        """完全展开磁盘"""
+        reply = QMessageBox.question(
+            self,
+            "确认展开",
+            "展开会把所有后端镜像的数据复制进当前磁盘，占用的空间接近磁盘的实际数据量。确定继续吗？",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        if get_clone_manager(self.vm_controller.config_manager).flatten_clone(self.vm_name):
+            QMessageBox.information(self, "已提交", "展开任务已加入磁盘任务队列，可在存储管理中查看进度")
+        else:
+            QMessageBox.warning(self, "失败", "磁盘没有后端镜像，或已有整理任务在进行")
+        self.load_snapshots()
     
     def create_snapshot(self):
         """创建快照"""
@@ -131,7 +256,9 @@ class SnapshotDialog(QDialog):
         description = self.snapshot_desc_edit.toPlainText().strip()
         
         try:
-            success = self.vm_controller.create_vm_snapshot(self.vm_name, snapshot_name, description)
+            success = self.vm_controller.create_vm_snapshot(
+                self.vm_name, snapshot_name, description, self.include_memory_check.isChecked()
+            )
             if success:
                 QMessageBox.information(self, "成功", "快照创建成功")
                 self.load_snapshots()
@@ -144,10 +271,16 @@ class SnapshotDialog(QDialog):
     
     def restore_snapshot(self, snapshot_id):
         """恢复快照"""
+        backup_note = {
+            'snapshot': "当前状态将自动保存为快照。",
+            'reflink': "当前状态将以reflink方式备份（文件系统不支持时不备份）。",
+            'none': "当前状态将被丢弃，此操作不可撤销！"
+        }.get(self.vm_controller.snapshot_manager.get_restore_backup_mode(self.vm_name)
+              if self.vm_controller.snapshot_manager else 'none', "")
         reply = QMessageBox.question(
             self, 
             "确认恢复", 
-            f"确定要恢复快照 '{snapshot_id}' 吗？\\n此操作将覆盖当前虚拟机状态！", 
+            f"确定要恢复快照 '{snapshot_id}' 吗？\\n{backup_note}", 
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
         )
         
@@ -155,7 +288,11 @@ class SnapshotDialog(QDialog):
             try:
                 success = self.vm_controller.restore_vm_snapshot(self.vm_name, snapshot_id)
                 if success:
-                    QMessageBox.information(self, "成功", "快照恢复成功")
+                    vm_config = self.vm_controller.config_manager.get_vm_config(self.vm_name) or {}
+                    resume_note = "\n虚拟机下次启动时将从快照保存的内存状态继续运行" \
+                        if vm_config.get('resume_state') else ""
+                    QMessageBox.information(self, "成功", f"快照恢复成功{resume_note}")
+                    self.load_snapshots()
                 else:
                     QMessageBox.critical(self, "错误", "快照恢复失败")
             except Exception as e:
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+快照清理对话框
+编辑快照保留策略，预览清理计划，确认后在后台执行
+"""
+
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QFormLayout,
+    QGroupBox, QPushButton, QLabel, QSpinBox, QDoubleSpinBox, QComboBox,
+    QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox, QProgressBar
+)
+from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtGui import QColor
+
+from ltwin_manager.utils.snapshot_retention import (
+    get_snapshot_retention_engine, RetentionPolicy, RetentionPlan
+)
+
+
+class RetentionWorker(QThread):
+    """执行清理计划的工作线程"""
+
+    progress_signal = pyqtSignal(str, int)  # (状态消息, 进度百分比)
+    finished_signal = pyqtSignal(dict)  # 执行结果
+
+    def __init__(self, engine, plan: RetentionPlan):
+        super().__init__()
+        self.engine = engine
+        self.plan = plan
+
+    def run(self):
+        """执行清理"""
+        try:
+            result = self.engine.execute(self.plan, progress_callback=self.progress_signal.emit)
+        except Exception as e:
+            result = {'deleted': 0, 'merged': 0, 'freed_bytes': 0, 'errors': [str(e)]}
+        self.finished_signal.emit(result)
+
+
+class SnapshotRetentionDialog(QDialog):
+    """快照清理对话框"""
+
+    def __init__(self, config_manager, parent=None):
+        super().__init__(parent)
+        self.config_manager = config_manager
+        self.engine = get_snapshot_retention_engine(config_manager)
+        self.plan = None
+        self.worker = None
+
+        self.setWindowTitle("快照清理")
+        self.resize(900, 600)
+
+        self.init_ui()
+        self.load_policy()
+
+    def init_ui(self):
+        """初始化用户界面"""
+        layout = QVBoxLayout(self)
+
+        # 保留策略
+        policy_group = QGroupBox("保留策略（0 表示不启用）")
+        policy_layout = QFormLayout(policy_group)
+
+        self.vm_combo = QComboBox()
+        self.vm_combo.addItem("全部虚拟机", None)
+        for vm_name in self.config_manager.list_vms():
+            self.vm_combo.addItem(vm_name, vm_name)
+        self.vm_combo.currentIndexChanged.connect(self.load_policy)
+        policy_layout.addRow("虚拟机:", self.vm_combo)
+
+        self.keep_last_spin = QSpinBox()
+        self.keep_last_spin.setRange(0, 1000)
+        policy_layout.addRow("保留最近快照数:", self.keep_last_spin)
+
+        self.keep_daily_spin = QSpinBox()
+        self.keep_daily_spin.setRange(0, 3650)
+        self.keep_daily_spin.setSuffix(" 天")
+        policy_layout.addRow("每天保留一个:", self.keep_daily_spin)
+
+        self.keep_weekly_spin = QSpinBox()
+        self.keep_weekly_spin.setRange(0, 520)
+        self.keep_weekly_spin.setSuffix(" 周")
+        policy_layout.addRow("每周保留一个:", self.keep_weekly_spin)
+
+        self.max_age_spin = QSpinBox()
+        self.max_age_spin.setRange(0, 3650)
+        self.max_age_spin.setSuffix(" 天")
+        policy_layout.addRow("最长保留:", self.max_age_spin)
+
+        self.max_gb_spin = QDoubleSpinBox()
+        self.max_gb_spin.setRange(0, 100000)
+        self.max_gb_spin.setDecimals(1)
+        self.max_gb_spin.setSuffix(" GB")
+        policy_layout.addRow("每台虚拟机快照容量上限:", self.max_gb_spin)
+
+        policy_buttons = QHBoxLayout()
+        self.save_policy_btn = QPushButton("保存策略")
+        self.save_policy_btn.clicked.connect(self.save_policy)
+        policy_buttons.addWidget(self.save_policy_btn)
+        self.preview_btn = QPushButton("预览清理计划")
+        self.preview_btn.clicked.connect(self.preview_plan)
+        policy_buttons.addWidget(self.preview_btn)
+        policy_buttons.addStretch()
+        policy_layout.addRow(policy_buttons)
+
+        layout.addWidget(policy_group)
+
+        # 清理计划
+        self.plan_table = QTableWidget()
+        self.plan_table.setColumnCount(7)
+        self.plan_table.setHorizontalHeaderLabels(["虚拟机", "快照", "创建时间", "大小", "操作", "原因", "需合并的子镜像"])
+        header = self.plan_table.horizontalHeader()
+        for column in range(6):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(6, QHeaderView.ResizeMode.Stretch)
+        self.plan_table.setAlternatingRowColors(True)
+        self.plan_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.plan_table)
+
+        self.summary_label = QLabel("点击“预览清理计划”查看将要删除的快照")
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        # 按钮
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        self.execute_btn = QPushButton("执行清理")
+        self.execute_btn.setEnabled(False)
+        self.execute_btn.clicked.connect(self.execute_plan)
+        button_layout.addWidget(self.execute_btn)
+        self.close_btn = QPushButton("关闭")
+        self.close_btn.clicked.connect(self.close)
+        button_layout.addWidget(self.close_btn)
+        layout.addLayout(button_layout)
+
+    def current_vm(self):
+        """当前选择的虚拟机（None 表示全部）"""
+        return self.vm_combo.currentData()
+
+    def load_policy(self):
+        """加载当前虚拟机（或全局）的保留策略"""
+        policy = self.engine.get_policy(self.current_vm())
+        self.keep_last_spin.setValue(policy.keep_last)
+        self.keep_daily_spin.setValue(policy.keep_daily)
+        self.keep_weekly_spin.setValue(policy.keep_weekly)
+        self.max_age_spin.setValue(policy.max_age_days)
+        self.max_gb_spin.setValue(policy.max_gb)
+        self.plan = None
+        self.execute_btn.setEnabled(False)
+
+    def current_policy(self) -> RetentionPolicy:
+        """界面上的保留策略"""
+        return RetentionPolicy(
+            keep_last=self.keep_last_spin.value(),
+            keep_daily=self.keep_daily_spin.value(),
+            keep_weekly=self.keep_weekly_spin.value(),
+            max_age_days=self.max_age_spin.value(),
+            max_gb=self.max_gb_spin.value()
+        )
+
+    def save_policy(self):
+        """保存策略：选择了虚拟机时保存到虚拟机配置，否则保存为全局默认策略"""
+        vm_name = self.current_vm()
+        policy = self.current_policy().to_dict()
+        if vm_name:
+            vm_config = self.config_manager.get_vm_config(vm_name) or {}
+            vm_config['snapshot_retention'] = policy
+            saved = self.config_manager.set_vm_config(vm_name, vm_config)
+        else:
+            saved = self.config_manager.set_global_config("snapshot_retention", policy)
+        if saved:
+            QMessageBox.information(self, "成功", "保留策略已保存")
+        else:
+            QMessageBox.warning(self, "失败", "保存保留策略失败")
+
+    def preview_plan(self):
+        """按界面上的策略生成清理计划（不做修改）"""
+        vm_name = self.current_vm()
+        policy = self.current_policy()
+        if vm_name:
+            self.plan = self.engine.plan(vm_name, policy)
+        else:
+            # 全部虚拟机时，配置了单独策略的虚拟机仍使用自己的策略
+            self.plan = RetentionPlan()
+            for name in list(self.engine.snapshot_manager.snapshots_metadata.keys()):
+                vm_config = self.config_manager.get_vm_config(name) or {}
+                vm_policy = RetentionPolicy.from_dict(vm_config['snapshot_retention']) \
+                    if vm_config.get('snapshot_retention') else policy
+                self.plan.actions.extend(self.engine.plan(name, vm_policy).actions)
+            self.plan.orphans = self.engine.find_orphans()
+        self.show_plan()
+
+    def show_plan(self):
+        """显示清理计划"""
+        actions = self.plan.actions
+        self.plan_table.setRowCount(len(actions))
+        for row, action in enumerate(actions):
+            values = [
+                action.vm_name,
+                action.name,
+                action.created_at,
+                f"{action.size_bytes / (1024**2):.1f} MB",
+                "删除" if action.delete else "保留",
+                "、".join(action.reasons),
+                "\n".join(action.children)
+            ]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if action.delete:
+                    item.setForeground(QColor("#c0392b"))
+                self.plan_table.setItem(row, column, item)
+
+        summary = self.plan.summary()
+        if self.plan.orphans:
+            summary += "\n未登记的镜像文件（不会自动删除）:\n" + "\n".join(self.plan.orphans)
+        self.summary_label.setText(summary)
+        self.execute_btn.setEnabled(bool(self.plan.deletions))
+
+    def execute_plan(self):
+        """确认后执行清理计划"""
+        if not self.plan or not self.plan.deletions:
+            return
+        reply = QMessageBox.question(
+            self,
+            "确认清理",
+            f"{self.plan.summary()}\n\n确定要执行吗？此操作不可撤销！",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+
+        self.execute_btn.setEnabled(False)
+        self.preview_btn.setEnabled(False)
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+
+        self.worker = RetentionWorker(self.engine, self.plan)
+        self.worker.progress_signal.connect(self.on_progress)
+        self.worker.finished_signal.connect(self.on_finished)
+        self.worker.start()
+
+    def on_progress(self, message: str, percent: int):
+        """更新进度"""
+        self.progress_bar.setValue(percent)
+        self.summary_label.setText(message)
+
+    def on_finished(self, result: dict):
+        """清理完成"""
+        self.progress_bar.setVisible(False)
+        self.preview_btn.setEnabled(True)
+        message = (f"已删除 {result['deleted']} 个快照，合并 {result['merged']} 个子镜像，"
+                   f"释放约 {result['freed_bytes'] / (1024**3):.2f} GB")
+        if result['errors']:
+            message += "\n\n失败:\n" + "\n".join(result['errors'])
+            QMessageBox.warning(self, "清理完成", message)
+        else:
+            QMessageBox.information(self, "清理完成", message)
+        self.preview_plan()
+
+    def closeEvent(self, event):
+        """清理进行中时不允许关闭"""
+        if self.worker and self.worker.isRunning():
+            QMessageBox.information(self, "提示", "清理正在进行，请等待完成")
+            event.ignore()
+            return
+        super().closeEvent(event)
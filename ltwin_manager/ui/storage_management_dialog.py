@@ -8,10 +8,97 @@ from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QFormLayout,
     QTabWidget, QWidget, QGroupBox, QPushButton,
     QLabel, QProgressBar, QTreeWidget, QTreeWidgetItem,
-    QHeaderView, QMessageBox, QSpinBox, QLineEdit
+    QHeaderView, QMessageBox, QSpinBox, QLineEdit, QComboBox,
+    QTableWidget, QTableWidgetItem, QCheckBox
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from datetime import datetime
+import os
+from ltwin_manager.utils.disk_job_queue import PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH
+from ltwin_manager.utils.storage_pools import POOL_ROLES, DEVICE_CLASS_NAMES
+from ltwin_manager.ui.snapshot_retention_dialog import SnapshotRetentionDialog
+from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+
+# 已经不需要结果、仍在运行的后台线程，结束前保持引用（没有父对象的 QThread 被回收时不能还在运行）
+_released_workers = set()
+
+
+def release_worker(worker: QThread, *signals):
+    """
+    断开后台线程的结果信号并请求中断，不等待它结束
+    
+    线程可能正在冷缓存上遍历后端链或等待虚拟机锁，在GUI线程中 wait() 会卡住界面；
+    结束后由 finished 信号释放
+    """
+    for signal in signals + (worker.finished,):
+        try:
+            signal.disconnect()
+        except TypeError:
+            pass  # 没有连接
+    worker.requestInterruption()
+    _released_workers.add(worker)
+    
+    def cleanup():
+        if worker in _released_workers:
+            _released_workers.discard(worker)
+            worker.deleteLater()
+    
+    worker.finished.connect(cleanup)
+    if worker.isFinished():
+        cleanup()
+
+
+class SnapshotUsageWorker(QThread):
+    """在后台计算快照占用（冷缓存时要遍历每个镜像的簇分配表），每算完一台虚拟机发出一次结果"""
+    
+    vm_ready = pyqtSignal(str, list)  # (虚拟机, [(名称, 独占, 共享, 已分配簇, 创建时间, 路径, 错误)])
+    
+    def __init__(self, snapshot_manager, vm_names):
+        super().__init__()
+        self.snapshot_manager = snapshot_manager
+        self.vm_names = vm_names
+    
+    def run(self):
+        for vm_name in self.vm_names:
+            if self.isInterruptionRequested():
+                return
+            try:
+                usage = self.snapshot_manager.snapshot_usage(vm_name)
+                snapshots = self.snapshot_manager.list_snapshots(vm_name)
+            except Exception as e:
+                print(f"计算 {vm_name} 的快照占用失败: {e}")
+                continue
+            rows = []
+            for snapshot in snapshots:
+                info = usage.get(snapshot['id'], {})
+                snapshot_info = self.snapshot_manager.get_snapshot_info(vm_name, snapshot['id']) or {}
+                paths = list(self.snapshot_manager.snapshot_disks(snapshot_info).values()) \
+                    or [snapshot_info.get('disk_path', '')]
+                rows.append((snapshot['name'], info.get('exclusive_bytes', 0), info.get('shared_bytes', 0),
+                             info.get('allocated_clusters', 0), snapshot['created_at'], "; ".join(paths),
+                             info.get('error', '')))
+            self.vm_ready.emit(vm_name, rows)
+
+
+class PoolStatusWorker(QThread):
+    """在后台扫描存储池目录、采样设备负载并读取容量台账"""
+    
+    pools_ready = pyqtSignal(list)  # [(PoolStatus, PoolCapacity)]
+    
+    def __init__(self, pool_manager, capacity_planner):
+        super().__init__()
+        self.pool_manager = pool_manager
+        self.capacity_planner = capacity_planner
+    
+    def run(self):
+        try:
+            rows = [(status, self.capacity_planner.get_pool_capacity(status.pool['name']))
+                    for status in self.pool_manager.list_pool_status()]
+        except Exception as e:
+            print(f"加载存储池状态失败: {e}")
+            rows = []
+        self.pools_ready.emit(rows)
 
 
 class StorageManagementDialog(QDialog):
@@ -21,12 +108,24 @@ class StorageManagementDialog(QDialog):
         super().__init__(parent)
         self.storage_manager = storage_manager
         self.config_manager = config_manager
+        self.job_queue = storage_manager.job_queue
+        self.pool_manager = storage_manager.pool_manager
+        self.job_rows = {}  # 任务ID -> 行号
+        self.usage_worker = None
+        self.pool_worker = None
+        self.snapshot_totals = [0, 0, 0]  # 快照数, 独占合计, 共享合计
         
         self.setWindowTitle("存储管理")
         self.resize(800, 600)
         
         self.init_ui()
         self.load_storage_info()
+        self.load_jobs()
+        
+        # 任务在对话框关闭后继续运行，这里只订阅状态更新
+        self.job_queue.job_added.connect(self.on_job_changed)
+        self.job_queue.job_updated.connect(self.on_job_changed)
+        self.job_queue.job_finished.connect(self.on_job_finished)
     
     def init_ui(self):
         """初始化用户界面"""
@@ -47,10 +146,20 @@ class StorageManagementDialog(QDialog):
         snapshot_storage_tab = self.create_snapshot_storage_tab()
         tab_widget.addTab(snapshot_storage_tab, "快照存储")
         
+        # 存储池标签页
+        pools_tab = self.create_pools_tab()
+        tab_widget.addTab(pools_tab, "存储池")
+        
         # 磁盘操作标签页
         disk_ops_tab = self.create_disk_operations_tab()
         tab_widget.addTab(disk_ops_tab, "磁盘操作")
         
+        # 后台任务标签页
+        jobs_tab = self.create_jobs_tab()
+        tab_widget.addTab(jobs_tab, "后台任务")
+        self.jobs_tab_index = tab_widget.indexOf(jobs_tab)
+        self.tab_widget = tab_widget
+        
         layout.addWidget(tab_widget)
         
         # 按钮布局
@@ -160,16 +269,20 @@ class StorageManagementDialog(QDialog):
         
         # 快照存储列表
         self.snapshot_storage_tree = QTreeWidget()
-        self.snapshot_storage_tree.setHeaderLabels(["快照", "大小", "创建时间", "路径"])
+        self.snapshot_storage_tree.setHeaderLabels(["快照", "独占（删除可回收）", "共享", "已分配簇", "创建时间", "路径"])
         header = self.snapshot_storage_tree.header()
         header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
-        header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
-        header.setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
-        header.setSectionResizeMode(3, QHeaderView.ResizeMode.Stretch)
+        for column in range(1, 5):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(5, QHeaderView.ResizeMode.Stretch)
         
         layout.addWidget(QLabel("快照存储列表:"))
         layout.addWidget(self.snapshot_storage_tree)
         
+        self.snapshot_totals_label = QLabel()
+        self.snapshot_totals_label.setToolTip("独占: 删除快照后实际能释放的空间；共享: 仍被子镜像或其他快照使用的数据")
+        layout.addWidget(self.snapshot_totals_label)
+        
         return widget
     
     def create_disk_operations_tab(self):
@@ -217,8 +330,335 @@ class StorageManagementDialog(QDialog):
         
         layout.addWidget(resize_group)
         
+        # 格式转换组
+        convert_group = QGroupBox("转换磁盘格式")
+        convert_layout = QFormLayout(convert_group)
+        
+        self.convert_source_edit = QLineEdit()
+        self.convert_source_edit.setPlaceholderText("输入源磁盘文件路径")
+        convert_layout.addRow("源磁盘:", self.convert_source_edit)
+        
+        self.convert_target_edit = QLineEdit()
+        self.convert_target_edit.setPlaceholderText("输入目标磁盘文件路径")
+        convert_layout.addRow("目标磁盘:", self.convert_target_edit)
+        
+        self.convert_format_combo = QComboBox()
+        self.convert_format_combo.addItems(["qcow2", "raw", "vmdk", "vdi"])
+        convert_layout.addRow("目标格式:", self.convert_format_combo)
+        
+        self.convert_compress_check = QCheckBox("压缩 (仅qcow2/vmdk，体积更小但转换更慢)")
+        convert_layout.addRow("", self.convert_compress_check)
+        
+        self.convert_disk_btn = QPushButton("开始转换")
+        self.convert_disk_btn.clicked.connect(self.convert_virtual_disk)
+        convert_layout.addRow("", self.convert_disk_btn)
+        
+        layout.addWidget(convert_group)
+        
+        # 磁盘压缩组
+        compact_group = QGroupBox("压缩磁盘 (去除零簇并回收空间)")
+        compact_layout = QFormLayout(compact_group)
+        
+        self.compact_path_edit = QLineEdit()
+        self.compact_path_edit.setPlaceholderText("输入要压缩的磁盘文件路径（虚拟机需已停止）")
+        compact_layout.addRow("磁盘路径:", self.compact_path_edit)
+        
+        self.compact_compress_check = QCheckBox("同时启用qcow2压缩")
+        compact_layout.addRow("", self.compact_compress_check)
+        
+        self.compact_disk_btn = QPushButton("开始压缩")
+        self.compact_disk_btn.clicked.connect(self.compact_virtual_disk)
+        compact_layout.addRow("", self.compact_disk_btn)
+        
+        layout.addWidget(compact_group)
+        
+        # 任务优先级
+        priority_layout = QHBoxLayout()
+        priority_layout.addWidget(QLabel("任务优先级:"))
+        self.job_priority_combo = QComboBox()
+        self.job_priority_combo.addItem("低", PRIORITY_LOW)
+        self.job_priority_combo.addItem("普通", PRIORITY_NORMAL)
+        self.job_priority_combo.addItem("高", PRIORITY_HIGH)
+        self.job_priority_combo.setCurrentIndex(1)
+        priority_layout.addWidget(self.job_priority_combo)
+        priority_layout.addStretch()
+        layout.addLayout(priority_layout)
+        
+        return widget
+    
+    def create_pools_tab(self):
+        """创建存储池标签页"""
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        
+        self.pools_table = QTableWidget(0, 11)
+        self.pools_table.setHorizontalHeaderLabels(
+            ["名称", "路径", "设备", "用途", "容量", "已用", "可用", "IOPS余量", "实测写入", "已承诺(超配)", "预计用满"]
+        )
+        header = self.pools_table.horizontalHeader()
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        for col in (0, 2, 3, 4, 5, 6, 7, 8, 9, 10):
+            header.setSectionResizeMode(col, QHeaderView.ResizeMode.ResizeToContents)
+        self.pools_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.pools_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.pools_table)
+        
+        pool_ops_layout = QHBoxLayout()
+        self.refresh_pools_btn = QPushButton("刷新")
+        self.refresh_pools_btn.clicked.connect(self.load_pools)
+        pool_ops_layout.addWidget(self.refresh_pools_btn)
+        self.remove_pool_btn = QPushButton("移除存储池")
+        self.remove_pool_btn.clicked.connect(self.remove_selected_pool)
+        pool_ops_layout.addWidget(self.remove_pool_btn)
+        pool_ops_layout.addStretch()
+        layout.addLayout(pool_ops_layout)
+        
+        # 添加存储池组
+        add_group = QGroupBox("添加存储池")
+        add_layout = QFormLayout(add_group)
+        
+        self.pool_name_edit = QLineEdit()
+        self.pool_name_edit.setPlaceholderText("例如: nvme-fast")
+        add_layout.addRow("名称:", self.pool_name_edit)
+        
+        self.pool_path_edit = QLineEdit()
+        self.pool_path_edit.setPlaceholderText("存储池目录")
+        add_layout.addRow("路径:", self.pool_path_edit)
+        
+        self.pool_device_combo = QComboBox()
+        for device_class in ('auto', 'nvme', 'ssd', 'hdd', 'network'):
+            self.pool_device_combo.addItem(DEVICE_CLASS_NAMES[device_class], device_class)
+        add_layout.addRow("设备类型:", self.pool_device_combo)
+        
+        self.pool_capacity_spinbox = QSpinBox()
+        self.pool_capacity_spinbox.setRange(0, 1024 * 1024)
+        self.pool_capacity_spinbox.setSuffix(" GB")
+        self.pool_capacity_spinbox.setSpecialValueText("不限制")
+        add_layout.addRow("容量上限:", self.pool_capacity_spinbox)
+        
+        roles_layout = QHBoxLayout()
+        self.pool_role_checks = {}
+        for role, role_name in POOL_ROLES.items():
+            check = QCheckBox(role_name)
+            check.setChecked(True)
+            self.pool_role_checks[role] = check
+            roles_layout.addWidget(check)
+        roles_layout.addStretch()
+        add_layout.addRow("用途:", roles_layout)
+        
+        self.add_pool_btn = QPushButton("添加")
+        self.add_pool_btn.clicked.connect(self.add_pool)
+        add_layout.addRow("", self.add_pool_btn)
+        
+        layout.addWidget(add_group)
+        
+        # 迁移磁盘组
+        migrate_group = QGroupBox("迁移虚拟机磁盘到存储池")
+        migrate_layout = QFormLayout(migrate_group)
+        
+        self.migrate_vm_combo = QComboBox()
+        migrate_layout.addRow("虚拟机:", self.migrate_vm_combo)
+        
+        self.migrate_pool_combo = QComboBox()
+        migrate_layout.addRow("目标存储池:", self.migrate_pool_combo)
+        
+        self.migrate_disk_btn = QPushButton("开始迁移")
+        self.migrate_disk_btn.clicked.connect(self.migrate_vm_disk)
+        migrate_layout.addRow("", self.migrate_disk_btn)
+        
+        layout.addWidget(migrate_group)
+        
         return widget
     
+    def load_pools(self):
+        """加载存储池列表（扫描目录和采样设备负载在后台线程中进行）"""
+        if self.pool_worker is not None:
+            release_worker(self.pool_worker, self.pool_worker.pools_ready)
+        self.pool_worker = PoolStatusWorker(self.pool_manager, self.storage_manager.capacity_planner)
+        self.pool_worker.pools_ready.connect(self.show_pools)
+        self.pool_worker.start()
+        
+        self.migrate_vm_combo.clear()
+        for vm_name in self.config_manager.list_vms():
+            vm_config = self.config_manager.get_vm_config(vm_name) or {}
+            current_pool = self.pool_manager.pool_for_path(vm_config.get('disk_path', '')) or "未在存储池中"
+            self.migrate_vm_combo.addItem(f"{vm_name} ({current_pool})", vm_name)
+    
+    def show_pools(self, rows):
+        """显示后台加载的存储池状态"""
+        self.pool_worker = None
+        self.pools_table.setRowCount(0)
+        self.migrate_pool_combo.clear()
+        for status, pool_capacity in rows:
+            pool = status.pool
+            days_until_full = pool_capacity.days_until_full
+            row = self.pools_table.rowCount()
+            self.pools_table.insertRow(row)
+            capacity = f"{status.capacity_bytes / (1024**3):.0f} GB" if status.capacity_bytes else "-"
+            if not pool['capacity_gb'] and status.capacity_bytes:
+                capacity += " (文件系统)"
+            values = [
+                pool['name'],
+                pool['path'],
+                DEVICE_CLASS_NAMES.get(status.device_class, status.device_class),
+                "、".join(POOL_ROLES.get(role, role) for role in pool['roles']),
+                capacity,
+                f"{status.used_bytes / (1024**3):.2f} GB",
+                f"{status.free_bytes / (1024**3):.2f} GB",
+                f"{status.iops_headroom:.0%}",
+                f"{pool['write_mb_s']:.0f} MB/s" if pool['write_mb_s'] else "未测量",
+                f"{pool_capacity.committed_bytes / (1024**3):.0f} GB ({pool_capacity.overcommit_ratio:.2f}x)",
+                f"{days_until_full:.0f} 天" if days_until_full is not None else "-"
+            ]
+            for col, value in enumerate(values):
+                self.pools_table.setItem(row, col, QTableWidgetItem(value))
+            if 'disks' in pool['roles'] and pool['enabled']:
+                self.migrate_pool_combo.addItem(pool['name'], pool['name'])
+    
+    def add_pool(self):
+        """添加存储池"""
+        name = self.pool_name_edit.text().strip()
+        path = self.pool_path_edit.text().strip()
+        roles = [role for role, check in self.pool_role_checks.items() if check.isChecked()]
+        if not name or not path:
+            QMessageBox.warning(self, "输入错误", "请输入存储池名称和路径")
+            return
+        if not roles:
+            QMessageBox.warning(self, "输入错误", "请至少选择一种用途")
+            return
+        
+        if self.pool_manager.add_pool(name, path, roles, self.pool_device_combo.currentData(),
+                                      self.pool_capacity_spinbox.value()):
+            self.pool_name_edit.clear()
+            self.pool_path_edit.clear()
+            self.load_pools()
+        else:
+            QMessageBox.critical(self, "错误", "添加存储池失败，请检查名称是否重复以及路径是否可写")
+    
+    def remove_selected_pool(self):
+        """移除选中的存储池（不删除文件）"""
+        row = self.pools_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "警告", "请先选择一个存储池")
+            return
+        name = self.pools_table.item(row, 0).text()
+        reply = QMessageBox.question(
+            self, "确认移除", f"确定要移除存储池 '{name}' 吗？目录中的文件不会被删除。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        if self.pool_manager.remove_pool(name):
+            self.load_pools()
+        else:
+            QMessageBox.critical(self, "错误", "移除存储池失败，可能仍有虚拟机磁盘位于该存储池")
+    
+    def migrate_vm_disk(self):
+        """迁移虚拟机磁盘到选中的存储池"""
+        vm_name = self.migrate_vm_combo.currentData()
+        pool_name = self.migrate_pool_combo.currentData()
+        if not vm_name or not pool_name:
+            QMessageBox.warning(self, "输入错误", "请选择虚拟机和目标存储池")
+            return
+        self.submit_job(self.storage_manager.migrate_disk_to_pool_async, vm_name, pool_name)
+    
+    def create_jobs_tab(self):
+        """创建后台任务标签页"""
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        
+        self.jobs_table = QTableWidget(0, 6)
+        self.jobs_table.setHorizontalHeaderLabels(["任务", "设备", "优先级", "状态", "进度", "耗时"])
+        header = self.jobs_table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        for col in range(1, 6):
+            header.setSectionResizeMode(col, QHeaderView.ResizeMode.ResizeToContents)
+        self.jobs_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.jobs_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.jobs_table)
+        
+        jobs_ops_layout = QHBoxLayout()
+        
+        self.cancel_job_btn = QPushButton("取消任务")
+        self.cancel_job_btn.clicked.connect(self.cancel_selected_job)
+        jobs_ops_layout.addWidget(self.cancel_job_btn)
+        
+        self.clear_jobs_btn = QPushButton("清除已结束")
+        self.clear_jobs_btn.clicked.connect(self.clear_finished_jobs)
+        jobs_ops_layout.addWidget(self.clear_jobs_btn)
+        
+        jobs_ops_layout.addStretch()
+        layout.addLayout(jobs_ops_layout)
+        
+        return widget
+    
+    def load_jobs(self):
+        """加载任务列表"""
+        self.jobs_table.setRowCount(0)
+        self.job_rows = {}
+        for job in self.job_queue.jobs():
+            self.on_job_changed(job)
+    
+    def on_job_changed(self, job):
+        """任务新增或更新"""
+        row = self.job_rows.get(job['id'])
+        if row is None:
+            row = self.jobs_table.rowCount()
+            self.jobs_table.insertRow(row)
+            self.job_rows[job['id']] = row
+            progress_bar = QProgressBar()
+            progress_bar.setRange(0, 100)
+            self.jobs_table.setCellWidget(row, 4, progress_bar)
+        
+        job_item = QTableWidgetItem(job['description'])
+        job_item.setData(Qt.ItemDataRole.UserRole, job['id'])
+        job_item.setToolTip(job['message'] or job['target_path'])
+        self.jobs_table.setItem(row, 0, job_item)
+        self.jobs_table.setItem(row, 1, QTableWidgetItem(job['device'] or "-"))
+        self.jobs_table.setItem(row, 2, QTableWidgetItem(str(job['priority'])))
+        self.jobs_table.setItem(row, 3, QTableWidgetItem(job['status_name']))
+        self.jobs_table.setItem(row, 5, QTableWidgetItem(f"{job['elapsed']:.1f} 秒"))
+        
+        progress_bar = self.jobs_table.cellWidget(row, 4)
+        if job['progress'] >= 0:
+            progress_bar.setRange(0, 100)
+            progress_bar.setValue(int(job['progress']))
+        elif job['status'] == 'running':
+            progress_bar.setRange(0, 0)  # 命令不报告进度时显示忙碌状态
+        else:
+            progress_bar.setRange(0, 100)
+            progress_bar.setValue(100 if job['status'] == 'completed' else 0)
+    
+    def on_job_finished(self, job_id, success, message):
+        """任务结束后刷新存储信息"""
+        if success:
+            self.load_storage_info()
+    
+    def cancel_selected_job(self):
+        """取消选中的任务"""
+        row = self.jobs_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "警告", "请先选择一个任务")
+            return
+        job_id = self.jobs_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
+        if not self.job_queue.cancel(job_id):
+            QMessageBox.information(self, "提示", "该任务已结束")
+    
+    def clear_finished_jobs(self):
+        """清除已结束的任务"""
+        self.job_queue.clear_finished()
+        self.load_jobs()
+    
+    def submit_job(self, submit, *args):
+        """提交后台任务并切换到任务标签页"""
+        try:
+            submit(*args, priority=self.job_priority_combo.currentData())
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"提交任务失败: {str(e)}")
+            return False
+        self.tab_widget.setCurrentIndex(self.jobs_tab_index)
+        return True
+    
     def load_storage_info(self):
         """加载存储信息"""
         # 加载系统磁盘信息
@@ -246,34 +686,94 @@ class StorageManagementDialog(QDialog):
         # 加载统计信息
         stats = self.storage_manager.get_disk_statistics()
         self.total_vms_label.setText(str(stats['total_vms']))
-        self.total_usage_label.setText(f"{stats['total_disk_usage'] / (1024**3):.2f} GB")
+        self.total_usage_label.setText(
+            f"{stats['total_disk_usage'] / (1024**3):.2f} GB "
+            f"(文件长度 {stats['total_apparent_size'] / (1024**3):.2f} GB)"
+        )
         self.largest_vm_label.setText(f"{stats['largest_vm']} ({stats['largest_vm_size'] / (1024**3):.2f} GB)")
         
-        # 加载虚拟机存储列表
-        self.load_vm_storage_list()
+        # 加载虚拟机存储列表（复用上面的统计结果，避免重复扫描）
+        self.load_vm_storage_list(stats)
         
         # 加载快照存储列表
         self.load_snapshot_storage_list()
+        
+        # 加载存储池
+        self.load_pools()
     
-    def load_vm_storage_list(self):
+    def load_vm_storage_list(self, vm_stats=None):
         """加载虚拟机存储列表"""
         self.vm_storage_tree.clear()
         
-        vm_stats = self.storage_manager.get_disk_statistics()
+        if vm_stats is None:
+            vm_stats = self.storage_manager.get_disk_statistics()
         
         for vm_name, size in vm_stats['vm_count_by_size']:
             size_gb = size / (1024**3)
             item = QTreeWidgetItem([vm_name, f"{size_gb:.2f} GB", str(self.storage_manager.base_path / vm_name)])
             self.vm_storage_tree.addTopLevelItem(item)
     
+    @staticmethod
+    def format_size(size):
+        return f"{size / (1024**3):.2f} GB" if size >= 1024**3 else f"{size / (1024**2):.1f} MB"
+    
     def load_snapshot_storage_list(self):
-        """加载快照存储列表"""
-        # 这里可以加载快照信息，暂时显示占位符
-        self.snapshot_storage_tree.clear()
+        """
+        加载快照存储列表：按虚拟机分组显示每个快照的独占、共享空间和合计
         
-        # 添加示例数据
-        snapshot_item = QTreeWidgetItem(["示例快照", "2.5 GB", "2023-01-01 12:00", "/path/to/snapshot"])
-        self.snapshot_storage_tree.addTopLevelItem(snapshot_item)
+        占用在后台线程中计算，每算完一台虚拟机添加一组
+        """
+        self.stop_usage_worker()
+        self.snapshot_storage_tree.clear()
+        self.snapshot_totals = [0, 0, 0]
+        self.snapshot_totals_label.setText("正在计算快照占用...")
+        snapshot_manager = get_snapshot_manager(self.config_manager)
+        self.usage_worker = SnapshotUsageWorker(snapshot_manager, list(snapshot_manager.snapshots_metadata.keys()))
+        self.usage_worker.vm_ready.connect(self.add_snapshot_usage)
+        self.usage_worker.finished.connect(self.on_usage_finished)
+        self.usage_worker.start()
+    
+    def add_snapshot_usage(self, vm_name, rows):
+        """添加一台虚拟机的快照占用"""
+        vm_item = QTreeWidgetItem([f"{vm_name} ({len(rows)} 个快照)"])
+        vm_exclusive = vm_shared = vm_clusters = 0
+        for name, exclusive, shared, clusters, created_at, paths, error in rows:
+            child = QTreeWidgetItem([
+                name, self.format_size(exclusive), self.format_size(shared), str(clusters), created_at, paths
+            ])
+            if error:
+                child.setToolTip(0, error)
+                child.setText(1, "无法计算")
+            vm_item.addChild(child)
+            vm_exclusive += exclusive
+            vm_shared += shared
+            vm_clusters += clusters
+        vm_item.setText(1, self.format_size(vm_exclusive))
+        vm_item.setText(2, self.format_size(vm_shared))
+        vm_item.setText(3, str(vm_clusters))
+        self.snapshot_storage_tree.addTopLevelItem(vm_item)
+        self.snapshot_totals[0] += len(rows)
+        self.snapshot_totals[1] += vm_exclusive
+        self.snapshot_totals[2] += vm_shared
+        self.show_snapshot_totals()
+    
+    def on_usage_finished(self):
+        if self.sender() is self.usage_worker:
+            self.show_snapshot_totals()
+    
+    def show_snapshot_totals(self):
+        count, exclusive, shared = self.snapshot_totals
+        running = self.usage_worker is not None and self.usage_worker.isRunning()
+        self.snapshot_totals_label.setText(
+            f"共 {count} 个快照，独占合计 {self.format_size(exclusive)}，"
+            f"共享合计 {self.format_size(shared)}" + ("（计算中...）" if running else "")
+        )
+    
+    def stop_usage_worker(self):
+        """放弃正在进行的占用计算（不等待，线程在当前虚拟机算完后退出）"""
+        if self.usage_worker is not None:
+            release_worker(self.usage_worker, self.usage_worker.vm_ready)
+            self.usage_worker = None
     
     def create_virtual_disk(self):
         """创建虚拟磁盘"""
@@ -284,12 +784,12 @@ class StorageManagementDialog(QDialog):
             QMessageBox.warning(self, "输入错误", "请输入磁盘文件路径")
             return
         
-        success = self.storage_manager.create_disk_image(disk_path, size_gb)
-        if success:
-            QMessageBox.information(self, "成功", f"虚拟磁盘 {disk_path} 创建成功")
+        if os.path.exists(disk_path):
+            QMessageBox.warning(self, "输入错误", f"目标文件已存在: {disk_path}")
+            return
+        
+        if self.submit_job(self.storage_manager.create_disk_image_async, disk_path, size_gb):
             self.disk_path_edit.clear()
-        else:
-            QMessageBox.critical(self, "错误", f"创建虚拟磁盘失败: {disk_path}")
     
     def resize_virtual_disk(self):
         """调整虚拟磁盘大小"""
@@ -300,26 +800,63 @@ class StorageManagementDialog(QDialog):
             QMessageBox.warning(self, "输入错误", "请输入磁盘文件路径")
             return
         
-        success = self.storage_manager.resize_disk_image(disk_path, new_size_gb)
-        if success:
-            QMessageBox.information(self, "成功", f"虚拟磁盘 {disk_path} 大小已调整为 {new_size_gb} GB")
+        if self.submit_job(self.storage_manager.resize_disk_image_async, disk_path, new_size_gb):
             self.resize_path_edit.clear()
-        else:
-            QMessageBox.critical(self, "错误", f"调整虚拟磁盘大小失败: {disk_path}")
     
-    def cleanup_old_files(self):
-        """清理旧文件"""
-        reply = QMessageBox.question(
-            self,
-            "确认清理",
-            "确定要清理30天前的旧文件吗？此操作不可撤销！",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
-        )
+    def convert_virtual_disk(self):
+        """转换虚拟磁盘格式"""
+        source_path = self.convert_source_edit.text().strip()
+        target_path = self.convert_target_edit.text().strip()
+        target_format = self.convert_format_combo.currentText()
+        
+        if not source_path or not target_path:
+            QMessageBox.warning(self, "输入错误", "请输入源磁盘和目标磁盘路径")
+            return
         
-        if reply == QMessageBox.StandardButton.Yes:
-            cleaned_count = self.storage_manager.cleanup_old_snapshots(30)
-            QMessageBox.information(self, "清理完成", f"已清理 {cleaned_count} 个旧快照文件")
-
+        if os.path.exists(target_path):
+            QMessageBox.warning(self, "输入错误", f"目标文件已存在: {target_path}")
+            return
+        
+        if self.submit_job(self.storage_manager.convert_disk_format_async, source_path, target_path,
+                           target_format, self.convert_compress_check.isChecked()):
+            self.convert_source_edit.clear()
+            self.convert_target_edit.clear()
+    
+    def compact_virtual_disk(self):
+        """压缩虚拟磁盘"""
+        disk_path = self.compact_path_edit.text().strip()
+        if not disk_path:
+            QMessageBox.warning(self, "输入错误", "请输入磁盘文件路径")
+            return
+        
+        if not os.path.exists(disk_path):
+            QMessageBox.warning(self, "输入错误", f"磁盘文件不存在: {disk_path}")
+            return
+        
+        if self.submit_job(self.storage_manager.compact_disk_image_async, disk_path,
+                           self.compact_compress_check.isChecked()):
+            self.compact_path_edit.clear()
+    
+    def done(self, result):
+        """关闭时断开任务信号（任务本身继续在后台运行），放弃快照占用和存储池状态的计算"""
+        self.stop_usage_worker()
+        if self.pool_worker is not None:
+            release_worker(self.pool_worker, self.pool_worker.pools_ready)
+            self.pool_worker = None
+        try:
+            self.job_queue.job_added.disconnect(self.on_job_changed)
+            self.job_queue.job_updated.disconnect(self.on_job_changed)
+            self.job_queue.job_finished.disconnect(self.on_job_finished)
+        except TypeError:
+            pass  # 已断开
+        super().done(result)
+    
+    def cleanup_old_files(self):
+        """按保留策略清理旧快照（先预览清理计划，确认后执行）"""
+        dialog = SnapshotRetentionDialog(self.config_manager, self)
+        dialog.preview_plan()
+        dialog.exec()
+        self.load_storage_info()
 
 if __name__ == "__main__":
     import sys
@@ -11,8 +11,11 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from PyQt6.QtGui import QFont
+import threading
 
 from ltwin_manager.utils.system_checker import SystemChecker
+from ltwin_manager.utils.config_manager import get_config_manager
+from ltwin_manager.utils.storage_benchmark import benchmark_pools, recommend_disk_options, BenchmarkCancelled
 from ltwin_manager.ui.performance_report_dialog import PerformanceReportDialog
 
 
@@ -55,6 +58,33 @@ class RepairWorker(QThread):
         success = self.checker.repair_missing_components()
 
 
+class StorageBenchmarkWorker(QThread):
+    """存储基准测试工作线程"""
+    
+    progress_signal = pyqtSignal(str, int)  # (状态消息, 进度百分比)
+    result_signal = pyqtSignal(list)  # 测试结果列表
+    error_signal = pyqtSignal(str)
+    
+    def __init__(self):
+        super().__init__()
+        self.cancel_event = threading.Event()
+    
+    def run(self):
+        """对所有存储池运行基准测试"""
+        try:
+            results = benchmark_pools(get_config_manager(), progress_callback=self.progress_signal.emit,
+                                      cancel_event=self.cancel_event)
+            self.result_signal.emit(results)
+        except BenchmarkCancelled:
+            self.error_signal.emit("基准测试已取消")
+        except Exception as e:
+            self.error_signal.emit(str(e))
+    
+    def cancel(self):
+        """请求取消"""
+        self.cancel_event.set()
+
+
 class SystemCheckDialog(QDialog):
     """系统检测对话框"""
     
@@ -63,6 +93,7 @@ class SystemCheckDialog(QDialog):
         self.checker = SystemChecker()
         self.check_worker = None
         self.repair_worker = None
+        self.benchmark_worker = None
         
         self.setWindowTitle("系统检测和修复工具")
         self.resize(700, 500)
@@ -172,6 +203,11 @@ class SystemCheckDialog(QDialog):
         self.performance_report_button.clicked.connect(self.open_performance_report)
         button_layout.addWidget(self.performance_report_button)
         
+        self.benchmark_button = QPushButton("存储基准测试")
+        self.benchmark_button.setToolTip("测量各存储池的顺序/随机4K读写性能（O_DIRECT）")
+        self.benchmark_button.clicked.connect(self.start_benchmark)
+        button_layout.addWidget(self.benchmark_button)
+        
         button_layout.addStretch()
         button_layout.addWidget(self.close_button)
         
@@ -305,6 +341,54 @@ class SystemCheckDialog(QDialog):
         self.progress_bar.setValue(100)
         self.status_label.setText("修复完成，点击检测按钮重新检查")
     
+    def start_benchmark(self):
+        """开始存储基准测试"""
+        reply = QMessageBox.question(
+            self,
+            "存储基准测试",
+            "将在每个存储池目录中写入临时文件并测量读写性能，期间磁盘负载较高。是否继续？",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        
+        self.benchmark_button.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.result_text.clear()
+        
+        self.benchmark_worker = StorageBenchmarkWorker()
+        self.benchmark_worker.progress_signal.connect(self.update_progress)
+        self.benchmark_worker.result_signal.connect(self.display_benchmark_results)
+        self.benchmark_worker.error_signal.connect(self.benchmark_failed)
+        self.benchmark_worker.finished.connect(self.benchmark_finished)
+        self.benchmark_worker.start()
+    
+    def display_benchmark_results(self, results: list):
+        """显示基准测试结果"""
+        for result in results:
+            self.result_text.append(result.summary())
+            recommendation = recommend_disk_options(result)
+            self.result_text.append(
+                f"  推荐: cache={recommendation['cache']}, aio={recommendation['aio']} ({recommendation['reason']})\n"
+            )
+        self.status_label.setText(f"基准测试完成，已测试 {len(results)} 个存储池")
+    
+    def benchmark_failed(self, message: str):
+        """基准测试失败"""
+        self.status_label.setText(message)
+        self.result_text.append(f'<font color="red">基准测试失败: {message}</font>')
+    
+    def benchmark_finished(self):
+        """基准测试线程结束"""
+        self.benchmark_button.setEnabled(True)
+    
+    def closeEvent(self, event):
+        """关闭时取消正在运行的基准测试（删除临时文件）"""
+        if self.benchmark_worker and self.benchmark_worker.isRunning():
+            self.benchmark_worker.cancel()
+            self.benchmark_worker.wait(10000)
+        super().closeEvent(event)
+    
     def open_performance_report(self):
         """打开性能报告"""
         try:
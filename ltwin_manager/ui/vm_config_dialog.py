@@ -12,9 +12,15 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt
 from pathlib import Path
+import subprocess
 
 from ltwin_manager.utils.config_manager import get_config_manager
 from ltwin_manager.utils.network_manager import get_network_manager
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager, DEVICE_CLASS_NAMES
+from ltwin_manager.utils.image_library import get_image_library
+from ltwin_manager.utils.snapshot_backends import BACKEND_NAMES
+from ltwin_manager.utils.guest_agent import FSFREEZE_MODE_NAMES
 
 
 class VMConfigDialog(QDialog):
@@ -25,6 +31,7 @@ class VMConfigDialog(QDialog):
         self.vm_name = vm_name
         self.config_manager = get_config_manager()
         self.network_manager = get_network_manager()
+        self.pool_manager = get_storage_pool_manager(self.config_manager)
         
         self.setWindowTitle("虚拟机配置" if vm_name else "创建新虚拟机")
         self.resize(700, 600)
@@ -100,10 +107,51 @@ class VMConfigDialog(QDialog):
         self.disk_size_spinbox.setSuffix(" GB")
         layout.addRow("磁盘大小:", self.disk_size_spinbox)
         
+        # 存储池
+        self.storage_pool_combo = QComboBox()
+        self.storage_pool_combo.addItem("自动选择", "")
+        for pool in self.pool_manager.list_pools():
+            if 'disks' in pool['roles']:
+                device_name = DEVICE_CLASS_NAMES.get(pool['device_class'], pool['device_class'])
+                self.storage_pool_combo.addItem(f"{pool['name']} ({device_name})", pool['name'])
+        layout.addRow("存储池:", self.storage_pool_combo)
+        
+        self.storage_tier_combo = QComboBox()
+        self.storage_tier_combo.addItem("默认", "")
+        self.storage_tier_combo.addItem("热数据 (优先NVMe/SSD)", "hot")
+        self.storage_tier_combo.addItem("冷数据 (优先HDD)", "cold")
+        layout.addRow("存储层级:", self.storage_tier_combo)
+        
+        # 基础镜像（镜像库中的磁盘镜像，新磁盘以覆盖层方式共享）
+        self.base_image_combo = QComboBox()
+        self.base_image_combo.addItem("无（新建空白磁盘）", "")
+        for image_name in self.config_manager.list_images():
+            image_config = self.config_manager.get_image_config(image_name) or {}
+            if image_config.get('content_hash') and image_config.get('type') == 'disk':
+                self.base_image_combo.addItem(image_name, image_name)
+        self.base_image_combo.setEnabled(not self.vm_name)  # 只能在创建时选择
+        layout.addRow("基础镜像:", self.base_image_combo)
+        
+        # 快照方式
+        self.snapshot_backend_combo = QComboBox()
+        self.snapshot_backend_combo.addItem("默认", "")
+        for backend, backend_name in BACKEND_NAMES.items():
+            self.snapshot_backend_combo.addItem(backend_name, backend)
+        self.snapshot_backend_combo.setToolTip("内部快照只支持单个qcow2磁盘，创建和恢复不复制数据")
+        layout.addRow("快照方式:", self.snapshot_backend_combo)
+        
+        # 在线快照前冻结文件系统
+        self.fsfreeze_combo = QComboBox()
+        self.fsfreeze_combo.addItem("默认", "")
+        for mode, mode_name in FSFREEZE_MODE_NAMES.items():
+            self.fsfreeze_combo.addItem(mode_name, mode)
+        self.fsfreeze_combo.setToolTip("需要客户机中运行 qemu-guest-agent；冻结后快照和备份中的文件系统是一致的")
+        layout.addRow("冻结文件系统:", self.fsfreeze_combo)
+        
         # 磁盘文件路径
         disk_layout = QHBoxLayout()
         self.disk_path_edit = QLineEdit()
-        self.disk_path_edit.setPlaceholderText("虚拟磁盘文件路径")
+        self.disk_path_edit.setPlaceholderText("虚拟磁盘文件路径（留空则按存储池放置策略生成）")
         disk_browse_btn = QPushButton("浏览...")
         disk_browse_btn.clicked.connect(self.browse_disk_path)
         disk_layout.addWidget(self.disk_path_edit)
@@ -180,7 +228,8 @@ class VMConfigDialog(QDialog):
     
     def browse_disk_path(self):
         """浏览磁盘文件路径"""
-        start_path = self.config_manager.get_default_vm_storage_path()
+        pool = self.pool_manager.get_pool(self.storage_pool_combo.currentData())
+        start_path = Path(pool['path']) if pool else self.config_manager.get_default_vm_storage_path()
         file_path, _ = QFileDialog.getSaveFileName(
             self,
             "选择虚拟磁盘文件",
@@ -219,14 +268,38 @@ class VMConfigDialog(QDialog):
         self.disk_path_edit.setText(config.get('disk_path', ''))
         
         self.iso_path_edit.setText(config.get('iso_path', ''))
+        
+        pool_index = self.storage_pool_combo.findData(config.get('storage_pool', ''))
+        self.storage_pool_combo.setCurrentIndex(max(pool_index, 0))
+        tier_index = self.storage_tier_combo.findData(config.get('storage_tier', ''))
+        self.storage_tier_combo.setCurrentIndex(max(tier_index, 0))
+        base_index = self.base_image_combo.findData(config.get('base_image', ''))
+        if base_index < 0 and config.get('base_image'):
+            self.base_image_combo.addItem(config['base_image'], config['base_image'])
+            base_index = self.base_image_combo.count() - 1
+        self.base_image_combo.setCurrentIndex(max(base_index, 0))
+        backend_index = self.snapshot_backend_combo.findData(config.get('snapshot_backend', ''))
+        self.snapshot_backend_combo.setCurrentIndex(max(backend_index, 0))
+        fsfreeze_index = self.fsfreeze_combo.findData(config.get('snapshot_fsfreeze', ''))
+        self.fsfreeze_combo.setCurrentIndex(max(fsfreeze_index, 0))
+    
+    def placed_disk_path(self, vm_name):
+        """按选择的存储池或放置策略生成磁盘路径"""
+        size_bytes = self.disk_size_spinbox.value() * 1024**3
+        pool = self.pool_manager.get_pool(self.storage_pool_combo.currentData())
+        if pool:
+            return str(Path(pool['path']) / vm_name / f"{vm_name}.qcow2")
+        status = self.pool_manager.place('disks', size_bytes, affinity=self.storage_tier_combo.currentData() or None)
+        if status is None:
+            return None
+        return str(Path(status.path) / vm_name / f"{vm_name}.qcow2")
     
     def calculate_disk_size(self, disk_path):
-        """计算磁盘文件大小（GB）"""
+        """计算磁盘虚拟容量（GB），而不是文件长度"""
         try:
-            if disk_path and Path(disk_path).exists():
-                size_bytes = Path(disk_path).stat().st_size
-                size_gb = size_bytes / (1024**3)
-                return int(size_gb)
+            disk_info = get_disk_inspector().inspect(disk_path)
+            if disk_info and disk_info.virtual_size > 0:
+                return int(-(-disk_info.virtual_size // (1024**3)))  # 向上取整
         except:
             pass
         return 20  # 默认20GB
@@ -244,8 +317,11 @@ class VMConfigDialog(QDialog):
         
         disk_path = self.disk_path_edit.text().strip()
         if not disk_path:
-            QMessageBox.warning(self, "输入错误", "请选择虚拟磁盘文件路径")
-            return False
+            disk_path = self.placed_disk_path(vm_name)
+            if not disk_path:
+                QMessageBox.warning(self, "输入错误", "没有空间足够的存储池，请手动选择虚拟磁盘文件路径")
+                return False
+            self.disk_path_edit.setText(disk_path)
         
         iso_path = self.iso_path_edit.text().strip()
         if iso_path and not Path(iso_path).exists():
@@ -260,10 +336,27 @@ class VMConfigDialog(QDialog):
         
         return True
     
+    def create_base_overlay(self):
+        """选择了基础镜像且磁盘文件不存在时，创建以基础镜像为后端的覆盖层磁盘"""
+        base_image = self.base_image_combo.currentData()
+        disk_path = self.disk_path_edit.text().strip()
+        if not base_image or Path(disk_path).exists():
+            return True
+        try:
+            get_image_library(self.config_manager).create_overlay(
+                base_image, disk_path, self.name_edit.text().strip()
+            )
+        except (ValueError, OSError, subprocess.CalledProcessError) as e:
+            QMessageBox.critical(self, "错误", f"创建基于镜像 '{base_image}' 的磁盘失败: {e}")
+            return False
+        return True
+    
     def accept(self):
         """确认保存配置"""
         if not self.validate_inputs():
             return
+        if not self.create_base_overlay():
+            return
         
         # 创建配置字典
         config = {
@@ -275,11 +368,18 @@ class VMConfigDialog(QDialog):
             'vnc_port': self.config_manager.get_next_vnc_port(),
             'network_mode': self.network_combo.currentText(),
             'vga_type': self.vga_combo.currentText(),
+            'storage_pool': self.storage_pool_combo.currentData(),
+            'storage_tier': self.storage_tier_combo.currentData(),
+            'base_image': self.base_image_combo.currentData(),
+            'snapshot_backend': self.snapshot_backend_combo.currentData(),
+            'snapshot_fsfreeze': self.fsfreeze_combo.currentData(),
             'status': 'stopped' if self.vm_name else 'configured'  # 如果是编辑现有VM，保持原状态
         }
         
-        # 保存配置
+        # 保存配置（编辑时保留对话框之外的字段，如附加磁盘、快照保留策略）
         vm_name = self.name_edit.text().strip()
+        if self.vm_name:
+            config = {**(self.config_manager.get_vm_config(vm_name) or {}), **config}
         if self.config_manager.set_vm_config(vm_name, config):
             QMessageBox.information(self, "成功", f"虚拟机配置已{'更新' if self.vm_name else '创建'}")
             super().accept()
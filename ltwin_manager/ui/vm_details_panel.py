@@ -14,6 +14,8 @@ from datetime import datetime
 from pathlib import Path
 import psutil
 
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+
 
 class VMDetailsPanel(QWidget):
     """虚拟机详情面板"""
@@ -141,6 +143,13 @@ class VMDetailsPanel(QWidget):
         self.disk_size_label = QLabel("-")
         storage_layout.addRow("磁盘大小:", self.disk_size_label)
         
+        self.disk_allocated_label = QLabel("-")
+        storage_layout.addRow("实际占用:", self.disk_allocated_label)
+        
+        self.backing_chain_label = QLabel("-")
+        self.backing_chain_label.setWordWrap(True)
+        storage_layout.addRow("后端链:", self.backing_chain_label)
+        
         self.disk_usage_label = QLabel("-")
         storage_layout.addRow("磁盘使用:", self.disk_usage_label)
         
@@ -207,17 +216,24 @@ class VMDetailsPanel(QWidget):
             return
         
         disk_path = self.vm_config.get('disk_path', '')
-        if disk_path and Path(disk_path).exists():
+        disk_info = get_disk_inspector().inspect(disk_path)
+        if disk_info:
             try:
-                disk_stat = Path(disk_path).stat()
-                disk_size = disk_stat.st_size
-                disk_size_gb = disk_size / (1024**3)
-                
                 # 获取所在分区的可用空间
                 disk_usage = psutil.disk_usage(Path(disk_path).parent)
                 free_space_gb = disk_usage.free / (1024**3)
                 
-                self.disk_size_label.setText(f"{disk_size_gb:.2f} GB")
+                self.disk_size_label.setText(f"{disk_info.virtual_size / (1024**3):.2f} GB ({disk_info.format})")
+                self.disk_allocated_label.setText(
+                    f"{disk_info.allocated_size / (1024**3):.2f} GB ({disk_info.sparse_ratio * 100:.1f}%)"
+                )
+                if disk_info.backing_chain:
+                    self.backing_chain_label.setText(" → ".join(
+                        f"{Path(item['path']).name} ({item['allocated_size'] / (1024**3):.2f} GB)"
+                        for item in disk_info.backing_chain
+                    ))
+                else:
+                    self.backing_chain_label.setText("无")
                 self.disk_free_label.setText(f"{free_space_gb:.2f} GB")
                 
                 # 计算使用率
@@ -228,6 +244,8 @@ class VMDetailsPanel(QWidget):
                 self.log_text.append(f"[{datetime.now().strftime('%H:%M:%S')}] 获取磁盘信息失败: {str(e)}")
         else:
             self.disk_size_label.setText("文件不存在")
+            self.disk_allocated_label.setText("-")
+            self.backing_chain_label.setText("-")
             self.disk_usage_label.setText("-")
             self.disk_free_label.setText("-")
     
@@ -275,6 +293,34 @@ class VMDetailsPanel(QWidget):
         """编辑虚拟机"""
         self.log_text.append(f"[{datetime.now().strftime('%H:%M:%S')}] 编辑功能将在后续版本中实现")
     
+    def apply_vm_metrics(self, changes, metrics):
+        """
+        应用虚拟机资源增量
+        
+        Args:
+            changes: 本帧变化的字段，None表示虚拟机进程已退出
+            metrics: 该虚拟机当前完整的扁平指标
+        """
+        if changes is None:
+            self.cpu_progress.setValue(0)
+            self.cpu_value_label.setText("0%")
+            self.mem_progress.setValue(0)
+            self.mem_value_label.setText("0%")
+            return
+        
+        if 'cpu_percent' in changes:
+            cpu_cores = (self.vm_config or {}).get('cpu_cores', 1) or 1
+            # 进程CPU占用按核心数累加，折算为虚拟机视角的百分比
+            cpu_percent = min(metrics.get('cpu_percent', 0) / cpu_cores, 100)
+            self.cpu_progress.setValue(int(cpu_percent))
+            self.cpu_value_label.setText(f"{cpu_percent:.1f}%")
+        
+        if 'memory_mb' in changes:
+            memory_mb = (self.vm_config or {}).get('memory_mb', 0)
+            mem_percent = min(metrics.get('memory_mb', 0) / memory_mb * 100, 100) if memory_mb else 0
+            self.mem_progress.setValue(int(mem_percent))
+            self.mem_value_label.setText(f"{mem_percent:.1f}%")
+    
     def update_vm_status(self, system_info):
         """更新虚拟机状态显示"""
         if isinstance(system_info, dict):
@@ -0,0 +1,725 @@
+# -*- coding: utf-8 -*-
+"""
+虚拟机增量备份
+运行中的虚拟机用 QEMU 脏位图跟踪变化：第一次备份时在同一个 QMP 事务里添加持久化位图并做完整导出，
+之后用 drive-backup sync=incremental 只导出位图记录的变化簇；
+已停止的虚拟机根据 qcow2 各层的簇分配表，只读取自上次备份以来新增或被修改的层中分配过的数据。
+
+备份数据按固定大小分块、zlib 压缩后以内容哈希命名保存（相同的数据块只存一份），
+每次备份写一个清单，记录各磁盘完整的数据块映射，因此任何一个备份都可以单独校验、恢复和删除。
+
+命令行:
+    python -m ltwin_manager.utils.backup_manager backup 虚拟机 [--full]
+    python -m ltwin_manager.utils.backup_manager list 虚拟机
+    python -m ltwin_manager.utils.backup_manager verify 虚拟机 备份ID
+    python -m ltwin_manager.utils.backup_manager restore 虚拟机 备份ID [--target 目录] [--apply]
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from ltwin_manager.utils.qcow2_reader import DiskChainReader, Qcow2Image, Qcow2Error, is_qcow2
+from ltwin_manager.utils.qmp_client import QMPClient, QMPError, qmp_socket_path
+from ltwin_manager.utils.snapshot_backends import vm_drives
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+
+CHUNK_SIZE = 1024 * 1024  # 备份数据块大小（必须不小于qcow2簇大小的常见取值，并为其整数倍）
+BITMAP_NAME = 'ltwin-backup'
+MANIFEST_FORMAT = 1
+
+
+class BackupCancelled(Exception):
+    """备份或恢复被取消"""
+
+
+class BackupManager:
+    """虚拟机增量备份管理器"""
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        location = config_manager.get_global_config("backup_location") or str(Path.home() / '.ltwin' / 'backups')
+        self.backup_dir = Path(os.path.expanduser(location))
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._running: Dict[str, bool] = {}  # 正在备份的虚拟机 -> 是否离线读取磁盘
+
+    # ---------- 存储布局 ----------
+
+    def vm_dir(self, vm_name: str) -> Path:
+        """虚拟机的备份目录"""
+        return self.backup_dir / vm_name
+
+    def _manifest_path(self, vm_name: str, backup_id: str) -> Path:
+        return self.vm_dir(vm_name) / 'manifests' / f"{backup_id}.json"
+
+    def _chunk_path(self, vm_name: str, digest: str) -> Path:
+        return self.vm_dir(vm_name) / 'chunks' / digest[:2] / digest
+
+    def _bitmap_state_path(self, vm_name: str) -> Path:
+        return self.vm_dir(vm_name) / 'bitmap.json'
+
+    def _compress_level(self) -> int:
+        return int(self.config_manager.get_global_config("backup_compress_level") or 6)
+
+    def _store_chunk(self, vm_name: str, data: bytes, stats: Dict) -> Optional[str]:
+        """保存数据块，返回内容哈希；全零的块不保存，返回 None"""
+        if data.count(0) == len(data):
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(vm_name, digest)
+        if not path.exists():
+            compressed = zlib.compress(data, self._compress_level())
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(path.name + '.tmp')
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, path)
+            stats['new_chunks'] += 1
+            stats['stored_bytes'] += len(compressed)
+        return digest
+
+    def _load_chunk(self, vm_name: str, digest: Optional[str], length: int) -> bytes:
+        """
+        读取数据块并校验哈希
+
+        Raises:
+            ValueError: 数据块缺失、损坏或哈希不匹配
+        """
+        if digest is None:
+            return bytes(length)
+        try:
+            with open(self._chunk_path(vm_name, digest), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except FileNotFoundError:
+            raise ValueError(f"数据块缺失: {digest}")
+        except zlib.error as e:
+            raise ValueError(f"数据块 {digest} 无法解压: {e}")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"数据块 {digest} 哈希不匹配")
+        return data
+
+    # ---------- 清单 ----------
+
+    def list_backups(self, vm_name: str) -> List[Dict]:
+        """虚拟机的备份列表（按时间排序，不含数据块映射）"""
+        backups = []
+        manifests_dir = self.vm_dir(vm_name) / 'manifests'
+        if not manifests_dir.exists():
+            return backups
+        for path in manifests_dir.glob('*.json'):
+            try:
+                manifest = self._read_json(path)
+            except (OSError, ValueError) as e:
+                print(f"读取备份清单失败 {path}: {e}")
+                continue
+            summary = {key: value for key, value in manifest.items() if key != 'drives'}
+            summary['drives'] = {drive_id: {'virtual_size': drive['virtual_size'], 'source': drive['source'],
+                                            'chunks': len(drive['chunks'])}
+                                 for drive_id, drive in manifest['drives'].items()}
+            backups.append(summary)
+        backups.sort(key=lambda item: (item.get('timestamp', 0), item['id']))
+        return backups
+
+    def load_manifest(self, vm_name: str, backup_id: str) -> Dict:
+        """
+        读取备份清单
+
+        Raises:
+            ValueError: 备份不存在
+        """
+        path = self._manifest_path(vm_name, backup_id)
+        if not path.exists():
+            raise ValueError(f"备份 '{backup_id}' 不存在")
+        return self._read_json(path)
+
+    def latest_manifest(self, vm_name: str) -> Optional[Dict]:
+        """最近一次备份的清单"""
+        backups = self.list_backups(vm_name)
+        return self.load_manifest(vm_name, backups[-1]['id']) if backups else None
+
+    @staticmethod
+    def _read_json(path: Path) -> Dict:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(path: Path, data: Dict):
+        """先写临时文件再替换，避免中途失败留下不完整的清单"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+    # ---------- 备份 ----------
+
+    def backup_running(self, vm_name: str, offline_only: bool = False) -> bool:
+        """虚拟机是否正在备份（offline_only 时只看离线读取磁盘的备份）"""
+        with self._lock:
+            return vm_name in self._running and (self._running[vm_name] or not offline_only)
+
+    @contextmanager
+    def _guard(self, vm_name: str, offline: bool):
+        with self._lock:
+            if vm_name in self._running:
+                raise RuntimeError(f"虚拟机 '{vm_name}' 正在备份")
+            self._running[vm_name] = offline
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running.pop(vm_name, None)
+
+    def backup_vm(self, vm_name: str, full: bool = False,
+                  progress_callback: Callable[[str, int], None] = None,
+                  cancel_event: threading.Event = None) -> Dict:
+        """
+        备份虚拟机的全部磁盘
+
+        Args:
+            vm_name: 虚拟机名称
+            full: 是否强制完整读取（不依赖上次备份）
+            progress_callback: 进度回调 (状态消息, 百分比)
+            cancel_event: 置位后尽快取消
+
+        Returns:
+            备份清单
+
+        Raises:
+            ValueError: 虚拟机不存在或没有磁盘
+            RuntimeError/QMPError/Qcow2Error: 备份失败
+            BackupCancelled: 已取消
+        """
+        from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+
+        vm_config = self.config_manager.get_vm_config(vm_name)
+        if not vm_config:
+            raise ValueError(f"虚拟机 '{vm_name}' 不存在")
+        drives = vm_drives(vm_config)
+        if not drives:
+            raise ValueError(f"虚拟机 '{vm_name}' 没有配置磁盘")
+        running = vm_config.get('status') == 'running'
+        if not running and get_chain_maintenance(self.config_manager).offline_job_running(vm_name):
+            raise RuntimeError(f"虚拟机 '{vm_name}' 的磁盘正在整理后端链，请稍后再备份")
+
+        progress = progress_callback or (lambda message, percent: None)
+        with self._guard(vm_name, offline=not running):
+            parent = None if full else self.latest_manifest(vm_name)
+            backup_id = self._new_backup_id(vm_name)
+            stats = {'read_bytes': 0, 'changed_chunks': 0, 'new_chunks': 0, 'stored_bytes': 0}
+            started = time.time()
+
+            if running:
+                drive_entries = self._backup_live(vm_name, drives, parent, stats, progress, cancel_event)
+                method = 'bitmap'
+            else:
+                drive_entries = self._backup_offline(vm_name, drives, parent, stats, progress, cancel_event)
+                method = 'allocation'
+            # 先从每个磁盘条目中取出标记再判断，避免 all() 提前结束后其余条目残留该字段
+            flags = [drive.pop('incremental') for drive in drive_entries.values()]
+            incremental = all(flags)
+
+            manifest = {
+                'format': MANIFEST_FORMAT,
+                'id': backup_id,
+                'vm_name': vm_name,
+                'created_at': datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+                'timestamp': started,
+                'type': 'incremental' if incremental else 'full',
+                'parent': parent['id'] if incremental else None,
+                'method': method,
+                'vm_status': 'running' if running else 'stopped',
+                'duration': round(time.time() - started, 1),
+                'stats': stats,
+                'drives': drive_entries
+            }
+            self._write_json(self._manifest_path(vm_name, backup_id), manifest)
+            if running:
+                self._write_json(self._bitmap_state_path(vm_name),
+                                 {'manifest': backup_id, 'instance': self._qemu_instance(vm_name)})
+
+        keep_last = int(self.config_manager.get_global_config("backup_keep_last") or 0)
+        if keep_last:
+            self.prune(vm_name, keep_last)
+        progress(f"备份完成：读取 {stats['read_bytes'] / 1024**2:.1f} MB，"
+                 f"新增 {stats['stored_bytes'] / 1024**2:.1f} MB", 100)
+        return manifest
+
+    def _new_backup_id(self, vm_name: str) -> str:
+        base = datetime.now().strftime("%Y%m%d-%H%M%S")
+        backup_id, index = base, 1
+        while self._manifest_path(vm_name, backup_id).exists():
+            backup_id = f"{base}-{index}"
+            index += 1
+        return backup_id
+
+    @staticmethod
+    def _check_cancel(cancel_event: Optional[threading.Event]):
+        if cancel_event is not None and cancel_event.is_set():
+            raise BackupCancelled("备份已取消")
+
+    @staticmethod
+    def _layer_signatures(reader: DiskChainReader) -> Dict[str, List[int]]:
+        """后端链各层的 [修改时间(ns), 文件大小]，用于判断层在两次备份之间是否被写过"""
+        signatures = {}
+        for layer in reader.layers:
+            stat = os.stat(layer['path'])
+            signatures[layer['path']] = [stat.st_mtime_ns, stat.st_size]
+        return signatures
+
+    @staticmethod
+    def _chunks_of_layer(layer: Dict, chunk_count: int) -> Set[int]:
+        """一层中分配过数据的簇所在的数据块；raw 层视为全部"""
+        if layer['format'] == 'raw':
+            return set(range(chunk_count))
+        image: Qcow2Image = layer['image']
+        cluster_size = image.header.cluster_size
+        chunks = set()
+        for cluster_index in image.allocated_clusters():
+            first = cluster_index * cluster_size // CHUNK_SIZE
+            last = ((cluster_index + 1) * cluster_size - 1) // CHUNK_SIZE
+            chunks.update(range(first, min(last, chunk_count - 1) + 1))
+        return chunks
+
+    @staticmethod
+    def _reusable(previous: Optional[Dict], virtual_size: int) -> bool:
+        return bool(previous) and previous['virtual_size'] == virtual_size and previous['chunk_size'] == CHUNK_SIZE
+
+    def _backup_offline(self, vm_name: str, drives: List[tuple], parent: Optional[Dict], stats: Dict,
+                        progress: Callable, cancel_event) -> Dict:
+        """
+        已停止的虚拟机：按簇分配表找出变化的数据块
+
+        上次备份后没有被修改过的层（修改时间和大小都相同）直接跳过；
+        上次备份时的某一层已经不在链中（恢复快照、整理后端链）时，无法判断哪些数据被覆盖，整块磁盘重新读取。
+        """
+        entries = {}
+        for drive_number, (drive_id, path) in enumerate(drives):
+            with DiskChainReader(path) as reader:
+                virtual_size = reader.virtual_size
+                chunk_count = -(-virtual_size // CHUNK_SIZE)
+                signatures = self._layer_signatures(reader)
+                previous = (parent or {}).get('drives', {}).get(drive_id)
+                incremental = self._reusable(previous, virtual_size) and set(previous['layers']) <= set(signatures)
+                if incremental:
+                    changed = set()
+                    for layer in reader.layers:
+                        if previous['layers'].get(layer['path']) != signatures[layer['path']]:
+                            changed |= self._chunks_of_layer(layer, chunk_count)
+                    chunks = dict(previous['chunks'])
+                else:
+                    changed = set()
+                    for layer in reader.layers:
+                        changed |= self._chunks_of_layer(layer, chunk_count)
+                    chunks = {}
+
+                ordered = sorted(changed)
+                for done, chunk_index in enumerate(ordered):
+                    self._check_cancel(cancel_event)
+                    data = reader.read(chunk_index * CHUNK_SIZE, CHUNK_SIZE)
+                    stats['read_bytes'] += len(data)
+                    digest = self._store_chunk(vm_name, data, stats)
+                    if digest:
+                        chunks[str(chunk_index)] = digest
+                    else:
+                        chunks.pop(str(chunk_index), None)
+                    if done % 64 == 0:
+                        progress(f"{drive_id}: 已读取 {done}/{len(ordered)} 个变化的数据块",
+                                 int((drive_number + done / len(ordered)) * 100 / len(drives)))
+                stats['changed_chunks'] += len(ordered)
+                entries[drive_id] = {'source': path, 'virtual_size': virtual_size, 'chunk_size': CHUNK_SIZE,
+                                     'layers': signatures, 'chunks': chunks, 'incremental': incremental}
+        return entries
+
+    # ---------- 运行中的虚拟机 ----------
+
+    @staticmethod
+    def _qemu_instance(vm_name: str) -> str:
+        """QEMU 进程标识：每次启动都会重新创建 QMP socket"""
+        try:
+            stat = os.stat(qmp_socket_path(vm_name))
+        except OSError:
+            return ''
+        return f"{stat.st_ino}-{stat.st_mtime_ns}"
+
+    def _bitmap_usable(self, vm_name: str, drives: List[tuple], parent: Optional[Dict]) -> bool:
+        """
+        能否用脏位图做增量备份：位图必须从上一个备份起一直在同一个 QEMU 进程中记录
+        （虚拟机重启或离线修改过磁盘后位图不可信）
+        """
+        if not parent:
+            return False
+        try:
+            state = self._read_json(self._bitmap_state_path(vm_name))
+        except (OSError, ValueError):
+            return False
+        return (state.get('manifest') == parent['id']
+                and state.get('instance') == self._qemu_instance(vm_name)
+                and set(parent['drives']) == {drive_id for drive_id, _ in drives})
+
+    def _backup_live(self, vm_name: str, drives: List[tuple], parent: Optional[Dict], stats: Dict,
+                     progress: Callable, cancel_event) -> tuple:
+        """
+        运行中的虚拟机：drive-backup 导出到临时qcow2，再把其中的数据切块保存
+        启动导出的事务按快照的冻结设置冻结客户机文件系统，导出内容对应冻结时的一致状态
+
+        Returns:
+            磁盘清单（incremental 表示是否只导出了位图记录的变化）
+        """
+        temp_dir = self.vm_dir(vm_name) / 'tmp'
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        temp_dir.mkdir(parents=True)
+        targets = {drive_id: str(temp_dir / f"{drive_id}.qcow2") for drive_id, _ in drives}
+        # 位图状态在备份成功前作废，失败后下一次不会基于残缺的位图做增量
+        incremental = self._bitmap_usable(vm_name, drives, parent)
+        self._bitmap_state_path(vm_name).unlink(missing_ok=True)
+        try:
+            with QMPClient.for_vm(vm_name, timeout=30.0) as qmp:
+                with get_snapshot_manager(self.config_manager).quiesce(vm_name):
+                    if incremental:
+                        try:
+                            qmp.execute('transaction', {'actions': [
+                                {'type': 'drive-backup', 'data': {
+                                    'job-id': f"backup-{drive_id}", 'device': drive_id, 'target': targets[drive_id],
+                                    'format': 'qcow2', 'sync': 'incremental', 'bitmap': BITMAP_NAME}}
+                                for drive_id, _ in drives]})
+                        except QMPError as e:
+                            # 位图不存在（例如在线快照切换了活动层），改为完整导出
+                            print(f"增量导出失败，改为完整导出: {e}")
+                            incremental = False
+                    if not incremental:
+                        self._start_full_export(qmp, drives, targets)
+                self._wait_jobs(qmp, [f"backup-{drive_id}" for drive_id, _ in drives], progress, cancel_event)
+
+            entries = {}
+            for drive_number, (drive_id, path) in enumerate(drives):
+                entries[drive_id] = self._import_export(
+                    vm_name, drive_id, path, targets[drive_id],
+                    (parent or {}).get('drives', {}).get(drive_id) if incremental else None,
+                    stats, lambda done, total, n=drive_number: progress(
+                        f"{drive_id}: 已保存 {done}/{total} 个变化的数据块",
+                        50 + int((n + done / max(total, 1)) * 50 / len(drives))),
+                    cancel_event
+                )
+                entries[drive_id]['incremental'] = incremental
+            return entries
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _start_full_export(self, qmp: QMPClient, drives: List[tuple], targets: Dict[str, str]):
+        """在同一个事务中重建脏位图并开始完整导出，保证位图从导出的时间点开始记录"""
+        actions = []
+        for drive_id, path in drives:
+            try:
+                qmp.execute('block-dirty-bitmap-remove', {'node': drive_id, 'name': BITMAP_NAME})
+            except QMPError:
+                pass
+            actions.append({'type': 'block-dirty-bitmap-add', 'data': {
+                'node': drive_id, 'name': BITMAP_NAME, 'persistent': is_qcow2(path)}})
+            actions.append({'type': 'drive-backup', 'data': {
+                'job-id': f"backup-{drive_id}", 'device': drive_id, 'target': targets[drive_id],
+                'format': 'qcow2', 'sync': 'full', 'compress': True}})
+        qmp.execute('transaction', {'actions': actions})
+
+    @staticmethod
+    def _wait_jobs(qmp: QMPClient, job_ids: List[str], progress: Callable, cancel_event,
+                   poll_interval: float = 0.5):
+        """等待导出任务结束（进度计为 0-50%），取消时 block-job-cancel"""
+        cancelled = False
+        while True:
+            jobs = [item for item in qmp.execute('query-block-jobs') or [] if item.get('device') in job_ids]
+            if not jobs:
+                break
+            if cancel_event is not None and cancel_event.is_set() and not cancelled:
+                for item in jobs:
+                    qmp.execute('block-job-cancel', {'device': item['device']})
+                cancelled = True
+            total = sum(item.get('len') or 0 for item in jobs)
+            if total:
+                progress("正在导出磁盘数据", int(sum(item.get('offset', 0) for item in jobs) * 50 / total))
+            time.sleep(poll_interval)
+        if cancelled:
+            raise BackupCancelled("备份已取消")
+        for event in qmp.events:
+            data = event.get('data', {})
+            if data.get('device') in job_ids and (data.get('error') or event.get('event') == 'BLOCK_JOB_CANCELLED'):
+                raise QMPError(f"drive-backup {data['device']}: {data.get('error') or '任务被取消'}")
+
+    def _import_export(self, vm_name: str, drive_id: str, source: str, export_path: str,
+                       previous: Optional[Dict], stats: Dict, report: Callable, cancel_event) -> Dict:
+        """
+        把导出的临时qcow2切块保存
+
+        完整导出时导出文件中未分配的部分全部为零；增量导出时未分配的部分与上次备份相同，
+        变化的簇不足一个数据块时，用上次备份的数据块补齐。
+        """
+        with DiskChainReader(export_path) as reader:
+            image: Qcow2Image = reader.layers[0]['image']
+            virtual_size = reader.virtual_size
+            chunk_count = -(-virtual_size // CHUNK_SIZE)
+            if previous is not None and not self._reusable(previous, virtual_size):
+                raise RuntimeError(f"{drive_id} 的容量已改变，需要完整备份")
+            chunks = dict(previous['chunks']) if previous else {}
+            cluster_size = image.header.cluster_size
+            changed_clusters: Dict[int, List[int]] = {}
+            for cluster_index in image.allocated_clusters():
+                first = cluster_index * cluster_size // CHUNK_SIZE
+                last = min(((cluster_index + 1) * cluster_size - 1) // CHUNK_SIZE, chunk_count - 1)
+                for chunk_index in range(first, last + 1):
+                    changed_clusters.setdefault(chunk_index, []).append(cluster_index)
+
+            ordered = sorted(changed_clusters)
+            for done, chunk_index in enumerate(ordered):
+                self._check_cancel(cancel_event)
+                start = chunk_index * CHUNK_SIZE
+                length = min(CHUNK_SIZE, virtual_size - start)
+                if previous is None:
+                    data = reader.read(start, length)
+                else:
+                    buffer = bytearray(self._load_chunk(vm_name, chunks.get(str(chunk_index)), length))
+                    for cluster_index in changed_clusters[chunk_index]:
+                        cluster_start = cluster_index * cluster_size
+                        begin = max(cluster_start, start)
+                        end = min(cluster_start + cluster_size, start + length)
+                        cluster = image.read_cluster(cluster_index)
+                        buffer[begin - start:end - start] = cluster[begin - cluster_start:end - cluster_start]
+                    data = bytes(buffer)
+                stats['read_bytes'] += length
+                digest = self._store_chunk(vm_name, data, stats)
+                if digest:
+                    chunks[str(chunk_index)] = digest
+                else:
+                    chunks.pop(str(chunk_index), None)
+                if done % 64 == 0:
+                    report(done, len(ordered))
+            stats['changed_chunks'] += len(ordered)
+
+        signatures = {}
+        try:
+            with DiskChainReader(source) as source_reader:
+                signatures = self._layer_signatures(source_reader)
+        except (OSError, Qcow2Error):
+            pass
+        return {'source': source, 'virtual_size': virtual_size, 'chunk_size': CHUNK_SIZE,
+                'layers': signatures, 'chunks': chunks}
+
+    # ---------- 校验、恢复和删除 ----------
+
+    def verify_backup(self, vm_name: str, backup_id: str,
+                      progress_callback: Callable[[str, int], None] = None) -> List[str]:
+        """
+        校验备份引用的全部数据块（解压并核对哈希）
+
+        Returns:
+            问题列表，为空表示备份完整
+        """
+        progress = progress_callback or (lambda message, percent: None)
+        manifest = self.load_manifest(vm_name, backup_id)
+        digests = {digest for drive in manifest['drives'].values() for digest in drive['chunks'].values()}
+        problems = []
+        for done, digest in enumerate(sorted(digests)):
+            try:
+                self._load_chunk(vm_name, digest, 0)
+            except ValueError as e:
+                problems.append(str(e))
+            if done % 64 == 0:
+                progress(f"已校验 {done}/{len(digests)} 个数据块", int(done * 100 / len(digests)))
+        progress(f"校验完成，{len(digests)} 个数据块，{len(problems)} 个问题", 100)
+        return problems
+
+    def restore_backup(self, vm_name: str, backup_id: str, target_dir: str = None, apply: bool = False,
+                       progress_callback: Callable[[str, int], None] = None,
+                       cancel_event: threading.Event = None) -> Dict[str, str]:
+        """
+        把备份恢复为新的 raw 磁盘文件（稀疏文件，全零的数据块不写入）
+
+        Args:
+            vm_name: 虚拟机名称
+            backup_id: 备份ID
+            target_dir: 输出目录，默认与各磁盘当前文件相同
+            apply: 是否让虚拟机改用恢复出的磁盘（虚拟机必须已停止，原磁盘文件保留）
+
+        Returns:
+            {drive id: 恢复出的文件路径}
+
+        Raises:
+            ValueError: 备份不存在、目标文件已存在、数据块损坏或虚拟机正在运行
+        """
+        progress = progress_callback or (lambda message, percent: None)
+        manifest = self.load_manifest(vm_name, backup_id)
+        vm_config = self.config_manager.get_vm_config(vm_name)
+        if apply and (not vm_config or vm_config.get('status') == 'running'):
+            raise ValueError("恢复并替换磁盘前请先停止虚拟机")
+
+        restored = {}
+        try:
+            for drive_number, (drive_id, drive) in enumerate(manifest['drives'].items()):
+                directory = target_dir or os.path.dirname(os.path.abspath(drive['source']))
+                path = os.path.join(directory, f"{vm_name}-{drive_id}-backup-{backup_id}.raw")
+                if os.path.exists(path):
+                    raise ValueError(f"目标文件已存在: {path}")
+                restored[drive_id] = path
+                with open(path, 'wb') as f:
+                    f.truncate(drive['virtual_size'])
+                    ordered = sorted(drive['chunks'].items(), key=lambda item: int(item[0]))
+                    for done, (chunk_index, digest) in enumerate(ordered):
+                        self._check_cancel(cancel_event)
+                        start = int(chunk_index) * drive['chunk_size']
+                        f.seek(start)
+                        f.write(self._load_chunk(vm_name, digest, 0)[:drive['virtual_size'] - start])
+                        if done % 64 == 0:
+                            progress(f"{drive_id}: 已写入 {done}/{len(ordered)} 个数据块",
+                                     int((drive_number + done / len(ordered)) * 100 / len(manifest['drives'])))
+        except Exception:
+            for path in restored.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        if apply:
+            self._apply_restored(vm_name, vm_config, restored)
+        progress("恢复完成", 100)
+        return restored
+
+    def _apply_restored(self, vm_name: str, vm_config: Dict, restored: Dict[str, str]):
+        """让虚拟机改用恢复出的磁盘（在后台线程中执行，与快照操作持有同一把虚拟机锁）"""
+        with get_snapshot_manager(self.config_manager).vm_lock(vm_name):
+            vm_config = self.config_manager.get_vm_config(vm_name) or vm_config
+            drives = dict(vm_drives(vm_config))
+            drives.update(restored)
+            vm_config['disk_path'] = drives.get('disk0', vm_config.get('disk_path', ''))
+            if vm_config.get('extra_disks') or len(drives) > 1:
+                vm_config['extra_disks'] = [drives[drive_id] for drive_id in sorted(drives, key=lambda d: int(d[4:]))
+                                            if drive_id != 'disk0']
+            self.config_manager.set_vm_config(vm_name, vm_config)
+        capacity_planner = get_capacity_planner(self.config_manager)
+        for path in restored.values():
+            capacity_planner.register(path, 'disk', vm_name)
+
+    def delete_backup(self, vm_name: str, backup_id: str) -> bool:
+        """删除备份并清理不再被引用的数据块"""
+        path = self._manifest_path(vm_name, backup_id)
+        if not path.exists():
+            print(f"备份 '{backup_id}' 不存在")
+            return False
+        try:
+            path.unlink()
+            self.collect_garbage(vm_name)
+            return True
+        except OSError as e:
+            print(f"删除备份失败: {e}")
+            return False
+
+    def prune(self, vm_name: str, keep_last: int) -> List[str]:
+        """只保留最近 keep_last 个备份，返回删除的备份ID"""
+        backups = self.list_backups(vm_name)
+        removed = [item['id'] for item in backups[:max(0, len(backups) - keep_last)]]
+        for backup_id in removed:
+            self._manifest_path(vm_name, backup_id).unlink(missing_ok=True)
+        if removed:
+            self.collect_garbage(vm_name)
+        return removed
+
+    def collect_garbage(self, vm_name: str) -> Dict[str, int]:
+        """删除没有任何清单引用的数据块"""
+        referenced = set()
+        for item in self.list_backups(vm_name):
+            manifest = self.load_manifest(vm_name, item['id'])
+            for drive in manifest['drives'].values():
+                referenced.update(drive['chunks'].values())
+        result = {'removed': 0, 'freed_bytes': 0}
+        chunks_dir = self.vm_dir(vm_name) / 'chunks'
+        if not chunks_dir.exists():
+            return result
+        for path in chunks_dir.glob('*/*'):
+            if path.name in referenced:
+                continue
+            result['freed_bytes'] += path.stat().st_size
+            path.unlink()
+            result['removed'] += 1
+        return result
+
+    def storage_usage(self, vm_name: str) -> int:
+        """备份占用的空间（字节）"""
+        return sum(path.stat().st_size for path in self.vm_dir(vm_name).rglob('*') if path.is_file())
+
+
+# 全局备份管理器实例
+backup_manager = None
+
+
+def get_backup_manager(config_manager) -> BackupManager:
+    """获取备份管理器实例"""
+    global backup_manager
+    if backup_manager is None:
+        backup_manager = BackupManager(config_manager)
+    return backup_manager
+
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    import argparse
+    from ltwin_manager.utils.config_manager import get_config_manager
+
+    parser = argparse.ArgumentParser(description="虚拟机增量备份")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help="备份虚拟机")
+    backup_parser.add_argument('vm_name')
+    backup_parser.add_argument('--full', action='store_true', help="完整读取，不依赖上次备份")
+
+    list_parser = subparsers.add_parser('list', help="列出备份")
+    list_parser.add_argument('vm_name')
+
+    verify_parser = subparsers.add_parser('verify', help="校验备份")
+    verify_parser.add_argument('vm_name')
+    verify_parser.add_argument('backup_id')
+
+    restore_parser = subparsers.add_parser('restore', help="恢复备份为新的磁盘文件")
+    restore_parser.add_argument('vm_name')
+    restore_parser.add_argument('backup_id')
+    restore_parser.add_argument('--target', help="输出目录")
+    restore_parser.add_argument('--apply', action='store_true', help="让虚拟机改用恢复出的磁盘")
+
+    args = parser.parse_args(argv)
+    manager = get_backup_manager(get_config_manager())
+    show = lambda message, percent: print(f"\r[{percent:3d}%] {message}", end='', flush=True)
+    try:
+        if args.command == 'backup':
+            manifest = manager.backup_vm(args.vm_name, full=args.full, progress_callback=show)
+            print(f"\n{manifest['id']} ({manifest['type']}, {manifest['method']}): {manifest['stats']}")
+        elif args.command == 'list':
+            for item in manager.list_backups(args.vm_name):
+                print(f"{item['id']}  {item['created_at']}  {item['type']:<12} {item['method']:<12} "
+                      f"新增 {item['stats']['stored_bytes'] / 1024**2:.1f} MB")
+        elif args.command == 'verify':
+            problems = manager.verify_backup(args.vm_name, args.backup_id, show)
+            print()
+            for problem in problems:
+                print(f"  {problem}")
+            return 1 if problems else 0
+        else:
+            restored = manager.restore_backup(args.vm_name, args.backup_id, args.target, args.apply, show)
+            print()
+            for drive_id, path in restored.items():
+                print(f"{drive_id}: {path}")
+        return 0
+    except (OSError, ValueError, RuntimeError, QMPError, Qcow2Error, BackupCancelled) as e:
+        print(f"\n错误: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
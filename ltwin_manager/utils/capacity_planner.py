@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+容量规划器
+按存储池维护已承诺的虚拟容量和实际占用的增量台账，根据历史占用预测增长，
+在创建磁盘、克隆和快照前检查是否会超出允许的超配比例
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import psutil
+
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager
+
+
+LEDGER_VERSION = 1
+HISTORY_RETENTION_DAYS = 90
+UNPOOLED = ""  # 不属于任何存储池的文件
+
+
+class CapacityError(ValueError):
+    """操作会超出容量限制"""
+
+
+@dataclass
+class PoolCapacity:
+    """存储池容量状况"""
+    pool: str
+    committed_bytes: int = 0  # 已承诺的虚拟容量合计
+    allocated_bytes: int = 0  # 台账中文件的实际占用合计
+    capacity_bytes: int = 0  # 物理容量（容量上限或文件系统总容量）
+    free_bytes: int = 0  # 物理可用空间（扣除预留）
+    growth_bytes_per_day: float = 0.0  # 按历史占用拟合的增长速度
+    entry_count: int = 0
+
+    @property
+    def overcommit_ratio(self) -> float:
+        """已承诺虚拟容量 / 物理容量"""
+        return self.committed_bytes / self.capacity_bytes if self.capacity_bytes else 0.0
+
+    @property
+    def days_until_full(self) -> Optional[float]:
+        """按当前增长速度预计的用满天数，不增长时为None"""
+        if self.growth_bytes_per_day <= 0:
+            return None
+        return self.free_bytes / self.growth_bytes_per_day
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return {
+            'pool': self.pool,
+            'committed_bytes': self.committed_bytes,
+            'allocated_bytes': self.allocated_bytes,
+            'capacity_bytes': self.capacity_bytes,
+            'free_bytes': self.free_bytes,
+            'growth_bytes_per_day': round(self.growth_bytes_per_day),
+            'overcommit_ratio': round(self.overcommit_ratio, 2),
+            'days_until_full': None if self.days_until_full is None else round(self.days_until_full, 1),
+            'entry_count': self.entry_count
+        }
+
+
+@dataclass
+class CapacityCheck:
+    """容量检查结果"""
+    allowed: bool
+    pool: str
+    overcommit_ratio_after: float = 0.0
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+
+def _linear_growth(samples: List[List[float]]) -> float:
+    """对 [(时间戳, 占用)] 做最小二乘拟合，返回每天增长字节数"""
+    if len(samples) < 2:
+        return 0.0
+    count = len(samples)
+    mean_t = sum(sample[0] for sample in samples) / count
+    mean_v = sum(sample[1] for sample in samples) / count
+    variance = sum((sample[0] - mean_t) ** 2 for sample in samples)
+    if variance == 0:
+        return 0.0
+    covariance = sum((sample[0] - mean_t) * (sample[1] - mean_v) for sample in samples)
+    return covariance / variance * 86400
+
+
+class CapacityPlanner:
+    """
+    容量规划器
+
+    台账记录每个受管磁盘文件（虚拟机磁盘、克隆、快照覆盖层）的虚拟容量和实际占用，
+    以及按存储池汇总的合计。文件注册、注销或刷新时只调整对应的合计，不扫描目录。
+
+    只有可写的磁盘（每条快照链的顶层）按虚拟容量计入承诺容量；快照冻结的只读层不会再增长，
+    它的数据已经计入实际占用和物理可用空间，承诺容量按 0 计，因此创建快照不改变承诺容量。
+    """
+
+    def __init__(self, config_manager, ledger_path: Path):
+        self.config_manager = config_manager
+        self.ledger_path = Path(ledger_path)
+        self.pool_manager = get_storage_pool_manager(config_manager)
+        self.disk_inspector = get_disk_inspector()
+        self._lock = threading.RLock()
+        self.entries: Dict[str, Dict] = {}  # 路径 -> {'pool', 'kind', 'vm', 'virtual_size', 'allocated'}
+        self.totals: Dict[str, Dict[str, int]] = {}  # 存储池 -> {'committed', 'allocated', 'count'}
+        self.history: Dict[str, List[List[float]]] = {}  # 存储池 -> [[时间戳, 占用], ...]
+        self._last_sample = 0.0
+        self._load()
+
+    def _load(self):
+        """加载台账"""
+        if not self.ledger_path.exists():
+            return
+        try:
+            with open(self.ledger_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != LEDGER_VERSION:
+                return
+            self.entries = data.get('entries', {})
+            self.history = data.get('history', {})
+            self._last_sample = data.get('last_sample', 0.0)
+            for entry in self.entries.values():
+                if entry['kind'] == 'snapshot':
+                    entry['virtual_size'] = 0  # 旧台账中快照层按虚拟容量登记
+                self._add_totals(entry, 1)
+        except Exception as e:
+            print(f"加载容量台账失败: {e}")
+
+    def _save(self):
+        """保存台账（需持有锁）"""
+        try:
+            self.ledger_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.ledger_path.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': LEDGER_VERSION,
+                    'entries': self.entries,
+                    'history': self.history,
+                    'last_sample': self._last_sample
+                }, f, ensure_ascii=False)
+            os.replace(temp_path, self.ledger_path)
+        except Exception as e:
+            print(f"保存容量台账失败: {e}")
+
+    def _add_totals(self, entry: Dict, sign: int):
+        """把条目加入（sign=1）或移出（sign=-1）所属存储池的合计（需持有锁）"""
+        totals = self.totals.setdefault(entry['pool'], {'committed': 0, 'allocated': 0, 'count': 0})
+        totals['committed'] += sign * entry['virtual_size']
+        totals['allocated'] += sign * entry['allocated']
+        totals['count'] += sign
+
+    def _pool_of(self, path: str) -> str:
+        """路径所属存储池"""
+        return self.pool_manager.pool_for_path(path) or UNPOOLED
+
+    # 台账维护
+
+    def register(self, path: str, kind: str, vm_name: str = "", virtual_size: int = None) -> bool:
+        """
+        登记或更新受管磁盘文件
+
+        Args:
+            path: 磁盘文件路径
+            kind: 'disk'、'clone' 或 'snapshot'
+            vm_name: 所属虚拟机
+            virtual_size: 虚拟容量，默认从镜像头部读取（快照层固定为 0，不计入承诺容量）
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        info = self.disk_inspector.inspect(path)
+        if info is None:
+            print(f"登记容量失败: 文件不存在 {path}")
+            return False
+        entry = {
+            'pool': self._pool_of(path),
+            'kind': kind,
+            'vm': vm_name,
+            'virtual_size': 0 if kind == 'snapshot' else virtual_size if virtual_size is not None else info.virtual_size,
+            'allocated': info.allocated_size
+        }
+        with self._lock:
+            old_entry = self.entries.get(path)
+            if old_entry:
+                self._add_totals(old_entry, -1)
+            self.entries[path] = entry
+            self._add_totals(entry, 1)
+            self._save()
+        return True
+
+    def unregister(self, path: str) -> bool:
+        """注销磁盘文件（文件被删除后调用）"""
+        path = os.path.abspath(os.path.expanduser(path))
+        with self._lock:
+            entry = self.entries.pop(path, None)
+            if entry is None:
+                return False
+            self._add_totals(entry, -1)
+            self._save()
+        return True
+
+    def move(self, old_path: str, new_path: str) -> bool:
+        """文件迁移后更新路径和所属存储池"""
+        old_path = os.path.abspath(os.path.expanduser(old_path))
+        with self._lock:
+            entry = self.entries.get(old_path)
+        if entry is None:
+            return False
+        self.unregister(old_path)
+        return self.register(new_path, entry['kind'], entry['vm'], entry['virtual_size'])
+
+    def refresh_allocation(self) -> int:
+        """
+        重新stat台账中的文件，更新实际占用（只访问已登记的文件）
+
+        Returns:
+            占用有变化的文件数
+        """
+        changed = 0
+        with self._lock:
+            for path, entry in list(self.entries.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    self._add_totals(entry, -1)
+                    del self.entries[path]
+                    changed += 1
+                    continue
+                except OSError:
+                    continue
+                blocks = getattr(st, 'st_blocks', None)
+                allocated = blocks * 512 if blocks is not None else st.st_size
+                if allocated != entry['allocated']:
+                    self._add_totals(entry, -1)
+                    entry['allocated'] = allocated
+                    self._add_totals(entry, 1)
+                    changed += 1
+            if changed:
+                self._save()
+        return changed
+
+    def rebuild(self, vm_names: List[str] = None) -> int:
+        """
+        根据虚拟机配置和快照元数据重建台账（首次使用或修复时调用）
+
+        Args:
+            vm_names: 只重建这些虚拟机的条目（只读取它们的快照元数据），None 表示全部
+
+        Returns:
+            登记的文件数
+        """
+        from ltwin_manager.utils.snapshot_manager import get_snapshot_manager, vm_drives  # 避免循环导入
+
+        with self._lock:
+            if vm_names is None:
+                self.entries.clear()
+                self.totals.clear()
+            else:
+                for path, entry in list(self.entries.items()):
+                    if entry['vm'] in vm_names:
+                        self._add_totals(entry, -1)
+                        del self.entries[path]
+                self._save()
+        snapshot_manager = get_snapshot_manager(self.config_manager)
+        if vm_names is None:
+            vm_names = sorted(set(self.config_manager.list_vms()) | set(snapshot_manager.snapshots_metadata))
+        count = 0
+        for vm_name in vm_names:
+            for _, disk_path in vm_drives(self.config_manager.get_vm_config(vm_name) or {}):
+                if self.register(disk_path, 'disk', vm_name):
+                    count += 1
+            for snapshot_info in snapshot_manager.snapshots_metadata.get(vm_name, {}).values():
+                for disk_path in snapshot_manager.snapshot_disks(snapshot_info).values():
+                    if self.register(disk_path, 'snapshot', vm_name):
+                        count += 1
+        return count
+
+    def ensure_initialized(self):
+        """台账为空但已有虚拟机时，从现有配置建立台账"""
+        with self._lock:
+            empty = not self.entries and not self.ledger_path.exists()
+        if empty and self.config_manager.list_vms():
+            self.rebuild()
+
+    def sample_growth(self, force: bool = False) -> bool:
+        """
+        刷新实际占用并记录各存储池的占用历史（按 capacity_sample_interval_seconds 限频）
+
+        Returns:
+            是否进行了采样
+        """
+        now = time.time()
+        interval = self.config_manager.get_global_config("capacity_sample_interval_seconds")
+        if not force and now - self._last_sample < interval:
+            return False
+        self.refresh_allocation()
+        with self._lock:
+            self._last_sample = now
+            cutoff = now - HISTORY_RETENTION_DAYS * 86400
+            for pool, totals in self.totals.items():
+                samples = [sample for sample in self.history.get(pool, []) if sample[0] >= cutoff]
+                samples.append([now, totals['allocated']])
+                self.history[pool] = samples
+            self._save()
+        return True
+
+    # 容量查询与检查
+
+    def _physical_capacity(self, pool_name: str, path: str = None):
+        """
+        返回 (物理容量, 物理可用空间)，只调用statvfs，不扫描目录
+
+        Args:
+            pool_name: 存储池名称（UNPOOLED 时使用 path 所在文件系统）
+            path: 路径（用于不属于存储池的文件）
+        """
+        pool = self.pool_manager.get_pool(pool_name) if pool_name else None
+        usage_path = Path(pool['path'] if pool else (path or '/'))
+        while not usage_path.exists() and usage_path != usage_path.parent:
+            usage_path = usage_path.parent
+        try:
+            usage = psutil.disk_usage(str(usage_path))
+        except OSError:
+            return 0, 0
+        reserve_percent = pool['reserve_percent'] if pool else 0
+        capacity = usage.total
+        free = usage.free - usage.total * reserve_percent / 100
+        if pool and pool['capacity_gb']:
+            capacity = pool['capacity_gb'] * 1024**3
+            with self._lock:
+                allocated = self.totals.get(pool_name, {}).get('allocated', 0)
+            free = min(free, capacity - allocated)
+        return capacity, max(int(free), 0)
+
+    def get_pool_capacity(self, pool_name: str, path: str = None) -> PoolCapacity:
+        """获取存储池的容量状况"""
+        with self._lock:
+            totals = dict(self.totals.get(pool_name, {'committed': 0, 'allocated': 0, 'count': 0}))
+            samples = list(self.history.get(pool_name, []))
+        capacity, free = self._physical_capacity(pool_name, path)
+        window = self.config_manager.get_global_config("capacity_growth_window_days") * 86400
+        recent = [sample for sample in samples if sample[0] >= time.time() - window]
+        return PoolCapacity(
+            pool=pool_name,
+            committed_bytes=totals['committed'],
+            allocated_bytes=totals['allocated'],
+            capacity_bytes=capacity,
+            free_bytes=free,
+            growth_bytes_per_day=_linear_growth(recent),
+            entry_count=totals['count']
+        )
+
+    def list_pool_capacity(self) -> List[PoolCapacity]:
+        """获取所有存储池（及不属于存储池的文件）的容量状况"""
+        names = [pool['name'] for pool in self.pool_manager.list_pools()]
+        with self._lock:
+            if self.totals.get(UNPOOLED, {}).get('count'):
+                names.append(UNPOOLED)
+        return [self.get_pool_capacity(name) for name in names]
+
+    def check(self, path: str, virtual_size: int, physical_size: int = 0) -> CapacityCheck:
+        """
+        检查在 path 新建一个磁盘文件是否满足容量策略
+
+        Args:
+            path: 新文件路径
+            virtual_size: 新文件的虚拟容量（计入承诺容量）
+            physical_size: 新文件立即需要的物理空间（如完全克隆复制的数据量）
+        """
+        pool_name = self._pool_of(os.path.abspath(os.path.expanduser(path)))
+        capacity = self.get_pool_capacity(pool_name, path)
+        result = CapacityCheck(allowed=True, pool=pool_name)
+        pool_label = pool_name or "未分配存储池"
+
+        if physical_size > capacity.free_bytes:
+            result.errors.append(
+                f"{pool_label} 物理空间不足: 需要 {physical_size / (1024**3):.2f} GB，"
+                f"可用 {capacity.free_bytes / (1024**3):.2f} GB"
+            )
+
+        if capacity.capacity_bytes:
+            result.overcommit_ratio_after = (capacity.committed_bytes + virtual_size) / capacity.capacity_bytes
+        max_ratio = self.config_manager.get_global_config("capacity_max_overcommit_ratio")
+        warn_ratio = self.config_manager.get_global_config("capacity_warn_overcommit_ratio")
+        ratio_message = (f"{pool_label} 超配比例将达到 {result.overcommit_ratio_after:.2f} "
+                         f"(承诺 {(capacity.committed_bytes + virtual_size) / (1024**3):.1f} GB / "
+                         f"物理 {capacity.capacity_bytes / (1024**3):.1f} GB)")
+        if max_ratio and result.overcommit_ratio_after > max_ratio:
+            if self.config_manager.get_global_config("capacity_enforcement") == "refuse":
+                result.errors.append(f"{ratio_message}，超过上限 {max_ratio}")
+            else:
+                result.warnings.append(f"{ratio_message}，超过上限 {max_ratio}")
+        elif warn_ratio and result.overcommit_ratio_after > warn_ratio:
+            result.warnings.append(ratio_message)
+
+        days = capacity.days_until_full
+        warn_days = self.config_manager.get_global_config("capacity_warn_days_until_full")
+        if days is not None and days < warn_days:
+            result.warnings.append(
+                f"{pool_label} 按近期增长速度 ({capacity.growth_bytes_per_day / (1024**3):.2f} GB/天) "
+                f"预计 {days:.0f} 天后用满"
+            )
+
+        result.allowed = not result.errors
+        return result
+
+    def enforce(self, path: str, virtual_size: int, physical_size: int = 0) -> List[str]:
+        """
+        执行容量检查，违反策略时抛出异常
+
+        Returns:
+            警告列表
+
+        Raises:
+            CapacityError: 违反容量策略
+        """
+        result = self.check(path, virtual_size, physical_size)
+        if not result.allowed:
+            raise CapacityError("；".join(result.errors))
+        for warning in result.warnings:
+            print(f"容量警告: {warning}")
+        return result.warnings
+
+
+# 全局容量规划器实例
+capacity_planner = None
+
+
+def get_capacity_planner(config_manager) -> CapacityPlanner:
+    """获取容量规划器实例"""
+    global capacity_planner
+    if capacity_planner is None:
+        capacity_planner = CapacityPlanner(config_manager, config_manager.config_dir / 'capacity_ledger.json')
+        capacity_planner.ensure_initialized()
+    return capacity_planner
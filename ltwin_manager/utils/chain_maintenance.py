@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""
+后端链整理服务
+外部快照和链接克隆会让磁盘的后端链越来越长，读取未分配的数据要逐层查找。
+本服务规划并在磁盘任务队列中执行缩短后端链的任务：
+运行中的虚拟机通过 QMP block-commit/block-stream（带速率限制），已停止的用 qemu-img commit/rebase；
+非紧急任务只在配置的空闲时段执行。
+"""
+
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from ltwin_manager.utils.qcow2_reader import is_qcow2
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.disk_job_queue import get_disk_job_queue, DiskJob, PRIORITY_LOW, PRIORITY_NORMAL
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+from ltwin_manager.utils.qmp_client import QMPClient, QMPError
+from ltwin_manager.utils.snapshot_backends import vm_drives
+
+
+@dataclass
+class ChainOperation:
+    """
+    一次缩短后端链的操作
+
+    commit: 把 top 到 base 之间（不含 base）的中间层合并进 base，并从链中去掉这些层。
+            只用于不属于任何快照、也没有其他镜像使用的层。
+    stream: 把 base 以上的层复制进虚拟机当前磁盘（base 为空时复制全部，磁盘不再依赖后端）。
+            快照冻结的镜像保持不变。
+    """
+    vm_name: str
+    drive_id: str
+    kind: str  # commit / stream
+    active: str  # 虚拟机当前磁盘
+    top: str  # commit 的最上层；stream 时等于 active
+    base: str  # 新的后端（stream 为空表示完全展开）
+    base_format: str = ''
+    removed: List[str] = field(default_factory=list)  # 操作完成后从链中去掉的层
+
+    def describe(self) -> str:
+        if self.kind == 'commit':
+            return (f"合并 {self.vm_name} {self.drive_id} 的 {len(self.removed)} 个中间层到 "
+                    f"{os.path.basename(self.base)}")
+        if not self.base:
+            return f"展开 {self.vm_name} {self.drive_id}（脱离全部后端）"
+        return f"缩短 {self.vm_name} {self.drive_id} 的后端链到 {os.path.basename(self.base)}"
+
+
+def parse_idle_window(text: str) -> Optional[tuple]:
+    """解析 "HH:MM-HH:MM" 形式的空闲时段，返回 ((时, 分), (时, 分))；为空或格式错误时返回 None"""
+    try:
+        start, end = (part.strip() for part in text.split('-'))
+        start_time = tuple(int(value) for value in start.split(':'))
+        end_time = tuple(int(value) for value in end.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    if len(start_time) != 2 or len(end_time) != 2:
+        return None
+    return start_time, end_time
+
+
+class ChainMaintenanceService:
+    """后端链整理服务"""
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.job_queue = get_disk_job_queue(config_manager)
+        self._lock = threading.Lock()
+        self._vm_jobs: Dict[str, List[str]] = {}  # 虚拟机 -> 提交过的任务ID
+        self._deferred: Dict[str, bool] = {}  # 等待空闲时段的虚拟机 -> 是否完全展开
+        self._offline_running: Set[str] = set()  # 正在用 qemu-img 改写磁盘的虚拟机
+        self._chain_cache: Dict[str, tuple] = {}  # 虚拟机 -> (磁盘文件签名, 后端链中的文件)
+        self._timer: Optional[threading.Timer] = None
+
+    # ---------- 规划 ----------
+
+    @staticmethod
+    def chain_of(path: str) -> List[Dict]:
+        """磁盘及其后端链 [{'path', 'format'}]，第一个是磁盘本身"""
+        info = get_disk_inspector().inspect(path)
+        chain = [{'path': path, 'format': 'qcow2' if is_qcow2(path) else 'raw'}]
+        for item in (info.backing_chain if info else []):
+            chain.append({'path': item['path'],
+                          'format': item.get('format') or ('qcow2' if is_qcow2(item['path']) else 'raw')})
+        return chain
+
+    def _vm_chain_paths(self, vm_name: str) -> Set[str]:
+        """
+        虚拟机各磁盘后端链中的文件，按磁盘文件的修改时间和大小缓存
+
+        快照、恢复和展开都会改变磁盘文件；合并中间层时磁盘文件可能不变，此时缓存的集合只会多出
+        已删除的文件，按它判断是否被使用只会更保守
+        """
+        drives = [path for _, path in vm_drives(self.config_manager.get_vm_config(vm_name) or {})]
+        signature = []
+        for path in drives:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        cached = self._chain_cache.get(vm_name)
+        if cached and cached[0] == signature:
+            return cached[1]
+        paths = {os.path.abspath(item['path']) for path in drives for item in self.chain_of(path)}
+        self._chain_cache[vm_name] = (signature, paths)
+        return paths
+
+    def chain_users(self, paths, exclude_vm: str = None) -> Dict[str, Set[str]]:
+        """
+        paths 中仍被使用的文件 {文件绝对路径: 使用它的虚拟机}
+
+        检查 exclude_vm 以外所有虚拟机各磁盘的后端链和它们的快照文件的后端链：
+        链接克隆、镜像库覆盖层可以以另一台虚拟机的磁盘或快照层为后端，
+        删除或改写镜像前都要确认没有其他虚拟机还在使用。
+        快照使用的文件从快照索引的摘要中查询，后端链按文件缓存，不读取其他虚拟机的快照元数据
+        """
+        from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+        targets = {os.path.abspath(path) for path in paths if path}
+        users: Dict[str, Set[str]] = {}
+        if not targets:
+            return users
+        for vm_name in self.config_manager.list_vms():
+            if vm_name == exclude_vm:
+                continue
+            for path in targets & self._vm_chain_paths(vm_name):
+                users.setdefault(path, set()).add(vm_name)
+        snapshot_index = get_snapshot_manager(self.config_manager).snapshots_metadata
+        for snapshot_path in snapshot_index.referenced_paths():
+            owners = snapshot_index.owners(snapshot_path) - {exclude_vm}
+            if not owners:
+                continue
+            chain = {os.path.abspath(item['path']) for item in self.chain_of(snapshot_path)}
+            for path in targets & chain:
+                users.setdefault(path, set()).update(owners)
+        return users
+
+    def pinned_paths(self, vm_name: str, candidates: Set[str]) -> Set[str]:
+        """
+        candidates（虚拟机后端链中的文件）中不能被合并或修改的镜像：
+        任何快照使用的文件、其他虚拟机磁盘链或快照链中的文件；另加镜像库目录（以分隔符结尾，按前缀匹配）
+        """
+        from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+        snapshot_index = get_snapshot_manager(self.config_manager).snapshots_metadata
+        candidates = {os.path.abspath(path) for path in candidates if path}
+        pinned = {path for path in candidates if snapshot_index.owners(path)}
+        pinned.update(self.chain_users(candidates - pinned, exclude_vm=vm_name))
+        library_path = self.config_manager.get_global_config("image_library_path")
+        library_dir = os.path.abspath(os.path.expanduser(library_path or os.path.join('~', 'ImageLibrary')))
+        return pinned | {library_dir + os.sep}
+
+    @staticmethod
+    def _is_pinned(path: str, pinned: Set[str]) -> bool:
+        path = os.path.abspath(path)
+        return path in pinned or any(path.startswith(prefix) for prefix in pinned if prefix.endswith(os.sep))
+
+    def plan(self, vm_name: str, max_depth: int = None, flatten: bool = False) -> List[ChainOperation]:
+        """
+        规划虚拟机各磁盘的整理操作
+
+        Args:
+            max_depth: 后端链长度上限（默认使用 snapshot_max_chain_depth），超过时缩短到上限的一半
+            flatten: 完全展开（磁盘不再依赖任何后端，用于脱离链接克隆的基础镜像）
+        """
+        if max_depth is None:
+            max_depth = int(self.config_manager.get_global_config("snapshot_max_chain_depth") or 0)
+        vm_config = self.config_manager.get_vm_config(vm_name) or {}
+        chains = {drive_id: self.chain_of(active) for drive_id, active in vm_drives(vm_config) if is_qcow2(active)}
+        if not flatten and (max_depth <= 0 or all(len(chain) - 1 <= max_depth for chain in chains.values())):
+            return []
+        pinned = self.pinned_paths(vm_name, {item['path'] for chain in chains.values() for item in chain[1:]})
+        operations = []
+        for drive_id, active in vm_drives(vm_config):
+            if drive_id not in chains:
+                continue
+            chain = chains[drive_id]
+            if flatten:
+                if len(chain) > 1:
+                    operations.append(ChainOperation(vm_name, drive_id, 'stream', active, active, '',
+                                                     removed=[item['path'] for item in chain[1:]]))
+                continue
+            if max_depth <= 0 or len(chain) - 1 <= max_depth:
+                continue
+
+            # 先合并连续的无主中间层（只改写无主的层，不复制快照数据）
+            index = 1
+            while index < len(chain) - 1:
+                end = index
+                while end < len(chain) and not self._is_pinned(chain[end]['path'], pinned):
+                    end += 1
+                if end - 1 > index:
+                    base = chain[end - 1]
+                    removed = [item['path'] for item in chain[index:end - 1]]
+                    operations.append(ChainOperation(vm_name, drive_id, 'commit', active, chain[index]['path'],
+                                                     base['path'], base['format'], removed))
+                    chain = chain[:index] + chain[end - 1:]
+                index += 1
+
+            # 仍然过长时把较深的层复制进当前磁盘
+            depth = len(chain) - 1
+            if depth > max_depth:
+                keep_depth = max(1, max_depth // 2)
+                base = chain[depth - keep_depth + 1]
+                operations.append(ChainOperation(
+                    vm_name, drive_id, 'stream', active, active, base['path'], base['format'],
+                    [item['path'] for item in chain[1:depth - keep_depth + 1]]
+                ))
+        return operations
+
+    # ---------- 调度 ----------
+
+    def idle_window(self) -> Optional[tuple]:
+        return parse_idle_window(self.config_manager.get_global_config("chain_job_idle_window") or "")
+
+    def in_idle_window(self, now: datetime = None) -> bool:
+        """当前是否在空闲时段内（未配置时段时总是允许）"""
+        window = self.idle_window()
+        if not window:
+            return True
+        now = now or datetime.now()
+        current = (now.hour, now.minute)
+        start, end = window
+        if start <= end:
+            return start <= current < end
+        return current >= start or current < end  # 跨午夜
+
+    def seconds_until_window(self, now: datetime = None) -> float:
+        """距离下一个空闲时段开始的秒数"""
+        window = self.idle_window()
+        if not window or self.in_idle_window(now):
+            return 0.0
+        now = now or datetime.now()
+        start = now.replace(hour=window[0][0], minute=window[0][1], second=0, microsecond=0)
+        if start <= now:
+            start += timedelta(days=1)
+        return (start - now).total_seconds()
+
+    def maintain(self, vm_name: str, urgent: bool = False) -> List[str]:
+        """
+        按 snapshot_max_chain_depth 缩短虚拟机的后端链
+
+        Args:
+            urgent: 立即执行，不等待空闲时段
+
+        Returns:
+            提交的任务ID（推迟到空闲时段或不需要整理时为空）
+        """
+        return self._request(vm_name, False, urgent)
+
+    def flatten(self, vm_name: str, urgent: bool = True) -> List[str]:
+        """完全展开虚拟机磁盘（链接克隆脱离基础镜像，快照不受影响）"""
+        return self._request(vm_name, True, urgent)
+
+    def _request(self, vm_name: str, flatten: bool, urgent: bool) -> List[str]:
+        if self.has_pending(vm_name):
+            return []
+        if not urgent and not self.in_idle_window():
+            operations = self.plan(vm_name, flatten=flatten)
+            if operations:
+                with self._lock:
+                    self._deferred[vm_name] = self._deferred.get(vm_name, False) or flatten
+                self._schedule_release()
+            return []
+        return self.submit(self.plan(vm_name, flatten=flatten), PRIORITY_NORMAL if urgent else PRIORITY_LOW)
+
+    def _schedule_release(self):
+        """在空闲时段开始时提交推迟的请求"""
+        with self._lock:
+            if self._timer and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(self.seconds_until_window() + 1, self.release_deferred)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def release_deferred(self) -> List[str]:
+        """重新规划并提交推迟的请求（到达空闲时段时自动调用）"""
+        if not self.in_idle_window():
+            self._timer = None
+            self._schedule_release()
+            return []
+        with self._lock:
+            deferred, self._deferred = self._deferred, {}
+            self._timer = None
+        job_ids = []
+        for vm_name, flatten in deferred.items():
+            job_ids.extend(self.submit(self.plan(vm_name, flatten=flatten), PRIORITY_LOW))
+        return job_ids
+
+    def submit(self, operations: List[ChainOperation], priority: int = PRIORITY_LOW) -> List[str]:
+        """把操作提交到磁盘任务队列（同一磁盘的操作按顺序执行）"""
+        job_ids = []
+        by_drive: Dict[tuple, List[ChainOperation]] = {}
+        for operation in operations:
+            by_drive.setdefault((operation.vm_name, operation.drive_id), []).append(operation)
+        for (vm_name, drive_id), drive_operations in by_drive.items():
+            job_id = self.job_queue.submit(
+                'chain', "；".join(operation.describe() for operation in drive_operations), [],
+                target_path=drive_operations[0].active, priority=priority,
+                runner=lambda job, ops=drive_operations: self._run(job, ops)
+            )
+            with self._lock:
+                self._vm_jobs.setdefault(vm_name, []).append(job_id)
+            job_ids.append(job_id)
+        return job_ids
+
+    def has_pending(self, vm_name: str) -> bool:
+        """虚拟机是否有推迟、排队或运行中的整理任务"""
+        with self._lock:
+            if vm_name in self._deferred:
+                return True
+            job_ids = list(self._vm_jobs.get(vm_name, []))
+        active = [job_id for job_id in job_ids
+                  if (self.job_queue.get_job(job_id) or {}).get('status') in ('queued', 'running')]
+        with self._lock:
+            self._vm_jobs[vm_name] = active
+        return bool(active)
+
+    def offline_job_running(self, vm_name: str) -> bool:
+        """是否正在用 qemu-img 改写虚拟机磁盘（此时不能启动虚拟机）"""
+        with self._lock:
+            return vm_name in self._offline_running
+
+    # ---------- 执行 ----------
+
+    def _rate_limit(self) -> int:
+        """速率限制（字节/秒，0表示不限制）"""
+        return int(float(self.config_manager.get_global_config("chain_job_rate_limit_mb") or 0) * 1024**2)
+
+    def _run(self, job: DiskJob, operations: List[ChainOperation]) -> str:
+        """任务线程：依次执行同一磁盘的操作"""
+        messages = []
+        for index, operation in enumerate(operations):
+            if job.status == 'cancelled':
+                break
+            self._check_still_valid(operation)
+            running = (self.config_manager.get_vm_config(operation.vm_name) or {}).get('status') == 'running'
+            scale = (index, len(operations))
+            if running:
+                self._run_live(job, operation, scale)
+            else:
+                with self._lock:
+                    self._offline_running.add(operation.vm_name)
+                try:
+                    self._run_offline(job, operation)
+                finally:
+                    with self._lock:
+                        self._offline_running.discard(operation.vm_name)
+            if job.status == 'cancelled':
+                break
+            self._finish(operation)
+            messages.append(operation.describe())
+        return f"{'，'.join(messages)}，耗时 {job.elapsed:.1f} 秒" if messages else ""
+
+    def _check_still_valid(self, operation: ChainOperation):
+        """排队期间磁盘或后端链可能已经变化（创建/恢复/删除快照），变化时放弃操作"""
+        current = dict(vm_drives(self.config_manager.get_vm_config(operation.vm_name) or {}))
+        if os.path.abspath(current.get(operation.drive_id, '')) != os.path.abspath(operation.active):
+            raise RuntimeError(f"{operation.drive_id} 已不是原来的磁盘，放弃整理")
+        get_disk_inspector().invalidate(operation.active)
+        chain = [os.path.abspath(item['path']) for item in self.chain_of(operation.active)]
+        for path in [operation.top, operation.base] + operation.removed:
+            if path and os.path.abspath(path) not in chain:
+                raise RuntimeError(f"后端链已变化（{os.path.basename(path)} 不在链中），放弃整理")
+
+    def _run_offline(self, job: DiskJob, operation: ChainOperation):
+        """已停止的虚拟机：qemu-img commit/rebase"""
+        rate = self._rate_limit()
+        if operation.kind == 'commit':
+            cmd = ['qemu-img', 'commit', '-p', '-f', 'qcow2', '-b', operation.base]
+            if rate:
+                cmd.extend(['-r', str(rate)])
+            self._check_command(job, cmd + [operation.top])
+            # 上面一层改为直接以 base 为后端（数据已合并，只改头部）
+            chain = [item['path'] for item in self.chain_of(operation.active)]
+            child = chain[chain.index(operation.top) - 1] if operation.top != operation.active else None
+            if child:
+                self._check_command(job, ['qemu-img', 'rebase', '-u', '-f', 'qcow2', '-b', operation.base,
+                                          '-F', operation.base_format, child])
+        else:
+            # rebase 没有速率参数，限速时以空闲I/O优先级运行
+            cmd = ['qemu-img', 'rebase', '-p', '-f', 'qcow2', '-b', operation.base]
+            if operation.base:
+                cmd.extend(['-F', operation.base_format])
+            cmd.append(operation.active)
+            if rate and shutil.which('ionice'):
+                cmd = ['ionice', '-c', '3'] + cmd
+            self._check_command(job, cmd)
+
+    def _check_command(self, job: DiskJob, cmd: List[str]):
+        returncode, stderr = self.job_queue.run_command(job, cmd)
+        if returncode != 0 and job.status != 'cancelled':
+            raise RuntimeError(stderr.strip() or f"{cmd[0]} 返回 {returncode}")
+
+    def _run_live(self, job: DiskJob, operation: ChainOperation, scale: tuple, poll_interval: float = 1.0):
+        """运行中的虚拟机：QMP block-commit/block-stream，轮询进度，取消时 block-job-cancel"""
+        block_job_id = f"{operation.kind}-{operation.drive_id}"
+        arguments = {'job-id': block_job_id, 'device': operation.drive_id}
+        if operation.base:
+            arguments['base'] = operation.base
+        if operation.kind == 'commit':
+            arguments['top'] = operation.top
+        rate = self._rate_limit()
+        if rate:
+            arguments['speed'] = rate
+
+        with QMPClient.for_vm(operation.vm_name, timeout=30.0) as qmp:
+            qmp.execute(f"block-{operation.kind}", arguments)
+            cancelled = False
+            while True:
+                jobs = [item for item in qmp.execute('query-block-jobs') or [] if item.get('device') == block_job_id]
+                if not jobs:
+                    break
+                if job.status == 'cancelled' and not cancelled:
+                    qmp.execute('block-job-cancel', {'device': block_job_id})
+                    cancelled = True
+                length = jobs[0].get('len') or 0
+                if length:
+                    done = (scale[0] + jobs[0].get('offset', 0) / length) / scale[1]
+                    self.job_queue.update_progress(job, round(done * 100, 1))
+                time.sleep(poll_interval)
+            for event in qmp.events:
+                data = event.get('data', {})
+                if data.get('device') == block_job_id and data.get('error'):
+                    raise QMPError(f"block-{operation.kind}: {data['error']}")
+
+    def _finish(self, operation: ChainOperation):
+        """操作完成后删除已经从链中去掉的无主中间层，清除受影响快照缓存的占用"""
+        from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+        for path in [operation.active] + operation.removed:
+            get_disk_inspector().invalidate(path)
+        get_snapshot_manager(self.config_manager).invalidate_usage(
+            operation.vm_name, [operation.active, operation.top, operation.base] + operation.removed)
+        if operation.kind != 'commit':
+            return
+        capacity_planner = get_capacity_planner(self.config_manager)
+        for path in operation.removed:
+            if os.path.exists(path):
+                os.remove(path)
+            capacity_planner.unregister(path)
+
+
+# 全局后端链整理服务实例
+chain_maintenance_service = None
+
+
+def get_chain_maintenance(config_manager) -> ChainMaintenanceService:
+    """获取后端链整理服务实例（首次调用应在GUI线程中，以便创建磁盘任务队列）"""
+    global chain_maintenance_service
+    if chain_maintenance_service is None:
+        chain_maintenance_service = ChainMaintenanceService(config_manager)
+    return chain_maintenance_service
@@ -11,6 +11,11 @@ from pathlib import Path
 from typing import Dict, Optional
 from datetime import datetime
 
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+
 
 class CloneManager:
     """克隆管理器"""
@@ -42,11 +47,24 @@ class CloneManager:
             if self.config_manager.vm_exists(target_vm_name):
                 raise ValueError(f"目标虚拟机 '{target_vm_name}' 已存在")
             
-            # 确定目标磁盘路径
+            # 确定目标磁盘路径（由放置策略选择存储池）
+            if not target_disk_path:
+                target_disk_path = get_storage_pool_manager(self.config_manager).disk_path_for_vm(
+                    target_vm_name, self._estimate_clone_size(source_config.get('disk_path', ''), clone_type)
+                )
             if not target_disk_path:
                 vm_storage_path = self.config_manager.get_default_vm_storage_path()
                 target_disk_path = str(vm_storage_path / f"{target_vm_name}.qcow2")
             
+            # 检查目标存储池容量: 克隆按源磁盘虚拟容量计入承诺容量，完全克隆还需要立即复制数据
+            capacity_planner = get_capacity_planner(self.config_manager)
+            source_info = get_disk_inspector().inspect(source_config.get('disk_path', ''))
+            capacity_planner.enforce(
+                target_disk_path,
+                source_info.virtual_size if source_info else 0,
+                self._estimate_clone_size(source_config.get('disk_path', ''), clone_type)
+            )
+            
             # 根据克隆类型执行相应操作
             if clone_type == "full":
                 # 完全克隆 - 复制整个磁盘文件
@@ -75,6 +93,7 @@ class CloneManager:
             
             # 保存新虚拟机配置
             self.config_manager.set_vm_config(target_vm_name, new_config)
+            capacity_planner.register(target_disk_path, 'clone', target_vm_name)
             
             return True
             
@@ -82,16 +101,38 @@ class CloneManager:
             print(f"克隆虚拟机失败: {e}")
             return False
     
+    def flatten_clone(self, vm_name: str) -> bool:
+        """
+        让链接克隆脱离基础镜像：在后台把整条后端链复制进虚拟机磁盘
+        
+        Returns:
+            bool: 是否提交了后台任务
+        """
+        try:
+            if not self.config_manager.vm_exists(vm_name):
+                raise ValueError(f"虚拟机 '{vm_name}' 不存在")
+            
+            from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+            if not get_chain_maintenance(self.config_manager).flatten(vm_name):
+                raise ValueError("磁盘没有后端镜像或已有整理任务在进行")
+            return True
+            
+        except Exception as e:
+            print(f"展开链接克隆失败: {e}")
+            return False
+    
     def _full_clone(self, source_disk: str, target_disk: str):
         """执行完全克隆"""
         # 确保目标目录存在
         target_path = Path(target_disk)
         target_path.parent.mkdir(parents=True, exist_ok=True)
         
+        source_format = self._check_source_disk(source_disk)
+        
         # 使用qemu-img进行磁盘克隆
         cmd = [
             'qemu-img', 'convert',
-            '-f', 'qcow2',
+            '-f', source_format,
             '-O', 'qcow2',
             source_disk,
             target_disk
@@ -105,17 +146,51 @@ class CloneManager:
         target_path = Path(target_disk)
         target_path.parent.mkdir(parents=True, exist_ok=True)
         
+        source_format = self._check_source_disk(source_disk)
+        
         # 创建基于源磁盘的链接克隆
         cmd = [
             'qemu-img', 'create',
             '-f', 'qcow2',
             '-b', source_disk,  # 基础镜像
-            '-F', 'qcow2',     # 基础镜像格式
+            '-F', source_format,  # 基础镜像格式
             target_disk
         ]
         
         subprocess.run(cmd, check=True)
     
+    def _estimate_clone_size(self, source_disk: str, clone_type: str) -> int:
+        """估算克隆需要的空间: 完全克隆为整条后端链的实际占用，链接克隆只需新建覆盖层"""
+        if clone_type != "full":
+            return 0
+        disk_info = get_disk_inspector().inspect(source_disk)
+        return disk_info.chain_allocated_size if disk_info else 0
+    
+    def _check_source_disk(self, source_disk: str) -> str:
+        """
+        校验源磁盘并返回其格式
+        
+        Raises:
+            ValueError: 源磁盘不存在、已损坏或后端文件缺失
+        """
+        if not os.path.exists(source_disk):
+            raise ValueError(f"源磁盘不存在: {source_disk}")
+        if not is_qcow2(source_disk):
+            return 'raw'
+        
+        try:
+            with Qcow2Image(source_disk) as image:
+                header = image.header
+                if header.corrupt:
+                    raise ValueError(f"源磁盘已被标记为损坏: {source_disk}")
+                if header.backing_file and not os.path.exists(image.resolve_backing_path()):
+                    raise ValueError(f"源磁盘的后端文件不存在: {header.backing_file}")
+                if header.dirty:
+                    print(f"警告: 源磁盘未正常关闭，克隆结果可能不一致: {source_disk}")
+        except Qcow2Error as e:
+            raise ValueError(f"源磁盘不是有效的qcow2镜像: {e}")
+        return 'qcow2'
+    
     def _generate_new_mac(self) -> str:
         """生成新的MAC地址"""
         import random
@@ -9,6 +9,9 @@ import os
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 import shutil
+import threading
+
+from ltwin_manager.utils.profiler import timed
 
 
 class ConfigManager:
@@ -24,6 +27,9 @@ class ConfigManager:
         # 确保配置目录存在
         self.config_dir.mkdir(parents=True, exist_ok=True)
         
+        # 计划快照等后台线程也会修改配置，写入时加锁
+        self._lock = threading.RLock()
+        
         # 初始化配置
         self.global_config = self._load_global_config()
         self.vms_config = self._load_vms_config()
@@ -54,22 +60,61 @@ class ConfigManager:
             "auto_optimize_vm": True,
             "max_concurrent_vms": 5,
             "enable_snapshots": True,
-            "snapshot_location": str(Path.home() / "VM_Snapshots")
+            "snapshot_location": str(Path.home() / "VM_Snapshots"),
+            "disk_latency_alert_ms": 50,
+            "disk_util_alert_percent": 90,
+            "disk_queue_alert_depth": 16,
+            "psi_alert_percent": 20,
+            "steal_alert_percent": 10,
+            "iowait_alert_percent": 30,
+            "pressure_sustain_seconds": 30,
+            "metrics_retention_days": 30,
+            "metrics_record_interval_seconds": 30,
+            "disk_job_max_concurrent": 2,
+            "disk_job_per_device_limit": 1,
+            "storage_pools": [],
+            "storage_placement_policy": "balanced",
+            "snapshot_pool_affinity": "cold",
+            "storage_benchmark_file_mb": 256,
+            "capacity_max_overcommit_ratio": 3.0,
+            "capacity_warn_overcommit_ratio": 1.5,
+            "capacity_enforcement": "refuse",
+            "capacity_warn_days_until_full": 14,
+            "capacity_growth_window_days": 14,
+            "capacity_sample_interval_seconds": 3600,
+            "snapshot_retention": {"keep_last": 0, "keep_daily": 0, "keep_weekly": 0, "max_age_days": 30, "max_gb": 0},
+            "image_library_path": str(Path.home() / "ImageLibrary"),
+            "image_hash_threads": 0,
+            "snapshot_backend": "external",
+            "snapshot_restore_backup": "snapshot",
+            "snapshot_max_chain_depth": 8,
+            "chain_job_rate_limit_mb": 64,
+            "chain_job_idle_window": "",
+            "snapshot_stagger_seconds": 30,
+            "backup_location": str(Path.home() / ".ltwin" / "backups"),
+            "backup_compress_level": 6,
+            "backup_keep_last": 14,
+            "guest_agent_channel": True,
+            "snapshot_fsfreeze": "off",
+            "fsfreeze_timeout_seconds": 10,
+            "fsfreeze_max_frozen_ms": 2000
         }
         
         self._save_global_config(default_config)
         return default_config
     
+    @timed("config_manager.save_global")
     def _save_global_config(self, config: Dict[str, Any]) -> bool:
         """保存全局配置"""
-        try:
-            with open(self.global_config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-            self.global_config = config
-            return True
-        except Exception as e:
-            print(f"保存全局配置失败: {e}")
-            return False
+        with self._lock:
+            try:
+                with open(self.global_config_path, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, ensure_ascii=False, indent=2)
+                self.global_config = config
+                return True
+            except Exception as e:
+                print(f"保存全局配置失败: {e}")
+                return False
     
     def _load_vms_config(self) -> Dict[str, Any]:
         """加载虚拟机配置"""
@@ -82,16 +127,18 @@ class ConfigManager:
         
         return {}  # 返回空字典而不是默认配置
     
+    @timed("config_manager.save_vms")
     def _save_vms_config(self, config: Dict[str, Any]) -> bool:
         """保存虚拟机配置"""
-        try:
-            with open(self.vms_config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-            self.vms_config = config
-            return True
-        except Exception as e:
-            print(f"保存虚拟机配置失败: {e}")
-            return False
+        with self._lock:
+            try:
+                with open(self.vms_config_path, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, ensure_ascii=False, indent=2)
+                self.vms_config = config
+                return True
+            except Exception as e:
+                print(f"保存虚拟机配置失败: {e}")
+                return False
     
     def _load_images_config(self) -> Dict[str, Any]:
         """加载镜像配置"""
@@ -104,16 +151,18 @@ class ConfigManager:
         
         return {}
     
+    @timed("config_manager.save_images")
     def _save_images_config(self, config: Dict[str, Any]) -> bool:
         """保存镜像配置"""
-        try:
-            with open(self.images_config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-            self.images_config = config
-            return True
-        except Exception as e:
-            print(f"保存镜像配置失败: {e}")
-            return False
+        with self._lock:
+            try:
+                with open(self.images_config_path, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, ensure_ascii=False, indent=2)
+                self.images_config = config
+                return True
+            except Exception as e:
+                print(f"保存镜像配置失败: {e}")
+                return False
     
     # 全局配置相关方法
     def get_global_config(self, key: str = None) -> Any:
@@ -137,7 +186,44 @@ class ConfigManager:
                     "auto_optimize_vm": True,
                     "max_concurrent_vms": 5,
                     "enable_snapshots": True,
-                    "snapshot_location": str(Path.home() / "VM_Snapshots")
+                    "snapshot_location": str(Path.home() / "VM_Snapshots"),
+                    "disk_latency_alert_ms": 50,
+                    "disk_util_alert_percent": 90,
+                    "disk_queue_alert_depth": 16,
+                    "psi_alert_percent": 20,
+                    "steal_alert_percent": 10,
+                    "iowait_alert_percent": 30,
+                    "pressure_sustain_seconds": 30,
+                    "metrics_retention_days": 30,
+                    "metrics_record_interval_seconds": 30,
+                    "disk_job_max_concurrent": 2,
+                    "disk_job_per_device_limit": 1,
+                    "storage_pools": [],
+                    "storage_placement_policy": "balanced",
+                    "snapshot_pool_affinity": "cold",
+                    "storage_benchmark_file_mb": 256,
+                    "capacity_max_overcommit_ratio": 3.0,
+                    "capacity_warn_overcommit_ratio": 1.5,
+                    "capacity_enforcement": "refuse",
+                    "capacity_warn_days_until_full": 14,
+                    "capacity_growth_window_days": 14,
+                    "capacity_sample_interval_seconds": 3600,
+                    "snapshot_retention": {"keep_last": 0, "keep_daily": 0, "keep_weekly": 0, "max_age_days": 30, "max_gb": 0},
+                    "image_library_path": str(Path.home() / "ImageLibrary"),
+                    "image_hash_threads": 0,
+                    "snapshot_backend": "external",
+                    "snapshot_restore_backup": "snapshot",
+                    "snapshot_max_chain_depth": 8,
+                    "chain_job_rate_limit_mb": 64,
+                    "chain_job_idle_window": "",
+                    "snapshot_stagger_seconds": 30,
+                    "backup_location": str(Path.home() / ".ltwin" / "backups"),
+                    "backup_compress_level": 6,
+                    "backup_keep_last": 14,
+                    "guest_agent_channel": True,
+                    "snapshot_fsfreeze": "off",
+                    "fsfreeze_timeout_seconds": 10,
+                    "fsfreeze_max_frozen_ms": 2000
                 }
                 if key in default_values:
                     return default_values[key]
@@ -161,15 +247,17 @@ class ConfigManager:
     
     def set_vm_config(self, vm_name: str, config: Dict[str, Any]) -> bool:
         """设置虚拟机配置"""
-        self.vms_config[vm_name] = config
-        return self._save_vms_config(self.vms_config)
+        with self._lock:
+            self.vms_config[vm_name] = config
+            return self._save_vms_config(self.vms_config)
     
     def delete_vm_config(self, vm_name: str) -> bool:
         """删除虚拟机配置"""
-        if vm_name in self.vms_config:
-            del self.vms_config[vm_name]
-            return self._save_vms_config(self.vms_config)
-        return False
+        with self._lock:
+            if vm_name in self.vms_config:
+                del self.vms_config[vm_name]
+                return self._save_vms_config(self.vms_config)
+            return False
     
     def list_vms(self) -> List[str]:
         """列出所有虚拟机"""
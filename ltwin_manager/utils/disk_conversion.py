@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘转换流水线
+检测源镜像格式，根据目标设备类型选择 qemu-img convert 的并行协程数、乱序写入和缓存模式，
+提供压缩（去除零簇）操作，并记录每次转换的吞吐量
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+from ltwin_manager.utils.disk_stats import get_device_class
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error
+
+
+# 各类设备的默认转换参数: (并行协程数 -m, 是否乱序写入 -W, 目标缓存模式 -t)
+# 机械硬盘乱序写入会导致大量寻道，SSD/NVMe 则可以用更多并发并绕过页缓存
+DEVICE_PROFILES = {
+    'nvme': (16, True, 'none'),
+    'ssd': (8, True, 'none'),
+    'hdd': (2, False, 'writeback'),
+    'network': (4, False, 'writeback'),
+    'unknown': (4, False, 'writeback'),
+}
+
+# 识别镜像格式的魔数: (偏移, 魔数, 格式)
+FORMAT_SIGNATURES = (
+    (0, b'QFI\xfb', 'qcow2'),
+    (0, b'KDMV', 'vmdk'),
+    (0, b'vhdxfile', 'vhdx'),
+    (0, b'conectix', 'vpc'),
+    (0x40, b'\x7f\x10\xda\xbe', 'vdi'),
+)
+
+COMPRESSIBLE_FORMATS = ('qcow2', 'vmdk')
+
+
+def detect_image_format(path: str) -> str:
+    """根据文件魔数检测镜像格式，无法识别时视为raw"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(0x44)
+    except OSError:
+        return 'raw'
+    for offset, magic, image_format in FORMAT_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return image_format
+    return 'raw'
+
+
+@dataclass
+class ConversionPlan:
+    """转换参数"""
+    source_format: str
+    target_format: str
+    device_class: str
+    coroutines: int
+    out_of_order: bool
+    target_cache: str
+    source_cache: str = "writeback"  # 源缓存模式 -T
+    compress: bool = False
+    sparse_size: str = "4k"  # -S: 全零区域不写入目标
+    backing_file: str = ""  # 压缩带后端链的镜像时保留后端
+    backing_format: str = ""
+
+    def describe(self) -> str:
+        """参数摘要（显示用）"""
+        parts = [self.device_class, f"-m {self.coroutines}"]
+        if self.out_of_order:
+            parts.append("-W")
+        parts.append(f"-t {self.target_cache}")
+        if self.compress:
+            parts.append("-c")
+        return " ".join(parts)
+
+    def build_command(self, source_path: str, target_path: str, progress: bool = False) -> List[str]:
+        """构建 qemu-img convert 命令"""
+        cmd = ['qemu-img', 'convert']
+        if progress:
+            cmd.append('-p')
+        cmd.extend(['-f', self.source_format, '-O', self.target_format])
+        cmd.extend(['-m', str(self.coroutines)])
+        if self.out_of_order:
+            cmd.append('-W')
+        cmd.extend(['-t', self.target_cache, '-T', self.source_cache])
+        if self.compress:
+            cmd.append('-c')
+        if self.sparse_size:
+            cmd.extend(['-S', self.sparse_size])
+        if self.backing_file:
+            cmd.extend(['-B', self.backing_file])
+            if self.backing_format:
+                cmd.extend(['-o', f'backing_fmt={self.backing_format}'])
+        cmd.extend([source_path, target_path])
+        return cmd
+
+
+class ConversionHistory:
+    """转换吞吐量记录（JSON文件，保留最近若干条）"""
+
+    def __init__(self, history_path: Path, max_records: int = 200):
+        self.history_path = Path(history_path)
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self.records: List[Dict] = self._load()
+
+    def _load(self) -> List[Dict]:
+        """加载历史记录"""
+        if self.history_path.exists():
+            try:
+                with open(self.history_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"加载转换历史失败: {e}")
+        return []
+
+    def record(self, plan: ConversionPlan, operation: str, bytes_read: int, elapsed: float) -> float:
+        """
+        记录一次转换
+
+        Returns:
+            吞吐量（MB/s）
+        """
+        throughput = bytes_read / (1024**2) / elapsed if elapsed > 0 else 0.0
+        entry = {
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'operation': operation,
+            'device_class': plan.device_class,
+            'source_format': plan.source_format,
+            'target_format': plan.target_format,
+            'coroutines': plan.coroutines,
+            'out_of_order': plan.out_of_order,
+            'target_cache': plan.target_cache,
+            'compress': plan.compress,
+            'bytes': bytes_read,
+            'elapsed': round(elapsed, 2),
+            'throughput_mb_s': round(throughput, 1)
+        }
+        with self._lock:
+            self.records.append(entry)
+            del self.records[:-self.max_records]
+            try:
+                self.history_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.history_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.records, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                print(f"保存转换历史失败: {e}")
+        return throughput
+
+
+class ConversionPlanner:
+    """转换参数规划器"""
+
+    def __init__(self, history: ConversionHistory):
+        self.history = history
+
+    def plan(self, source_path: str, target_path: str, target_format: str,
+             compress: bool = False) -> ConversionPlan:
+        """
+        为一次转换选择参数
+
+        Args:
+            source_path: 源镜像
+            target_path: 目标镜像（用于判断目标设备类型）
+            target_format: 目标格式
+            compress: 是否压缩（仅qcow2/vmdk目标有效）
+        """
+        device_class = get_device_class(os.path.dirname(os.path.abspath(target_path)))
+        coroutines, out_of_order, target_cache = DEVICE_PROFILES.get(device_class, DEVICE_PROFILES['unknown'])
+        compress = compress and target_format in COMPRESSIBLE_FORMATS
+
+        # 源在本地块设备上时用O_DIRECT读取，避免大镜像挤占页缓存
+        source_class = get_device_class(source_path)
+        source_cache = 'none' if source_class in ('nvme', 'ssd', 'hdd') else 'writeback'
+
+        return ConversionPlan(
+            source_format=detect_image_format(source_path),
+            target_format=target_format,
+            device_class=device_class,
+            coroutines=coroutines,
+            out_of_order=out_of_order,
+            target_cache=target_cache,
+            source_cache=source_cache,
+            compress=compress
+        )
+
+    def plan_compact(self, image_path: str, temp_path: str, compress: bool = False) -> ConversionPlan:
+        """
+        为压缩操作选择参数
+
+        压缩即按原格式重写镜像：全零区域（-S）和零簇不会写入新文件；
+        若镜像有后端文件，新镜像保留同一后端，只复制本层数据。
+        """
+        source_format = detect_image_format(image_path)
+        plan = self.plan(image_path, temp_path, source_format, compress)
+        if source_format == 'qcow2':
+            try:
+                with Qcow2Image(image_path) as image:
+                    if image.header.backing_file:
+                        plan.backing_file = image.resolve_backing_path()
+                        plan.backing_format = image.header.backing_format or detect_image_format(plan.backing_file)
+            except (OSError, Qcow2Error) as e:
+                print(f"读取镜像后端信息失败: {e}")
+        return plan
+
+
+def allocated_bytes(path: str) -> int:
+    """文件实际占用字节数（用于计算吞吐量）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    blocks = getattr(st, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+# 全局规划器实例
+conversion_planner = None
+
+
+def get_conversion_planner(config_manager) -> ConversionPlanner:
+    """获取转换规划器实例"""
+    global conversion_planner
+    if conversion_planner is None:
+        conversion_planner = ConversionPlanner(
+            ConversionHistory(config_manager.config_dir / 'conversion_history.json')
+        )
+    return conversion_planner
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘镜像检查器
+统一获取虚拟磁盘的虚拟大小、实际分配大小、qcow2簇使用情况和后端链，
+qcow2镜像直接解析头部，其他格式调用 qemu-img；结果按文件 mtime 缓存
+"""
+
+import json
+import os
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ltwin_manager.utils.profiler import timed
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+
+
+@dataclass
+class DiskImageInfo:
+    """虚拟磁盘信息"""
+    path: str
+    format: str = "raw"
+    virtual_size: int = 0  # 客户机看到的磁盘容量
+    apparent_size: int = 0  # 文件长度 (st_size)
+    allocated_size: int = 0  # 实际占用的块 (st_blocks * 512)
+    cluster_size: int = 0  # qcow2簇大小，raw为0
+    dirty: bool = False  # qcow2脏标志（未正常关闭）
+    corrupt: bool = False  # qcow2损坏标志
+    snapshot_count: int = 0  # qcow2内部快照数
+    backing_chain: List[Dict] = field(default_factory=list)  # 后端链（不含自身）: [{'path', 'format', 'allocated_size'}]
+    source: str = "stat"  # 信息来源: 'native'、'qemu-img' 或 'stat'
+
+    @property
+    def sparse_ratio(self) -> float:
+        """实际占用占虚拟容量的比例"""
+        return self.allocated_size / self.virtual_size if self.virtual_size else 0.0
+
+    @property
+    def allocated_clusters(self) -> int:
+        """已分配簇数（按实际占用估算，包含元数据簇）"""
+        if not self.cluster_size:
+            return 0
+        return -(-self.allocated_size // self.cluster_size)
+
+    @property
+    def total_clusters(self) -> int:
+        """虚拟容量对应的簇数"""
+        if not self.cluster_size:
+            return 0
+        return -(-self.virtual_size // self.cluster_size)
+
+    @property
+    def chain_allocated_size(self) -> int:
+        """整条后端链的实际占用"""
+        return self.allocated_size + sum(item.get('allocated_size', 0) for item in self.backing_chain)
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return {
+            'path': self.path,
+            'format': self.format,
+            'virtual_size': self.virtual_size,
+            'apparent_size': self.apparent_size,
+            'allocated_size': self.allocated_size,
+            'cluster_size': self.cluster_size,
+            'allocated_clusters': self.allocated_clusters,
+            'total_clusters': self.total_clusters,
+            'dirty': self.dirty,
+            'corrupt': self.corrupt,
+            'snapshot_count': self.snapshot_count,
+            'backing_chain': self.backing_chain,
+            'source': self.source
+        }
+
+
+class DiskInspector:
+    """虚拟磁盘检查器（结果按 mtime 和文件大小缓存）"""
+
+    def __init__(self, qemu_img: str = 'qemu-img', timeout: int = 30):
+        self.qemu_img = qemu_img
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._cache: Dict[str, tuple] = {}  # 路径 -> ((mtime_ns, st_size), DiskImageInfo)
+        self._qemu_img_available = None
+
+    @timed("disk_inspector.inspect")
+    def inspect(self, path: str) -> Optional[DiskImageInfo]:
+        """
+        获取磁盘镜像信息
+
+        Args:
+            path: 磁盘文件路径
+
+        Returns:
+            磁盘信息，文件不存在时返回None
+        """
+        return self._inspect(path, frozenset())
+
+    def _inspect(self, path: str, seen: frozenset) -> Optional[DiskImageInfo]:
+        """inspect 的实现，seen 为后端链中已经检查过的文件（用于发现循环引用）"""
+        if not path:
+            return None
+        path = os.path.abspath(os.path.expanduser(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        info = self._inspect_native(path, seen) or self._inspect_with_qemu_img(path) or self._inspect_with_stat(path)
+        with self._lock:
+            self._cache[path] = (key, info)
+        return info
+
+    def invalidate(self, path: str = None):
+        """清除缓存（path为None时清除全部）"""
+        with self._lock:
+            if path is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(os.path.abspath(os.path.expanduser(path)), None)
+
+    def _inspect_with_qemu_img(self, path: str) -> Optional[DiskImageInfo]:
+        """通过一次 qemu-img info --backing-chain 调用获取完整信息"""
+        if self._qemu_img_available is False:
+            return None
+        try:
+            result = subprocess.run(
+                [self.qemu_img, 'info', '--output=json', '--backing-chain', '-U', path],
+                capture_output=True, text=True, timeout=self.timeout
+            )
+        except FileNotFoundError:
+            self._qemu_img_available = False
+            return None
+        except subprocess.TimeoutExpired:
+            print(f"获取磁盘信息超时: {path}")
+            return None
+        self._qemu_img_available = True
+
+        if result.returncode != 0:
+            print(f"获取磁盘信息失败: {result.stderr.strip()}")
+            return None
+        try:
+            chain = json.loads(result.stdout)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(chain, dict):
+            chain = [chain]
+        if not chain:
+            return None
+
+        top = chain[0]
+        info = self._stat_sizes(path)
+        info.source = 'qemu-img'
+        info.format = top.get('format', 'raw')
+        info.virtual_size = top.get('virtual-size', info.apparent_size)
+        info.cluster_size = top.get('cluster-size', 0) if info.format == 'qcow2' else 0
+        info.dirty = bool(top.get('dirty-flag', False))
+        specific = top.get('format-specific', {}).get('data', {})
+        info.corrupt = bool(specific.get('corrupt', False))
+        info.snapshot_count = len(top.get('snapshots', []))
+
+        for item in chain[1:]:
+            info.backing_chain.append({
+                'path': item.get('filename', ''),
+                'format': item.get('format', ''),
+                'virtual_size': item.get('virtual-size', 0),
+                'allocated_size': item.get('actual-size', 0)
+            })
+        return info
+
+    def _inspect_native(self, path: str, seen: frozenset = frozenset()) -> Optional[DiskImageInfo]:
+        """qcow2镜像直接解析头部，不启动子进程；后端链出现循环时在重复的文件处停止"""
+        if not is_qcow2(path):
+            return None
+        try:
+            with Qcow2Image(path) as image:
+                header = image.header
+                info = self._stat_sizes(path)
+                info.source = 'native'
+                info.format = 'qcow2'
+                info.virtual_size = header.virtual_size
+                info.cluster_size = header.cluster_size
+                info.dirty = header.dirty
+                info.corrupt = header.corrupt
+                info.snapshot_count = header.nb_snapshots
+                backing_path = image.resolve_backing_path()
+        except (OSError, Qcow2Error) as e:
+            print(f"解析qcow2镜像失败: {path}: {e}")
+            return None
+
+        seen = seen | {path}
+        if backing_path and os.path.abspath(backing_path) in seen:
+            print(f"镜像后端链存在循环引用: {path} -> {backing_path}")
+            info.backing_chain = [{'path': backing_path, 'format': '', 'virtual_size': 0, 'allocated_size': 0}]
+        elif backing_path:
+            backing = self._inspect(backing_path, seen)
+            if backing:
+                info.backing_chain = [{
+                    'path': backing.path,
+                    'format': backing.format,
+                    'virtual_size': backing.virtual_size,
+                    'allocated_size': backing.allocated_size
+                }] + backing.backing_chain
+            else:
+                info.backing_chain = [{'path': backing_path, 'format': '', 'virtual_size': 0, 'allocated_size': 0}]
+        return info
+
+    def _inspect_with_stat(self, path: str) -> DiskImageInfo:
+        """qemu-img 不可用时的回退: 按raw镜像处理"""
+        info = self._stat_sizes(path)
+        info.virtual_size = info.apparent_size
+        return info
+
+    @staticmethod
+    def _stat_sizes(path: str) -> DiskImageInfo:
+        """通过stat获取文件长度和实际占用"""
+        st = os.stat(path)
+        allocated = getattr(st, 'st_blocks', None)
+        return DiskImageInfo(
+            path=path,
+            apparent_size=st.st_size,
+            allocated_size=allocated * 512 if allocated is not None else st.st_size
+        )
+
+
+# 全局磁盘检查器实例
+disk_inspector = DiskInspector()
+
+
+def get_disk_inspector() -> DiskInspector:
+    """获取磁盘检查器实例"""
+    return disk_inspector
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘操作任务队列
+在后台运行 qemu-img 等耗时磁盘操作，限制总并发和每个块设备的并发，
+解析 -p 进度输出并通过信号通知界面，支持优先级和取消。
+不能用单条命令表示的任务（如通过QMP执行的块任务）可以提交 runner 函数。
+"""
+
+import heapq
+import itertools
+import os
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from ltwin_manager.utils.disk_stats import resolve_block_device
+
+
+# qemu-img -p 输出形如 "    (12.34/100%)\r"
+PROGRESS_PATTERN = re.compile(r'\((\d+(?:\.\d+)?)/100%\)')
+
+JOB_STATUS_NAMES = {
+    'queued': '排队中',
+    'running': '运行中',
+    'completed': '已完成',
+    'failed': '失败',
+    'cancelled': '已取消'
+}
+
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+
+@dataclass
+class DiskJob:
+    """磁盘操作任务"""
+    id: str
+    kind: str  # create / resize / convert 等
+    description: str
+    cmd: List[str]
+    target_path: str = ""
+    priority: int = PRIORITY_NORMAL  # 越大越优先
+    device: str = ""  # 目标所在块设备
+    status: str = "queued"
+    progress: float = -1.0  # 0-100，-1表示命令不报告进度
+    created_at: float = field(default_factory=time.time)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    message: str = ""
+    remove_target_on_failure: bool = False  # 失败或取消时删除不完整的目标文件（只删除任务自己创建的）
+    target_existed: bool = False  # 任务开始时目标文件是否已经存在
+    on_success: Optional[Callable[['DiskJob'], Optional[str]]] = None  # 在任务线程中调用，可返回完成信息
+    runner: Optional[Callable[['DiskJob'], Optional[str]]] = None  # 代替 cmd 在任务线程中执行，失败时抛出异常
+    process: Optional[subprocess.Popen] = field(default=None, repr=False)
+
+    @property
+    def elapsed(self) -> float:
+        """已运行时长（秒）"""
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def to_dict(self) -> Dict:
+        """转换为字典（供界面显示）"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'target_path': self.target_path,
+            'priority': self.priority,
+            'device': self.device,
+            'status': self.status,
+            'status_name': JOB_STATUS_NAMES.get(self.status, self.status),
+            'progress': self.progress,
+            'elapsed': round(self.elapsed, 1),
+            'message': self.message
+        }
+
+
+class DiskJobQueue(QObject):
+    """
+    磁盘操作任务队列
+
+    单例，不依附于任何对话框，关闭对话框后任务继续运行。必须在GUI线程中创建。
+    """
+
+    job_added = pyqtSignal(dict)  # 任务信息
+    job_updated = pyqtSignal(dict)  # 状态或进度变化后的任务信息
+    job_finished = pyqtSignal(str, bool, str)  # (任务ID, 是否成功, 信息)
+
+    def __init__(self, max_concurrent: int = 2, per_device_limit: int = 1, history_limit: int = 100):
+        super().__init__()
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_device_limit = max(1, per_device_limit)
+        self.history_limit = history_limit
+        self._lock = threading.Lock()
+        self._queue: List[tuple] = []  # 堆: (-优先级, 序号, 任务)
+        self._sequence = itertools.count()
+        self._jobs: Dict[str, DiskJob] = {}  # 任务ID -> 任务（按提交顺序）
+        self._running_by_device: Dict[str, int] = {}
+        self._running = 0
+
+    def submit(self, kind: str, description: str, cmd: List[str], target_path: str = "",
+               priority: int = PRIORITY_NORMAL, remove_target_on_failure: bool = False,
+               on_success: Optional[Callable[[DiskJob], Optional[str]]] = None,
+               runner: Optional[Callable[[DiskJob], Optional[str]]] = None) -> str:
+        """
+        提交任务
+
+        Args:
+            kind: 任务类型
+            description: 显示用描述
+            cmd: 要执行的命令
+            target_path: 目标文件路径（用于确定所在设备）
+            priority: 优先级，越大越先执行
+            remove_target_on_failure: 失败或取消时是否删除目标文件（任务开始时已存在的文件不会被删除）
+            on_success: 成功后在任务线程中执行的回调，返回的字符串作为完成信息
+            runner: 代替 cmd 执行的函数，可用 run_command/update_progress 执行命令和报告进度，
+                    应在 job.status 变为 cancelled 后尽快返回
+
+        Returns:
+            任务ID
+        """
+        job_id = f"{kind}_{int(time.time() * 1000)}_{next(self._sequence)}"
+        device = ""
+        if target_path:
+            device = resolve_block_device(os.path.dirname(os.path.abspath(target_path))) or ""
+        job = DiskJob(
+            id=job_id, kind=kind, description=description, cmd=list(cmd),
+            target_path=target_path, priority=priority, device=device,
+            progress=0.0 if '-p' in cmd or runner else -1.0,
+            remove_target_on_failure=remove_target_on_failure, on_success=on_success, runner=runner
+        )
+        with self._lock:
+            self._jobs[job_id] = job
+            heapq.heappush(self._queue, (-priority, next(self._sequence), job))
+            self._trim_history()
+        self.job_added.emit(job.to_dict())
+        self._dispatch()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的任务"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished:
+                return False
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+                job.message = "已取消"
+                self._queue = [item for item in self._queue if item[2] is not job]
+                heapq.heapify(self._queue)
+                queued_cancel = True
+            else:
+                job.status = 'cancelled'
+                process = job.process
+                queued_cancel = False
+
+        if queued_cancel:
+            self.job_updated.emit(job.to_dict())
+            self.job_finished.emit(job_id, False, job.message)
+            return True
+
+        if process and process.poll() is None:
+            process.terminate()
+        return True
+
+    def set_priority(self, job_id: str, priority: int) -> bool:
+        """调整排队中任务的优先级"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            job.priority = priority
+            self._queue = [(-item[2].priority, item[1], item[2]) for item in self._queue]
+            heapq.heapify(self._queue)
+        self.job_updated.emit(job.to_dict())
+        return True
+
+    def update_progress(self, job: DiskJob, progress: float):
+        """runner 报告进度（0-100）"""
+        job.progress = progress
+        self.job_updated.emit(job.to_dict())
+
+    def jobs(self) -> List[Dict]:
+        """获取所有任务信息（按提交顺序）"""
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """获取单个任务信息"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def active_count(self) -> int:
+        """排队中和运行中的任务数"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.is_finished)
+
+    def clear_finished(self):
+        """清除已结束的任务记录"""
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.is_finished]:
+                del self._jobs[job_id]
+
+    def cancel_all(self):
+        """取消所有未完成的任务（退出程序时调用）"""
+        with self._lock:
+            pending = [job_id for job_id, job in self._jobs.items() if not job.is_finished]
+        for job_id in pending:
+            self.cancel(job_id)
+
+    def _trim_history(self):
+        """限制已结束任务记录的数量（需持有锁）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - self.history_limit)]:
+            del self._jobs[job_id]
+
+    def _dispatch(self):
+        """按优先级启动满足并发限制的任务"""
+        to_start = []
+        with self._lock:
+            deferred = []
+            while self._queue and self._running < self.max_concurrent:
+                item = heapq.heappop(self._queue)
+                job = item[2]
+                if self._running_by_device.get(job.device, 0) >= self.per_device_limit:
+                    deferred.append(item)  # 该设备已满，先让其他设备上的任务执行
+                    continue
+                job.status = 'running'
+                job.started_at = time.time()
+                self._running += 1
+                self._running_by_device[job.device] = self._running_by_device.get(job.device, 0) + 1
+                to_start.append(job)
+            for item in deferred:
+                heapq.heappush(self._queue, item)
+
+        for job in to_start:
+            self.job_updated.emit(job.to_dict())
+            threading.Thread(target=self._run_job, args=(job,), name=f"DiskJob-{job.id}", daemon=True).start()
+
+    def _run_job(self, job: DiskJob):
+        """在任务线程中执行命令并解析进度"""
+        success = False
+        message = ""
+        job.target_existed = bool(job.target_path) and os.path.exists(job.target_path)
+        try:
+            if job.runner:
+                message = job.runner(job) or ""
+                returncode, stderr = 0, ""
+            else:
+                returncode, stderr = self.run_command(job, job.cmd)
+
+            if job.status == 'cancelled':
+                message = "已取消"
+            elif returncode == 0:
+                message = message or f"完成，耗时 {job.elapsed:.1f} 秒"
+                if job.on_success:
+                    message = job.on_success(job) or message
+                success = True
+            else:
+                message = stderr.strip() or f"命令返回 {returncode}"
+        except Exception as e:
+            message = str(e)
+
+        if not success and job.remove_target_on_failure and job.target_path and not job.target_existed:
+            try:
+                if os.path.exists(job.target_path):
+                    os.remove(job.target_path)
+            except OSError as e:
+                print(f"删除不完整的目标文件失败: {e}")
+
+        with self._lock:
+            if job.status != 'cancelled':
+                job.status = 'completed' if success else 'failed'
+            if success:
+                job.progress = 100.0
+            job.finished_at = time.time()
+            job.message = message
+            job.process = None
+            self._running -= 1
+            self._running_by_device[job.device] -= 1
+
+        self.job_updated.emit(job.to_dict())
+        self.job_finished.emit(job.id, success, message)
+        self._dispatch()
+
+    def run_command(self, job: DiskJob, cmd: List[str]) -> Tuple[int, str]:
+        """
+        在任务线程中执行命令（可取消），解析 -p 进度
+
+        Returns:
+            (返回码, 标准错误输出)
+        """
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        with self._lock:
+            job.process = process
+            cancelled_early = job.status == 'cancelled'
+        if cancelled_early:
+            process.terminate()
+
+        stderr_chunks = []
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True
+        )
+        stderr_thread.start()
+        self._read_progress(job, process.stdout)
+        process.wait()
+        stderr_thread.join(timeout=5)
+        with self._lock:
+            job.process = None
+        stderr = b"".join(chunk for chunk in stderr_chunks if chunk).decode('utf-8', errors='replace')
+        return process.returncode, stderr
+
+    def _read_progress(self, job: DiskJob, stream):
+        """读取 qemu-img -p 输出（以 \\r 分隔）并节流发送进度"""
+        buffer = b""
+        last_emitted = -1.0
+        while True:
+            chunk = stream.read1(4096) if hasattr(stream, 'read1') else stream.read(4096)
+            if not chunk:
+                break
+            buffer += chunk
+            *lines, buffer = re.split(rb'[\r\n]', buffer)
+            for line in reversed(lines):
+                match = PROGRESS_PATTERN.search(line.decode('ascii', errors='ignore'))
+                if match:
+                    job.progress = float(match.group(1))
+                    break
+            if job.progress >= 0 and job.progress - last_emitted >= 0.5:
+                last_emitted = job.progress
+                self.job_updated.emit(job.to_dict())
+
+
+# 全局任务队列实例
+disk_job_queue = None
+
+
+def get_disk_job_queue(config_manager) -> DiskJobQueue:
+    """获取磁盘任务队列实例（首次调用必须在GUI线程中）"""
+    global disk_job_queue
+    if disk_job_queue is None:
+        disk_job_queue = DiskJobQueue(
+            max_concurrent=config_manager.get_global_config("disk_job_max_concurrent") or 2,
+            per_device_limit=config_manager.get_global_config("disk_job_per_device_limit") or 1
+        )
+    return disk_job_queue
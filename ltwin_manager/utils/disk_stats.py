@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘IO统计采样器
+基于 /proc/diskstats 的增量计算IOPS、吞吐量、平均延迟和队列深度
+"""
+
+import os
+import threading
+import time
+import psutil
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from dataclasses import dataclass
+
+
+DISKSTATS_PATH = "/proc/diskstats"
+SECTOR_SIZE = 512  # /proc/diskstats 中的扇区固定为512字节
+
+
+@dataclass
+class DiskCounters:
+    """单个块设备的累计计数"""
+    reads: int
+    read_sectors: int
+    read_ms: int
+    writes: int
+    write_sectors: int
+    write_ms: int
+    in_flight: int
+    io_ms: int
+    weighted_ms: int
+
+
+def read_diskstats() -> Dict[str, DiskCounters]:
+    """读取 /proc/diskstats，返回 {设备名: 累计计数}"""
+    counters = {}
+    try:
+        with open(DISKSTATS_PATH, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 14:
+                    continue
+                counters[fields[2]] = DiskCounters(
+                    reads=int(fields[3]),
+                    read_sectors=int(fields[5]),
+                    read_ms=int(fields[6]),
+                    writes=int(fields[7]),
+                    write_sectors=int(fields[9]),
+                    write_ms=int(fields[10]),
+                    in_flight=int(fields[11]),
+                    io_ms=int(fields[12]),
+                    weighted_ms=int(fields[13])
+                )
+    except OSError:
+        return {}
+    return counters
+
+
+def _existing_path(path: str) -> Optional[Path]:
+    """返回路径本身或其最近的已存在父目录"""
+    path_obj = Path(path).expanduser()
+    for candidate in [path_obj, *path_obj.parents]:
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def resolve_block_device(path: str) -> Optional[str]:
+    """
+    解析路径所在的块设备名称（与 /proc/diskstats 中的名称一致）
+
+    Args:
+        path: 文件或目录路径
+
+    Returns:
+        设备名称，如 'sda2'、'nvme0n1p1'、'dm-0'；无法解析时返回None
+    """
+    existing = _existing_path(path)
+    if existing is None:
+        return None
+
+    # 优先通过设备号查找 /sys/dev/block/<major>:<minor>
+    try:
+        st_dev = existing.stat().st_dev
+        major, minor = os.major(st_dev), os.minor(st_dev)
+        sys_link = Path(f"/sys/dev/block/{major}:{minor}")
+        if major != 0 and sys_link.exists():
+            return Path(os.path.realpath(sys_link)).name
+    except (OSError, AttributeError):
+        pass
+
+    # btrfs/overlay 等使用匿名设备号，退回到按最长挂载点匹配
+    best_mount = ""
+    best_device = None
+    resolved = str(existing.resolve())
+    for partition in psutil.disk_partitions(all=False):
+        mountpoint = partition.mountpoint
+        if resolved == mountpoint or resolved.startswith(mountpoint.rstrip(os.sep) + os.sep):
+            if len(mountpoint) > len(best_mount) and partition.device.startswith('/dev/'):
+                best_mount = mountpoint
+                best_device = Path(os.path.realpath(partition.device)).name
+    return best_device
+
+
+def block_device_parent(device: str) -> str:
+    """
+    获取块设备对应的物理磁盘名称
+
+    分区返回所在磁盘（sda2 -> sda），device-mapper/md 设备返回第一个底层设备的磁盘，
+    其他设备原样返回。
+    """
+    sys_path = Path("/sys/class/block") / device
+    try:
+        if (sys_path / "partition").exists():
+            return Path(os.path.realpath(sys_path)).parent.name
+        slaves = sorted((sys_path / "slaves").iterdir()) if (sys_path / "slaves").is_dir() else []
+        if slaves:
+            return block_device_parent(slaves[0].name)
+    except OSError:
+        pass
+    return device
+
+
+def get_device_class(path: str) -> str:
+    """
+    判断路径所在存储设备的类型
+
+    Returns:
+        'nvme'、'ssd'、'hdd'、'network' 或 'unknown'
+    """
+    existing = _existing_path(path)
+    if existing is None:
+        return 'unknown'
+
+    # 网络文件系统没有对应的本地块设备
+    resolved = str(existing.resolve())
+    best_mount, best_fstype = "", ""
+    for partition in psutil.disk_partitions(all=True):
+        mountpoint = partition.mountpoint
+        if resolved == mountpoint or resolved.startswith(mountpoint.rstrip(os.sep) + os.sep):
+            if len(mountpoint) > len(best_mount):
+                best_mount, best_fstype = mountpoint, partition.fstype
+    if best_fstype in ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'glusterfs', 'ceph', 'fuse.sshfs'):
+        return 'network'
+
+    device = resolve_block_device(str(existing))
+    if not device:
+        return 'unknown'
+    disk = block_device_parent(device)
+    if disk.startswith('nvme'):
+        return 'nvme'
+    try:
+        with open(f"/sys/block/{disk}/queue/rotational", 'r') as f:
+            return 'hdd' if f.read().strip() == '1' else 'ssd'
+    except OSError:
+        return 'unknown'
+
+
+class DiskStatsSampler:
+    """按设备计算磁盘IO速率"""
+
+    def __init__(self):
+        self._last_counters: Dict[str, DiskCounters] = {}
+        self._last_timestamp: Optional[float] = None
+        self._device_cache: Dict[Tuple[str, int], Optional[str]] = {}
+        self._lock = threading.Lock()  # 同一个采样器可能被GUI线程和后台线程同时使用
+
+    @staticmethod
+    def is_supported() -> bool:
+        """当前系统是否提供 /proc/diskstats"""
+        return os.path.exists(DISKSTATS_PATH)
+
+    def device_for_path(self, path: str) -> Optional[str]:
+        """获取路径所在设备（按路径和设备号缓存）"""
+        existing = _existing_path(path)
+        if existing is None:
+            return None
+        try:
+            key = (str(existing), existing.stat().st_dev)
+        except OSError:
+            return None
+        with self._lock:
+            if key in self._device_cache:
+                return self._device_cache[key]
+        device = resolve_block_device(str(existing))
+        with self._lock:
+            self._device_cache[key] = device
+        return device
+
+    def sample(self, role_paths: Dict[str, str]) -> Dict[str, Dict]:
+        """
+        采样指定用途路径所在设备的IO速率
+
+        Args:
+            role_paths: {用途: 路径}，如 {'vm_storage': '/data/vms', 'snapshots': '/data/snaps'}
+
+        Returns:
+            {设备名: 指标字典}，第一次采样时没有基线，返回空字典
+        """
+        if not self.is_supported():
+            return {}
+
+        roles_by_device: Dict[str, list] = {}
+        for role, path in role_paths.items():
+            if not path:
+                continue
+            device = self.device_for_path(path)
+            if device:
+                roles_by_device.setdefault(device, []).append(role)
+
+        with self._lock:
+            now = time.monotonic()
+            counters = read_diskstats()
+            last_counters, last_timestamp = self._last_counters, self._last_timestamp
+            self._last_counters, self._last_timestamp = counters, now
+
+        if last_timestamp is None:
+            return {}
+
+        elapsed = now - last_timestamp
+        if elapsed <= 0:
+            return {}
+
+        metrics = {}
+        for device, roles in roles_by_device.items():
+            current, previous = counters.get(device), last_counters.get(device)
+            if current is None or previous is None:
+                continue
+            metrics[device] = self._compute_rates(current, previous, elapsed)
+            metrics[device]['roles'] = ",".join(sorted(roles))
+        return metrics
+
+    @staticmethod
+    def _compute_rates(current: DiskCounters, previous: DiskCounters, elapsed: float) -> Dict:
+        """根据两次累计计数计算速率指标"""
+        reads = max(current.reads - previous.reads, 0)
+        writes = max(current.writes - previous.writes, 0)
+        read_bytes = max(current.read_sectors - previous.read_sectors, 0) * SECTOR_SIZE
+        write_bytes = max(current.write_sectors - previous.write_sectors, 0) * SECTOR_SIZE
+        read_ms = max(current.read_ms - previous.read_ms, 0)
+        write_ms = max(current.write_ms - previous.write_ms, 0)
+        io_ms = max(current.io_ms - previous.io_ms, 0)
+        weighted_ms = max(current.weighted_ms - previous.weighted_ms, 0)
+        elapsed_ms = elapsed * 1000
+        total_ios = reads + writes
+
+        return {
+            'read_iops': round(reads / elapsed, 1),
+            'write_iops': round(writes / elapsed, 1),
+            'read_mb_s': round(read_bytes / elapsed / (1024**2), 2),
+            'write_mb_s': round(write_bytes / elapsed / (1024**2), 2),
+            'read_latency_ms': round(read_ms / reads, 2) if reads else 0.0,
+            'write_latency_ms': round(write_ms / writes, 2) if writes else 0.0,
+            'await_ms': round((read_ms + write_ms) / total_ios, 2) if total_ios else 0.0,
+            'queue_depth': round(weighted_ms / elapsed_ms, 2),
+            'util_percent': round(min(io_ms / elapsed_ms * 100, 100.0), 1),
+            'in_flight': current.in_flight
+        }
+
+
+def check_disk_alerts(device_metrics: Dict[str, Dict], thresholds: Dict) -> Dict[str, str]:
+    """
+    根据阈值检查设备IO告警
+
+    Args:
+        device_metrics: sample() 的返回值
+        thresholds: {'latency_ms': ..., 'util_percent': ..., 'queue_depth': ...}
+
+    Returns:
+        {设备名: 告警信息}，无告警的设备不包含在内
+    """
+    alerts = {}
+    for device, metrics in device_metrics.items():
+        reasons = []
+        if metrics['await_ms'] >= thresholds.get('latency_ms', float('inf')):
+            reasons.append(f"平均延迟 {metrics['await_ms']:.1f}ms")
+        if metrics['util_percent'] >= thresholds.get('util_percent', float('inf')):
+            reasons.append(f"利用率 {metrics['util_percent']:.0f}%")
+        if metrics['queue_depth'] >= thresholds.get('queue_depth', float('inf')):
+            reasons.append(f"队列深度 {metrics['queue_depth']:.1f}")
+        if reasons:
+            alerts[device] = f"{device} ({metrics.get('roles', '')}) IO饱和: " + "，".join(reasons)
+    return alerts
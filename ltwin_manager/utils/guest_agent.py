@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+qemu-guest-agent 客户端
+虚拟机启动时通过 virtio-serial 端口 org.qemu.guest_agent.0 接出一个 unix socket，
+客户机中运行 qemu-guest-agent 后即可执行 guest-* 命令。
+FilesystemFreeze 在快照等操作前冻结客户机文件系统（刷写并阻塞写入），操作后立即解冻，
+超过最长冻结时间时由计时线程强制解冻。
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ltwin_manager.utils.profiler import get_timing_registry
+
+GUEST_AGENT_PORT = 'org.qemu.guest_agent.0'
+FSFREEZE_MODES = {'off', 'try', 'require'}  # 不冻结 / 冻结失败时继续（崩溃一致）/ 冻结失败时放弃操作
+FSFREEZE_MODE_NAMES = {
+    'off': '不冻结',
+    'try': '尽量冻结',
+    'require': '必须冻结',
+}
+
+
+class GuestAgentError(Exception):
+    """客户机代理不可用、命令返回错误或超时"""
+    pass
+
+
+def guest_agent_socket_path(vm_name: str) -> Path:
+    """虚拟机的客户机代理 socket 路径（与QMP socket在同一目录）"""
+    return Path.home() / '.ltwin' / 'run' / f"{vm_name}.qga"
+
+
+def guest_agent_command_args(vm_name: str) -> List[str]:
+    """启动QEMU时添加的客户机代理通道参数（同时创建socket目录）"""
+    path = guest_agent_socket_path(vm_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return [
+        '-chardev', f'socket,path={path},server=on,wait=off,id=qga0',
+        '-device', 'virtio-serial',
+        '-device', f'virtserialport,chardev=qga0,name={GUEST_AGENT_PORT}'
+    ]
+
+
+class GuestAgentClient:
+    """
+    客户机代理客户端（同步，每行一个JSON消息）
+
+    代理没有问候消息，通道上可能残留上一个客户端未读完的响应，
+    连接后先用 guest-sync-delimited 同步；命令超时后下一条命令前会重新同步。
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 5.0):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self._buffer = b''
+        self._desynced = False
+
+    @classmethod
+    def for_vm(cls, vm_name: str, timeout: float = 5.0) -> 'GuestAgentClient':
+        """按虚拟机名称创建客户端"""
+        return cls(guest_agent_socket_path(vm_name), timeout)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        """连接并同步"""
+        if not os.path.exists(self.socket_path):
+            raise GuestAgentError(f"客户机代理socket不存在（虚拟机未运行或启动时未启用代理通道）: {self.socket_path}")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(self.socket_path)
+        except OSError as e:
+            self.close()
+            raise GuestAgentError(f"连接客户机代理失败: {e}")
+        try:
+            self.sync()
+        except GuestAgentError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+                self._buffer = b''
+
+    def sync(self):
+        """丢弃通道中的残留数据：响应前有一个 0xFF 分隔字节，之后第一个 return 等于同步ID的消息即为本次响应"""
+        sync_id = random.randint(1, 2**31 - 1)
+        self._send('guest-sync-delimited', {'id': sync_id})
+        try:
+            while True:
+                while b'\xff' in self._buffer:
+                    self._buffer = self._buffer.split(b'\xff', 1)[1]
+                if b'\n' not in self._buffer:
+                    self._recv()
+                    continue
+                line, self._buffer = self._buffer.split(b'\n', 1)
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(message, dict) and message.get('return') == sync_id:
+                    self._desynced = False
+                    return
+        except socket.timeout:
+            self._desynced = True
+            raise GuestAgentError("客户机代理无响应（客户机中是否运行了 qemu-guest-agent？）")
+        except OSError as e:
+            raise GuestAgentError(f"guest-sync-delimited: {e}")
+
+    def _send(self, command: str, arguments: Dict = None):
+        message = {'execute': command}
+        if arguments:
+            message['arguments'] = arguments
+        self.sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise GuestAgentError("客户机代理连接已关闭")
+        self._buffer += data
+
+    def execute(self, command: str, arguments: Dict = None, timeout: float = None) -> Any:
+        """
+        执行代理命令并返回 return 字段
+
+        Args:
+            timeout: 本条命令的超时（秒），默认使用客户端超时
+
+        Raises:
+            GuestAgentError: 命令返回错误、超时或连接断开
+        """
+        if self.sock is None:
+            raise GuestAgentError("客户机代理未连接")
+        if self._desynced:
+            self.sync()
+        self.sock.settimeout(timeout or self.timeout)
+        try:
+            self._send(command, arguments)
+            while True:
+                if b'\n' not in self._buffer:
+                    self._recv()
+                    continue
+                line, self._buffer = self._buffer.split(b'\n', 1)
+                line = line.strip(b'\xff \r\t')
+                if not line:
+                    continue
+                response = json.loads(line)
+                if 'error' in response:
+                    error = response['error']
+                    raise GuestAgentError(f"{command}: {error.get('class', '')} {error.get('desc', '')}".strip())
+                return response.get('return')
+        except socket.timeout:
+            self._desynced = True
+            raise GuestAgentError(f"{command}: 等待客户机代理响应超时")
+        except (OSError, ValueError) as e:
+            raise GuestAgentError(f"{command}: {e}")
+        finally:
+            if self.sock is not None:
+                self.sock.settimeout(self.timeout)
+
+    def ping(self):
+        """检查代理是否在运行"""
+        self.execute('guest-ping')
+
+    def fsfreeze_status(self) -> str:
+        """文件系统冻结状态（thawed / frozen）"""
+        return self.execute('guest-fsfreeze-status')
+
+    def fsfreeze_freeze(self, timeout: float = None) -> int:
+        """冻结所有可冻结的文件系统，返回冻结的文件系统个数"""
+        return self.execute('guest-fsfreeze-freeze', timeout=timeout)
+
+    def fsfreeze_thaw(self, timeout: float = None) -> int:
+        """解冻文件系统，返回解冻的文件系统个数"""
+        return self.execute('guest-fsfreeze-thaw', timeout=timeout)
+
+
+def guest_agent_available(vm_name: str, timeout: float = 1.0) -> bool:
+    """客户机代理是否可用（socket存在且代理响应 guest-ping）"""
+    try:
+        with GuestAgentClient.for_vm(vm_name, timeout) as client:
+            client.ping()
+        return True
+    except GuestAgentError:
+        return False
+
+
+@dataclass
+class FreezeResult:
+    """一次文件系统冻结的结果和耗时"""
+    mode: str = 'off'
+    frozen: bool = False  # 是否成功冻结过
+    filesystems: int = 0
+    freeze_ms: float = 0.0  # guest-fsfreeze-freeze 耗时（客户机刷写脏数据）
+    frozen_ms: float = 0.0  # 冻结完成到解冻完成，客户机写入被阻塞的时长
+    thaw_ms: float = 0.0
+    timed_out: bool = False  # 超过最长冻结时间被强制解冻
+    error: str = ''
+
+    def to_dict(self) -> Dict:
+        """转换为字典（保存到快照元数据）"""
+        return {key: round(value, 1) if isinstance(value, float) else value for key, value in asdict(self).items()}
+
+
+class FilesystemFreeze:
+    """
+    在一段操作期间冻结客户机文件系统
+
+    用法:
+        with FilesystemFreeze(vm_name, 'try') as result:
+            ...  # 只放需要一致性的最短操作，例如切换覆盖层的QMP事务
+        result.frozen_ms
+
+    进入前先连接并同步代理，冻结窗口内不做任何连接或准备工作。
+    mode 为 try 时代理不可用或冻结失败只记录错误，操作照常进行（崩溃一致）；为 require 时抛出 GuestAgentError。
+    """
+
+    THAW_ATTEMPTS = 3
+
+    def __init__(self, vm_name: str, mode: str = 'try', freeze_timeout: float = 10.0, max_frozen_ms: float = 2000.0):
+        self.vm_name = vm_name
+        self.mode = mode if mode in FSFREEZE_MODES else 'off'
+        self.freeze_timeout = freeze_timeout
+        self.max_frozen_ms = max_frozen_ms
+        self.result = FreezeResult(mode=self.mode)
+        self._client: Optional[GuestAgentClient] = None
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._frozen_at = 0.0
+        self._is_frozen = False
+
+    def __enter__(self) -> FreezeResult:
+        if self.mode == 'off':
+            return self.result
+        try:
+            self._client = GuestAgentClient.for_vm(self.vm_name, timeout=2.0)
+            self._client.connect()
+            started = time.perf_counter()
+            try:
+                self.result.filesystems = self._client.fsfreeze_freeze(timeout=self.freeze_timeout) or 0
+            except GuestAgentError:
+                # 冻结超时或部分失败时客户机可能已冻结了一部分文件系统
+                self._is_frozen = True
+                self._thaw()
+                raise
+            self.result.freeze_ms = (time.perf_counter() - started) * 1000
+            get_timing_registry().record('guest_agent.fsfreeze_freeze', self.result.freeze_ms)
+        except GuestAgentError as e:
+            self.result.error = str(e)
+            self._close()
+            if self.mode == 'require':
+                raise
+            print(f"冻结 {self.vm_name} 的文件系统失败，继续执行（崩溃一致）: {e}")
+            return self.result
+
+        self.result.frozen = True
+        self._frozen_at = time.perf_counter()
+        self._is_frozen = True
+        self._timer = threading.Timer(self.max_frozen_ms / 1000, self._force_thaw)
+        self._timer.daemon = True
+        self._timer.start()
+        return self.result
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._thaw()
+        self._close()
+        return False
+
+    def _force_thaw(self):
+        """计时线程：超过最长冻结时间时强制解冻"""
+        self.result.timed_out = True
+        print(f"{self.vm_name} 的文件系统冻结超过 {self.max_frozen_ms:.0f} 毫秒，强制解冻")
+        self._thaw()
+
+    def _thaw(self):
+        """解冻（失败时重试，客户机文件系统不能一直处于冻结状态）"""
+        with self._lock:
+            if not self._is_frozen or self._client is None:
+                return
+            started = time.perf_counter()
+            for attempt in range(self.THAW_ATTEMPTS):
+                try:
+                    self._client.fsfreeze_thaw(timeout=self.freeze_timeout)
+                    break
+                except GuestAgentError as e:
+                    self.result.error = str(e)
+                    print(f"解冻 {self.vm_name} 的文件系统失败（第 {attempt + 1} 次）: {e}")
+            self._is_frozen = False
+            now = time.perf_counter()
+            self.result.thaw_ms = (now - started) * 1000
+            if self._frozen_at:
+                self.result.frozen_ms = (now - self._frozen_at) * 1000
+                get_timing_registry().record('guest_agent.frozen_window', self.result.frozen_ms)
+
+    def _close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
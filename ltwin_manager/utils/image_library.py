@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+去重镜像库
+按内容哈希存放ISO和基础磁盘镜像，相同内容只保存一份，新虚拟机以qcow2覆盖层的方式共享基础镜像
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+from ltwin_manager.utils.clone_manager import get_clone_manager
+from ltwin_manager.utils.disk_conversion import detect_image_format, allocated_bytes
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+
+
+CHUNK_SIZE = 8 * 1024 * 1024  # 分块哈希的块大小
+HASH_PREFIX = "sha256-chunked"  # 哈希值 = sha256(文件大小 + 各块sha256)，与块大小相关
+
+# 扫描重复镜像时考虑的文件后缀
+IMAGE_SUFFIXES = ('.iso', '.img', '.raw', '.qcow2', '.vmdk', '.vdi', '.vhdx')
+
+
+class HashCancelled(Exception):
+    """哈希计算被取消"""
+    pass
+
+
+class ChunkedHasher:
+    """
+    多线程分块哈希
+
+    各线程用 os.pread 读取不同的块并计算块哈希（hashlib 计算时释放GIL），
+    同时在途的块数受限，内存占用约为 threads * 2 个块。
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, threads: int = None):
+        self.chunk_size = chunk_size
+        self.threads = threads or min(8, os.cpu_count() or 2)
+
+    def _hash_chunk(self, fd: int, index: int) -> bytes:
+        data = os.pread(fd, self.chunk_size, index * self.chunk_size)
+        return hashlib.sha256(data).digest()
+
+    def hash_file(self, path: str, progress_callback: Optional[Callable[[int, int], None]] = None,
+                  cancel_event: threading.Event = None) -> str:
+        """
+        计算文件内容哈希
+
+        Args:
+            path: 文件路径
+            progress_callback: 进度回调 (已处理字节, 总字节)
+            cancel_event: 设置后中止计算
+
+        Returns:
+            形如 "sha256-chunked:<hex>" 的哈希值
+        """
+        size = os.path.getsize(path)
+        chunk_count = -(-size // self.chunk_size)
+        digests: List[Optional[bytes]] = [None] * chunk_count
+        window = self.threads * 2
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                pending = {}
+                next_index = 0
+                done = 0
+                while done < chunk_count:
+                    while next_index < chunk_count and len(pending) < window:
+                        pending[next_index] = executor.submit(self._hash_chunk, fd, next_index)
+                        next_index += 1
+                    # 按顺序收取最早提交的块，保证内存有界
+                    index = min(pending)
+                    digests[index] = pending.pop(index).result()
+                    done += 1
+                    if cancel_event is not None and cancel_event.is_set():
+                        for future in pending.values():
+                            future.cancel()
+                        raise HashCancelled(path)
+                    if progress_callback:
+                        progress_callback(min(done * self.chunk_size, size), size)
+        finally:
+            os.close(fd)
+
+        tree = hashlib.sha256(size.to_bytes(8, 'little'))
+        for digest in digests:
+            tree.update(digest)
+        return f"{HASH_PREFIX}:{tree.hexdigest()}"
+
+
+class ImageLibrary:
+    """
+    内容寻址镜像库
+
+    镜像文件存放在 <库目录>/<哈希前2位>/<哈希>.<格式>，设为只读；
+    images_config 中每个镜像名记录 content_hash 和库内路径，多个镜像名可以指向同一份内容。
+    """
+
+    def __init__(self, config_manager, hasher: ChunkedHasher = None):
+        self.config_manager = config_manager
+        self.hasher = hasher or ChunkedHasher(
+            threads=config_manager.get_global_config("image_hash_threads") or None
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def library_path(self) -> Path:
+        path_str = self.config_manager.get_global_config("image_library_path")
+        return Path(path_str) if path_str else Path.home() / "ImageLibrary"
+
+    def blob_path(self, content_hash: str, image_format: str) -> Path:
+        """内容哈希对应的库内路径"""
+        digest = content_hash.split(':', 1)[-1]
+        suffix = 'iso' if image_format == 'iso' else image_format
+        return self.library_path / digest[:2] / f"{digest}.{suffix}"
+
+    @staticmethod
+    def _image_type(path: str, image_format: str) -> str:
+        """区分ISO和磁盘镜像"""
+        return 'iso' if image_format == 'raw' and path.lower().endswith('.iso') else 'disk'
+
+    def find_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """按内容哈希查找已入库的镜像"""
+        for config in self.config_manager.images_config.values():
+            if config.get('content_hash') == content_hash and os.path.exists(config.get('path', '')):
+                return config
+        return None
+
+    def import_image(self, source_path: str, name: str = None, remove_source: bool = False,
+                     progress_callback: Optional[Callable[[int, int], None]] = None,
+                     cancel_event: threading.Event = None) -> Dict:
+        """
+        导入镜像
+
+        已有相同内容时只登记新名称，不再复制；否则复制到库目录，
+        删除源文件时改用硬链接（同一文件系统内不复制数据）。带后端文件的qcow2不能直接入库。
+
+        Args:
+            source_path: 源文件
+            name: 镜像名称（默认使用文件名）
+            remove_source: 入库后删除源文件
+            progress_callback: 哈希进度回调 (已处理字节, 总字节)
+            cancel_event: 取消事件
+
+        Returns:
+            镜像配置字典（含 'deduplicated' 表示是否命中已有内容）
+
+        Raises:
+            ValueError: 源文件不存在、名称冲突或镜像带后端文件
+        """
+        source_path = os.path.abspath(source_path)
+        if not os.path.isfile(source_path):
+            raise ValueError(f"镜像文件不存在: {source_path}")
+        name = name or os.path.basename(source_path)
+        if self.config_manager.image_exists(name):
+            raise ValueError(f"镜像名称 '{name}' 已存在")
+
+        image_format = detect_image_format(source_path)
+        if image_format == 'qcow2':
+            try:
+                with Qcow2Image(source_path) as image:
+                    if image.header.backing_file:
+                        raise ValueError(f"镜像带有后端文件，请先转换为独立镜像: {source_path}")
+            except Qcow2Error as e:
+                raise ValueError(f"镜像已损坏: {e}")
+
+        content_hash = self.hasher.hash_file(source_path, progress_callback, cancel_event)
+        image_type = self._image_type(source_path, image_format)
+
+        with self._lock:
+            existing = self.find_by_hash(content_hash)
+            if existing:
+                target = existing['path']
+            else:
+                target = str(self.blob_path(content_hash, 'iso' if image_type == 'iso' else image_format))
+                self._store_blob(source_path, target, remove_source)
+
+            config = {
+                'name': name,
+                'path': target,
+                'type': image_type,
+                'format': image_format,
+                'size': os.path.getsize(target),
+                'content_hash': content_hash,
+                'source_path': source_path,
+                'imported_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+            self.config_manager.set_image_config(name, config)
+
+        if remove_source and os.path.abspath(source_path) != os.path.abspath(target):
+            try:
+                os.remove(source_path)
+            except OSError as e:
+                print(f"删除源文件失败: {e}")
+
+        return dict(config, deduplicated=existing is not None)
+
+    def _store_blob(self, source_path: str, target: str, move: bool):
+        """
+        把内容存入库目录并设为只读
+
+        只有源文件随后会被删除时才硬链接，否则对源文件的修改会改写库中共享的后端镜像
+        """
+        target_path = Path(target)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = target_path.with_name(target_path.name + '.importing')
+        linked = False
+        if move:
+            try:
+                os.link(source_path, temp_path)
+                linked = True
+            except OSError:
+                pass
+        if not linked:
+            shutil.copyfile(source_path, temp_path)
+        os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(temp_path, target_path)
+
+    def remove_image(self, name: str) -> bool:
+        """
+        移除镜像名称；最后一个名称被移除且没有虚拟机磁盘以它为后端时删除库文件
+
+        Raises:
+            ValueError: 仍有虚拟机磁盘以该镜像为后端
+        """
+        config = self.config_manager.get_image_config(name)
+        if not config:
+            return False
+        path = config.get('path', '')
+        others = [other for other_name, other in self.config_manager.images_config.items()
+                  if other_name != name and other.get('path') == path]
+        if not others:
+            users = self.overlay_users(path)
+            if users:
+                raise ValueError(f"以下虚拟机的磁盘以该镜像为后端: {', '.join(users)}")
+        self.config_manager.delete_image_config(name)
+        if not others and path.startswith(str(self.library_path)) and os.path.exists(path):
+            os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+            os.remove(path)
+        return True
+
+    def create_overlay(self, name: str, target_disk: str, vm_name: str = None) -> str:
+        """
+        以库中的磁盘镜像为后端创建虚拟机磁盘（qcow2覆盖层）
+
+        Raises:
+            ValueError: 镜像不存在或不是磁盘镜像
+        """
+        config = self.config_manager.get_image_config(name)
+        if not config or not os.path.exists(config.get('path', '')):
+            raise ValueError(f"镜像 '{name}' 不存在")
+        if config.get('type') == 'iso':
+            raise ValueError(f"镜像 '{name}' 是ISO文件，不能作为磁盘后端")
+
+        capacity_planner = get_capacity_planner(self.config_manager)
+        capacity_planner.enforce(target_disk, self._virtual_size(config['path']))
+        get_clone_manager(self.config_manager)._linked_clone(config['path'], target_disk)
+        capacity_planner.register(target_disk, 'disk', vm_name)
+        return target_disk
+
+    @staticmethod
+    def _virtual_size(path: str) -> int:
+        if is_qcow2(path):
+            try:
+                with Qcow2Image(path) as image:
+                    return image.header.virtual_size
+            except (OSError, Qcow2Error):
+                pass
+        return os.path.getsize(path)
+
+    def overlay_users(self, blob_path: str) -> List[str]:
+        """
+        使用指定库文件的虚拟机列表
+
+        检查每台虚拟机所有磁盘的整条后端链和快照文件的后端链：创建外部快照后虚拟机的当前磁盘是
+        覆盖层的覆盖层，库文件不再是它的直接后端
+        """
+        return self._blob_users([blob_path]).get(os.path.abspath(blob_path), [])
+
+    def _blob_users(self, blob_paths: List[str]) -> Dict[str, List[str]]:
+        """{库文件绝对路径: 使用它的虚拟机}，没有使用者的库文件不包含在内"""
+        users = get_chain_maintenance(self.config_manager).chain_users(blob_paths)
+        return {path: sorted(vm_names) for path, vm_names in users.items()}
+
+    def list_entries(self) -> List[Dict]:
+        """按库文件汇总：每份内容的名称、引用它的虚拟机和大小"""
+        blobs: Dict[str, Dict] = {}
+        for name, config in self.config_manager.images_config.items():
+            path = config.get('path', '')
+            if not config.get('content_hash'):
+                continue
+            entry = blobs.setdefault(path, {
+                'path': path,
+                'content_hash': config['content_hash'],
+                'type': config.get('type', 'disk'),
+                'format': config.get('format', ''),
+                'size': allocated_bytes(path),
+                'names': [],
+                'vms': []
+            })
+            entry['names'].append(name)
+        users = self._blob_users([path for path, entry in blobs.items() if entry['type'] != 'iso'])
+        for path, entry in blobs.items():
+            if entry['type'] != 'iso':
+                entry['vms'] = users.get(os.path.abspath(path), [])
+        return list(blobs.values())
+
+    def dedup_report(self) -> Dict:
+        """
+        去重节省统计
+
+        逻辑占用 = 每个镜像名和每台共享基础镜像的虚拟机各自保存一份时的大小，
+        实际占用 = 库中每份内容只算一次。
+        """
+        entries = self.list_entries()
+        stored = sum(entry['size'] for entry in entries)
+        logical = sum(entry['size'] * (len(entry['names']) + len(entry['vms'])) for entry in entries)
+        saved = logical - stored
+        return {
+            'unique_images': len(entries),
+            'names': sum(len(entry['names']) for entry in entries),
+            'overlay_vms': sum(len(entry['vms']) for entry in entries),
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'saved_bytes': saved,
+            'ratio': logical / stored if stored else 1.0
+        }
+
+    def scan_duplicates(self, directories: List[str] = None,
+                        progress_callback: Optional[Callable[[str, int], None]] = None,
+                        cancel_event: threading.Event = None) -> List[Dict]:
+        """
+        扫描目录中的重复镜像（默认ISO目录和虚拟机目录）
+
+        先按文件大小分组，只对与其他文件或库内容大小相同的文件计算哈希。
+
+        Returns:
+            [{'content_hash', 'size', 'paths': [...], 'in_library': 库文件路径或None, 'reclaimable': 字节}]
+        """
+        if directories is None:
+            directories = [
+                str(self.config_manager.get_default_iso_storage_path()),
+                str(self.config_manager.get_default_vm_storage_path())
+            ]
+        library_sizes = {config.get('size'): config for config in self.config_manager.images_config.values()
+                         if config.get('content_hash')}
+
+        by_size: Dict[int, List[str]] = {}
+        for directory in directories:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    if not filename.lower().endswith(IMAGE_SUFFIXES):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        by_size.setdefault(os.path.getsize(path), []).append(path)
+                    except OSError:
+                        continue
+
+        candidates = [(size, path) for size, paths in by_size.items()
+                      if len(paths) > 1 or size in library_sizes for path in paths]
+        by_hash: Dict[str, List[str]] = {}
+        for index, (size, path) in enumerate(candidates):
+            if progress_callback:
+                progress_callback(path, int(index * 100 / len(candidates)))
+            try:
+                content_hash = self.hasher.hash_file(path, cancel_event=cancel_event)
+            except OSError:
+                continue
+            by_hash.setdefault(content_hash, []).append(path)
+
+        groups = []
+        for content_hash, paths in by_hash.items():
+            existing = self.find_by_hash(content_hash)
+            copies = len(paths) if existing else len(paths) - 1
+            if copies <= 0:
+                continue
+            size = os.path.getsize(paths[0])
+            groups.append({
+                'content_hash': content_hash,
+                'size': size,
+                'paths': sorted(paths),
+                'in_library': existing['path'] if existing else None,
+                'reclaimable': size * copies
+            })
+        if progress_callback:
+            progress_callback("", 100)
+        return sorted(groups, key=lambda group: group['reclaimable'], reverse=True)
+
+
+# 全局镜像库实例
+image_library = None
+
+
+def get_image_library(config_manager) -> ImageLibrary:
+    """获取镜像库实例"""
+    global image_library
+    if image_library is None:
+        image_library = ImageLibrary(config_manager)
+    return image_library
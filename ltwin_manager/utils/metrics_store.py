@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+性能指标存储
+把系统监控采样持久化到SQLite，并提供流式读取和流式统计工具
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# 需要持久化的主机指标（扁平字段名前缀匹配）
+HOST_METRIC_PREFIXES = (
+    'cpu_percent',
+    'memory.percent',
+    'swap.percent',
+    'disk.percent',
+    'pressure.psi.',
+    'pressure.cpu_steal.avg',
+    'pressure.cpu_iowait.avg',
+)
+# 磁盘IO只保存速率和延迟类指标
+DISK_IO_METRICS = ('read_iops', 'write_iops', 'read_mb_s', 'write_mb_s', 'await_ms', 'util_percent')
+# 每台虚拟机需要持久化的指标
+VM_METRICS = ('cpu_percent', 'memory_mb', 'io_read_mb', 'io_write_mb')
+
+
+class StreamingStats:
+    """
+    流式统计
+
+    只保存计数、最值、总和以及对数分桶直方图，内存占用与样本数无关。
+    分位数由直方图估算，相对误差约为 bucket_ratio - 1。
+    """
+
+    def __init__(self, bucket_ratio: float = 1.02):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._log_ratio = math.log(bucket_ratio)
+        self._buckets: Dict[int, int] = {}  # 桶序号 -> 样本数
+        self._non_positive = 0  # <= 0 的样本数
+
+    def add(self, value: float):
+        """加入一个样本"""
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self._non_positive += 1
+        else:
+            index = math.floor(math.log(value) / self._log_ratio)
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def merge(self, other: 'StreamingStats'):
+        """合并另一个统计对象（分桶比例必须相同）"""
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._non_positive += other._non_positive
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+
+    @property
+    def avg(self) -> float:
+        """平均值"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """估算分位数"""
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = self._non_positive
+        if rank <= seen:
+            return min(self.min, 0.0)
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                # 取桶的几何中点，并限制在实际最值范围内
+                estimate = math.exp((index + 0.5) * self._log_ratio)
+                return max(self.min, min(self.max, estimate))
+        return self.max
+
+    def to_dict(self) -> Dict:
+        """导出为 min/avg/p95/max 字典"""
+        return {
+            'count': self.count,
+            'min': round(self.min, 3) if self.min is not None else 0.0,
+            'avg': round(self.avg, 3),
+            'p95': round(self.percentile(95), 3),
+            'max': round(self.max, 3) if self.max is not None else 0.0
+        }
+
+
+def select_host_metrics(flat_info: Dict) -> Dict[str, float]:
+    """从扁平化的主机采样中挑选需要持久化的数值指标"""
+    metrics = {}
+    for key, value in flat_info.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key.startswith('disk_io.'):
+            if key.rsplit('.', 1)[-1] in DISK_IO_METRICS:
+                metrics[key] = value
+        elif key.startswith(HOST_METRIC_PREFIXES):
+            metrics[key] = value
+    return metrics
+
+
+class MetricsStore:
+    """基于SQLite的性能指标存储"""
+
+    def __init__(self, db_path: Path, retention_days: int = 30):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """创建连接（每次调用使用独立连接，便于跨线程访问）"""
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_db(self):
+        """初始化表结构"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples ("
+                "ts REAL NOT NULL, scope TEXT NOT NULL, metric TEXT NOT NULL, value REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_samples_ts ON samples (ts)")
+
+    def record(self, scoped_metrics: Dict[str, Dict[str, float]], timestamp: Optional[float] = None):
+        """
+        记录一次采样
+
+        Args:
+            scoped_metrics: {范围: {指标名: 数值}}，范围为 'host' 或 'vm:<名称>'
+            timestamp: 采样时间（Unix时间戳），默认当前时间
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        rows = [
+            (timestamp, scope, metric, float(value))
+            for scope, metrics in scoped_metrics.items()
+            for metric, value in metrics.items()
+        ]
+        if not rows:
+            return
+
+        try:
+            with self._lock, closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT INTO samples (ts, scope, metric, value) VALUES (?, ?, ?, ?)", rows)
+                # 每小时清理一次过期数据
+                if timestamp - self._last_prune > 3600:
+                    conn.execute("DELETE FROM samples WHERE ts < ?", (timestamp - self.retention_days * 86400,))
+                    self._last_prune = timestamp
+        except sqlite3.Error as e:
+            print(f"保存性能指标失败: {e}")
+
+    def iter_samples(self, start_ts: float, end_ts: float,
+                     batch_size: int = 5000) -> Iterator[Tuple[float, str, str, float]]:
+        """
+        按时间顺序流式读取时间窗口内的样本
+
+        Yields:
+            (时间戳, 范围, 指标名, 数值)
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "SELECT ts, scope, metric, value FROM samples WHERE ts >= ? AND ts <= ? ORDER BY ts",
+                (start_ts, end_ts)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def count_samples(self, start_ts: float, end_ts: float) -> int:
+        """统计时间窗口内的样本行数"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM samples WHERE ts >= ? AND ts <= ?", (start_ts, end_ts)
+            ).fetchone()[0]
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """获取已存储数据的时间范围"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT MIN(ts), MAX(ts) FROM samples").fetchone()
+        return row if row and row[0] is not None else None
+
+    def list_scopes(self) -> List[str]:
+        """列出所有范围"""
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT scope FROM samples")]
+
+
+# 全局指标存储实例
+metrics_store = None
+
+
+def get_metrics_store(config_manager) -> MetricsStore:
+    """获取指标存储实例"""
+    global metrics_store
+    if metrics_store is None:
+        metrics_store = MetricsStore(
+            config_manager.config_dir / 'metrics.db',
+            config_manager.get_global_config("metrics_retention_days")
+        )
+    return metrics_store
@@ -8,7 +8,9 @@ import subprocess
 import psutil
 import platform
 from typing import Dict, List, Optional
-from pathlib import Path
+
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.storage_benchmark import get_benchmark_store, recommend_disk_options
 
 
 class PerformanceOptimizer:
@@ -87,17 +89,13 @@ class PerformanceOptimizer:
             '-smp', f'cpus={cpu_cores},cores={cpu_cores}',  # 优化SMP配置
         ])
         
-        # 优化存储性能
+        # 优化存储性能: 按磁盘所在存储的基准测试结果设置缓存模式和aio
         disk_path = vm_config.get('disk_path', '')
-        if disk_path:
-            # 使用优化的存储参数
-            for i, arg in enumerate(optimized_cmd):
-                if 'drive' in arg and disk_path in optimized_cmd[min(i+1, len(optimized_cmd)-1)]:
-                    # 替换为性能更好的参数
-                    optimized_cmd[i+1] = optimized_cmd[i+1].replace(
-                        'cache=none,aio=io_uring', 
-                        'cache=none,aio=native,cache.direct=on,cache.no-flush=on'
-                    )
+        disk_options = self.recommend_disk_options(disk_path) if disk_path else None
+        if disk_options:
+            for i, arg in enumerate(optimized_cmd[:-1]):
+                if arg == '-drive' and disk_path in optimized_cmd[i + 1]:
+                    optimized_cmd[i + 1] = self._apply_drive_options(optimized_cmd[i + 1], disk_options)
                     break
         
         # 优化网络性能
@@ -120,6 +118,29 @@ class PerformanceOptimizer:
         
         return optimized_cmd
     
+    def recommend_disk_options(self, disk_path: str) -> Optional[Dict[str, str]]:
+        """
+        根据磁盘所在存储的基准测试结果推荐缓存模式和aio
+        
+        Returns:
+            {'cache', 'aio', 'reason'}，该存储没有测试结果时返回None
+        """
+        try:
+            from ltwin_manager.utils.config_manager import get_config_manager
+            result = get_benchmark_store(get_config_manager()).result_for_path(disk_path)
+        except Exception as e:
+            print(f"读取存储基准测试结果失败: {e}")
+            return None
+        return recommend_disk_options(result)
+    
+    @staticmethod
+    def _apply_drive_options(drive_arg: str, disk_options: Dict[str, str]) -> str:
+        """在 -drive 参数中设置 cache 和 aio（已有的值会被替换）"""
+        options = [option for option in drive_arg.split(',')
+                   if not option.startswith(('cache=', 'aio='))]
+        options.extend([f"cache={disk_options['cache']}", f"aio={disk_options['aio']}"])
+        return ','.join(options)
+    
     def get_system_performance_tips(self) -> List[str]:
         """获取系统性能优化建议"""
         tips = []
@@ -171,14 +192,24 @@ class PerformanceOptimizer:
         if disk_size_gb and disk_size_gb > recommended_disk * 2:
             recommendations.append(f"虚拟机磁盘容量较大，建议根据实际需要调整")
         
+        # 检查磁盘缓存模式
+        disk_path = vm_config.get('disk_path', '')
+        if disk_path:
+            disk_options = self.recommend_disk_options(disk_path)
+            if disk_options:
+                recommendations.append(f"磁盘建议使用 cache={disk_options['cache']}, aio={disk_options['aio']}："
+                                       f"{disk_options['reason']}")
+            else:
+                recommendations.append("磁盘所在存储尚未进行基准测试，运行存储基准测试后可获得缓存模式建议")
+        
         return recommendations if recommendations else ["虚拟机配置合理，性能表现良好"]
     
     def _get_disk_size_gb(self, disk_path: str) -> Optional[float]:
-        """获取磁盘文件大小(GB)"""
+        """获取磁盘虚拟容量(GB)"""
         try:
-            if disk_path and Path(disk_path).exists():
-                size_bytes = Path(disk_path).stat().st_size
-                return size_bytes / (1024**3)
+            disk_info = get_disk_inspector().inspect(disk_path)
+            if disk_info:
+                return disk_info.virtual_size / (1024**3)
         except:
             pass
         return None
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+历史性能报告引擎
+对指定时间窗口内的已存储指标做流式聚合，生成主机和虚拟机的 min/avg/p95/max 统计，
+并支持导出为CSV、JSON和HTML
+"""
+
+import csv
+import html
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from ltwin_manager.utils.metrics_store import MetricsStore, StreamingStats
+
+
+# 报告中的指标显示名称
+METRIC_LABELS = {
+    'cpu_percent': 'CPU使用率 (%)',
+    'memory.percent': '内存使用率 (%)',
+    'swap.percent': '交换内存使用率 (%)',
+    'disk.percent': '磁盘使用率 (%)',
+    'pressure.cpu_steal.avg': 'CPU Steal (%)',
+    'pressure.cpu_iowait.avg': 'CPU IOWait (%)',
+    'memory_mb': '内存占用 (MB)',
+    'io_read_mb': '读取速率 (MB/s)',
+    'io_write_mb': '写入速率 (MB/s)',
+}
+
+# 累计计数器：报告统计相邻两次采样之间的速率（每秒增量），而不是计数器本身
+COUNTER_METRICS = ('io_read_mb', 'io_write_mb')
+
+# 用于排名资源消耗者的指标: (指标名, 排名依据)
+RANKING_METRICS = (
+    ('cpu_percent', 'avg'),
+    ('memory_mb', 'p95'),
+)
+
+
+def metric_label(metric: str) -> str:
+    """获取指标的显示名称"""
+    return METRIC_LABELS.get(metric, metric)
+
+
+@dataclass
+class PerformanceReport:
+    """性能报告"""
+    start_ts: float
+    end_ts: float
+    generated_at: float
+    sample_rows: int = 0
+    host: Dict[str, Dict] = field(default_factory=dict)  # 指标 -> 统计
+    vms: Dict[str, Dict[str, Dict]] = field(default_factory=dict)  # 虚拟机 -> 指标 -> 统计
+    top_consumers: Dict[str, List[Dict]] = field(default_factory=dict)  # 指标 -> 排名列表
+
+    def to_dict(self) -> Dict:
+        """转换为可序列化的字典"""
+        return {
+            'start': datetime.fromtimestamp(self.start_ts).strftime("%Y-%m-%d %H:%M:%S"),
+            'end': datetime.fromtimestamp(self.end_ts).strftime("%Y-%m-%d %H:%M:%S"),
+            'generated_at': datetime.fromtimestamp(self.generated_at).strftime("%Y-%m-%d %H:%M:%S"),
+            'sample_rows': self.sample_rows,
+            'host': self.host,
+            'vms': self.vms,
+            'top_consumers': self.top_consumers
+        }
+
+
+class ReportEngine:
+    """历史性能报告引擎"""
+
+    def __init__(self, metrics_store: MetricsStore):
+        self.metrics_store = metrics_store
+
+    def generate(self, start_ts: float, end_ts: float,
+                 progress_callback: Optional[Callable[[int], None]] = None,
+                 is_cancelled: Optional[Callable[[], bool]] = None,
+                 top_n: int = 5) -> Optional[PerformanceReport]:
+        """
+        生成报告
+
+        样本按批次流式读取，每个(范围, 指标)只保留一个 StreamingStats，
+        因此内存占用只与指标数量有关，与时间窗口长度无关。
+        累计计数器（COUNTER_METRICS）换算为相邻样本之间的速率后再统计。
+
+        Args:
+            start_ts: 窗口开始时间（Unix时间戳）
+            end_ts: 窗口结束时间（Unix时间戳）
+            progress_callback: 进度回调，参数为百分比
+            is_cancelled: 返回True时中止生成
+            top_n: 每个排名指标保留的虚拟机数量
+
+        Returns:
+            报告对象，被取消时返回None
+        """
+        total_rows = self.metrics_store.count_samples(start_ts, end_ts)
+        series: Dict[tuple, StreamingStats] = {}
+        previous: Dict[tuple, tuple] = {}  # 计数器指标上一次的 (时间戳, 数值)
+        processed = 0
+        last_percent = -1
+
+        for ts, scope, metric, value in self.metrics_store.iter_samples(start_ts, end_ts):
+            if metric in COUNTER_METRICS:
+                value = self._counter_rate(previous, (scope, metric), ts, value)
+            if value is not None:
+                stats = series.get((scope, metric))
+                if stats is None:
+                    stats = series[(scope, metric)] = StreamingStats()
+                stats.add(value)
+
+            processed += 1
+            if processed % 10000 == 0:
+                if is_cancelled and is_cancelled():
+                    return None
+                percent = int(processed * 100 / total_rows) if total_rows else 100
+                if progress_callback and percent != last_percent:
+                    progress_callback(percent)
+                    last_percent = percent
+
+        report = PerformanceReport(start_ts=start_ts, end_ts=end_ts,
+                                   generated_at=time.time(), sample_rows=processed)
+        for (scope, metric), stats in sorted(series.items()):
+            if scope == 'host':
+                report.host[metric] = stats.to_dict()
+            elif scope.startswith('vm:'):
+                report.vms.setdefault(scope[3:], {})[metric] = stats.to_dict()
+
+        report.top_consumers = self._rank_consumers(report.vms, top_n)
+
+        if progress_callback:
+            progress_callback(100)
+        return report
+
+    @staticmethod
+    def _counter_rate(previous: Dict[tuple, tuple], key: tuple, ts: float, value: float) -> Optional[float]:
+        """
+        累计计数器相对上一次采样的每秒增量
+
+        每个序列的第一个样本没有差值；计数器变小说明虚拟机重启过，这一对样本也不计入
+        """
+        last = previous.get(key)
+        previous[key] = (ts, value)
+        if last is None or ts <= last[0] or value < last[1]:
+            return None
+        return (value - last[1]) / (ts - last[0])
+
+    @staticmethod
+    def _rank_consumers(vms: Dict[str, Dict[str, Dict]], top_n: int) -> Dict[str, List[Dict]]:
+        """按指标对虚拟机排名"""
+        rankings = {}
+        for metric, basis in RANKING_METRICS:
+            ranked = sorted(
+                ((vm_name, metrics[metric][basis]) for vm_name, metrics in vms.items() if metric in metrics),
+                key=lambda item: item[1],
+                reverse=True
+            )
+            rankings[metric] = [
+                {'vm': vm_name, 'basis': basis, 'value': value}
+                for vm_name, value in ranked[:top_n]
+            ]
+        return rankings
+
+
+def _iter_rows(report: PerformanceReport):
+    """把报告展开为 (范围, 指标, 统计) 行"""
+    for metric, stats in report.host.items():
+        yield 'host', metric, stats
+    for vm_name in sorted(report.vms):
+        for metric, stats in report.vms[vm_name].items():
+            yield f"vm:{vm_name}", metric, stats
+
+
+def export_csv(report: PerformanceReport, path: str):
+    """导出为CSV"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['scope', 'metric', 'count', 'min', 'avg', 'p95', 'max'])
+        for scope, metric, stats in _iter_rows(report):
+            writer.writerow([scope, metric, stats['count'], stats['min'], stats['avg'], stats['p95'], stats['max']])
+
+
+def export_json(report: PerformanceReport, path: str):
+    """导出为JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def export_html(report: PerformanceReport, path: str):
+    """导出为HTML"""
+    data = report.to_dict()
+    lines = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset='utf-8'><title>LTWin Manager 性能报告</title>",
+        "<style>body{font-family:sans-serif;margin:20px}table{border-collapse:collapse;margin-bottom:20px}"
+        "th,td{border:1px solid #ccc;padding:4px 8px;text-align:right}th:first-child,td:first-child{text-align:left}"
+        "th{background:#f0f0f0}</style></head><body>",
+        "<h1>LTWin Manager 性能报告</h1>",
+        f"<p>时间窗口: {data['start']} ~ {data['end']}，样本数: {data['sample_rows']}，生成于 {data['generated_at']}</p>",
+    ]
+
+    def stats_table(title, metrics):
+        rows = [f"<h2>{html.escape(title)}</h2>",
+                "<table><tr><th>指标</th><th>最小</th><th>平均</th><th>P95</th><th>最大</th><th>样本</th></tr>"]
+        for metric, stats in metrics.items():
+            rows.append(
+                f"<tr><td>{html.escape(metric_label(metric))}</td><td>{stats['min']}</td><td>{stats['avg']}</td>"
+                f"<td>{stats['p95']}</td><td>{stats['max']}</td><td>{stats['count']}</td></tr>"
+            )
+        rows.append("</table>")
+        return rows
+
+    lines.extend(stats_table("主机", report.host))
+    for vm_name in sorted(report.vms):
+        lines.extend(stats_table(f"虚拟机: {vm_name}", report.vms[vm_name]))
+
+    lines.append("<h2>资源消耗排名</h2>")
+    for metric, ranking in report.top_consumers.items():
+        lines.append(f"<h3>{html.escape(metric_label(metric))}</h3><ol>")
+        for entry in ranking:
+            lines.append(f"<li>{html.escape(entry['vm'])}: {entry['value']} ({entry['basis']})</li>")
+        lines.append("</ol>")
+
+    lines.append("</body></html>")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+
+
+EXPORTERS = {
+    'csv': export_csv,
+    'json': export_json,
+    'html': export_html,
+}
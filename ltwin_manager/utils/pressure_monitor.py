@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+资源压力监控
+读取 /proc/pressure 下的PSI（压力停顿信息）以及每个CPU的steal/iowait占比，
+用于发现超分配主机上已经影响虚拟机延迟的资源争用
+"""
+
+import os
+import time
+import psutil
+from typing import Dict, List, Optional
+
+
+PRESSURE_DIR = "/proc/pressure"
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+
+
+def read_pressure(resource: str) -> Dict[str, float]:
+    """
+    读取单个资源的PSI数据
+
+    Args:
+        resource: 'cpu'、'memory' 或 'io'
+
+    Returns:
+        {'some_avg10': ..., 'some_avg60': ..., 'some_avg300': ..., 'full_avg10': ...}，
+        不支持PSI时返回空字典
+    """
+    values = {}
+    try:
+        with open(os.path.join(PRESSURE_DIR, resource), 'r') as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                kind = fields[0]  # some 或 full
+                for field in fields[1:]:
+                    name, _, value = field.partition('=')
+                    if name.startswith('avg'):
+                        values[f"{kind}_{name}"] = float(value)
+    except (OSError, ValueError):
+        return {}
+    return values
+
+
+class PressureMonitor:
+    """主机资源压力采样与持续告警判断"""
+
+    def __init__(self):
+        self._last_cpu_times = None
+        self._exceeded_since: Dict[str, float] = {}  # 告警键 -> 首次超过阈值的时间
+        self._active_alerts = set()
+
+    @staticmethod
+    def is_psi_supported() -> bool:
+        """当前内核是否提供PSI"""
+        return os.path.isdir(PRESSURE_DIR)
+
+    def sample(self) -> Dict:
+        """
+        采样资源压力
+
+        Returns:
+            {'psi': {资源: PSI数据}, 'cpu_steal': {...}, 'cpu_iowait': {...}}
+        """
+        psi = {}
+        if self.is_psi_supported():
+            for resource in PRESSURE_RESOURCES:
+                values = read_pressure(resource)
+                if values:
+                    psi[resource] = values
+
+        steal, iowait = self._sample_cpu_contention()
+        return {
+            'psi': psi,
+            'cpu_steal': self._summarize(steal),
+            'cpu_iowait': self._summarize(iowait)
+        }
+
+    def _sample_cpu_contention(self):
+        """计算自上次采样以来每个CPU的steal和iowait百分比"""
+        current = psutil.cpu_times(percpu=True)
+        previous, self._last_cpu_times = self._last_cpu_times, current
+        if previous is None or len(previous) != len(current):
+            return [], []
+
+        steal, iowait = [], []
+        for before, after in zip(previous, current):
+            total = self._total_time(after) - self._total_time(before)
+            if total <= 0:
+                steal.append(0.0)
+                iowait.append(0.0)
+                continue
+            steal.append(round((getattr(after, 'steal', 0) - getattr(before, 'steal', 0)) / total * 100, 1))
+            iowait.append(round((getattr(after, 'iowait', 0) - getattr(before, 'iowait', 0)) / total * 100, 1))
+        return steal, iowait
+
+    @staticmethod
+    def _total_time(cpu_times) -> float:
+        """CPU总时间（Linux上guest时间已计入user，需要扣除）"""
+        return sum(cpu_times) - getattr(cpu_times, 'guest', 0) - getattr(cpu_times, 'guest_nice', 0)
+
+    @staticmethod
+    def _summarize(per_cpu: List[float]) -> Dict:
+        """汇总每个CPU的百分比"""
+        if not per_cpu:
+            return {'avg': 0.0, 'max': 0.0, 'per_cpu': []}
+        return {
+            'avg': round(sum(per_cpu) / len(per_cpu), 1),
+            'max': max(per_cpu),
+            'per_cpu': per_cpu
+        }
+
+    def check_alerts(self, pressure: Dict, thresholds: Dict, now: Optional[float] = None) -> Dict[str, str]:
+        """
+        检查持续超过阈值的压力
+
+        Args:
+            pressure: sample() 的返回值
+            thresholds: {'psi_percent': ..., 'steal_percent': ..., 'iowait_percent': ..., 'sustain_seconds': ...}
+            now: 当前时间（单调时钟），默认取 time.monotonic()
+
+        Returns:
+            新进入告警状态的 {告警键: 告警信息}；持续告警不会重复返回
+        """
+        now = time.monotonic() if now is None else now
+        sustain = thresholds.get('sustain_seconds', 30)
+        psi_limit = thresholds.get('psi_percent', float('inf'))
+        resource_names = {'cpu': 'CPU', 'memory': '内存', 'io': 'IO'}
+
+        current = {}
+        for resource, values in pressure.get('psi', {}).items():
+            some = values.get('some_avg10', 0.0)
+            if some >= psi_limit:
+                current[f"psi_{resource}"] = f"{resource_names.get(resource, resource)}压力持续偏高: some avg10={some:.1f}%"
+
+        steal = pressure.get('cpu_steal', {}).get('avg', 0.0)
+        if steal >= thresholds.get('steal_percent', float('inf')):
+            current['cpu_steal'] = f"CPU steal持续偏高: 平均 {steal:.1f}%"
+
+        iowait = pressure.get('cpu_iowait', {}).get('avg', 0.0)
+        if iowait >= thresholds.get('iowait_percent', float('inf')):
+            current['cpu_iowait'] = f"CPU iowait持续偏高: 平均 {iowait:.1f}%"
+
+        # 低于阈值的条件重新计时并解除告警
+        for key in list(self._exceeded_since.keys()):
+            if key not in current:
+                del self._exceeded_since[key]
+                self._active_alerts.discard(key)
+
+        new_alerts = {}
+        for key, message in current.items():
+            since = self._exceeded_since.setdefault(key, now)
+            if now - since >= sustain and key not in self._active_alerts:
+                self._active_alerts.add(key)
+                new_alerts[key] = message
+        return new_alerts
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+自身性能剖析工具
+提供耗时统计注册表（装饰器/上下文管理器）、可选的栈采样剖析器以及诊断数据导出，
+用于定位管理器自身的卡顿
+"""
+
+import functools
+import json
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from ltwin_manager.utils.metrics_store import StreamingStats
+
+
+class TimingRegistry:
+    """
+    耗时统计注册表
+
+    每个计时点保留一个 StreamingStats（毫秒），记录次数、最值和分位数，
+    另外保留最近的慢调用便于排查。线程安全。
+    """
+
+    def __init__(self, slow_threshold_ms: float = 100.0, slow_history: int = 50):
+        self.slow_threshold_ms = slow_threshold_ms
+        self._lock = threading.Lock()
+        self._stats: Dict[str, StreamingStats] = {}
+        self._slow_calls: List[Dict] = []
+        self._slow_history = slow_history
+        self.enabled = True
+
+    def record(self, name: str, elapsed_ms: float):
+        """记录一次耗时"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = StreamingStats()
+            stats.add(elapsed_ms)
+            if elapsed_ms >= self.slow_threshold_ms:
+                self._slow_calls.append({
+                    'name': name,
+                    'elapsed_ms': round(elapsed_ms, 2),
+                    'thread': threading.current_thread().name,
+                    'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
+                del self._slow_calls[:-self._slow_history]
+
+    def timed(self, name: str) -> '_Timer':
+        """
+        获取计时器，可作为装饰器或上下文管理器使用
+
+        用法:
+            @timing_registry.timed("vm.start")
+            def start_vm(...): ...
+
+            with timing_registry.timed("storage.scan"):
+                ...
+        """
+        return _Timer(self, name)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """获取所有计时点的统计: {名称: {count, min, avg, p50, p95, p99, max, total}}"""
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                summary = stats.to_dict()
+                summary['p50'] = round(stats.percentile(50), 3)
+                summary['p99'] = round(stats.percentile(99), 3)
+                summary['total'] = round(stats.total, 3)
+                result[name] = summary
+            return result
+
+    def slow_calls(self) -> List[Dict]:
+        """获取最近的慢调用记录（新的在后）"""
+        with self._lock:
+            return list(self._slow_calls)
+
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._stats.clear()
+            self._slow_calls.clear()
+
+
+class _Timer:
+    """计时器（装饰器/上下文管理器）"""
+
+    def __init__(self, registry: TimingRegistry, name: str):
+        self.registry = registry
+        self.name = name
+        self._start = threading.local()
+
+    def __enter__(self):
+        self._start.value = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.record(self.name, (time.perf_counter() - self._start.value) * 1000)
+        return False
+
+    def __call__(self, func: Callable) -> Callable:
+        registry, name = self.registry, self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+
+class StackSampler:
+    """
+    栈采样剖析器
+
+    后台线程按固定间隔读取所有线程的调用栈并累计折叠栈计数，
+    开销与被测代码无关，可在卡顿时临时打开。输出的折叠栈格式可直接用于火焰图工具。
+    """
+
+    def __init__(self, interval_ms: float = 10.0, max_depth: int = 64):
+        self.interval_ms = interval_ms
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()  # 折叠栈 -> 样本数
+        self._leaf_frames: Counter = Counter()  # 栈顶函数 -> 样本数
+        self._sample_count = 0
+        self._started_at = None
+        self._thread = None
+        self._running = False
+
+    def is_running(self) -> bool:
+        """是否正在采样"""
+        return self._running
+
+    def start(self):
+        """开始采样"""
+        if self._running:
+            return
+        self._running = True
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._sample_loop, name="StackSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止采样（已有数据保留）"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def clear(self):
+        """清空采样数据"""
+        with self._lock:
+            self._stacks.clear()
+            self._leaf_frames.clear()
+            self._sample_count = 0
+
+    def _sample_loop(self):
+        """采样循环"""
+        own_ident = threading.get_ident()
+        thread_names = {}
+        while self._running:
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own_ident:
+                        continue
+                    stack = self._format_stack(frame)
+                    if not stack:
+                        continue
+                    self._stacks[f"{thread_names.get(ident, ident)};{';'.join(stack)}"] += 1
+                    self._leaf_frames[stack[-1]] += 1
+                self._sample_count += 1
+            del frames
+            time.sleep(self.interval_ms / 1000)
+
+    def _format_stack(self, frame) -> List[str]:
+        """把帧链转换为从外到内的 '模块:函数:行号' 列表"""
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            module = frame.f_globals.get('__name__', code.co_filename)
+            stack.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def top_frames(self, limit: int = 20) -> List[Dict]:
+        """获取采样最多的栈顶函数"""
+        with self._lock:
+            total = sum(self._leaf_frames.values()) or 1
+            return [
+                {'frame': frame, 'samples': count, 'percent': round(count * 100 / total, 1)}
+                for frame, count in self._leaf_frames.most_common(limit)
+            ]
+
+    def folded_stacks(self) -> List[str]:
+        """获取折叠栈文本行（'栈;栈 样本数'）"""
+        with self._lock:
+            return [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+
+    def summary(self) -> Dict:
+        """获取采样概况"""
+        with self._lock:
+            return {
+                'running': self._running,
+                'interval_ms': self.interval_ms,
+                'sample_count': self._sample_count,
+                'started_at': datetime.fromtimestamp(self._started_at).strftime("%Y-%m-%d %H:%M:%S")
+                if self._started_at else ''
+            }
+
+
+# 全局实例
+timing_registry = TimingRegistry()
+stack_sampler = None
+
+
+def get_timing_registry() -> TimingRegistry:
+    """获取耗时统计注册表"""
+    return timing_registry
+
+
+def get_stack_sampler() -> StackSampler:
+    """获取栈采样剖析器"""
+    global stack_sampler
+    if stack_sampler is None:
+        stack_sampler = StackSampler()
+    return stack_sampler
+
+
+def timed(name: str) -> _Timer:
+    """在全局注册表上计时（装饰器/上下文管理器）"""
+    return timing_registry.timed(name)
+
+
+def dump_diagnostics(path: str) -> bool:
+    """
+    导出诊断数据
+
+    写出JSON格式的耗时统计、慢调用和栈采样结果；若有栈采样数据，
+    同时在旁边写出 .folded 折叠栈文件。
+
+    Args:
+        path: 输出文件路径
+
+    Returns:
+        是否成功
+    """
+    sampler = get_stack_sampler()
+    data = {
+        'generated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'threads': [thread.name for thread in threading.enumerate()],
+        'timings': timing_registry.snapshot(),
+        'slow_calls': timing_registry.slow_calls(),
+        'sampler': sampler.summary(),
+        'hot_frames': sampler.top_frames(50)
+    }
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+        folded = sampler.folded_stacks()
+        if folded:
+            with open(f"{path}.folded", 'w', encoding='utf-8') as f:
+                f.write("\n".join(folded) + "\n")
+        return True
+    except Exception as e:
+        print(f"导出诊断数据失败: {e}")
+        return False
+
+
+def install_event_loop_probe(parent, interval_ms: int = 100):
+    """
+    在GUI线程安装事件循环延迟探针
+
+    定时器每 interval_ms 触发一次，实际触发时间与预期的差值记为 'ui.event_loop_lag'，
+    该值升高即表示GUI线程被阻塞（界面卡顿）。
+
+    Args:
+        parent: 定时器的父对象（GUI线程中的QObject）
+
+    Returns:
+        QTimer实例
+    """
+    from PyQt6.QtCore import QTimer
+
+    timer = QTimer(parent)
+    state = {'last': time.perf_counter()}
+
+    def on_timeout():
+        now = time.perf_counter()
+        lag_ms = max((now - state['last']) * 1000 - interval_ms, 0.0)
+        state['last'] = now
+        timing_registry.record('ui.event_loop_lag', lag_ms)
+
+    timer.timeout.connect(on_timeout)
+    timer.start(interval_ms)
+    return timer
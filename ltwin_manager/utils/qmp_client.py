@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+QMP客户端
+通过虚拟机启动时创建的 QMP unix socket 向运行中的 QEMU 发送命令
+"""
+
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class QMPError(Exception):
+    """QMP命令返回错误或连接失败"""
+    pass
+
+
+def qmp_socket_path(vm_name: str) -> Path:
+    """虚拟机的QMP socket路径"""
+    return Path.home() / '.ltwin' / 'run' / f"{vm_name}.qmp"
+
+
+def qmp_command_args(vm_name: str) -> List[str]:
+    """启动QEMU时添加的QMP参数（同时创建socket目录）"""
+    path = qmp_socket_path(vm_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return ['-qmp', f'unix:{path},server=on,wait=off']
+
+
+class QMPClient:
+    """QMP客户端（同步，每行一个JSON消息）"""
+
+    def __init__(self, socket_path: str, timeout: float = 10.0):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self._buffer = b''
+        self.events: List[Dict] = []  # 执行命令期间收到的异步事件
+
+    @classmethod
+    def for_vm(cls, vm_name: str, timeout: float = 10.0) -> 'QMPClient':
+        """按虚拟机名称创建客户端"""
+        return cls(qmp_socket_path(vm_name), timeout)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        """连接并完成能力协商"""
+        if not os.path.exists(self.socket_path):
+            raise QMPError(f"QMP socket不存在（虚拟机未运行或启动时未启用QMP）: {self.socket_path}")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(self.socket_path)
+            greeting = self._read_message()
+            if 'QMP' not in greeting:
+                raise QMPError(f"无效的QMP问候消息: {greeting}")
+            self.execute('qmp_capabilities')
+        except OSError as e:
+            self.close()
+            raise QMPError(f"连接QMP失败: {e}")
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+    def _read_message(self) -> Dict:
+        while b'\n' not in self._buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                raise QMPError("QMP连接已关闭")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def execute(self, command: str, arguments: Dict = None) -> Any:
+        """
+        执行QMP命令并返回 return 字段
+
+        Raises:
+            QMPError: 命令返回错误、超时或连接断开
+        """
+        if self.sock is None:
+            raise QMPError("QMP未连接")
+        message = {'execute': command}
+        if arguments:
+            message['arguments'] = arguments
+        try:
+            self.sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            while True:
+                response = self._read_message()
+                if 'event' in response:
+                    self.events.append(response)
+                    continue
+                if 'error' in response:
+                    error = response['error']
+                    raise QMPError(f"{command}: {error.get('class', '')} {error.get('desc', '')}".strip())
+                return response.get('return')
+        except socket.timeout:
+            raise QMPError(f"{command}: 等待QMP响应超时")
+        except OSError as e:
+            raise QMPError(f"{command}: {e}")
+
+    def wait_for_migration(self, timeout: float = 600.0, poll_interval: float = 0.1) -> Dict:
+        """
+        等待迁移（保存内存状态）结束
+
+        Raises:
+            QMPError: 迁移失败或超时
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            info = self.execute('query-migrate') or {}
+            status = info.get('status')
+            if status == 'completed':
+                return info
+            if status in ('failed', 'cancelled'):
+                raise QMPError(f"保存内存状态失败: {info.get('error-desc', status)}")
+            time.sleep(poll_interval)
+        raise QMPError("保存内存状态超时")
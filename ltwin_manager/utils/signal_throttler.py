@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+信号节流器
+用于把后台线程产生的高频数据合并为每帧一次的增量信号，降低UI刷新开销
+"""
+
+import threading
+from typing import Any, Dict, Optional
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+
+def flatten_payload(payload: Dict, prefix: str = "") -> Dict[str, Any]:
+    """把嵌套字典展开为 'a.b.c' 形式的扁平字典"""
+    flat = {}
+    for key, value in payload.items():
+        flat_key = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_payload(value, f"{flat_key}."))
+        else:
+            flat[flat_key] = value
+    return flat
+
+
+class SignalThrottler(QObject):
+    """
+    跨线程信号节流器
+
+    后台线程通过 publish() 按主题提交最新数据，GUI线程每帧最多收到一次
+    batch_ready 信号，其中只包含自上次投递以来发生变化的字段。
+    GUI线程处理不过来时，未投递的中间样本会被最新样本直接覆盖。
+
+    必须在GUI线程中创建。
+    """
+
+    # {主题: {扁平字段名: 新值}}，主题被移除时值为 None
+    batch_ready = pyqtSignal(dict)
+    # 内部信号：通知GUI线程有待投递的数据（跨线程排队投递）
+    _pending_available = pyqtSignal()
+
+    def __init__(self, frame_interval_ms: int = 100, parent=None):
+        super().__init__(parent)
+        self.frame_interval_ms = frame_interval_ms
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Optional[Dict]] = {}  # 主题 -> 最新的完整负载
+        self._delivered: Dict[str, Dict[str, Any]] = {}  # 主题 -> 已投递的扁平状态
+        self._flush_scheduled = False
+        self.dropped_count = 0  # 被覆盖而未投递的中间样本数
+
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.timeout.connect(self._flush)
+        self._pending_available.connect(self._schedule_flush)
+
+    def publish(self, topic: str, payload: Dict):
+        """提交某个主题的最新数据（线程安全）"""
+        self._enqueue(topic, payload)
+
+    def retire(self, topic: str):
+        """移除某个主题，下一帧会投递 {topic: None}（线程安全）"""
+        self._enqueue(topic, None)
+
+    def _enqueue(self, topic: str, payload: Optional[Dict]):
+        """记录待投递数据，只在从空闲变为待投递时唤醒GUI线程"""
+        with self._lock:
+            if topic in self._pending:
+                self.dropped_count += 1
+            self._pending[topic] = payload
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._pending_available.emit()
+
+    def _schedule_flush(self):
+        """在GUI线程中启动帧定时器"""
+        if not self._frame_timer.isActive():
+            self._frame_timer.start(self.frame_interval_ms)
+
+    def _flush(self):
+        """合并本帧的所有待投递数据并计算增量"""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._flush_scheduled = False
+
+        batch = {}
+        for topic, payload in pending.items():
+            if payload is None:
+                if self._delivered.pop(topic, None) is not None:
+                    batch[topic] = None
+                continue
+
+            flat = flatten_payload(payload)
+            previous = self._delivered.get(topic, {})
+            changes = {key: value for key, value in flat.items() if previous.get(key) != value or key not in previous}
+            if changes:
+                self._delivered[topic] = flat
+                batch[topic] = changes
+
+        if batch:
+            self.batch_ready.emit(batch)
+
+    def snapshot(self, topic: str) -> Dict[str, Any]:
+        """获取某个主题最近一次投递后的完整扁平状态（仅限GUI线程调用）"""
+        return dict(self._delivered.get(topic, {}))
+
+    def topics(self):
+        """获取当前已投递过的主题列表（仅限GUI线程调用）"""
+        return list(self._delivered.keys())
+
+    def request_full_refresh(self):
+        """清空已投递状态，下一帧将投递所有字段（仅限GUI线程调用）"""
+        self._delivered.clear()
@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+"""
+快照后端
+外部覆盖层快照（冻结当前磁盘，虚拟机改写新覆盖层）和 qcow2 内部快照（快照保存在磁盘镜像内），
+由 SnapshotManager 按虚拟机配置的 snapshot_backend 选择
+"""
+
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.qmp_client import QMPClient, QMPError
+from ltwin_manager.utils.guest_agent import FreezeResult
+
+try:
+    import fcntl
+except ImportError:  # 非Linux平台没有reflink
+    fcntl = None
+
+
+BACKEND_NAMES = {
+    'external': '外部覆盖层',
+    'internal': 'qcow2内部快照',
+}
+
+# 恢复快照前如何保留当前状态
+RESTORE_BACKUP_MODES = {
+    'snapshot': '保存为快照',
+    'reflink': 'reflink备份',
+    'none': '不保留',
+}
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+
+def reflink_copy(source: str, target: str) -> bool:
+    """
+    用 FICLONE 克隆文件（btrfs/XFS等支持reflink的文件系统上与文件大小无关、不占用额外空间）
+
+    Returns:
+        是否成功；文件系统不支持时返回 False，不会退化为完整复制
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'xb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(target) and os.path.getsize(target) == 0:
+            os.remove(target)
+        return False
+    shutil.copystat(source, target)
+    return True
+
+
+def vm_drives(vm_config: Dict) -> List[Tuple[str, str]]:
+    """虚拟机的磁盘列表 [(drive id, 路径)]：主磁盘为 disk0，extra_disks 依次为 disk1, disk2, ..."""
+    paths = [vm_config.get('disk_path', '')] + list(vm_config.get('extra_disks') or [])
+    return [(f"disk{index}", path) for index, path in enumerate(paths) if path]
+
+
+class SnapshotBackend:
+    """快照后端基类"""
+
+    name = ''
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.config_manager = manager.config_manager
+
+    def check(self, vm_name: str, vm_config: Dict):
+        """
+        检查虚拟机是否可以使用该后端
+
+        Raises:
+            ValueError: 不支持
+        """
+        drives = vm_drives(vm_config)
+        if not drives or drives[0][0] != 'disk0':
+            raise ValueError(f"虚拟机 '{vm_name}' 没有配置磁盘")
+        for drive_id, disk_path in drives:
+            problems = self.manager._check_disk(disk_path)
+            if problems:
+                raise ValueError(f"磁盘 {drive_id} 无法创建快照: {'；'.join(problems)}")
+
+    def create(self, vm_name: str, vm_config: Dict, snapshot_id: str, include_memory: bool) -> Dict:
+        """创建快照，返回需要写入快照元数据的字段"""
+        raise NotImplementedError
+
+    def restore(self, vm_name: str, vm_config: Dict, snapshot_info: Dict,
+                backup: str = 'snapshot', backup_id: str = '') -> Dict:
+        """
+        恢复快照
+
+        Args:
+            backup: 当前状态的保留方式（见 RESTORE_BACKUP_MODES）
+            backup_id: backup 为 snapshot 时保存当前状态使用的快照ID
+
+        Returns:
+            当前状态保存为快照时，需要写入该快照元数据的字段；否则为空字典
+        """
+        raise NotImplementedError
+
+    def delete(self, vm_name: str, vm_config: Dict, snapshot_info: Dict):
+        """删除快照的数据（元数据由 SnapshotManager 移除）"""
+        raise NotImplementedError
+
+    def verify(self, snapshot_info: Dict) -> List[str]:
+        """校验快照，返回问题列表"""
+        return []
+
+    @staticmethod
+    def _is_running(vm_config: Dict) -> bool:
+        return vm_config.get('status') == 'running'
+
+
+class ExternalOverlayBackend(SnapshotBackend):
+    """
+    外部覆盖层快照
+
+    当前磁盘冻结为快照，虚拟机改为写入以它为后端的新覆盖层：
+    运行中的虚拟机通过 QMP transaction 对所有磁盘原子地执行 blockdev-snapshot-sync（崩溃一致），
+    已停止的虚拟机直接用 qemu-img 创建覆盖层。
+    """
+
+    name = 'external'
+
+    def create(self, vm_name: str, vm_config: Dict, snapshot_id: str, include_memory: bool) -> Dict:
+        running = self._is_running(vm_config)
+        drives = vm_drives(vm_config)
+
+        # 新覆盖层放在当前磁盘旁边（虚拟机之后写入它），冻结的磁盘原地成为快照
+        # 覆盖层接替当前磁盘按虚拟容量计入承诺容量，冻结的磁盘不再计入，承诺容量不变
+        capacity_planner = get_capacity_planner(self.config_manager)
+        overlays = {}
+        for drive_id, disk_path in drives:
+            overlays[drive_id] = self._plan_overlay(
+                disk_path, f"{vm_name}-{drive_id}-{snapshot_id.rsplit('_snap_', 1)[-1]}.qcow2")
+
+        memory_path = ''
+        pause_ms = 0.0
+        freeze = None
+        try:
+            if running:
+                if include_memory:
+                    # 内存状态放在快照存储池（没有可用存储池时使用快照默认位置）
+                    snapshot_dir = self.manager.pool_manager.snapshot_dir_for(vm_name, snapshot_id) \
+                        or self.manager.snapshots_dir / vm_name / snapshot_id
+                    snapshot_dir.mkdir(parents=True, exist_ok=True)
+                    memory_path = str(snapshot_dir / "memory.state")
+                pause_ms, memory_saved, freeze = self._live_snapshot(vm_name, drives, overlays, memory_path)
+                if not memory_saved:
+                    memory_path = ''
+            else:
+                # 冻结的磁盘作为后端
+                self._create_overlays({drive_id: disk_path for drive_id, disk_path in drives}, overlays)
+        except Exception:
+            # 磁盘没有切换，删除已经创建的覆盖层
+            self._remove_files(overlays.values())
+            raise
+
+        # 虚拟机改为使用新覆盖层
+        frozen = dict(drives)
+        vm_config['disk_path'] = overlays['disk0']
+        if vm_config.get('extra_disks'):
+            vm_config['extra_disks'] = [overlays[drive_id] for drive_id, _ in drives[1:]]
+        self.config_manager.set_vm_config(vm_name, vm_config)
+
+        for drive_id, disk_path in drives:
+            capacity_planner.register(disk_path, 'snapshot', vm_name)
+            capacity_planner.register(overlays[drive_id], 'disk', vm_name)
+
+        fields = {
+            'disk_path': frozen['disk0'],
+            'disks': frozen,
+            'memory_state': memory_path,
+            'pause_ms': round(pause_ms, 1),
+            'storage_pool': self.manager.pool_manager.pool_for_path(frozen['disk0']) or '',
+            'vm_state': 'running' if running else 'stopped'  # 记录虚拟机状态
+        }
+        if freeze and freeze.mode != 'off':
+            fields['fsfreeze'] = freeze.to_dict()
+        return fields
+
+    def _plan_overlay(self, disk_path: str, file_name: str) -> str:
+        """
+        新覆盖层的路径（放在 disk_path 旁边）并检查容量
+
+        覆盖层替换 disk_path 成为可写层，承诺容量不增加，只检查物理空间和已有的超配情况
+        """
+        overlay_path = str(Path(disk_path).parent / file_name)
+        if os.path.exists(overlay_path):
+            raise ValueError(f"覆盖层文件已存在: {overlay_path}")
+        get_capacity_planner(self.config_manager).enforce(overlay_path, 0)
+        return overlay_path
+
+    @staticmethod
+    def _create_overlays(backings: Dict[str, str], overlays: Dict[str, str]):
+        """离线创建覆盖层 {drive id: 后端文件} -> {drive id: 覆盖层}，只写qcow2头部"""
+        for drive_id, backing_path in backings.items():
+            cmd = [
+                'qemu-img', 'create',
+                '-f', 'qcow2',
+                '-b', backing_path,
+                '-F', 'qcow2' if is_qcow2(backing_path) else 'raw',
+                overlays[drive_id]
+            ]
+            subprocess.run(cmd, check=True)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _live_snapshot(self, vm_name: str, drives: List[Tuple[str, str]], overlays: Dict[str, str],
+                       memory_path: str = '') -> Tuple[float, bool, Optional[FreezeResult]]:
+        """
+        对运行中的虚拟机执行在线快照
+
+        所有磁盘放在一个 transaction 中，要么全部切换到新覆盖层，要么全部不变。
+        不保存内存时按配置通过客户机代理冻结文件系统，冻结窗口只包含这个事务（QMP已提前连接）。
+        保存内存状态时先暂停虚拟机，磁盘切换后把内存迁移到文件，再恢复运行。
+
+        Returns:
+            (虚拟机暂停或I/O被阻塞的毫秒数, 是否保存了内存状态, 文件系统冻结结果)
+
+        Raises:
+            QMPError: 磁盘切换失败（此时所有磁盘保持不变）
+        """
+        actions = [
+            {
+                'type': 'blockdev-snapshot-sync',
+                'data': {
+                    'device': drive_id,
+                    'snapshot-file': overlays[drive_id],
+                    'format': 'qcow2',
+                    'mode': 'absolute-paths'
+                }
+            }
+            for drive_id, _ in drives
+        ]
+
+        with QMPClient.for_vm(vm_name, timeout=30.0) as qmp:
+            if not memory_path:
+                with self.manager.quiesce(vm_name) as freeze:
+                    started = time.perf_counter()
+                    qmp.execute('transaction', {'actions': actions})
+                    pause_ms = (time.perf_counter() - started) * 1000
+                return pause_ms, False, freeze
+
+            started = time.perf_counter()
+            qmp.execute('stop')
+            memory_saved = False
+            try:
+                qmp.execute('transaction', {'actions': actions})
+                # 磁盘已经切换，内存保存失败时快照仍然有效（只是没有内存状态）
+                try:
+                    qmp.execute('migrate', {'uri': f"exec:cat > {shlex.quote(memory_path)}"})
+                    qmp.wait_for_migration()
+                    memory_saved = True
+                except QMPError as e:
+                    print(f"保存内存状态失败，快照只包含磁盘: {e}")
+                    if os.path.exists(memory_path):
+                        os.remove(memory_path)
+            finally:
+                qmp.execute('cont')
+            return (time.perf_counter() - started) * 1000, memory_saved, None
+
+    def restore(self, vm_name: str, vm_config: Dict, snapshot_info: Dict,
+                backup: str = 'snapshot', backup_id: str = '') -> Dict:
+        """
+        把虚拟机的磁盘切换到以快照为后端的新覆盖层，不复制磁盘数据，耗时与磁盘大小无关
+
+        原来的当前磁盘不会被修改：backup 为 snapshot 或 reflink 时原样保留为一个快照
+        （它本身就是完整的状态，无需再复制），为 none 时删除。
+        快照含内存状态且恢复了所有磁盘时，虚拟机下次启动从内存状态继续运行（见 VMController.start_vm）。
+        """
+        # 确保虚拟机已停止
+        if self._is_running(vm_config):
+            raise ValueError(f"请先停止虚拟机 '{vm_name}' 再恢复快照")
+
+        current_drives = dict(vm_drives(vm_config))
+        snapshot_disks = {}
+        for drive_id, snapshot_path in self.manager.snapshot_disks(snapshot_info).items():
+            if drive_id not in current_drives:
+                print(f"虚拟机当前没有磁盘 {drive_id}，跳过恢复")
+                continue
+            if not os.path.exists(snapshot_path):
+                raise ValueError(f"快照文件不存在: {snapshot_path}")
+            snapshot_disks[drive_id] = snapshot_path
+        if not snapshot_disks:
+            raise ValueError("快照中没有可恢复的磁盘")
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        overlays = {
+            drive_id: self._plan_overlay(current_drives[drive_id], f"{vm_name}-{drive_id}-restore-{stamp}.qcow2")
+            for drive_id in snapshot_disks
+        }
+        try:
+            self._create_overlays(snapshot_disks, overlays)
+        except Exception:
+            self._remove_files(overlays.values())
+            raise
+
+        # 虚拟机改为使用新覆盖层（快照之后新增的磁盘保持不变）
+        replaced = {drive_id: current_drives[drive_id] for drive_id in overlays}
+        current_drives.update(overlays)
+        drives = sorted(current_drives.items(), key=lambda item: int(item[0][4:]))
+        vm_config['disk_path'] = current_drives['disk0']
+        if vm_config.get('extra_disks'):
+            vm_config['extra_disks'] = [path for drive_id, path in drives[1:]]
+        # 内存状态对应快照时的全部磁盘，快照之后新增了磁盘时无法从内存状态继续运行
+        memory_state = snapshot_info.get('memory_state', '')
+        if memory_state and os.path.exists(memory_state) and set(overlays) == set(current_drives):
+            vm_config['resume_state'] = {'memory_state': memory_state}
+        else:
+            vm_config.pop('resume_state', None)
+        self.config_manager.set_vm_config(vm_name, vm_config)
+
+        capacity_planner = get_capacity_planner(self.config_manager)
+        for overlay_path in overlays.values():
+            capacity_planner.register(overlay_path, 'disk', vm_name)
+
+        if backup != 'none' and not any(self._snapshot_using(vm_name, path) for path in replaced.values()):
+            for old_path in replaced.values():
+                capacity_planner.register(old_path, 'snapshot', vm_name)
+            first = replaced.get('disk0') or next(iter(replaced.values()))
+            return {
+                'disk_path': first,
+                'disks': replaced,
+                'memory_state': '',
+                'storage_pool': self.manager.pool_manager.pool_for_path(first) or '',
+                'vm_state': 'stopped'
+            }
+
+        # 不保留时删除原来的当前磁盘（仍被引用的除外）
+        for old_path in replaced.values():
+            reason = self._still_referenced(vm_name, old_path)
+            if reason:
+                print(f"保留原磁盘 {old_path}: {reason}")
+                continue
+            os.remove(old_path)
+            capacity_planner.unregister(old_path)
+        return {}
+
+    def _snapshot_using(self, vm_name: str, path: str) -> str:
+        """使用 path 作为磁盘文件的快照名称（内部快照所在的镜像也算）"""
+        target = os.path.abspath(path)
+        for snapshot_info in self.manager.snapshots_metadata.get(vm_name, {}).values():
+            paths = [snapshot_info.get('disk_path', '')] + list(self.manager.snapshot_disks(snapshot_info).values())
+            if target in {os.path.abspath(p) for p in paths if p}:
+                return snapshot_info['name']
+        return ''
+
+    def _still_referenced(self, vm_name: str, path: str) -> str:
+        """path 是否仍被快照、其他镜像或其他虚拟机（链接克隆等）使用，返回原因（未使用时为空）"""
+        snapshot_name = self._snapshot_using(vm_name, path)
+        if snapshot_name:
+            return f"被快照 '{snapshot_name}' 使用"
+        users = self.manager.backing_users(vm_name, [path])
+        if users:
+            return f"是 {', '.join(users)} 的后端"
+        other_vms = self._other_vm_users(vm_name, [path])
+        if other_vms:
+            return f"是虚拟机 {', '.join(other_vms)} 的后端链中的镜像"
+        return ''
+
+    def _other_vm_users(self, vm_name: str, paths: List[str]) -> List[str]:
+        """磁盘或快照的后端链中包含 paths 中某个文件的其他虚拟机"""
+        from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+
+        users = get_chain_maintenance(self.config_manager).chain_users(paths, exclude_vm=vm_name)
+        return sorted(set().union(*users.values())) if users else []
+
+    def delete(self, vm_name: str, vm_config: Dict, snapshot_info: Dict):
+        # 外部快照冻结的磁盘可能仍是当前磁盘或其他快照的后端，直接删除会破坏快照链
+        snapshot_disks = self.manager.snapshot_disks(snapshot_info)
+        users = self.manager.backing_users(vm_name, list(snapshot_disks.values()))
+        if users:
+            raise ValueError(f"快照仍被以下镜像作为后端，请先合并（快照清理）再删除: {', '.join(users)}")
+        other_vms = self._other_vm_users(vm_name, list(snapshot_disks.values()))
+        if other_vms:
+            raise ValueError(f"快照仍在以下虚拟机（链接克隆等）的后端链中，不能删除: {', '.join(other_vms)}")
+
+        # 删除快照文件和内存状态
+        paths = [Path(path) for path in snapshot_disks.values()]
+        if snapshot_info.get('memory_state'):
+            paths.append(Path(snapshot_info['memory_state']))
+        for snapshot_path in paths:
+            if snapshot_path.exists():
+                snapshot_path.unlink()
+            get_capacity_planner(self.config_manager).unregister(str(snapshot_path))
+
+            # 删除快照目录
+            snapshot_dir = snapshot_path.parent
+            if snapshot_dir.exists() and len(list(snapshot_dir.iterdir())) == 0:
+                snapshot_dir.rmdir()
+
+    def verify(self, snapshot_info: Dict) -> List[str]:
+        problems = []
+        for snapshot_path in self.manager.snapshot_disks(snapshot_info).values():
+            if not os.path.exists(snapshot_path):
+                problems.append(f"快照文件不存在: {snapshot_path}")
+                continue
+            if not is_qcow2(snapshot_path):
+                continue
+            try:
+                with Qcow2Image(snapshot_path) as image:
+                    problems.extend(image.validate())
+            except (OSError, Qcow2Error) as e:
+                problems.append(str(e))
+        return problems
+
+
+class InternalQcow2Backend(SnapshotBackend):
+    """
+    qcow2内部快照
+
+    快照保存在磁盘镜像内部，创建和恢复只修改镜像的快照表和引用计数，不复制数据：
+    已停止时用 qemu-img snapshot -c/-a/-d，运行中用 savevm/loadvm/delvm（同时保存内存状态）。
+    只支持单个qcow2磁盘的虚拟机。
+    """
+
+    name = 'internal'
+
+    def check(self, vm_name: str, vm_config: Dict):
+        super().check(vm_name, vm_config)
+        drives = vm_drives(vm_config)
+        if len(drives) != 1:
+            raise ValueError("内部快照只支持单磁盘虚拟机")
+        if not is_qcow2(drives[0][1]):
+            raise ValueError("内部快照只支持qcow2磁盘")
+
+    @staticmethod
+    def _hmp(qmp: QMPClient, command_line: str):
+        """执行HMP命令（savevm/loadvm/delvm 失败时只返回错误文本）"""
+        output = qmp.execute('human-monitor-command', {'command-line': command_line})
+        if output and output.strip():
+            raise QMPError(output.strip())
+
+    def create(self, vm_name: str, vm_config: Dict, snapshot_id: str, include_memory: bool) -> Dict:
+        disk_path = vm_config['disk_path']
+        running = self._is_running(vm_config)
+        pause_ms = 0.0
+        if running:
+            # savevm 总是保存内存状态，执行期间虚拟机暂停
+            with QMPClient.for_vm(vm_name, timeout=600.0) as qmp:
+                started = time.perf_counter()
+                self._hmp(qmp, f"savevm {snapshot_id}")
+                pause_ms = (time.perf_counter() - started) * 1000
+        else:
+            subprocess.run(['qemu-img', 'snapshot', '-c', snapshot_id, disk_path], check=True)
+        get_disk_inspector().invalidate(disk_path)
+
+        return {
+            'disk_path': disk_path,
+            'tag': snapshot_id,
+            'memory_state': '',
+            'memory_saved': running,
+            'pause_ms': round(pause_ms, 1),
+            'storage_pool': self.manager.pool_manager.pool_for_path(disk_path) or '',
+            'vm_state': 'running' if running else 'stopped'
+        }
+
+    def _ensure_current_disk(self, vm_config: Dict, snapshot_info: Dict):
+        """内部快照所在的镜像必须仍是虚拟机当前磁盘（之后做过外部快照时它已成为只读后端）"""
+        if os.path.abspath(vm_config.get('disk_path', '')) != os.path.abspath(snapshot_info['disk_path']):
+            raise ValueError("快照所在的镜像已不是虚拟机当前磁盘，无法直接恢复")
+
+    def restore(self, vm_name: str, vm_config: Dict, snapshot_info: Dict,
+                backup: str = 'snapshot', backup_id: str = '') -> Dict:
+        """
+        恢复内部快照（原地修改镜像）
+
+        backup 为 snapshot 时先把当前状态保存为另一个内部快照；为 reflink 时在已停止状态下
+        用reflink克隆镜像到 .backup，文件系统不支持时跳过，不做完整复制。
+        已停止时 qemu-img 只恢复磁盘，快照保存了内存状态时下次启动用 -loadvm 继续运行。
+        """
+        self._ensure_current_disk(vm_config, snapshot_info)
+        tag = snapshot_info.get('tag', snapshot_info['id'])
+        fields = {}
+        if backup == 'snapshot' and backup_id:
+            fields = self.create(vm_name, vm_config, backup_id, False)
+        elif backup == 'reflink':
+            disk_path = snapshot_info['disk_path']
+            if self._is_running(vm_config):
+                print("虚拟机运行中，无法生成一致的reflink备份，跳过备份")
+            elif not reflink_copy(disk_path, f"{disk_path}.backup"):
+                print("文件系统不支持reflink或备份文件已存在，跳过备份")
+        if self._is_running(vm_config):
+            with QMPClient.for_vm(vm_name, timeout=600.0) as qmp:
+                self._hmp(qmp, f"loadvm {tag}")
+        else:
+            subprocess.run(['qemu-img', 'snapshot', '-a', tag, snapshot_info['disk_path']], check=True)
+        get_disk_inspector().invalidate(snapshot_info['disk_path'])
+        if snapshot_info.get('memory_saved') and not self._is_running(vm_config):
+            vm_config['resume_state'] = {'loadvm': tag}
+        else:
+            vm_config.pop('resume_state', None)
+        self.config_manager.set_vm_config(vm_name, vm_config)
+        return fields
+
+    def delete(self, vm_name: str, vm_config: Dict, snapshot_info: Dict):
+        tag = snapshot_info.get('tag', snapshot_info['id'])
+        disk_path = snapshot_info['disk_path']
+        if not os.path.exists(disk_path):
+            return
+        if self._is_running(vm_config) and os.path.abspath(vm_config.get('disk_path', '')) == os.path.abspath(disk_path):
+            with QMPClient.for_vm(vm_name, timeout=600.0) as qmp:
+                self._hmp(qmp, f"delvm {tag}")
+        else:
+            subprocess.run(['qemu-img', 'snapshot', '-d', tag, disk_path], check=True)
+        get_disk_inspector().invalidate(disk_path)
+
+    def verify(self, snapshot_info: Dict) -> List[str]:
+        disk_path = snapshot_info['disk_path']
+        tag = snapshot_info.get('tag', snapshot_info['id'])
+        try:
+            with Qcow2Image(disk_path) as image:
+                if tag not in [snapshot.name for snapshot in image.snapshots()]:
+                    return [f"镜像中没有内部快照: {tag}"]
+                return image.validate()
+        except (OSError, Qcow2Error) as e:
+            return [str(e)]
+
+
+BACKENDS = {
+    backend.name: backend for backend in (ExternalOverlayBackend, InternalQcow2Backend)
+}
+
+
+def benchmark_backends(directory: str, size_mb: int = 256, rounds: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    对比两种后端在离线状态下的创建/恢复/删除耗时（毫秒，取中位数）
+
+    在 directory 中生成写满随机数据的qcow2磁盘：外部后端的恢复是在快照上创建新覆盖层，
+    内部后端只修改快照表，两者都不复制数据。
+    """
+    def timed_run(cmd: List[str]) -> float:
+        started = time.perf_counter()
+        subprocess.run(cmd, check=True, capture_output=True)
+        return (time.perf_counter() - started) * 1000
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=directory, prefix='ltwin-snapbench-') as work_dir:
+        raw_path = os.path.join(work_dir, 'data.raw')
+        with open(raw_path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        base_path = os.path.join(work_dir, 'disk.qcow2')
+        subprocess.run(['qemu-img', 'convert', '-f', 'raw', '-O', 'qcow2', raw_path, base_path],
+                       check=True, capture_output=True)
+        os.remove(raw_path)
+
+        samples = {'external': {'create': [], 'restore': [], 'delete': []},
+                   'internal': {'create': [], 'restore': [], 'delete': []}}
+        for index in range(rounds):
+            # 外部: 在磁盘上创建覆盖层，恢复时丢弃它并在冻结的磁盘上创建新覆盖层
+            overlay_path = os.path.join(work_dir, f'overlay{index}.qcow2')
+            restored_path = os.path.join(work_dir, f'restored{index}.qcow2')
+            samples['external']['create'].append(timed_run(
+                ['qemu-img', 'create', '-f', 'qcow2', '-b', base_path, '-F', 'qcow2', overlay_path]))
+            samples['external']['restore'].append(timed_run(
+                ['qemu-img', 'create', '-f', 'qcow2', '-b', base_path, '-F', 'qcow2', restored_path]))
+            os.remove(overlay_path)
+            started = time.perf_counter()
+            os.remove(restored_path)
+            samples['external']['delete'].append((time.perf_counter() - started) * 1000)
+
+            # 内部
+            tag = f'bench{index}'
+            samples['internal']['create'].append(timed_run(['qemu-img', 'snapshot', '-c', tag, base_path]))
+            samples['internal']['restore'].append(timed_run(['qemu-img', 'snapshot', '-a', tag, base_path]))
+            samples['internal']['delete'].append(timed_run(['qemu-img', 'snapshot', '-d', tag, base_path]))
+
+    for backend, operations in samples.items():
+        results[backend] = {
+            operation: round(sorted(values)[len(values) // 2], 1) for operation, values in operations.items()
+        }
+    return results
+
+
+def main(argv=None) -> int:
+    """命令行: python -m ltwin_manager.utils.snapshot_backends <目录> [大小MB] [轮数]"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print(main.__doc__)
+        return 2
+    directory = argv[0]
+    size_mb = int(argv[1]) if len(argv) > 1 else 256
+    rounds = int(argv[2]) if len(argv) > 2 else 3
+    try:
+        results = benchmark_backends(directory, size_mb, rounds)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"基准测试失败: {e}")
+        return 1
+    print(f"{'后端':<16}{'创建(ms)':>12}{'恢复(ms)':>12}{'删除(ms)':>12}")
+    for backend, timings in results.items():
+        print(f"{BACKEND_NAMES[backend]:<16}{timings['create']:>12}{timings['restore']:>12}{timings['delete']:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
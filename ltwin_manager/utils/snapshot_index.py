@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+快照元数据索引
+每台虚拟机一个索引文件（index/<虚拟机>.json），保存快照字典和预先排好的顺序（最新的在前）。
+只有访问到的虚拟机才会读取索引文件，读取后缓存在内存中；文件被其他进程修改（修改时间变化）时重新读取。
+对外表现为只读映射 {虚拟机: {快照ID: 快照信息}}，修改通过 put/remove/save 进行。
+另有一个摘要文件（summary.idx）记录每台虚拟机快照使用的文件和最早的创建时间，
+"某个文件被哪台虚拟机的快照使用"之类的跨虚拟机查询只读摘要，不需要读取所有虚拟机的索引。
+"""
+
+import json
+import os
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+INDEX_FORMAT = 1
+SUMMARY_FILE = 'summary.idx'
+
+
+class SnapshotIndex(Mapping):
+    """按虚拟机懒加载的快照元数据索引"""
+
+    def __init__(self, index_dir: Path, on_load: Callable[[str, Dict[str, Dict]], bool] = None,
+                 paths_of: Callable[[Dict], Iterable[str]] = None):
+        """
+        Args:
+            index_dir: 索引文件目录
+            on_load: 读取某台虚拟机的索引后调用（用于补全旧元数据），返回 True 时写回文件
+            paths_of: 快照信息 -> 快照使用的文件（记录到摘要中）
+        """
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.on_load = on_load
+        self.paths_of = paths_of or (lambda info: [info.get('disk_path', '')])
+        self._lock = threading.RLock()
+        self._snapshots: Dict[str, Dict[str, Dict]] = {}  # 虚拟机 -> {快照ID: 快照信息}
+        self._order: Dict[str, List[str]] = {}  # 虚拟机 -> 按创建时间排序的快照ID（最新的在前）
+        self._mtimes: Dict[str, int] = {}  # 虚拟机 -> 读取或写入时索引文件的修改时间
+        self._versions: Dict[str, int] = {}  # 虚拟机 -> 内容版本号，每次变化加一
+        self._summary: Optional[Dict[str, Dict]] = None  # 虚拟机 -> {'paths': [...], 'oldest': 创建时间}
+        self._summary_mtime: Optional[int] = None
+        self._owners: Dict[str, Set[str]] = {}  # 文件绝对路径 -> 使用它的虚拟机
+        self._building_summary = False
+
+    def _path(self, vm_name: str) -> Path:
+        return self.index_dir / f"{vm_name}.json"
+
+    @staticmethod
+    def _mtime(path: Path) -> Optional[int]:
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _ensure_loaded(self, vm_name: str) -> Dict[str, Dict]:
+        """返回虚拟机的快照字典（必要时读取索引文件）"""
+        path = self._path(vm_name)
+        mtime = self._mtime(path)
+        if vm_name in self._snapshots and self._mtimes.get(vm_name) == mtime:
+            return self._snapshots[vm_name]
+
+        snapshots, order = {}, []
+        if mtime is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                snapshots = data.get('snapshots', {})
+                order = data.get('order', [])
+            except Exception as e:
+                print(f"加载快照索引失败 {path}: {e}")
+        if sorted(order) != sorted(snapshots):
+            order = self._sorted_ids(snapshots)
+        self._snapshots[vm_name] = snapshots
+        self._order[vm_name] = order
+        self._mtimes[vm_name] = mtime
+        self._versions[vm_name] = self._versions.get(vm_name, 0) + 1
+        if snapshots and self.on_load and self.on_load(vm_name, snapshots):
+            self.save(vm_name)
+        else:
+            self._update_summary(vm_name)
+        return snapshots
+
+    @staticmethod
+    def _sorted_ids(snapshots: Dict[str, Dict]) -> List[str]:
+        return [info['id'] for info in sorted(snapshots.values(), key=lambda x: (x['created_at'], x['id']),
+                                              reverse=True)]
+
+    # ---------- Mapping 接口 ----------
+
+    def __getitem__(self, vm_name: str) -> Dict[str, Dict]:
+        with self._lock:
+            snapshots = self._ensure_loaded(vm_name)
+        if not snapshots:
+            raise KeyError(vm_name)
+        return snapshots
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.vm_names())
+
+    def __len__(self) -> int:
+        return len(self.vm_names())
+
+    def __contains__(self, vm_name) -> bool:
+        with self._lock:
+            return bool(self._ensure_loaded(vm_name))
+
+    def vm_names(self) -> List[str]:
+        """有快照的虚拟机（只列目录，不读取索引文件）"""
+        with self._lock:
+            names = {path.stem for path in self.index_dir.glob('*.json')}
+            names.update(name for name, snapshots in self._snapshots.items() if snapshots)
+        return sorted(names)
+
+    # ---------- 查询 ----------
+
+    def find(self, vm_name: str, snapshot_id: str) -> Optional[Dict]:
+        """按ID查找快照"""
+        with self._lock:
+            return self._ensure_loaded(vm_name).get(snapshot_id)
+
+    def ordered(self, vm_name: str) -> List[Dict]:
+        """按创建时间排序的快照信息（最新的在前）"""
+        with self._lock:
+            snapshots = self._ensure_loaded(vm_name)
+            return [snapshots[snapshot_id] for snapshot_id in self._order[vm_name]]
+
+    def version(self, vm_name: str) -> int:
+        """内容版本号，用于判断基于索引计算的缓存是否过期"""
+        with self._lock:
+            self._ensure_loaded(vm_name)
+            return self._versions[vm_name]
+
+    # ---------- 摘要（跨虚拟机查询） ----------
+
+    def _summary_path(self) -> Path:
+        return self.index_dir / SUMMARY_FILE
+
+    def _ensure_summary(self) -> Dict[str, Dict]:
+        """返回摘要（必要时读取摘要文件；文件不存在时读取所有索引生成一次）"""
+        path = self._summary_path()
+        mtime = self._mtime(path)
+        if self._summary is not None and self._summary_mtime == mtime:
+            return self._summary
+        if mtime is None:
+            self._summary = {}
+            self._building_summary = True
+            try:
+                for path_item in self.index_dir.glob('*.json'):
+                    self._ensure_loaded(path_item.stem)
+                    self._summary[path_item.stem] = self._summary_entry(path_item.stem)
+            finally:
+                self._building_summary = False
+            self._save_summary()
+        else:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._summary = json.load(f).get('vms', {})
+            except Exception as e:
+                print(f"加载快照摘要失败 {path}: {e}")
+                self._summary = {}
+            self._summary_mtime = mtime
+        self._rebuild_owners()
+        return self._summary
+
+    def _summary_entry(self, vm_name: str) -> Dict:
+        snapshots = self._snapshots.get(vm_name, {})
+        paths = {os.path.abspath(path) for info in snapshots.values() for path in self.paths_of(info) if path}
+        order = self._order.get(vm_name) or []
+        return {
+            'paths': sorted(paths),
+            'oldest': snapshots[order[-1]].get('created_at', '') if order else ''
+        }
+
+    def _rebuild_owners(self):
+        self._owners = {}
+        for vm_name, entry in self._summary.items():
+            for path in entry['paths']:
+                self._owners.setdefault(path, set()).add(vm_name)
+
+    def _update_summary(self, vm_name: str):
+        """虚拟机的快照读取或修改后更新摘要（内容没有变化时不写文件）"""
+        if self._building_summary:
+            return
+        summary = self._ensure_summary()
+        entry = self._summary_entry(vm_name)
+        if summary.get(vm_name, {'paths': [], 'oldest': ''}) == entry:
+            return
+        if entry['paths'] or entry['oldest']:
+            summary[vm_name] = entry
+        else:
+            summary.pop(vm_name, None)
+        self._rebuild_owners()
+        self._save_summary()
+
+    def _save_summary(self):
+        path = self._summary_path()
+        try:
+            temp_path = path.with_name(path.name + '.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': INDEX_FORMAT, 'vms': self._summary}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"保存快照摘要失败: {e}")
+        self._summary_mtime = self._mtime(path)
+
+    def owners(self, path: str) -> Set[str]:
+        """快照使用了该文件的虚拟机（只读摘要）"""
+        with self._lock:
+            self._ensure_summary()
+            return set(self._owners.get(os.path.abspath(path), ()))
+
+    def referenced_paths(self) -> Set[str]:
+        """所有快照使用的文件（只读摘要）"""
+        with self._lock:
+            self._ensure_summary()
+            return set(self._owners)
+
+    def oldest(self, vm_name: str) -> str:
+        """虚拟机最早的快照的创建时间（没有快照时为空，只读摘要）"""
+        with self._lock:
+            return self._ensure_summary().get(vm_name, {}).get('oldest', '')
+
+    # ---------- 修改 ----------
+
+    def put(self, vm_name: str, info: Dict):
+        """添加或替换快照并写回索引文件"""
+        with self._lock:
+            snapshots = self._ensure_loaded(vm_name)
+            order = self._order[vm_name]
+            if info['id'] in snapshots:
+                order.remove(info['id'])
+            snapshots[info['id']] = info
+            # 新快照通常是最新的，从头部开始找插入位置
+            key = (info['created_at'], info['id'])
+            position = 0
+            while position < len(order) and (snapshots[order[position]]['created_at'], order[position]) > key:
+                position += 1
+            order.insert(position, info['id'])
+            self.save(vm_name)
+
+    def remove(self, vm_name: str, snapshot_id: str) -> Optional[Dict]:
+        """删除快照并写回索引文件，返回被删除的快照信息"""
+        with self._lock:
+            snapshots = self._ensure_loaded(vm_name)
+            info = snapshots.pop(snapshot_id, None)
+            if info is not None:
+                self._order[vm_name].remove(snapshot_id)
+                self.save(vm_name)
+            return info
+
+    def save(self, vm_name: str) -> bool:
+        """
+        把内存中的快照字典写回索引文件（直接修改快照信息后调用）；没有快照时删除索引文件
+        """
+        with self._lock:
+            snapshots = self._snapshots.get(vm_name, {})
+            path = self._path(vm_name)
+            try:
+                if snapshots:
+                    temp_path = path.with_name(path.name + '.tmp')
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        json.dump({'format': INDEX_FORMAT, 'order': self._order[vm_name], 'snapshots': snapshots},
+                                  f, ensure_ascii=False, indent=2)
+                    os.replace(temp_path, path)
+                elif path.exists():
+                    path.unlink()
+            except OSError as e:
+                print(f"保存快照索引失败: {e}")
+                return False
+            self._mtimes[vm_name] = self._mtime(path)
+            self._versions[vm_name] = self._versions.get(vm_name, 0) + 1
+            self._update_summary(vm_name)
+            return True
+
+    def import_legacy(self, legacy_file: Path) -> int:
+        """
+        把旧的 snapshots.json（所有虚拟机在一个文件中）拆分为每台虚拟机一个索引文件，
+        原文件改名为 snapshots.json.migrated
+
+        Returns:
+            迁移的虚拟机数量
+        """
+        legacy_file = Path(legacy_file)
+        if not legacy_file.exists():
+            return 0
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            print(f"读取旧快照元数据失败: {e}")
+            return 0
+
+        with self._lock:
+            for vm_name, snapshots in legacy.items():
+                if not snapshots or self._path(vm_name).exists():
+                    continue
+                self._snapshots[vm_name] = snapshots
+                self._order[vm_name] = self._sorted_ids(snapshots)
+                self.save(vm_name)
+                # 下次访问时重新读取，以便经过 on_load 补全
+                self._snapshots.pop(vm_name, None)
+        legacy_file.rename(legacy_file.with_name(legacy_file.name + '.migrated'))
+        return len(legacy)
@@ -4,13 +4,32 @@
 用于管理虚拟机快照的创建、恢复、删除等操作
 """
 
+import functools
 import os
-import json
 import subprocess
+import threading
+from collections import Counter
 from pathlib import Path
 from typing import Dict, List, Optional
 from datetime import datetime
-import shutil
+
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+from ltwin_manager.utils.snapshot_scheduler import get_vm_schedule
+from ltwin_manager.utils.snapshot_backends import BACKENDS, RESTORE_BACKUP_MODES, SnapshotBackend, vm_drives
+from ltwin_manager.utils.snapshot_index import SnapshotIndex
+from ltwin_manager.utils.guest_agent import FilesystemFreeze, FSFREEZE_MODES
+
+
+def _vm_locked(method):
+    """持有虚拟机锁（第一个参数为虚拟机名称）执行，快照、恢复、删除和调整磁盘大小互斥"""
+    @functools.wraps(method)
+    def wrapper(self, vm_name, *args, **kwargs):
+        with self.vm_lock(vm_name):
+            return method(self, vm_name, *args, **kwargs)
+    return wrapper
 
 
 class Snapshot:
@@ -36,78 +55,90 @@ class SnapshotManager:
             snapshot_location = os.path.join(os.path.expanduser('~'), '.ltwin', 'snapshots')
         self.snapshots_dir = Path(snapshot_location)
         self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        self.pool_manager = get_storage_pool_manager(config_manager)
+        self.backends = {name: backend(self) for name, backend in BACKENDS.items()}
+        self._vm_locks: Dict[str, threading.RLock] = {}
+        self._vm_locks_guard = threading.Lock()
         
-        # 快照元数据文件
-        self.metadata_file = self.snapshots_dir / "snapshots.json"
-        self.snapshots_metadata = self._load_snapshots_metadata()
+        # 快照元数据：每台虚拟机一个索引文件，访问时才读取
+        self.snapshots_metadata = SnapshotIndex(
+            self.snapshots_dir / "index", on_load=self._migrate_parent_links, paths_of=self._snapshot_paths
+        )
+        self.snapshots_metadata.import_legacy(self.snapshots_dir / "snapshots.json")
+        self._list_cache: Dict[str, tuple] = {}  # 虚拟机 -> (索引版本, 当前快照, list_snapshots 结果)
     
-    def _load_snapshots_metadata(self) -> Dict:
-        """加载快照元数据"""
-        if self.metadata_file.exists():
-            try:
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"加载快照元数据失败: {e}")
-                return {}
-        return {}
-    
-    def _save_snapshots_metadata(self):
-        """保存快照元数据"""
-        try:
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.snapshots_metadata, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存快照元数据失败: {e}")
+    def get_backend_name(self, vm_name: str) -> str:
+        """虚拟机使用的快照后端：虚拟机配置的 snapshot_backend 优先于全局配置"""
+        vm_config = self.config_manager.get_vm_config(vm_name) or {}
+        name = vm_config.get('snapshot_backend') or self.config_manager.get_global_config("snapshot_backend")
+        return name if name in self.backends else 'external'
+    
+    def vm_lock(self, vm_name: str) -> threading.RLock:
+        """
+        虚拟机的操作锁
+        
+        计划快照在后台线程中执行，与界面上的恢复、删除、调整磁盘大小会修改同一份虚拟机配置、
+        快照索引和容量台账，这些入口都持有同一把锁依次执行
+        """
+        with self._vm_locks_guard:
+            return self._vm_locks.setdefault(vm_name, threading.RLock())
+    
+    def _backend_of(self, snapshot_info: Dict) -> SnapshotBackend:
+        """快照所属的后端（旧元数据没有 backend 字段，都是外部快照）"""
+        return self.backends.get(snapshot_info.get('backend', 'external'), self.backends['external'])
+    
+    def _new_snapshot_id(self, vm_name: str) -> str:
+        """生成快照ID（同一秒内多次创建时加序号）"""
+        base_id = f"{vm_name}_snap_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        snapshot_id = base_id
+        suffix = 1
+        while self.snapshots_metadata.find(vm_name, snapshot_id):
+            snapshot_id = f"{base_id}.{suffix}"
+            suffix += 1
+        return snapshot_id
+    
+    def _add_snapshot_metadata(self, vm_name: str, snapshot_id: str, snapshot_name: str,
+                               description: str, backend: str, fields: Dict, parent_id: Optional[str]):
+        """记录快照元数据并保存"""
+        self.snapshots_metadata.put(vm_name, {
+            'id': snapshot_id,
+            'name': snapshot_name,
+            'description': description,
+            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'backend': backend,
+            'parent_id': parent_id,
+            **fields
+        })
     
-    def create_snapshot(self, vm_name: str, snapshot_name: str, description: str = "") -> bool:
-        """创建虚拟机快照"""
+    @_vm_locked
+    def create_snapshot(self, vm_name: str, snapshot_name: str, description: str = "",
+                        include_memory: bool = False) -> bool:
+        """
+        创建虚拟机快照（按虚拟机选择的后端）
+        
+        Args:
+            include_memory: 运行中时同时保存内存状态（虚拟机在保存期间暂停）
+        """
         try:
             # 获取虚拟机配置
             vm_config = self.config_manager.get_vm_config(vm_name)
             if not vm_config:
                 raise ValueError(f"虚拟机 '{vm_name}' 不存在")
+            if include_memory and vm_config.get('status') != 'running':
+                raise ValueError(f"虚拟机 '{vm_name}' 未运行，无法保存内存状态")
             
-            # 确保虚拟机正在运行
-            if vm_config.get('status') != 'running':
-                raise ValueError(f"虚拟机 '{vm_name}' 未运行，无法创建快照")
-            
-            # 生成快照ID
-            snapshot_id = f"{vm_name}_snap_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            
-            # 创建快照目录
-            snapshot_dir = self.snapshots_dir / vm_name / snapshot_id
-            snapshot_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 创建快照 - 对于qcow2格式，我们可以使用qemu-img
-            disk_path = vm_config['disk_path']
-            snapshot_path = snapshot_dir / f"{vm_name}_snapshot.qcow2"
-            
-            # 使用qemu-img创建快照
-            cmd = [
-                'qemu-img', 'create',
-                '-f', 'qcow2',
-                '-b', disk_path,  # 基础镜像
-                '-F', 'qcow2',    # 基础镜像格式
-                str(snapshot_path)
-            ]
+            snapshot_id = self._new_snapshot_id(vm_name)
+            parent_id = self.get_current_snapshot(vm_name)
+            backend = self.backends[self.get_backend_name(vm_name)]
+            backend.check(vm_name, vm_config)
+            fields = backend.create(vm_name, vm_config, snapshot_id, include_memory)
             
-            subprocess.run(cmd, check=True)
-            
-            # 保存快照元数据
-            if vm_name not in self.snapshots_metadata:
-                self.snapshots_metadata[vm_name] = {}
-                
-            self.snapshots_metadata[vm_name][snapshot_id] = {
-                'id': snapshot_id,
-                'name': snapshot_name,
-                'description': description,
-                'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'disk_path': str(snapshot_path),
-                'vm_state': 'stopped'  # 记录虚拟机状态
-            }
-            
-            self._save_snapshots_metadata()
+            # 保存快照元数据，新快照成为当前位置
+            self._add_snapshot_metadata(vm_name, snapshot_id, snapshot_name, description, backend.name,
+                                        fields, parent_id)
+            self._set_current_snapshot(vm_name, snapshot_id)
+            self.invalidate_usage(vm_name, self._snapshot_paths(fields))
+            self.schedule_chain_shortening(vm_name)
             return True
             
         except subprocess.CalledProcessError as e:
@@ -117,11 +148,49 @@ class SnapshotManager:
             print(f"创建快照时发生错误: {e}")
             return False
     
-    def restore_snapshot(self, vm_name: str, snapshot_id: str) -> bool:
-        """恢复虚拟机快照"""
+    def get_restore_backup_mode(self, vm_name: str = None) -> str:
+        """
+        恢复快照前保留当前状态的方式（全局配置 snapshot_restore_backup）
+        
+        虚拟机的快照计划要求高风险操作前创建快照时，总是把当前状态保存为快照
+        """
+        mode = self.config_manager.get_global_config("snapshot_restore_backup")
+        mode = mode if mode in RESTORE_BACKUP_MODES else 'snapshot'
+        if vm_name and mode != 'snapshot' and self.config_manager.get_global_config("enable_snapshots") is not False \
+                and get_vm_schedule(self.config_manager, vm_name).before_risky:
+            return 'snapshot'
+        return mode
+    
+    def get_fsfreeze_mode(self, vm_name: str) -> str:
+        """在线快照前冻结客户机文件系统的方式：虚拟机配置的 snapshot_fsfreeze 优先于全局配置"""
+        vm_config = self.config_manager.get_vm_config(vm_name) or {}
+        mode = vm_config.get('snapshot_fsfreeze') or self.config_manager.get_global_config("snapshot_fsfreeze")
+        return mode if mode in FSFREEZE_MODES else 'off'
+    
+    def quiesce(self, vm_name: str) -> FilesystemFreeze:
+        """
+        冻结客户机文件系统的上下文（通过客户机代理，按 get_fsfreeze_mode 决定是否冻结）
+        
+        只应包住切换磁盘的最短操作；超过 fsfreeze_max_frozen_ms 时强制解冻
+        """
+        return FilesystemFreeze(
+            vm_name, self.get_fsfreeze_mode(vm_name),
+            freeze_timeout=float(self.config_manager.get_global_config("fsfreeze_timeout_seconds") or 10),
+            max_frozen_ms=float(self.config_manager.get_global_config("fsfreeze_max_frozen_ms") or 2000)
+        )
+    
+    @_vm_locked
+    def restore_snapshot(self, vm_name: str, snapshot_id: str, backup: str = None) -> bool:
+        """
+        恢复虚拟机快照
+        
+        Args:
+            backup: 当前状态的保留方式（snapshot/reflink/none），默认使用全局配置
+        """
         try:
             # 检查快照是否存在
-            if vm_name not in self.snapshots_metadata or snapshot_id not in self.snapshots_metadata[vm_name]:
+            snapshot_info = self.snapshots_metadata.find(vm_name, snapshot_id)
+            if snapshot_info is None:
                 raise ValueError(f"快照 '{snapshot_id}' 不存在")
             
             # 获取虚拟机配置
@@ -129,32 +198,23 @@ class SnapshotManager:
             if not vm_config:
                 raise ValueError(f"虚拟机 '{vm_name}' 不存在")
             
-            # 确保虚拟机已停止
-            if vm_config.get('status') == 'running':
-                raise ValueError(f"请先停止虚拟机 '{vm_name}' 再恢复快照")
-            
-            # 获取快照信息
-            snapshot_info = self.snapshots_metadata[vm_name][snapshot_id]
-            snapshot_path = snapshot_info['disk_path']
-            
-            # 使用qemu-img将快照合并回原始磁盘
-            original_disk_path = vm_config['disk_path']
-            
-            # 首先备份原磁盘
-            backup_path = f"{original_disk_path}.backup"
-            shutil.copy2(original_disk_path, backup_path)
-            
-            # 将快照内容复制回原磁盘
-            cmd = [
-                'qemu-img', 'convert',
-                '-f', 'qcow2',
-                '-O', 'qcow2',
-                snapshot_path,
-                original_disk_path
-            ]
-            
-            subprocess.run(cmd, check=True)
+            backup = backup if backup in RESTORE_BACKUP_MODES else self.get_restore_backup_mode(vm_name)
+            backend = self._backend_of(snapshot_info)
+            backup_id = self._new_snapshot_id(vm_name)
+            previous_id = self.get_current_snapshot(vm_name)
+            fields = backend.restore(vm_name, vm_config, snapshot_info, backup, backup_id)
             
+            # 恢复前的状态作为快照保留（位于原来的分支上）
+            if fields:
+                self._add_snapshot_metadata(
+                    vm_name, backup_id, f"恢复前状态 ({snapshot_info['name']})",
+                    f"恢复快照 '{snapshot_info['name']}' 时自动保存", backend.name,
+                    {**fields, 'auto': True}, previous_id
+                )
+            # 之后创建的快照成为该快照的子节点（新分支）
+            self._set_current_snapshot(vm_name, snapshot_id)
+            self.invalidate_usage(vm_name, self._snapshot_paths(snapshot_info) + self._snapshot_paths(fields))
+            self.schedule_chain_shortening(vm_name)
             return True
             
         except subprocess.CalledProcessError as e:
@@ -164,63 +224,402 @@ class SnapshotManager:
             print(f"恢复快照时发生错误: {e}")
             return False
     
+    @_vm_locked
     def delete_snapshot(self, vm_name: str, snapshot_id: str) -> bool:
         """删除虚拟机快照"""
         try:
             # 检查快照是否存在
-            if vm_name not in self.snapshots_metadata or snapshot_id not in self.snapshots_metadata[vm_name]:
+            snapshot_info = self.snapshots_metadata.find(vm_name, snapshot_id)
+            if snapshot_info is None:
                 raise ValueError(f"快照 '{snapshot_id}' 不存在")
             
-            # 删除快照文件
-            snapshot_info = self.snapshots_metadata[vm_name][snapshot_id]
-            snapshot_path = Path(snapshot_info['disk_path'])
-            
-            if snapshot_path.exists():
-                snapshot_path.unlink()
-            
-            # 删除快照目录
-            snapshot_dir = snapshot_path.parent
-            if snapshot_dir.exists() and len(list(snapshot_dir.iterdir())) == 0:
-                snapshot_dir.rmdir()
+            vm_config = self.config_manager.get_vm_config(vm_name) or {}
+            self._backend_of(snapshot_info).delete(vm_name, vm_config, snapshot_info)
             
-            # 从元数据中移除
-            del self.snapshots_metadata[vm_name][snapshot_id]
+            # 子快照改挂到被删除快照的父节点上
+            parent_id = snapshot_info.get('parent_id')
+            for info in self.snapshots_metadata[vm_name].values():
+                if info.get('parent_id') == snapshot_id:
+                    info['parent_id'] = parent_id
+            if self.get_current_snapshot(vm_name) == snapshot_id:
+                self._set_current_snapshot(vm_name, parent_id)
             
-            # 如果该虚拟机没有其他快照，则删除虚拟机条目
-            if not self.snapshots_metadata[vm_name]:
-                del self.snapshots_metadata[vm_name]
-            
-            self._save_snapshots_metadata()
+            # 从元数据中移除（没有其他快照时删除该虚拟机的索引文件）
+            self.snapshots_metadata.remove(vm_name, snapshot_id)
+            self.invalidate_usage(vm_name, self._snapshot_paths(snapshot_info))
             return True
             
         except Exception as e:
             print(f"删除快照失败: {e}")
             return False
     
-    def list_snapshots(self, vm_name: str) -> List[Dict]:
-        """列出虚拟机的所有快照"""
-        if vm_name not in self.snapshots_metadata:
+    @staticmethod
+    def snapshot_disks(snapshot_info: Dict) -> Dict[str, str]:
+        """快照独占的磁盘文件 {drive id: 路径}（旧元数据只有 disk_path；内部快照不占用单独的文件）"""
+        if snapshot_info.get('backend') == 'internal':
+            return {}
+        return snapshot_info.get('disks') or {'disk0': snapshot_info['disk_path']}
+    
+    def _child_map(self, vm_name: str) -> Dict[str, List[str]]:
+        """虚拟机当前磁盘和所有快照文件中的 qcow2 镜像按后端分组 {后端绝对路径: [直接以它为后端的镜像]}"""
+        candidates = [path for _, path in vm_drives(self.config_manager.get_vm_config(vm_name) or {})]
+        for snapshot_info in self.snapshots_metadata.get(vm_name, {}).values():
+            candidates.extend(self.snapshot_disks(snapshot_info).values())
+        
+        children = {}
+        for path in dict.fromkeys(candidates):
+            if not is_qcow2(path):
+                continue
+            try:
+                with Qcow2Image(path) as image:
+                    backing = image.resolve_backing_path()
+            except (OSError, Qcow2Error):
+                continue
+            if backing:
+                children.setdefault(os.path.abspath(backing), []).append(path)
+        return children
+    
+    def backing_users(self, vm_name: str, paths: List[str]) -> List[str]:
+        """虚拟机当前磁盘和其他快照中，直接以 paths 中某个文件为后端的镜像"""
+        targets = {os.path.abspath(path) for path in paths}
+        children = self._child_map(vm_name)
+        users = []
+        for target in targets:
+            users.extend(path for path in children.get(target, [])
+                         if os.path.abspath(path) not in targets and path not in users)
+        return users
+    
+    @_vm_locked
+    def snapshot_usage(self, vm_name: str) -> Dict[str, Dict]:
+        """
+        各快照占用的空间
+        
+        exclusive_bytes: 删除快照后能回收的空间（外部快照先合并到子镜像，子镜像都已覆盖的簇不需要合并）
+        shared_bytes: 仍被子镜像、其他快照或当前磁盘需要的数据
+        allocated_clusters: 快照中有数据的簇数
+        
+        结果保存在快照元数据中，只有相关镜像（快照文件、子镜像）的修改时间或大小变化时才重新计算，
+        因此创建或合并快照后只有受影响的快照需要重新遍历簇分配表
+        
+        Returns:
+            {快照ID: 占用信息}，无法计算时包含 error
+        """
+        snapshots = self.snapshots_metadata.get(vm_name, {})
+        children = self._child_map(vm_name) if any(
+            info.get('backend', 'external') == 'external' for info in snapshots.values()) else {}
+        
+        usage = {}
+        stale_internal: Dict[str, List[Dict]] = {}
+        changed = False
+        for snapshot_id, info in snapshots.items():
+            if info.get('backend') == 'internal':
+                paths = [info['disk_path']]
+            else:
+                paths = list(self.snapshot_disks(info).values())
+                paths += [child for path in list(paths) for child in children.get(os.path.abspath(path), [])]
+            if info.get('memory_state'):
+                paths.append(info['memory_state'])
+            signature = [self._file_signature(path) for path in paths]
+            
+            cached = info.get('usage')
+            if cached and cached.get('signature') == signature:
+                usage[snapshot_id] = {key: value for key, value in cached.items() if key != 'signature'}
+                continue
+            if info.get('backend') == 'internal':
+                stale_internal.setdefault(os.path.abspath(info['disk_path']), []).append(info)
+                info['usage'] = {'signature': signature}
+                continue
+            info['usage'] = {**self._external_usage(info, children), 'signature': signature}
+            usage[snapshot_id] = {key: value for key, value in info['usage'].items() if key != 'signature'}
+            changed = True
+        
+        # 同一镜像中的内部快照一起计算（需要统计所有L1表对宿主簇的引用）
+        for disk_path, infos in stale_internal.items():
+            results = self._internal_usage(disk_path, infos)
+            for info in infos:
+                info['usage'].update(results[info['id']])
+                usage[info['id']] = results[info['id']]
+            changed = True
+        
+        if changed:
+            self.snapshots_metadata.save(vm_name)
+        return usage
+    
+    @_vm_locked
+    def invalidate_usage(self, vm_name: str, paths: List[str] = None):
+        """
+        清除缓存的快照占用（创建、删除、恢复快照或合并改写镜像后调用）
+        
+        Args:
+            paths: 只清除计算时用到了这些文件的快照（快照文件或其子镜像），None 表示全部
+        """
+        targets = {os.path.abspath(path) for path in paths if path} if paths is not None else None
+        changed = False
+        for info in self.snapshots_metadata.get(vm_name, {}).values():
+            cached = info.get('usage')
+            if not cached:
+                continue
+            if targets is not None and not any(
+                    os.path.abspath(item[0]) in targets for item in cached.get('signature') or []):
+                continue
+            del info['usage']
+            changed = True
+        if changed:
+            self.snapshots_metadata.save(vm_name)
+    
+    def _snapshot_paths(self, snapshot_info: Dict) -> List[str]:
+        """快照使用的文件（外部快照的冻结磁盘，内部快照所在的镜像）"""
+        if not snapshot_info:
             return []
+        return [snapshot_info.get('disk_path', '')] + list(self.snapshot_disks(snapshot_info).values())
+    
+    @staticmethod
+    def _file_signature(path: str) -> List:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return [path, None, None]
+        return [path, stat.st_mtime_ns, stat.st_size]
+    
+    @staticmethod
+    def _disk_bytes(path: str) -> int:
+        """文件实际占用的空间（稀疏文件按已分配的块计算）"""
+        stat = os.stat(path)
+        return stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
+    
+    def _external_usage(self, snapshot_info: Dict, children: Dict[str, List[str]]) -> Dict:
+        """外部快照：子镜像没有全部覆盖的簇在合并时要复制到子镜像，不能回收"""
+        result = {'exclusive_bytes': 0, 'shared_bytes': 0, 'allocated_clusters': 0}
+        try:
+            for path in self.snapshot_disks(snapshot_info).values():
+                file_bytes = self._disk_bytes(path)
+                if not is_qcow2(path):
+                    # raw 快照文件全部都是数据，有子镜像时都要保留
+                    shared = file_bytes if children.get(os.path.abspath(path)) else 0
+                    result['shared_bytes'] += shared
+                    result['exclusive_bytes'] += file_bytes - shared
+                    continue
+                with Qcow2Image(path) as image:
+                    cluster_size = image.header.cluster_size
+                    allocated = set(image.allocated_clusters(data_only=True))
+                needed = set()
+                for child in children.get(os.path.abspath(path), []):
+                    needed |= allocated - self._covered_clusters(child, cluster_size, allocated)
+                result['allocated_clusters'] += len(allocated)
+                result['shared_bytes'] += len(needed) * cluster_size
+                result['exclusive_bytes'] += max(0, file_bytes - len(needed) * cluster_size)
+            if snapshot_info.get('memory_state') and os.path.exists(snapshot_info['memory_state']):
+                result['exclusive_bytes'] += self._disk_bytes(snapshot_info['memory_state'])
+        except (OSError, Qcow2Error) as e:
+            result['error'] = str(e)
+        return result
+    
+    @staticmethod
+    def _covered_clusters(child_path: str, cluster_size: int, clusters: set) -> set:
+        """clusters（按 cluster_size 计）中被子镜像完整覆盖的簇"""
+        if not is_qcow2(child_path):
+            return set(clusters)
+        with Qcow2Image(child_path) as image:
+            child_cluster_size = image.header.cluster_size
+            child_allocated = set(image.allocated_clusters())
+        if child_cluster_size >= cluster_size:
+            ratio = child_cluster_size // cluster_size
+            return {index for index in clusters if index // ratio in child_allocated}
+        ratio = cluster_size // child_cluster_size
+        return {index for index in clusters
+                if all(child in child_allocated for child in range(index * ratio, (index + 1) * ratio))}
+    
+    def _internal_usage(self, disk_path: str, infos: List[Dict]) -> Dict[str, Dict]:
+        """内部快照：只被该快照的L1表引用的宿主簇（含L2表和内存状态）删除后可以回收"""
+        results = {}
+        try:
+            with Qcow2Image(disk_path) as image:
+                cluster_size = image.header.cluster_size
+                references = {}
+                active, _ = image.referenced_clusters()
+                refcounts = Counter(active)
+                for snapshot in image.snapshots():
+                    references[snapshot.name] = image.referenced_clusters(snapshot.l1_table_offset,
+                                                                          snapshot.l1_size)
+                    refcounts.update(references[snapshot.name][0])
+        except (OSError, Qcow2Error) as e:
+            return {info['id']: {'exclusive_bytes': 0, 'shared_bytes': 0, 'allocated_clusters': 0,
+                                 'error': str(e)} for info in infos}
+        
+        for info in infos:
+            tag = info.get('tag', info['id'])
+            if tag not in references:
+                results[info['id']] = {'exclusive_bytes': 0, 'shared_bytes': 0, 'allocated_clusters': 0,
+                                       'error': f"镜像中没有内部快照: {tag}"}
+                continue
+            clusters, data_clusters = references[tag]
+            exclusive = sum(1 for cluster in clusters if refcounts[cluster] == 1)
+            results[info['id']] = {'exclusive_bytes': exclusive * cluster_size,
+                                   'shared_bytes': (len(clusters) - exclusive) * cluster_size,
+                                   'allocated_clusters': data_clusters}
+        return results
+    
+    def list_snapshots(self, vm_name: str) -> List[Dict]:
+        """
+        列出虚拟机的所有快照（最新的在前）
+        
+        结果按索引版本和当前快照缓存，快照没有变化时不重新生成；返回的条目不应被修改
+        """
+        version = self.snapshots_metadata.version(vm_name)
+        current_id = self.get_current_snapshot(vm_name)
+        cached = self._list_cache.get(vm_name)
+        if cached and cached[0] == version and cached[1] == current_id:
+            return list(cached[2])
         
         snapshots = []
-        for snap_id, snap_info in self.snapshots_metadata[vm_name].items():
+        for snap_info in self.snapshots_metadata.ordered(vm_name):
+            snap_id = snap_info['id']
             snapshots.append({
                 'id': snap_info['id'],
                 'name': snap_info['name'],
                 'description': snap_info['description'],
                 'created_at': snap_info['created_at'],
-                'vm_state': snap_info.get('vm_state', 'unknown')
+                'vm_state': snap_info.get('vm_state', 'unknown'),
+                'backend': snap_info.get('backend', 'external'),
+                'has_memory': bool(snap_info.get('memory_state') or snap_info.get('memory_saved')),
+                'pause_ms': snap_info.get('pause_ms'),
+                'parent_id': snap_info.get('parent_id'),
+                'is_current': snap_id == current_id,
+                'auto': snap_info.get('auto', False)
             })
         
-        # 按创建时间排序（最新的在前）
-        snapshots.sort(key=lambda x: x['created_at'], reverse=True)
-        return snapshots
+        self._list_cache[vm_name] = (version, current_id, snapshots)
+        return list(snapshots)
+    
+    def snapshot_tree(self, vm_name: str) -> List[Dict]:
+        """
+        快照树：list_snapshots 的条目加上 children 列表，返回根节点列表
+        
+        同一父节点下的快照按创建时间排序（最早的在前）
+        """
+        nodes = {snapshot['id']: {**snapshot, 'children': []} for snapshot in self.list_snapshots(vm_name)}
+        roots = []
+        for node in reversed(list(nodes.values())):
+            parent = nodes.get(node['parent_id'])
+            (parent['children'] if parent else roots).append(node)
+        return roots
+    
+    def get_current_snapshot(self, vm_name: str) -> Optional[str]:
+        """虚拟机当前磁盘所基于的快照（之后的修改都在它之上）"""
+        vm_config = self.config_manager.get_vm_config(vm_name) or {}
+        current_id = vm_config.get('current_snapshot')
+        return current_id if current_id and self.snapshots_metadata.find(vm_name, current_id) else None
+    
+    def _set_current_snapshot(self, vm_name: str, snapshot_id: Optional[str]):
+        vm_config = self.config_manager.get_vm_config(vm_name)
+        if vm_config is not None and vm_config.get('current_snapshot') != snapshot_id:
+            vm_config['current_snapshot'] = snapshot_id
+            self.config_manager.set_vm_config(vm_name, vm_config)
+    
+    def _migrate_parent_links(self, vm_name: str, snapshots: Dict[str, Dict]) -> bool:
+        """
+        读取虚拟机的快照索引时为旧元数据补上 parent_id 和当前位置
+        
+        外部快照按冻结磁盘的后端文件找父快照，其他快照按创建时间接在前一个快照之后
+        
+        Returns:
+            是否修改了元数据
+        """
+        if all('parent_id' in info for info in snapshots.values()):
+            vm_config = self.config_manager.get_vm_config(vm_name)
+            if vm_config is None or vm_config.get('current_snapshot') in snapshots:
+                return False
+        
+        changed = False
+        by_disk = {
+            os.path.abspath(info['disk_path']): snapshot_id
+            for snapshot_id, info in snapshots.items() if info.get('backend', 'external') == 'external'
+        }
+        ordered = sorted(snapshots.values(), key=lambda x: x['created_at'])
+        for index, info in enumerate(ordered):
+            if 'parent_id' in info:
+                continue
+            parent_id = None
+            if info.get('backend', 'external') == 'external':
+                parent_id = by_disk.get(self._backing_of(info['disk_path']))
+            elif index > 0:
+                parent_id = ordered[index - 1]['id']
+            info['parent_id'] = parent_id
+            changed = True
+        
+        vm_config = self.config_manager.get_vm_config(vm_name)
+        if vm_config is not None and vm_config.get('current_snapshot') not in snapshots:
+            current_id = by_disk.get(self._backing_of(vm_config.get('disk_path', '')), ordered[-1]['id'])
+            self._set_current_snapshot(vm_name, current_id)
+        return changed
+    
+    @staticmethod
+    def _backing_of(path: str) -> str:
+        """qcow2镜像的后端文件绝对路径（没有时为空）"""
+        if not path or not is_qcow2(path):
+            return ''
+        try:
+            with Qcow2Image(path) as image:
+                backing = image.resolve_backing_path()
+        except (OSError, Qcow2Error):
+            return ''
+        return os.path.abspath(backing) if backing else ''
+    
+    def chain_depths(self, vm_name: str) -> Dict[str, int]:
+        """虚拟机各磁盘当前的后端链长度 {drive id: 后端文件个数}"""
+        depths = {}
+        for drive_id, path in vm_drives(self.config_manager.get_vm_config(vm_name) or {}):
+            info = get_disk_inspector().inspect(path)
+            depths[drive_id] = len(info.backing_chain) if info else 0
+        return depths
+    
+    def chain_job_running(self, vm_name: str) -> bool:
+        """是否有等待或正在执行的后端链整理任务"""
+        return get_chain_maintenance(self.config_manager).has_pending(vm_name)
+    
+    def schedule_chain_shortening(self, vm_name: str) -> bool:
+        """
+        后端链超过 snapshot_max_chain_depth 时交给后端链整理服务缩短（非紧急，等待空闲时段）
+        
+        Returns:
+            是否立即提交了整理任务
+        """
+        return bool(get_chain_maintenance(self.config_manager).maintain(vm_name))
+    
+    def _check_disk(self, disk_path: str) -> List[str]:
+        """检查磁盘是否可以作为快照基础镜像，返回阻止创建快照的问题"""
+        if not os.path.exists(disk_path):
+            return [f"磁盘文件不存在: {disk_path}"]
+        if not is_qcow2(disk_path):
+            return []
+        try:
+            with Qcow2Image(disk_path) as image:
+                problems = []
+                if image.header.corrupt:
+                    problems.append("镜像被标记为损坏 (corrupt)")
+                if image.header.backing_file and not os.path.exists(image.resolve_backing_path()):
+                    problems.append(f"后端文件不存在: {image.header.backing_file}")
+                return problems
+        except Qcow2Error as e:
+            return [f"不是有效的qcow2镜像: {e}"]
+    
+    def verify_snapshots(self, vm_name: str) -> Dict[str, List[str]]:
+        """
+        校验虚拟机所有快照（只解析头部，不启动子进程）
+        
+        Returns:
+            {快照ID: 问题列表}，没有问题的快照不包含在内
+        """
+        results = {}
+        for snapshot_id, snapshot_info in self.snapshots_metadata.get(vm_name, {}).items():
+            problems = self._backend_of(snapshot_info).verify(snapshot_info)
+            if problems:
+                results[snapshot_id] = problems
+        return results
     
     def get_snapshot_info(self, vm_name: str, snapshot_id: str) -> Optional[Dict]:
         """获取快照详细信息"""
-        if vm_name in self.snapshots_metadata and snapshot_id in self.snapshots_metadata[vm_name]:
-            return self.snapshots_metadata[vm_name][snapshot_id]
-        return None
+        return self.snapshots_metadata.find(vm_name, snapshot_id)
 
 
 # 全局快照管理器实例
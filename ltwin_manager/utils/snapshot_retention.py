@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+快照保留策略
+根据快照元数据按“保留最近N个”、“每天/每周保留一个”、“最长保留天数”和“总容量上限”生成清理计划，
+删除被其他镜像作为后端的快照前先把数据合并到子镜像，避免破坏快照链
+"""
+
+import os
+import subprocess
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from ltwin_manager.utils.disk_inspector import get_disk_inspector
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+from ltwin_manager.utils.snapshot_manager import get_snapshot_manager, vm_drives
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager
+
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@dataclass
+class RetentionPolicy:
+    """保留策略（各项为0表示不启用）"""
+    keep_last: int = 0  # 保留最近N个快照
+    keep_daily: int = 0  # 最近N天每天保留最新的一个
+    keep_weekly: int = 0  # 最近N周每周保留最新的一个
+    max_age_days: int = 0  # 超过该天数且未被以上规则保留的快照会被删除
+    max_gb: float = 0  # 每台虚拟机快照总占用上限，超出时从最旧的开始删除（至少保留最新的一个）
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> 'RetentionPolicy':
+        """从配置字典创建（忽略未知字段）"""
+        data = data or {}
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return asdict(self)
+
+    @property
+    def has_keep_rules(self) -> bool:
+        return bool(self.keep_last or self.keep_daily or self.keep_weekly)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.has_keep_rules or self.max_age_days or self.max_gb)
+
+
+@dataclass
+class RetentionAction:
+    """单个快照的处理方式"""
+    vm_name: str
+    snapshot_id: str
+    name: str
+    created_at: str
+    disk_path: str
+    disk_paths: List[str] = field(default_factory=list)  # 快照包含的所有磁盘
+    size_bytes: int = 0
+    delete: bool = False
+    reasons: List[str] = field(default_factory=list)
+    children: List[str] = field(default_factory=list)  # 以该快照为后端的镜像，删除前需要合并
+
+
+@dataclass
+class RetentionPlan:
+    """清理计划"""
+    actions: List[RetentionAction] = field(default_factory=list)
+    orphans: List[str] = field(default_factory=list)  # 快照目录中未被元数据引用的镜像（只报告，不删除）
+
+    @property
+    def deletions(self) -> List[RetentionAction]:
+        return [action for action in self.actions if action.delete]
+
+    @property
+    def freed_bytes(self) -> int:
+        """预计释放的空间（被合并到子镜像的数据不会完全释放）"""
+        return sum(action.size_bytes for action in self.deletions)
+
+    def summary(self) -> str:
+        """计划摘要"""
+        merges = sum(len(action.children) for action in self.deletions)
+        text = (f"共 {len(self.actions)} 个快照，将删除 {len(self.deletions)} 个，"
+                f"预计释放 {self.freed_bytes / (1024**3):.2f} GB")
+        if merges:
+            text += f"，需要合并 {merges} 个子镜像"
+        if self.orphans:
+            text += f"；发现 {len(self.orphans)} 个未登记的镜像文件"
+        return text
+
+
+class SnapshotRetentionEngine:
+    """快照保留策略引擎"""
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.snapshot_manager = get_snapshot_manager(config_manager)
+        self.pool_manager = get_storage_pool_manager(config_manager)
+        self.disk_inspector = get_disk_inspector()
+
+    def get_policy(self, vm_name: str = None) -> RetentionPolicy:
+        """获取策略：虚拟机配置中的 snapshot_retention 优先于全局配置"""
+        vm_config = (self.config_manager.get_vm_config(vm_name) or {}) if vm_name else {}
+        policy = vm_config.get('snapshot_retention') or self.config_manager.get_global_config("snapshot_retention")
+        return RetentionPolicy.from_dict(policy)
+
+    def plan(self, vm_name: str = None, policy: RetentionPolicy = None,
+             now: datetime = None, vm_names: List[str] = None) -> RetentionPlan:
+        """
+        生成清理计划（不做任何修改）
+
+        Args:
+            vm_name: 只处理指定虚拟机
+            policy: 使用指定策略，None 表示按虚拟机/全局配置
+            now: 当前时间（用于计算天数）
+            vm_names: 只处理这些虚拟机；vm_name 和 vm_names 都为 None 时处理全部并查找孤立文件
+        """
+        now = now or datetime.now()
+        plan = RetentionPlan()
+        if vm_name:
+            vm_names = [vm_name]
+        scan_all = vm_names is None
+        if scan_all:
+            vm_names = list(self.snapshot_manager.snapshots_metadata.keys())
+        for name in vm_names:
+            plan.actions.extend(self._plan_vm(name, policy or self.get_policy(name), now))
+        if scan_all:
+            plan.orphans = self.find_orphans()
+        return plan
+
+    def vms_with_snapshots_before(self, cutoff: datetime) -> List[str]:
+        """有早于 cutoff 的快照的虚拟机（只读快照索引的摘要）"""
+        index = self.snapshot_manager.snapshots_metadata
+        cutoff_text = cutoff.strftime(TIME_FORMAT)
+        return [name for name in index.keys() if index.oldest(name) and index.oldest(name) < cutoff_text]
+
+    def _plan_vm(self, vm_name: str, policy: RetentionPolicy, now: datetime) -> List[RetentionAction]:
+        """为单台虚拟机生成计划"""
+        actions = []
+        for snapshot_id, info in self.snapshot_manager.snapshots_metadata.get(vm_name, {}).items():
+            disk_paths = list(self.snapshot_manager.snapshot_disks(info).values())
+            size_bytes = 0
+            for path in disk_paths:
+                disk_info = self.disk_inspector.inspect(path)
+                size_bytes += disk_info.allocated_size if disk_info else 0
+            actions.append(RetentionAction(
+                vm_name=vm_name,
+                snapshot_id=snapshot_id,
+                name=info.get('name', snapshot_id),
+                created_at=info.get('created_at', ''),
+                disk_path=info.get('disk_path', ''),
+                disk_paths=disk_paths,
+                size_bytes=size_bytes
+            ))
+        actions.sort(key=lambda action: action.created_at, reverse=True)  # 最新的在前
+        if policy.is_empty or not actions:
+            for action in actions:
+                action.reasons.append("未配置保留策略")
+            return actions
+
+        # 按保留规则标记需要保留的快照
+        kept = set()
+        for action in actions[:policy.keep_last]:
+            kept.add(action.snapshot_id)
+            action.reasons.append(f"最近 {policy.keep_last} 个")
+        self._keep_per_period(actions, policy.keep_daily, now, timedelta(days=1), kept,
+                              lambda created: created.date(), "每天保留")
+        self._keep_per_period(actions, policy.keep_weekly, now, timedelta(weeks=1), kept,
+                              lambda created: tuple(created.isocalendar()[:2]), "每周保留")
+
+        cutoff = now - timedelta(days=policy.max_age_days) if policy.max_age_days else None
+        for action in actions:
+            if action.snapshot_id in kept:
+                continue
+            created = self._parse_time(action.created_at)
+            if policy.has_keep_rules:
+                action.delete = True
+                action.reasons.append("不在保留规则内")
+            elif cutoff and created and created < cutoff:
+                action.delete = True
+                action.reasons.append(f"超过 {policy.max_age_days} 天")
+            else:
+                action.reasons.append("未过期")
+
+        # 总容量上限：从最新的开始累计，超出部分（最旧的）删除，至少保留最新的一个
+        if policy.max_gb:
+            limit = policy.max_gb * 1024**3
+            total = 0
+            for index, action in enumerate(actions):
+                if action.delete:
+                    continue
+                total += action.size_bytes
+                if total > limit and index > 0:
+                    action.delete = True
+                    action.reasons = [f"超出容量上限 {policy.max_gb} GB"]
+
+        self._attach_children(vm_name, actions)
+        return actions
+
+    def _keep_per_period(self, actions: List[RetentionAction], periods: int, now: datetime,
+                         step: timedelta, kept: set, period_key: Callable, label: str):
+        """
+        在截至 now 的最近 periods 个周期内（包括 now 所在的周期），每个周期保留最新的一个快照
+
+        没有快照的周期也计入窗口，更早周期的快照不按该规则保留
+        """
+        if not periods:
+            return
+        oldest_key = period_key(now - step * (periods - 1))
+        seen = set()
+        for action in actions:
+            created = self._parse_time(action.created_at)
+            if created is None:
+                continue
+            key = period_key(created)
+            if key < oldest_key:
+                break
+            if key in seen:
+                continue
+            seen.add(key)
+            if action.snapshot_id not in kept:
+                kept.add(action.snapshot_id)
+                action.reasons.append(label)
+
+    def _child_candidates(self) -> List[str]:
+        """
+        可能以快照层为后端的镜像：所有虚拟机的当前磁盘和所有快照文件
+
+        链接克隆、镜像库覆盖层可以以另一台虚拟机的快照层为后端，只查同一台虚拟机会漏掉它们
+        """
+        candidates = self.snapshot_manager.snapshots_metadata.referenced_paths()
+        for name in self.config_manager.list_vms():
+            candidates.update(os.path.abspath(path)
+                              for _, path in vm_drives(self.config_manager.get_vm_config(name) or {}))
+        return sorted(candidates)
+
+    def _running_disks(self) -> set:
+        """正在运行的虚拟机的当前磁盘"""
+        running = set()
+        for name in self.config_manager.list_vms():
+            vm_config = self.config_manager.get_vm_config(name) or {}
+            if vm_config.get('status') == 'running':
+                running.update(os.path.abspath(path) for _, path in vm_drives(vm_config))
+        return running
+
+    def _attach_children(self, vm_name: str, actions: List[RetentionAction]):
+        """找出以待删除快照为后端的镜像（所有虚拟机的快照和当前磁盘）"""
+        running_disks = self._running_disks()
+        candidates = {os.path.abspath(path) for action in actions for path in action.disk_paths}
+        candidates.update(self._child_candidates())
+        backing = {path: self._backing_of(path) for path in candidates}
+        # 冻结的镜像里可能还有内部快照，删除文件会丢失它们
+        internal_hosts = {
+            os.path.abspath(info.get('disk_path', ''))
+            for info in self.snapshot_manager.snapshots_metadata.get(vm_name, {}).values()
+            if info.get('backend') == 'internal'
+        }
+
+        for action in actions:
+            if not action.delete:
+                continue
+            parent_paths = {os.path.abspath(path) for path in action.disk_paths}
+            action.children = [path for path, backing_path in backing.items() if backing_path in parent_paths]
+            if set(action.children) & running_disks:
+                action.delete = False
+                action.reasons.append("运行中的虚拟机磁盘以该快照为后端")
+            elif parent_paths & internal_hosts:
+                action.delete = False
+                action.reasons.append("镜像中保存着内部快照")
+
+    @staticmethod
+    def _backing_of(path: str) -> Optional[str]:
+        """获取qcow2镜像的后端文件绝对路径"""
+        if not path or not is_qcow2(path):
+            return None
+        try:
+            with Qcow2Image(path) as image:
+                backing_path = image.resolve_backing_path()
+        except (OSError, Qcow2Error):
+            return None
+        return os.path.abspath(backing_path) if backing_path else None
+
+    @staticmethod
+    def _parse_time(value: str) -> Optional[datetime]:
+        try:
+            return datetime.strptime(value, TIME_FORMAT)
+        except (TypeError, ValueError):
+            return None
+
+    def find_orphans(self) -> List[str]:
+        """列出快照存储池中未被快照元数据引用的qcow2文件"""
+        referenced = self.snapshot_manager.snapshots_metadata.referenced_paths()
+        referenced.update(
+            os.path.abspath(path)
+            for name in self.config_manager.list_vms()
+            for _, path in vm_drives(self.config_manager.get_vm_config(name) or {})
+        )
+        roots = {str(self.snapshot_manager.snapshots_dir)}
+        roots.update(pool['path'] for pool in self.pool_manager.list_pools() if 'snapshots' in pool['roles'])
+
+        orphans = []
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.abspath(os.path.join(dirpath, filename))
+                    if filename.endswith('.qcow2') and path not in referenced:
+                        orphans.append(path)
+        return sorted(set(orphans))
+
+    def execute(self, plan: RetentionPlan,
+                progress_callback: Optional[Callable[[str, int], None]] = None) -> Dict:
+        """
+        执行清理计划
+
+        删除每个快照前重新读取实际的后端关系，把该快照的数据合并到所有子镜像
+        （qemu-img rebase 安全模式），子镜像改为指向该快照的后端，然后通过快照管理器删除文件和元数据。
+
+        Returns:
+            {'deleted': 删除数, 'merged': 合并的子镜像数, 'freed_bytes': 释放字节数, 'errors': [错误信息]}
+        """
+        result = {'deleted': 0, 'merged': 0, 'freed_bytes': 0, 'errors': []}
+        deletions = plan.deletions
+        for index, action in enumerate(deletions):
+            if progress_callback:
+                progress_callback(f"删除快照 {action.vm_name}/{action.name}", int(index * 100 / len(deletions)))
+            # 与计划快照、恢复、调整磁盘大小一样持有虚拟机的操作锁，合并和删除之间快照链不会被改动
+            with self.snapshot_manager.vm_lock(action.vm_name):
+                try:
+                    result['merged'] += self._merge_into_children(action)
+                except (OSError, Qcow2Error, subprocess.CalledProcessError, ValueError) as e:
+                    result['errors'].append(f"{action.vm_name}/{action.name}: 合并到子镜像失败，已跳过: {e}")
+                    continue
+                if self.snapshot_manager.delete_snapshot(action.vm_name, action.snapshot_id):
+                    result['deleted'] += 1
+                    result['freed_bytes'] += action.size_bytes
+                else:
+                    result['errors'].append(f"{action.vm_name}/{action.name}: 删除失败")
+        if progress_callback:
+            progress_callback("完成", 100)
+        return result
+
+    def _merge_into_children(self, action: RetentionAction) -> int:
+        """
+        把快照各磁盘的数据合并到以它为后端的镜像，返回合并的子镜像数
+
+        Raises:
+            ValueError: 子镜像是正在运行的虚拟机磁盘
+        """
+        running_disks = self._running_disks()
+        candidates = self._child_candidates()
+
+        merged = 0
+        for parent in action.disk_paths:
+            parent_path = os.path.abspath(parent)
+            if not os.path.exists(parent_path):
+                continue
+            # raw 磁盘没有后端，子镜像合并后成为独立镜像
+            grandparent, grandparent_format = "", ""
+            if is_qcow2(parent_path):
+                with Qcow2Image(parent_path) as image:
+                    grandparent = image.resolve_backing_path() or ""
+                    grandparent_format = image.header.backing_format
+
+            for child in candidates:
+                if child == parent_path or self._backing_of(child) != parent_path:
+                    continue
+                if child in running_disks:
+                    raise ValueError("运行中的虚拟机磁盘以该快照为后端")
+                cmd = ['qemu-img', 'rebase', '-f', 'qcow2', '-b', grandparent]
+                if grandparent:
+                    cmd.extend(['-F', grandparent_format or ('qcow2' if is_qcow2(grandparent) else 'raw')])
+                cmd.append(child)
+                subprocess.run(cmd, check=True, capture_output=True)
+                self.disk_inspector.invalidate(child)
+                merged += 1
+        return merged
+
+
+# 全局保留策略引擎实例
+snapshot_retention_engine = None
+
+
+def get_snapshot_retention_engine(config_manager) -> SnapshotRetentionEngine:
+    """获取快照保留策略引擎实例"""
+    global snapshot_retention_engine
+    if snapshot_retention_engine is None:
+        snapshot_retention_engine = SnapshotRetentionEngine(config_manager)
+    return snapshot_retention_engine
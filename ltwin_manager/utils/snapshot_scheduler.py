@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+快照计划
+按虚拟机配置中的类cron计划自动创建快照，在恢复快照、调整磁盘大小等高风险操作前创建快照，
+以及批量为多台虚拟机创建快照。多台虚拟机的快照依次错开执行，避免同时产生大量I/O。
+上次执行时间保存在快照目录中，程序重启后错过的计划会补做一次。
+"""
+
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# (最小值, 最大值)：分 时 日 月 星期（0和7都表示星期日）
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+class CronExpression:
+    """
+    五段式cron表达式（分 时 日 月 星期），支持 * , - / 和 @hourly 等别名
+
+    与cron相同：日和星期都不是 * 时，满足其中一个即可
+    """
+
+    def __init__(self, text: str):
+        self.text = text.strip()
+        fields = CRON_ALIASES.get(self.text, self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式需要5个字段: {text}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"无效的步长: {field}")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"取值超出范围 {low}-{high}: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.isoweekday() % 7) in self.weekdays
+        if self.any_day:
+            return weekday_ok
+        if self.any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> Optional[datetime]:
+        """moment 之后（不含）的下一个触发时间，五年内没有时返回 None"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while candidate <= limit:
+            if candidate.month not in self.months:
+                # 跳到下个月1日
+                year, month = (candidate.year + 1, 1) if candidate.month == 12 else (candidate.year, candidate.month + 1)
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        return None
+
+
+@dataclass
+class SnapshotSchedule:
+    """虚拟机的快照计划（保存在虚拟机配置的 snapshot_schedule 中）"""
+    enabled: bool = False
+    cron: str = '0 2 * * *'
+    include_memory: bool = False
+    before_risky: bool = True  # 恢复快照、调整磁盘大小前自动创建快照
+    name_prefix: str = '自动快照'
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> 'SnapshotSchedule':
+        data = data or {}
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def validate(self):
+        """
+        Raises:
+            ValueError: cron表达式无效
+        """
+        if self.enabled:
+            CronExpression(self.cron)
+
+
+def get_vm_schedule(config_manager, vm_name: str) -> SnapshotSchedule:
+    """读取虚拟机的快照计划"""
+    vm_config = config_manager.get_vm_config(vm_name) or {}
+    return SnapshotSchedule.from_dict(vm_config.get('snapshot_schedule'))
+
+
+def set_vm_schedule(config_manager, vm_name: str, schedule: SnapshotSchedule) -> bool:
+    """保存虚拟机的快照计划"""
+    schedule.validate()
+    vm_config = config_manager.get_vm_config(vm_name)
+    if vm_config is None:
+        raise ValueError(f"虚拟机 '{vm_name}' 不存在")
+    vm_config['snapshot_schedule'] = schedule.to_dict()
+    return config_manager.set_vm_config(vm_name, vm_config)
+
+
+class SnapshotScheduler(QObject):
+    """
+    快照计划执行器
+
+    后台线程每 check_interval 秒检查到期的计划，所有快照（计划、批量）在同一个队列中依次执行，
+    相邻两次之间间隔 snapshot_stagger_seconds 秒。
+    """
+
+    snapshot_finished = pyqtSignal(str, bool, str)  # (虚拟机名称, 是否成功, 信息)
+
+    def __init__(self, config_manager, check_interval: int = 30):
+        super().__init__()
+        from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+        self.config_manager = config_manager
+        self.snapshot_manager = get_snapshot_manager(config_manager)
+        self.check_interval = check_interval
+        self.state_file = self.snapshot_manager.snapshots_dir / "schedule_state.json"
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+        self._pending = deque()  # [(虚拟机名称, 快照名称, 描述, 是否保存内存, 是否为计划快照)]
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- 状态 ----------
+
+    def _load_state(self) -> Dict:
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"加载快照计划状态失败: {e}")
+        return {}
+
+    def _save_state(self):
+        try:
+            with open(self.state_file, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存快照计划状态失败: {e}")
+
+    def snapshots_enabled(self) -> bool:
+        enabled = self.config_manager.get_global_config("enable_snapshots")
+        return enabled if enabled is not None else True
+
+    def next_run(self, vm_name: str, now: datetime = None) -> Optional[datetime]:
+        """虚拟机下一次计划快照时间（未启用计划时为 None；已经到期时返回到期时间）"""
+        schedule = get_vm_schedule(self.config_manager, vm_name)
+        if not schedule.enabled:
+            return None
+        try:
+            cron = CronExpression(schedule.cron)
+        except ValueError:
+            return None
+        vm_state = self.state.get(vm_name, {})
+        since = vm_state.get('last_run') or vm_state.get('since')
+        if not since:
+            return cron.next_after(now or datetime.now())
+        return cron.next_after(datetime.strptime(since, "%Y-%m-%d %H:%M:%S"))
+
+    def due_vms(self, now: datetime = None) -> List[str]:
+        """
+        计划已到期的虚拟机（程序未运行期间错过的多次只算一次）
+
+        第一次看到某台虚拟机的计划（或计划被修改）时只记录起点，不立即创建快照
+        """
+        now = now or datetime.now()
+        due = []
+        changed = False
+        for vm_name in self.config_manager.list_vms():
+            schedule = get_vm_schedule(self.config_manager, vm_name)
+            if not schedule.enabled:
+                continue
+            vm_state = self.state.get(vm_name, {})
+            if vm_state.get('cron') != schedule.cron:
+                # 新的或修改过的计划从现在开始计算
+                self.state[vm_name] = {'cron': schedule.cron, 'since': now.strftime("%Y-%m-%d %H:%M:%S")}
+                changed = True
+                continue
+            next_run = self.next_run(vm_name, now)
+            if next_run and next_run <= now:
+                due.append(vm_name)
+        if changed:
+            self._save_state()
+        return due
+
+    # ---------- 提交 ----------
+
+    def _enqueue(self, vm_name: str, snapshot_name: str, description: str,
+                 include_memory: bool, scheduled: bool) -> bool:
+        with self._lock:
+            if any(item[0] == vm_name and item[4] == scheduled for item in self._pending):
+                return False
+            self._pending.append((vm_name, snapshot_name, description, include_memory, scheduled))
+        self._wake.set()
+        return True
+
+    def snapshot_all(self, vm_names: List[str] = None, snapshot_name: str = None,
+                     include_memory: bool = False) -> int:
+        """
+        批量创建快照（依次错开执行）
+
+        Returns:
+            加入队列的虚拟机数量
+        """
+        if not self.snapshots_enabled():
+            return 0
+        snapshot_name = snapshot_name or f"批量快照 {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        count = 0
+        for vm_name in vm_names if vm_names is not None else self.config_manager.list_vms():
+            if self._enqueue(vm_name, snapshot_name, "批量创建", include_memory, False):
+                count += 1
+        return count
+
+    def snapshot_before(self, vm_name: str, operation: str) -> bool:
+        """
+        高风险操作前同步创建快照（虚拟机计划的 before_risky 关闭或全局禁用快照时跳过）
+
+        Returns:
+            是否创建了快照
+        """
+        if not self.wants_snapshot_before(vm_name):
+            return False
+        return self.snapshot_manager.create_snapshot(
+            vm_name, f"{operation}前自动快照", f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {operation}前自动创建"
+        )
+
+    def wants_snapshot_before(self, vm_name: str) -> bool:
+        """高风险操作前是否需要快照"""
+        return self.snapshots_enabled() and get_vm_schedule(self.config_manager, vm_name).before_risky
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    # ---------- 后台线程 ----------
+
+    def start(self):
+        """启动后台线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="SnapshotScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程（正在创建的快照会完成）"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.snapshots_enabled():
+                    for vm_name in self.due_vms():
+                        schedule = get_vm_schedule(self.config_manager, vm_name)
+                        self._enqueue(vm_name, f"{schedule.name_prefix} {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+                                      f"计划 {schedule.cron}", schedule.include_memory, True)
+                self._drain()
+            except Exception as e:
+                print(f"快照计划出错: {e}")
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+
+    def _drain(self):
+        """依次执行队列中的快照，相邻两次之间错开"""
+        stagger = float(self.config_manager.get_global_config("snapshot_stagger_seconds") or 0)
+        first = True
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._pending:
+                    return
+                vm_name, snapshot_name, description, include_memory, scheduled = self._pending.popleft()
+            if not first and stagger > 0 and self._stop.wait(stagger):
+                return
+            first = False
+            self._take(vm_name, snapshot_name, description, include_memory, scheduled)
+
+    def _take(self, vm_name: str, snapshot_name: str, description: str, include_memory: bool, scheduled: bool):
+        """创建一个快照并记录结果（create_snapshot 持有虚拟机锁，与界面上的恢复、删除、调整大小互斥）"""
+        vm_config = self.config_manager.get_vm_config(vm_name) or {}
+        if include_memory and vm_config.get('status') != 'running':
+            include_memory = False  # 已停止的虚拟机只做磁盘快照
+        started = datetime.now()
+        success = self.snapshot_manager.create_snapshot(vm_name, snapshot_name, description, include_memory)
+        message = f"{snapshot_name}: {'成功' if success else '失败'}"
+        if scheduled:
+            # 失败也记录，避免每次检查都重试；下一个计划时间再试
+            self.state[vm_name] = {
+                **self.state.get(vm_name, {}),
+                'last_run': started.strftime("%Y-%m-%d %H:%M:%S"),
+                'success': success
+            }
+            self._save_state()
+        self.snapshot_finished.emit(vm_name, success, message)
+
+
+# 全局快照计划实例
+snapshot_scheduler = None
+
+
+def get_snapshot_scheduler(config_manager) -> SnapshotScheduler:
+    """获取快照计划实例"""
+    global snapshot_scheduler
+    if snapshot_scheduler is None:
+        snapshot_scheduler = SnapshotScheduler(config_manager)
+    return snapshot_scheduler
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+存储基准测试
+在存储池目录中创建临时文件，使用 O_DIRECT 测量顺序读写吞吐量和随机4K读写IOPS及延迟，
+结果保存后用于磁盘缓存模式/aio推荐和存储池放置
+"""
+
+import json
+import mmap
+import os
+import platform
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+from ltwin_manager.utils.disk_stats import get_device_class, resolve_block_device
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager
+
+
+SEQUENTIAL_BLOCK_SIZE = 1024 * 1024
+RANDOM_BLOCK_SIZE = 4096
+BENCHMARK_FILE_PREFIX = ".ltwin_bench_"
+
+# 随机IO的IOPS阈值: 高于 FAST 视为快速设备，低于 SLOW 视为机械盘级别
+FAST_IOPS_THRESHOLD = 20000
+SLOW_IOPS_THRESHOLD = 1000
+
+
+class BenchmarkCancelled(Exception):
+    """基准测试被取消"""
+
+
+@dataclass
+class BenchmarkResult:
+    """基准测试结果"""
+    path: str
+    device: str = ""
+    device_class: str = "unknown"
+    o_direct: bool = True  # 文件系统不支持 O_DIRECT 时退回页缓存+fsync，结果偏乐观
+    file_size_mb: int = 0
+    seq_read_mb_s: float = 0.0
+    seq_write_mb_s: float = 0.0
+    rand_read_iops: float = 0.0
+    rand_write_iops: float = 0.0
+    rand_read_latency_ms: float = 0.0  # 平均延迟
+    rand_write_latency_ms: float = 0.0
+    rand_read_p99_ms: float = 0.0
+    rand_write_p99_ms: float = 0.0
+    duration: float = 0.0
+    timestamp: str = ""
+
+    @property
+    def rand_iops(self) -> float:
+        """随机读写IOPS的平均值（用于存储池放置）"""
+        return (self.rand_read_iops + self.rand_write_iops) / 2
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return asdict(self)
+
+    def summary(self) -> str:
+        """结果摘要（显示用）"""
+        lines = [
+            f"{self.path} ({self.device or '未知设备'}, {self.device_class}"
+            f"{'' if self.o_direct else ', 未使用O_DIRECT'})",
+            f"  顺序读 {self.seq_read_mb_s:.0f} MB/s，顺序写 {self.seq_write_mb_s:.0f} MB/s",
+            f"  随机4K读 {self.rand_read_iops:.0f} IOPS (平均 {self.rand_read_latency_ms:.2f} ms，"
+            f"P99 {self.rand_read_p99_ms:.2f} ms)",
+            f"  随机4K写 {self.rand_write_iops:.0f} IOPS (平均 {self.rand_write_latency_ms:.2f} ms，"
+            f"P99 {self.rand_write_p99_ms:.2f} ms)"
+        ]
+        return "\n".join(lines)
+
+
+def _latency_stats(latencies_ns: List[int]):
+    """返回 (平均, P99) 延迟（毫秒）"""
+    if not latencies_ns:
+        return 0.0, 0.0
+    latencies_ns.sort()
+    average = sum(latencies_ns) / len(latencies_ns) / 1e6
+    p99 = latencies_ns[min(len(latencies_ns) - 1, int(len(latencies_ns) * 0.99))] / 1e6
+    return round(average, 3), round(p99, 3)
+
+
+class StorageBenchmark:
+    """存储基准测试（顺序1MB读写 + 随机4K读写）"""
+
+    def __init__(self, file_size_mb: int = 256, random_seconds: float = 3.0, random_max_ops: int = 200000):
+        self.file_size_mb = file_size_mb
+        self.random_seconds = random_seconds  # 每项随机测试的最长时间
+        self.random_max_ops = random_max_ops
+
+    def run(self, directory: str, progress_callback: Optional[Callable[[str, int], None]] = None,
+            cancel_event: Optional[threading.Event] = None) -> BenchmarkResult:
+        """
+        在目录中运行基准测试
+
+        Args:
+            directory: 测试目录（通常是存储池目录）
+            progress_callback: 进度回调 (状态信息, 百分比)
+            cancel_event: 设置后尽快停止并抛出 BenchmarkCancelled
+
+        Raises:
+            ValueError: 目录不存在或空间不足
+            OSError: 读写失败
+        """
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.isdir(directory):
+            raise ValueError(f"目录不存在: {directory}")
+        file_size = self.file_size_mb * 1024 * 1024
+        if psutil.disk_usage(directory).free < file_size * 2:
+            raise ValueError(f"可用空间不足，基准测试需要至少 {self.file_size_mb * 2} MB")
+
+        def report(message: str, percent: int):
+            if cancel_event is not None and cancel_event.is_set():
+                raise BenchmarkCancelled()
+            if progress_callback:
+                progress_callback(message, percent)
+
+        result = BenchmarkResult(
+            path=directory,
+            device=resolve_block_device(directory) or "",
+            device_class=get_device_class(directory),
+            file_size_mb=self.file_size_mb,
+            timestamp=time.strftime("%Y-%m-%d %H:%M:%S")
+        )
+        test_path = os.path.join(directory, f"{BENCHMARK_FILE_PREFIX}{os.getpid()}_{threading.get_ident()}")
+        start = time.time()
+        fd = self._open(test_path, result)
+        # O_DIRECT 要求缓冲区按页对齐，匿名 mmap 天然满足
+        buffer = mmap.mmap(-1, SEQUENTIAL_BLOCK_SIZE)
+        buffer.write(os.urandom(SEQUENTIAL_BLOCK_SIZE))  # 随机数据，避免被压缩或去重设备优化
+        try:
+            report("顺序写入...", 5)
+            result.seq_write_mb_s = self._sequential(fd, buffer, file_size, write=True, result=result)
+            report("顺序读取...", 30)
+            self._drop_cache(fd, result)
+            result.seq_read_mb_s = self._sequential(fd, buffer, file_size, write=False, result=result)
+            report("随机4K读取...", 55)
+            self._drop_cache(fd, result)
+            result.rand_read_iops, latencies = self._random(fd, buffer, file_size, write=False,
+                                                            cancel_event=cancel_event)
+            result.rand_read_latency_ms, result.rand_read_p99_ms = _latency_stats(latencies)
+            report("随机4K写入...", 80)
+            result.rand_write_iops, latencies = self._random(fd, buffer, file_size, write=True,
+                                                             cancel_event=cancel_event)
+            result.rand_write_latency_ms, result.rand_write_p99_ms = _latency_stats(latencies)
+            report("完成", 100)
+        finally:
+            buffer.close()
+            os.close(fd)
+            try:
+                os.remove(test_path)
+            except OSError:
+                pass
+        result.duration = round(time.time() - start, 1)
+        return result
+
+    @staticmethod
+    def _open(path: str, result: BenchmarkResult) -> int:
+        """以 O_DIRECT 打开测试文件，文件系统不支持时（如tmpfs）退回普通IO"""
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC
+        o_direct = getattr(os, 'O_DIRECT', 0)
+        if o_direct:
+            try:
+                return os.open(path, flags | o_direct, 0o600)
+            except OSError:
+                pass
+        result.o_direct = False
+        return os.open(path, flags, 0o600)
+
+    @staticmethod
+    def _drop_cache(fd: int, result: BenchmarkResult):
+        """未使用 O_DIRECT 时尽量丢弃页缓存，避免读测试命中缓存"""
+        if result.o_direct:
+            return
+        os.fsync(fd)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    @staticmethod
+    def _sequential(fd: int, buffer: mmap.mmap, file_size: int, write: bool, result: BenchmarkResult) -> float:
+        """顺序读写整个文件，返回 MB/s"""
+        blocks = file_size // SEQUENTIAL_BLOCK_SIZE
+        start = time.perf_counter()
+        for index in range(blocks):
+            offset = index * SEQUENTIAL_BLOCK_SIZE
+            if write:
+                os.pwrite(fd, buffer, offset)
+            else:
+                os.preadv(fd, [buffer], offset)
+        if write:
+            os.fsync(fd)
+        elapsed = time.perf_counter() - start
+        return round(file_size / (1024**2) / elapsed, 1) if elapsed > 0 else 0.0
+
+    def _random(self, fd: int, buffer: mmap.mmap, file_size: int, write: bool,
+                cancel_event: Optional[threading.Event] = None):
+        """
+        随机4K读写（队列深度1），在时间或次数上限内尽量多做
+
+        Returns:
+            (IOPS, 每次操作的延迟列表(纳秒))
+        """
+        block = memoryview(buffer)[:RANDOM_BLOCK_SIZE]
+        block_count = file_size // RANDOM_BLOCK_SIZE
+        rng = random.Random(0)
+        latencies = []
+        deadline = time.perf_counter() + self.random_seconds
+        start = time.perf_counter()
+        try:
+            while len(latencies) < self.random_max_ops:
+                offset = rng.randrange(block_count) * RANDOM_BLOCK_SIZE
+                op_start = time.perf_counter_ns()
+                if write:
+                    os.pwrite(fd, block, offset)
+                else:
+                    os.preadv(fd, [block], offset)
+                latencies.append(time.perf_counter_ns() - op_start)
+                if len(latencies) % 256 == 0:
+                    if time.perf_counter() >= deadline:
+                        break
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise BenchmarkCancelled()
+            if write:
+                os.fsync(fd)
+        finally:
+            block.release()
+        elapsed = time.perf_counter() - start
+        return (round(len(latencies) / elapsed, 0) if elapsed > 0 else 0.0), latencies
+
+
+def recommend_disk_options(result: Optional[BenchmarkResult]) -> Optional[Dict[str, str]]:
+    """
+    根据基准测试结果推荐QEMU磁盘缓存模式和aio后端
+
+    Returns:
+        {'cache': ..., 'aio': ..., 'reason': ...}，没有测试结果时返回None
+    """
+    if result is None:
+        return None
+    if not result.o_direct:
+        # cache=none 依赖 O_DIRECT，文件系统不支持时只能使用页缓存
+        return {'cache': 'writeback', 'aio': 'threads', 'reason': "存储不支持O_DIRECT，使用页缓存"}
+    if result.rand_iops >= FAST_IOPS_THRESHOLD:
+        kernel = platform.release().split('.')
+        try:
+            io_uring = (int(kernel[0]), int(kernel[1])) >= (5, 1)
+        except (ValueError, IndexError):
+            io_uring = False
+        return {
+            'cache': 'none', 'aio': 'io_uring' if io_uring else 'native',
+            'reason': f"快速存储 ({result.rand_iops:.0f} IOPS)，绕过页缓存并使用异步IO"
+        }
+    if result.rand_iops < SLOW_IOPS_THRESHOLD:
+        return {
+            'cache': 'writeback', 'aio': 'threads',
+            'reason': f"随机IO较慢 ({result.rand_iops:.0f} IOPS，写延迟 {result.rand_write_latency_ms:.1f} ms)，"
+                      f"使用页缓存合并小块写入"
+        }
+    return {
+        'cache': 'none', 'aio': 'native',
+        'reason': f"中速存储 ({result.rand_iops:.0f} IOPS)，绕过页缓存"
+    }
+
+
+class BenchmarkStore:
+    """基准测试结果存储（每个目录保留最近一次结果）"""
+
+    def __init__(self, store_path: Path):
+        self.store_path = Path(store_path)
+        self._lock = threading.Lock()
+        self.results: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        """加载结果"""
+        if self.store_path.exists():
+            try:
+                with open(self.store_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"加载基准测试结果失败: {e}")
+        return {}
+
+    def save_result(self, result: BenchmarkResult):
+        """保存一次结果"""
+        with self._lock:
+            self.results[result.path] = result.to_dict()
+            try:
+                self.store_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.store_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.results, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                print(f"保存基准测试结果失败: {e}")
+
+    def get_result(self, path: str) -> Optional[BenchmarkResult]:
+        """获取目录的结果"""
+        with self._lock:
+            data = self.results.get(os.path.abspath(os.path.expanduser(path)))
+        return BenchmarkResult(**data) if data else None
+
+    def result_for_path(self, path: str) -> Optional[BenchmarkResult]:
+        """
+        获取适用于任意文件的结果
+
+        优先使用包含该文件的最深测试目录，其次使用同一块设备上最近的测试结果。
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        with self._lock:
+            results = list(self.results.values())
+        best = None
+        for data in results:
+            prefix = data['path'].rstrip(os.sep) + os.sep
+            if path.startswith(prefix) and (best is None or len(data['path']) > len(best['path'])):
+                best = data
+        if best is None:
+            device = resolve_block_device(path)
+            same_device = [data for data in results if device and data.get('device') == device]
+            if same_device:
+                best = max(same_device, key=lambda data: data.get('timestamp', ''))
+        return BenchmarkResult(**best) if best else None
+
+
+def benchmark_pools(config_manager, pool_names: List[str] = None, file_size_mb: int = None,
+                    progress_callback: Optional[Callable[[str, int], None]] = None,
+                    cancel_event: Optional[threading.Event] = None) -> List[BenchmarkResult]:
+    """
+    对存储池运行基准测试，保存结果并更新存储池的实测吞吐量和IOPS
+
+    Args:
+        pool_names: 要测试的存储池，None 表示全部已启用的存储池
+        file_size_mb: 测试文件大小，默认读取 storage_benchmark_file_mb 配置
+    """
+    pool_manager = get_storage_pool_manager(config_manager)
+    store = get_benchmark_store(config_manager)
+    benchmark = StorageBenchmark(file_size_mb or config_manager.get_global_config("storage_benchmark_file_mb"))
+    pools = [pool for pool in pool_manager.list_pools()
+             if pool['enabled'] and (pool_names is None or pool['name'] in pool_names)]
+
+    results = []
+    for index, pool in enumerate(pools):
+        Path(pool['path']).mkdir(parents=True, exist_ok=True)
+
+        def pool_progress(message: str, percent: int):
+            if progress_callback:
+                overall = int((index * 100 + percent) / len(pools))
+                progress_callback(f"[{pool['name']}] {message}", overall)
+
+        result = benchmark.run(pool['path'], pool_progress, cancel_event)
+        store.save_result(result)
+        pool_manager.record_throughput(pool['name'], read_mb_s=result.seq_read_mb_s,
+                                       write_mb_s=result.seq_write_mb_s, iops=result.rand_iops)
+        results.append(result)
+    return results
+
+
+# 全局结果存储实例
+benchmark_store = None
+
+
+def get_benchmark_store(config_manager) -> BenchmarkStore:
+    """获取基准测试结果存储实例"""
+    global benchmark_store
+    if benchmark_store is None:
+        benchmark_store = BenchmarkStore(config_manager.config_dir / 'storage_benchmarks.json')
+    return benchmark_store
+
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="存储基准测试（O_DIRECT 顺序/随机4K读写）")
+    parser.add_argument('paths', nargs='*', help="要测试的目录；不指定时测试所有存储池")
+    parser.add_argument('--size', type=int, default=None, help="测试文件大小(MB)")
+    parser.add_argument('--json', action='store_true', help="以JSON格式输出")
+    args = parser.parse_args(argv)
+
+    from ltwin_manager.utils.config_manager import get_config_manager
+    config_manager = get_config_manager()
+
+    def print_progress(message: str, percent: int):
+        if not args.json:
+            print(f"[{percent:3d}%] {message}")
+
+    try:
+        if args.paths:
+            benchmark = StorageBenchmark(args.size or config_manager.get_global_config("storage_benchmark_file_mb"))
+            store = get_benchmark_store(config_manager)
+            results = []
+            for path in args.paths:
+                result = benchmark.run(path, print_progress)
+                store.save_result(result)
+                results.append(result)
+        else:
+            results = benchmark_pools(config_manager, file_size_mb=args.size, progress_callback=print_progress)
+    except (ValueError, OSError) as e:
+        print(f"基准测试失败: {e}")
+        return 1
+
+    if args.json:
+        print(json.dumps([result.to_dict() for result in results], ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            print(result.summary())
+            recommendation = recommend_disk_options(result)
+            print(f"  推荐: cache={recommendation['cache']}, aio={recommendation['aio']} ({recommendation['reason']})")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
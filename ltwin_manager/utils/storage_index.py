@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+存储索引器
+使用 os.scandir 和线程池增量扫描存储目录，按目录缓存文件大小合计，
+目录的 mtime/inode 未变化时直接复用缓存，避免每次全量遍历
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ltwin_manager.utils.profiler import timed
+
+
+# 会原地增长的磁盘镜像文件（写入不会改变目录mtime，目录未变化时仍需重新stat）
+GROWING_FILE_SUFFIXES = ('.qcow2', '.img', '.raw', '.vmdk', '.vdi', '.vhd', '.vhdx')
+
+INDEX_VERSION = 2
+
+
+@dataclass
+class ScanResult:
+    """扫描结果"""
+    root: str
+    total_size: int = 0  # 文件长度合计 (st_size)
+    total_allocated: int = 0  # 实际占用合计 (st_blocks * 512)
+    file_count: int = 0
+    children: Dict[str, int] = field(default_factory=dict)  # 直接子目录名 -> 递归大小
+    children_allocated: Dict[str, int] = field(default_factory=dict)  # 直接子目录名 -> 递归实际占用
+    scanned_dirs: int = 0  # 本次实际重新读取的目录数
+    cached_dirs: int = 0  # 复用缓存的目录数
+
+
+def _file_sizes(st) -> Tuple[int, int]:
+    """返回 (文件长度, 实际占用)；不支持 st_blocks 的平台以文件长度代替"""
+    blocks = getattr(st, 'st_blocks', None)
+    return st.st_size, blocks * 512 if blocks is not None else st.st_size
+
+
+class StorageIndexer:
+    """增量存储索引器"""
+
+    def __init__(self, index_path: Path, max_workers: int = 8):
+        self.index_path = Path(index_path)
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        # 目录路径 -> {'mtime_ns', 'ino', 'files_size', 'files_allocated', 'file_count', 'subdirs', 'growing'}
+        self._dirs: Dict[str, Dict] = {}
+        self._dirty = False
+        self._load_index()
+
+    def _load_index(self):
+        """加载持久化的索引"""
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self._dirs = data.get('dirs', {})
+        except Exception as e:
+            print(f"加载存储索引失败: {e}")
+
+    def _save_index(self):
+        """保存索引（仅在有变化时写入）"""
+        if not self._dirty:
+            return
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.index_path.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'dirs': self._dirs}, f)
+            os.replace(temp_path, self.index_path)
+            self._dirty = False
+        except Exception as e:
+            print(f"保存存储索引失败: {e}")
+
+    @timed("storage_index.scan")
+    def scan(self, root) -> ScanResult:
+        """
+        扫描目录并返回大小合计
+
+        首次扫描会读取所有目录；之后只有 mtime 或 inode 发生变化的目录才会重新读取，
+        未变化目录中的磁盘镜像文件会单独重新stat以反映原地增长。
+
+        Args:
+            root: 要扫描的根目录
+
+        Returns:
+            扫描结果
+        """
+        root = os.path.abspath(os.path.expanduser(str(root)))
+        result = ScanResult(root=root)
+        if not os.path.isdir(root):
+            return result
+
+        with self._lock:
+            visited = set()
+            level = [root]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while level:
+                    next_level = []
+                    for path, entry, rescanned in executor.map(self._refresh_dir, level):
+                        if entry is None:
+                            self._dirs.pop(path, None)
+                            continue
+                        visited.add(path)
+                        if rescanned:
+                            result.scanned_dirs += 1
+                        else:
+                            result.cached_dirs += 1
+                        next_level.extend(os.path.join(path, name) for name in entry['subdirs'])
+                    level = next_level
+
+            # 清理根目录下已不存在的目录缓存
+            prefix = root.rstrip(os.sep) + os.sep
+            for path in [p for p in self._dirs if p.startswith(prefix) and p not in visited]:
+                del self._dirs[path]
+                self._dirty = True
+
+            self._aggregate(root, result)
+            self._save_index()
+
+        return result
+
+    def _refresh_dir(self, path: str) -> Tuple[str, Optional[Dict], bool]:
+        """
+        刷新单个目录的缓存（在线程池中执行）
+
+        Returns:
+            (目录路径, 缓存条目或None, 是否重新读取了目录)
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path, None, True
+
+        cached = self._dirs.get(path)
+        if cached and cached['mtime_ns'] == st.st_mtime_ns and cached['ino'] == st.st_ino:
+            if cached['growing']:
+                self._restat_growing(path, cached)
+            return path, cached, False
+
+        entry = {
+            'mtime_ns': st.st_mtime_ns,
+            'ino': st.st_ino,
+            'files_size': 0,
+            'files_allocated': 0,
+            'file_count': 0,
+            'subdirs': [],
+            'growing': {}  # 文件名 -> [大小, 实际占用]
+        }
+        try:
+            with os.scandir(path) as iterator:
+                for item in iterator:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            entry['subdirs'].append(item.name)
+                        elif item.is_file(follow_symlinks=False):
+                            size, allocated = _file_sizes(item.stat(follow_symlinks=False))
+                            entry['files_size'] += size
+                            entry['files_allocated'] += allocated
+                            entry['file_count'] += 1
+                            if item.name.lower().endswith(GROWING_FILE_SUFFIXES):
+                                entry['growing'][item.name] = [size, allocated]
+                    except OSError:
+                        continue  # 忽略无法访问的文件
+        except OSError:
+            return path, None, True
+
+        self._dirs[path] = entry
+        self._dirty = True
+        return path, entry, True
+
+    def _restat_growing(self, path: str, entry: Dict):
+        """重新stat目录中的磁盘镜像文件并修正合计"""
+        for name, (old_size, old_allocated) in list(entry['growing'].items()):
+            try:
+                size, allocated = _file_sizes(os.stat(os.path.join(path, name)))
+            except OSError:
+                continue  # 文件被删除时目录mtime会变化，下次扫描会处理
+            if size != old_size or allocated != old_allocated:
+                entry['growing'][name] = [size, allocated]
+                entry['files_size'] += size - old_size
+                entry['files_allocated'] += allocated - old_allocated
+                self._dirty = True
+
+    def _aggregate(self, root: str, result: ScanResult):
+        """自底向上计算递归大小，并填充根目录及其各子目录的合计"""
+        totals: Dict[str, Tuple[int, int, int]] = {}  # 路径 -> (大小, 实际占用, 文件数)
+
+        # 使用显式栈避免深层目录导致递归过深
+        stack = [(root, False)]
+        while stack:
+            current, expanded = stack.pop()
+            entry = self._dirs.get(current)
+            if entry is None:
+                totals[current] = (0, 0, 0)
+                continue
+            subpaths = [os.path.join(current, name) for name in entry['subdirs']]
+            if not expanded:
+                stack.append((current, True))
+                stack.extend((sub, False) for sub in subpaths if sub not in totals)
+                continue
+            size, allocated, count = entry['files_size'], entry['files_allocated'], entry['file_count']
+            for sub in subpaths:
+                sub_size, sub_allocated, sub_count = totals.get(sub, (0, 0, 0))
+                size += sub_size
+                allocated += sub_allocated
+                count += sub_count
+            totals[current] = (size, allocated, count)
+
+        result.total_size, result.total_allocated, result.file_count = totals[root]
+        for name in self._dirs.get(root, {}).get('subdirs', []):
+            sub_size, sub_allocated, _ = totals.get(os.path.join(root, name), (0, 0, 0))
+            result.children[name] = sub_size
+            result.children_allocated[name] = sub_allocated
+
+    def invalidate(self, path=None):
+        """
+        使缓存失效
+
+        Args:
+            path: 指定目录（连同其子目录）；为None时清空全部缓存
+        """
+        with self._lock:
+            if path is None:
+                self._dirs.clear()
+            else:
+                path = os.path.abspath(os.path.expanduser(str(path)))
+                prefix = path.rstrip(os.sep) + os.sep
+                for cached in [p for p in self._dirs if p == path or p.startswith(prefix)]:
+                    del self._dirs[cached]
+            self._dirty = True
+
+
+# 全局存储索引器实例
+storage_indexer = None
+
+
+def get_storage_indexer(config_manager) -> StorageIndexer:
+    """获取存储索引器实例"""
+    global storage_indexer
+    if storage_indexer is None:
+        storage_indexer = StorageIndexer(config_manager.config_dir / 'storage_index.json')
+    return storage_indexer
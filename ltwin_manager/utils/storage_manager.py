@@ -8,9 +8,24 @@ import os
 import shutil
 import psutil
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import subprocess
+import time
+from datetime import datetime, timedelta
+
+from ltwin_manager.utils.profiler import timed
+from ltwin_manager.utils.storage_index import get_storage_indexer
+from ltwin_manager.utils.disk_inspector import get_disk_inspector, DiskImageInfo
+from ltwin_manager.utils.qcow2_reader import Qcow2Image, Qcow2Error, is_qcow2
+from ltwin_manager.utils.storage_index import GROWING_FILE_SUFFIXES
+from ltwin_manager.utils.disk_job_queue import get_disk_job_queue, PRIORITY_NORMAL
+from ltwin_manager.utils.disk_conversion import get_conversion_planner, allocated_bytes
+from ltwin_manager.utils.storage_pools import get_storage_pool_manager
+from ltwin_manager.utils.snapshot_manager import get_snapshot_manager, vm_drives
+from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+from ltwin_manager.utils.snapshot_retention import get_snapshot_retention_engine, RetentionPolicy
 
 
 @dataclass
@@ -32,6 +47,7 @@ class FileInfo:
     size: int
     is_directory: bool
     modified_time: float
+    allocated_size: int = 0  # 实际占用 (st_blocks * 512)，稀疏文件小于 size
 
 
 class StorageManager:
@@ -42,6 +58,12 @@ class StorageManager:
         vm_storage_path = config_manager.get_global_config("vm_storage_path")
         self.base_path = Path(vm_storage_path) if vm_storage_path else Path.home() / "VirtualMachines"
         self.base_path.mkdir(parents=True, exist_ok=True)
+        self.indexer = get_storage_indexer(config_manager)
+        self.disk_inspector = get_disk_inspector()
+        self.job_queue = get_disk_job_queue(config_manager)
+        self.conversion_planner = get_conversion_planner(config_manager)
+        self.pool_manager = get_storage_pool_manager(config_manager)
+        self.capacity_planner = get_capacity_planner(config_manager)
     
     def get_system_disks(self) -> List[DiskInfo]:
         """获取系统磁盘信息"""
@@ -65,16 +87,10 @@ class StorageManager:
         
         return disks
     
+    @timed("storage_manager.storage_usage")
     def get_ltwin_storage_usage(self) -> DiskInfo:
-        """获取LTWin存储使用情况"""
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(self.base_path):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                try:
-                    total_size += os.path.getsize(filepath)
-                except OSError:
-                    continue  # 忽略无法访问的文件
+        """获取LTWin存储使用情况（已用空间按实际占用计算）"""
+        total_size = self.indexer.scan(self.base_path).total_allocated
         
         # 获取所在磁盘的总信息
         disk_usage = psutil.disk_usage(str(self.base_path))
@@ -88,6 +104,7 @@ class StorageManager:
             usage_percent=(total_size / disk_usage.total) * 100 if disk_usage.total > 0 else 0
         )
     
+    @timed("storage_manager.list_directory")
     def list_directory(self, path: str) -> List[FileInfo]:
         """列出目录内容"""
         path_obj = Path(path)
@@ -98,12 +115,14 @@ class StorageManager:
         for item in path_obj.iterdir():
             try:
                 stat = item.stat()
+                blocks = getattr(stat, 'st_blocks', None)
                 file_info = FileInfo(
                     name=item.name,
                     path=str(item),
                     size=stat.st_size,
                     is_directory=item.is_dir(),
-                    modified_time=stat.st_mtime
+                    modified_time=stat.st_mtime,
+                    allocated_size=blocks * 512 if blocks is not None else stat.st_size
                 )
                 files.append(file_info)
             except (OSError, PermissionError):
@@ -117,13 +136,7 @@ class StorageManager:
             # 确保目录存在
             Path(path).parent.mkdir(parents=True, exist_ok=True)
             
-            cmd = [
-                'qemu-img', 'create',
-                '-f', 'qcow2',
-                path,
-                f'{size_gb}G'
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
+            subprocess.run(self._create_disk_command(path, size_gb), check=True, capture_output=True)
             return True
         except subprocess.CalledProcessError as e:
             print(f"创建磁盘镜像失败: {e}")
@@ -133,14 +146,16 @@ class StorageManager:
             return False
     
     def resize_disk_image(self, path: str, new_size_gb: int) -> bool:
-        """调整虚拟磁盘大小"""
+        """调整虚拟磁盘大小（虚拟机当前磁盘按快照计划先创建快照，快照失败时不调整）"""
         try:
-            cmd = [
-                'qemu-img', 'resize',
-                path,
-                f'{new_size_gb}G'
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
+            owner = self._disk_owner(path)
+            if owner is None:
+                subprocess.run(self._resize_disk_command(path, new_size_gb), check=True, capture_output=True)
+                return True
+            vm_name, drive_id = owner
+            with get_snapshot_manager(self.config_manager).vm_lock(vm_name):
+                path = self._snapshot_before_resize(vm_name, drive_id, path)
+                subprocess.run(self._resize_disk_command(path, new_size_gb), check=True, capture_output=True)
             return True
         except subprocess.CalledProcessError as e:
             print(f"调整磁盘大小失败: {e}")
@@ -149,17 +164,16 @@ class StorageManager:
             print(f"调整磁盘大小失败: {e}")
             return False
     
-    def convert_disk_format(self, source_path: str, target_path: str, target_format: str) -> bool:
+    def convert_disk_format(self, source_path: str, target_path: str, target_format: str,
+                            compress: bool = False) -> bool:
         """转换磁盘格式"""
         try:
-            cmd = [
-                'qemu-img', 'convert',
-                '-f', 'qcow2',  # 假设源格式为qcow2
-                '-O', target_format,
-                source_path,
-                target_path
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
+            plan = self.conversion_planner.plan(source_path, target_path, target_format, compress)
+            start = time.time()
+            subprocess.run(plan.build_command(source_path, target_path), check=True, capture_output=True)
+            self.conversion_planner.history.record(
+                plan, 'convert', allocated_bytes(source_path), time.time() - start
+            )
             return True
         except subprocess.CalledProcessError as e:
             print(f"转换磁盘格式失败: {e}")
@@ -168,6 +182,308 @@ class StorageManager:
             print(f"转换磁盘格式失败: {e}")
             return False
     
+    def _create_disk_command(self, path: str, size_gb: int) -> List[str]:
+        """构建创建磁盘的命令"""
+        return ['qemu-img', 'create', '-f', 'qcow2', path, f'{size_gb}G']
+    
+    def _disk_owner(self, path: str) -> Optional[Tuple[str, str]]:
+        """把该文件作为当前磁盘的虚拟机 (虚拟机名称, drive id)，不是任何虚拟机的磁盘时为 None"""
+        target = os.path.abspath(path)
+        for vm_name in self.config_manager.list_vms():
+            for drive_id, disk_path in vm_drives(self.config_manager.get_vm_config(vm_name) or {}):
+                if os.path.abspath(disk_path) == target:
+                    return vm_name, drive_id
+        return None
+    
+    def _snapshot_before_resize(self, vm_name: str, drive_id: str, path: str) -> str:
+        """
+        调整虚拟机当前磁盘的大小前按快照计划创建快照（调用方持有虚拟机锁）
+        
+        外部快照会把虚拟机切换到新的覆盖层，返回快照后应调整的磁盘路径
+        
+        Raises:
+            RuntimeError: 快照计划要求先创建快照但创建失败
+        """
+        from ltwin_manager.utils.snapshot_scheduler import get_snapshot_scheduler
+        
+        scheduler = get_snapshot_scheduler(self.config_manager)
+        if not scheduler.wants_snapshot_before(vm_name):
+            return path
+        if not scheduler.snapshot_before(vm_name, "调整磁盘大小"):
+            raise RuntimeError(f"调整大小前为虚拟机 '{vm_name}' 创建快照失败，已取消调整")
+        return dict(vm_drives(self.config_manager.get_vm_config(vm_name) or {})).get(drive_id, path)
+    
+    def _resize_disk_command(self, path: str, new_size_gb: int) -> List[str]:
+        """构建调整磁盘大小的命令"""
+        return ['qemu-img', 'resize', path, f'{new_size_gb}G']
+    
+    def create_disk_image_async(self, path: str, size_gb: int, priority: int = PRIORITY_NORMAL) -> str:
+        """
+        在后台任务队列中创建虚拟磁盘，返回任务ID
+        
+        Raises:
+            ValueError: 目标文件已存在
+            CapacityError: 会超出所在存储池允许的超配比例
+        """
+        if os.path.exists(path):
+            raise ValueError(f"目标文件已存在: {path}")
+        self.capacity_planner.enforce(path, size_gb * 1024**3)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        
+        def on_success(job):
+            self.capacity_planner.register(path, 'disk')
+        
+        return self.job_queue.submit(
+            'create', f"创建磁盘 {Path(path).name} ({size_gb} GB)",
+            self._create_disk_command(path, size_gb),
+            target_path=path, priority=priority, remove_target_on_failure=True,
+            on_success=on_success
+        )
+    
+    def resize_disk_image_async(self, path: str, new_size_gb: int, priority: int = PRIORITY_NORMAL) -> str:
+        """
+        在后台任务队列中调整磁盘大小，返回任务ID
+        
+        虚拟机当前磁盘的调整前快照也在任务中执行（持有虚拟机锁），快照失败时任务失败，不调整大小
+        """
+        owner = self._disk_owner(path)
+        if owner is None:
+            return self.job_queue.submit(
+                'resize', f"调整 {Path(path).name} 为 {new_size_gb} GB",
+                self._resize_disk_command(path, new_size_gb),
+                target_path=path, priority=priority
+            )
+        vm_name, drive_id = owner
+        
+        def runner(job):
+            with get_snapshot_manager(self.config_manager).vm_lock(vm_name):
+                if job.status == 'cancelled':
+                    return None
+                target = self._snapshot_before_resize(vm_name, drive_id, path)
+                returncode, stderr = self.job_queue.run_command(job, self._resize_disk_command(target, new_size_gb))
+            if returncode != 0 and job.status != 'cancelled':
+                raise RuntimeError(stderr.strip() or f"qemu-img resize 返回 {returncode}")
+            return f"已调整 {Path(target).name}，耗时 {job.elapsed:.1f} 秒"
+        
+        return self.job_queue.submit(
+            'resize', f"调整 {vm_name} 的磁盘 {drive_id} 为 {new_size_gb} GB",
+            self._resize_disk_command(path, new_size_gb),
+            target_path=path, priority=priority, runner=runner
+        )
+    
+    def convert_disk_format_async(self, source_path: str, target_path: str, target_format: str,
+                                  compress: bool = False, priority: int = PRIORITY_NORMAL) -> str:
+        """在后台任务队列中转换磁盘格式（带进度），返回任务ID"""
+        Path(target_path).parent.mkdir(parents=True, exist_ok=True)
+        plan = self.conversion_planner.plan(source_path, target_path, target_format, compress)
+        source_bytes = allocated_bytes(source_path)
+        
+        def on_success(job):
+            throughput = self.conversion_planner.history.record(plan, 'convert', source_bytes, job.elapsed)
+            return f"完成，耗时 {job.elapsed:.1f} 秒，{throughput:.1f} MB/s"
+        
+        return self.job_queue.submit(
+            'convert',
+            f"转换 {Path(source_path).name} → {Path(target_path).name} ({plan.source_format}→{target_format}, {plan.describe()})",
+            plan.build_command(source_path, target_path, progress=True),
+            target_path=target_path, priority=priority, remove_target_on_failure=True,
+            on_success=on_success
+        )
+    
+    def compact_disk_image_async(self, path: str, compress: bool = False,
+                                 priority: int = PRIORITY_NORMAL) -> str:
+        """
+        在后台重写镜像以去除零簇和已释放的空间，完成后替换原文件，返回任务ID
+        
+        qemu-img convert 不会复制内部快照，镜像中保存着内部快照时拒绝压缩。
+        
+        Raises:
+            ValueError: 镜像正被运行中的虚拟机使用（任一磁盘或其后端链），或镜像中有内部快照
+        """
+        path = os.path.abspath(path)
+        users = get_chain_maintenance(self.config_manager).chain_users([path]).get(path, set())
+        for vm_name in sorted(users):
+            if (self.config_manager.get_vm_config(vm_name) or {}).get('status') == 'running':
+                raise ValueError(f"虚拟机 '{vm_name}' 正在使用该磁盘，请先停止")
+        if is_qcow2(path):
+            try:
+                with Qcow2Image(path) as image:
+                    snapshot_count = image.header.nb_snapshots
+            except (OSError, Qcow2Error) as e:
+                raise ValueError(f"读取镜像失败: {e}")
+            if snapshot_count:
+                raise ValueError(f"镜像中有 {snapshot_count} 个内部快照，压缩会丢失它们，请先删除或导出")
+        
+        temp_path = f"{path}.compact.tmp"
+        plan = self.conversion_planner.plan_compact(path, temp_path, compress)
+        source_bytes = allocated_bytes(path)
+        
+        def on_success(job):
+            compacted_bytes = allocated_bytes(temp_path)
+            shutil.copystat(path, temp_path)
+            os.replace(temp_path, path)
+            self.disk_inspector.invalidate(path)
+            throughput = self.conversion_planner.history.record(plan, 'compact', source_bytes, job.elapsed)
+            saved = max(source_bytes - compacted_bytes, 0)
+            return f"完成，释放 {saved / (1024**3):.2f} GB，{throughput:.1f} MB/s"
+        
+        return self.job_queue.submit(
+            'compact', f"压缩 {Path(path).name} ({plan.describe()})",
+            plan.build_command(path, temp_path, progress=True),
+            target_path=temp_path, priority=priority, remove_target_on_failure=True,
+            on_success=on_success
+        )
+    
+    def migrate_disk_to_pool_async(self, vm_name: str, pool_name: str,
+                                   priority: int = PRIORITY_NORMAL) -> str:
+        """
+        在后台把虚拟机磁盘迁移到另一个存储池，返回任务ID
+        
+        按原格式复制（保留后端文件）到 <池>/<虚拟机>/ 下，完成后把该虚拟机快照的后端指向新位置、
+        更新虚拟机配置，原文件没有其他使用者时删除。迁移期间虚拟机需保持停止。
+        原文件是其他虚拟机（链接克隆、镜像库覆盖层）的后端时任务失败，不复制；
+        检查使用者和目标存储池空间都在任务线程中进行。
+        
+        Raises:
+            ValueError: 虚拟机或存储池不存在、虚拟机正在运行
+        """
+        vm_config = self.config_manager.get_vm_config(vm_name)
+        if not vm_config:
+            raise ValueError(f"虚拟机 '{vm_name}' 不存在")
+        if vm_config.get('status') == 'running':
+            raise ValueError(f"虚拟机 '{vm_name}' 正在运行，请先停止")
+        pool = self.pool_manager.get_pool(pool_name)
+        if pool is None:
+            raise ValueError(f"存储池 '{pool_name}' 不存在")
+        
+        source_path = os.path.abspath(vm_config.get('disk_path', ''))
+        if not os.path.exists(source_path):
+            raise ValueError(f"磁盘文件不存在: {source_path}")
+        if self.pool_manager.pool_for_path(source_path) == pool_name:
+            raise ValueError(f"磁盘已位于存储池 '{pool_name}'")
+        target_path = str(Path(pool['path']) / vm_name / os.path.basename(source_path))
+        if os.path.exists(target_path):
+            raise ValueError(f"目标文件已存在: {target_path}")
+        
+        source_bytes = allocated_bytes(source_path)
+        Path(target_path).parent.mkdir(parents=True, exist_ok=True)
+        plan = self.conversion_planner.plan_compact(source_path, target_path)  # 按原格式重写，保留后端文件
+        chain_maintenance = get_chain_maintenance(self.config_manager)
+        
+        def runner(job):
+            users = chain_maintenance.chain_users([source_path], exclude_vm=vm_name)
+            if users:
+                raise RuntimeError(
+                    f"磁盘仍是其他虚拟机的后端（{', '.join(sorted(set().union(*users.values())))}），不能迁移"
+                )
+            status = self.pool_manager.get_pool_status(pool)
+            if status.free_bytes < source_bytes:
+                raise RuntimeError(
+                    f"存储池 '{pool_name}' 空间不足: 需要 {source_bytes / (1024**3):.2f} GB，"
+                    f"可用 {status.free_bytes / (1024**3):.2f} GB"
+                )
+            returncode, stderr = self.job_queue.run_command(job, plan.build_command(source_path, target_path,
+                                                                                    progress=True))
+            if returncode != 0 and job.status != 'cancelled':
+                raise RuntimeError(stderr.strip() or f"qemu-img 返回 {returncode}")
+            return None
+        
+        def on_success(job):
+            shutil.copystat(source_path, target_path)
+            rebase_failures = self._rebase_snapshot_overlays(vm_name, source_path, target_path, plan.source_format)
+            
+            current_config = self.config_manager.get_vm_config(vm_name) or vm_config
+            current_config['disk_path'] = target_path
+            current_config['storage_pool'] = pool_name
+            self.config_manager.set_vm_config(vm_name, current_config)
+            
+            if not self.capacity_planner.move(source_path, target_path):
+                self.capacity_planner.register(target_path, 'disk', vm_name)
+            throughput = self.conversion_planner.history.record(plan, 'migrate', source_bytes, job.elapsed)
+            self.pool_manager.record_throughput(pool_name, write_mb_s=throughput)
+            self.disk_inspector.invalidate(source_path)
+            
+            if rebase_failures:
+                # 仍有快照引用原文件，保留原文件以免快照失效
+                return f"已迁移到 {pool_name}，但 {len(rebase_failures)} 个快照未能重新指向新磁盘，原文件已保留"
+            users = chain_maintenance.chain_users([source_path])
+            if users:
+                # 复制期间其他虚拟机开始使用原文件（或仍有快照链经过它），保留原文件
+                return (f"已迁移到 {pool_name}，但原文件仍被 "
+                        f"{', '.join(sorted(set().union(*users.values())))} 使用，已保留")
+            os.remove(source_path)
+            return f"已迁移到 {pool_name}，耗时 {job.elapsed:.1f} 秒，{throughput:.1f} MB/s"
+        
+        return self.job_queue.submit(
+            'migrate', f"迁移 {vm_name} 磁盘 → {pool_name} ({plan.describe()})",
+            plan.build_command(source_path, target_path, progress=True),
+            target_path=target_path, priority=priority, remove_target_on_failure=True,
+            on_success=on_success, runner=runner
+        )
+    
+    def _rebase_snapshot_overlays(self, vm_name: str, old_path: str, new_path: str, backing_format: str) -> List[str]:
+        """
+        把后端为 old_path 的快照覆盖层改为指向 new_path（只改头部，不复制数据）
+        
+        Returns:
+            重新指向失败的快照文件列表
+        """
+        failures = []
+        snapshot_manager = get_snapshot_manager(self.config_manager)
+        for snapshot_info in snapshot_manager.snapshots_metadata.get(vm_name, {}).values():
+            overlay_path = snapshot_info.get('disk_path', '')
+            if not is_qcow2(overlay_path):
+                continue
+            try:
+                with Qcow2Image(overlay_path) as image:
+                    backing_path = image.resolve_backing_path()
+                if not backing_path or os.path.abspath(backing_path) != old_path:
+                    continue
+                subprocess.run(
+                    ['qemu-img', 'rebase', '-u', '-b', new_path, '-F', backing_format, overlay_path],
+                    check=True, capture_output=True
+                )
+                self.disk_inspector.invalidate(overlay_path)
+            except (OSError, Qcow2Error, subprocess.CalledProcessError) as e:
+                print(f"重新指向快照后端失败: {overlay_path}: {e}")
+                failures.append(overlay_path)
+        return failures
+    
+    def get_disk_image_info(self, path: str) -> Optional[DiskImageInfo]:
+        """获取虚拟磁盘的虚拟大小、实际占用和后端链"""
+        return self.disk_inspector.inspect(path)
+    
+    def list_disk_images(self, path: str) -> List[DiskImageInfo]:
+        """列出目录中的虚拟磁盘（qcow2直接解析头部，不逐个启动qemu-img）"""
+        images = []
+        try:
+            with os.scandir(path) as iterator:
+                for item in iterator:
+                    if item.is_file() and item.name.lower().endswith(GROWING_FILE_SUFFIXES):
+                        info = self.disk_inspector.inspect(item.path)
+                        if info:
+                            images.append(info)
+        except OSError:
+            return []
+        return sorted(images, key=lambda x: x.path)
+    
+    def validate_disk_image(self, path: str) -> List[str]:
+        """
+        校验虚拟磁盘
+        
+        Returns:
+            问题列表，为空表示未发现问题
+        """
+        if not os.path.exists(path):
+            return [f"文件不存在: {path}"]
+        if not is_qcow2(path):
+            return []
+        try:
+            with Qcow2Image(path) as image:
+                return image.validate()
+        except (OSError, Qcow2Error) as e:
+            return [str(e)]
+    
     def get_file_size(self, path: str) -> int:
         """获取文件大小"""
         try:
@@ -175,11 +491,13 @@ class StorageManager:
         except OSError:
             return 0
     
+    @timed("storage_manager.disk_statistics")
     def get_disk_statistics(self, vm_name: str = None) -> Dict:
         """获取磁盘统计信息"""
         stats = {
             'total_vms': 0,
-            'total_disk_usage': 0,
+            'total_disk_usage': 0,  # 实际占用
+            'total_apparent_size': 0,  # 文件长度合计（稀疏文件按完整长度计）
             'largest_vm': '',
             'largest_vm_size': 0,
             'vm_count_by_size': []
@@ -189,17 +507,18 @@ class StorageManager:
         vm_storage_path = Path(vm_storage_path_str) if vm_storage_path_str else Path.home() / "VirtualMachines"
         
         if vm_storage_path.exists():
-            vms = [d for d in vm_storage_path.iterdir() if d.is_dir()]
-            stats['total_vms'] = len(vms)
+            # 每个虚拟机目录的递归大小来自增量索引
+            scan_result = self.indexer.scan(vm_storage_path)
+            stats['total_vms'] = len(scan_result.children)
+            stats['total_apparent_size'] = scan_result.total_size
             
             vm_sizes = []
-            for vm_dir in vms:
-                vm_size = sum(f.stat().st_size for f in vm_dir.rglob('*') if f.is_file())
-                vm_sizes.append((vm_dir.name, vm_size))
+            for vm_name, vm_size in scan_result.children_allocated.items():
+                vm_sizes.append((vm_name, vm_size))
                 stats['total_disk_usage'] += vm_size
                 
                 if vm_size > stats['largest_vm_size']:
-                    stats['largest_vm'] = vm_dir.name
+                    stats['largest_vm'] = vm_name
                     stats['largest_vm_size'] = vm_size
             
             # 按大小排序虚拟机
@@ -208,26 +527,20 @@ class StorageManager:
         return stats
     
     def cleanup_old_snapshots(self, days_old: int = 30) -> int:
-        """清理旧快照"""
-        import time
-        
-        snapshot_location_str = self.config_manager.get_global_config("snapshot_location")
-        snapshot_location = Path(snapshot_location_str) if snapshot_location_str else Path.home() / ".ltwin" / "snapshots"
-        cleaned_count = 0
-        
-        if snapshot_location.exists():
-            cutoff_time = time.time() - (days_old * 24 * 60 * 60)
-            
-            for snapshot_dir in snapshot_location.rglob("*"):
-                if snapshot_dir.is_dir():
-                    if snapshot_dir.stat().st_mtime < cutoff_time:
-                        try:
-                            shutil.rmtree(snapshot_dir)
-                            cleaned_count += 1
-                        except OSError:
-                            continue  # 忽略无法删除的目录
-        
-        return cleaned_count
+        """
+        清理旧快照
+
+        按快照元数据删除超过指定天数的快照（先合并依赖它的子镜像，同时更新元数据），
+        返回删除的快照数。更细的保留规则见 SnapshotRetentionEngine。
+        """
+        engine = get_snapshot_retention_engine(self.config_manager)
+        # 只处理有过期快照的虚拟机，不读取其他虚拟机的快照元数据
+        vm_names = engine.vms_with_snapshots_before(datetime.now() - timedelta(days=days_old))
+        plan = engine.plan(policy=RetentionPolicy(max_age_days=days_old), vm_names=vm_names)
+        result = engine.execute(plan)
+        for error in result['errors']:
+            print(f"清理快照失败: {error}")
+        return result['deleted']
     
     def get_vm_disk_info(self, vm_name: str) -> List[FileInfo]:
         """获取特定虚拟机的磁盘文件信息"""
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+存储池管理器
+把多个目录组织为命名的存储池（容量、设备类型、实测吞吐量），
+按放置策略（剩余空间、IOPS余量、亲和性）为新磁盘和快照选择存储池
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+from ltwin_manager.utils.disk_stats import DiskStatsSampler, get_device_class
+from ltwin_manager.utils.storage_index import get_storage_indexer
+
+
+POOL_ROLES = {
+    'disks': '虚拟机磁盘',
+    'snapshots': '快照'
+}
+
+DEVICE_CLASS_NAMES = {
+    'auto': '自动检测',
+    'nvme': 'NVMe',
+    'ssd': 'SSD',
+    'hdd': 'HDD',
+    'network': '网络存储',
+    'unknown': '未知'
+}
+
+# 亲和性: 热数据优先放在快速设备上，冷数据优先放在大容量慢速设备上
+AFFINITY_DEVICE_CLASSES = {
+    'hot': ('nvme', 'ssd'),
+    'cold': ('hdd', 'network')
+}
+
+# 放置策略的评分权重: (剩余空间, IOPS余量, 亲和性)
+PLACEMENT_POLICIES = {
+    'balanced': (0.4, 0.3, 0.3),
+    'most_free': (0.8, 0.1, 0.1),
+    'fastest': (0.1, 0.6, 0.3)
+}
+
+# 放置时使用的设备负载采样结果的有效期（秒），过期后在后台线程中重新采样
+DEVICE_LOAD_MAX_AGE = 30
+
+
+@dataclass
+class PoolStatus:
+    """存储池当前状态"""
+    pool: Dict
+    device_class: str
+    used_bytes: int = 0  # 池目录中文件的实际占用
+    free_bytes: int = 0  # 考虑容量上限和预留空间后的可用空间
+    capacity_bytes: int = 0  # 容量上限（未设置时为文件系统总容量）
+    util_percent: float = 0.0  # 所在设备当前利用率
+    current_iops: float = 0.0  # 所在设备当前IOPS
+    score: float = 0.0  # 放置评分（仅 place() 结果）
+    reason: str = ""  # 放置原因（仅 place() 结果）
+
+    @property
+    def name(self) -> str:
+        return self.pool['name']
+
+    @property
+    def path(self) -> str:
+        return self.pool['path']
+
+    @property
+    def iops_headroom(self) -> float:
+        """IOPS余量比例（0-1）：有实测IOPS时按实测值计算，否则按设备利用率估算"""
+        headroom = max(0.0, 1.0 - self.util_percent / 100)
+        measured_iops = self.pool.get('iops', 0)
+        if measured_iops:
+            headroom = min(headroom, max(0.0, 1.0 - self.current_iops / measured_iops))
+        return headroom
+
+    def to_dict(self) -> Dict:
+        """转换为字典（供界面显示）"""
+        return {
+            **self.pool,
+            'device_class': self.device_class,
+            'used_bytes': self.used_bytes,
+            'free_bytes': self.free_bytes,
+            'capacity_bytes': self.capacity_bytes,
+            'util_percent': self.util_percent,
+            'iops_headroom': round(self.iops_headroom, 2)
+        }
+
+
+def _normalize_pool(pool: Dict) -> Dict:
+    """补全存储池字段"""
+    return {
+        'name': pool['name'],
+        'path': str(Path(pool['path']).expanduser()),
+        'roles': list(pool.get('roles') or ['disks', 'snapshots']),
+        'device_class': pool.get('device_class', 'auto'),
+        'capacity_gb': pool.get('capacity_gb', 0),  # 0 表示使用整个文件系统
+        'reserve_percent': pool.get('reserve_percent', 5),  # 为文件系统保留的空间比例
+        'enabled': pool.get('enabled', True),
+        'read_mb_s': pool.get('read_mb_s', 0.0),  # 实测吞吐量，0 表示未测量
+        'write_mb_s': pool.get('write_mb_s', 0.0),
+        'iops': pool.get('iops', 0.0),
+        'measured_at': pool.get('measured_at', '')
+    }
+
+
+class StoragePoolManager:
+    """存储池管理器"""
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.indexer = get_storage_indexer(config_manager)
+        self.disk_stats_sampler = DiskStatsSampler()
+        self._load_lock = threading.Lock()
+        self._device_load: Tuple[float, Dict[str, Dict]] = (float('-inf'), {})  # (采样时间, 设备指标)
+        self._load_thread: Optional[threading.Thread] = None
+
+    def list_pools(self) -> List[Dict]:
+        """
+        列出所有存储池
+
+        未配置存储池时，由 vm_storage_path 和 snapshot_location 生成默认存储池（不写入配置）。
+        """
+        pools = self.config_manager.get_global_config("storage_pools") or []
+        if pools:
+            return [_normalize_pool(pool) for pool in pools]
+        return self._default_pools()
+
+    def _default_pools(self) -> List[Dict]:
+        """由原有的单一存储路径生成默认存储池"""
+        vm_storage_path = str(self.config_manager.get_default_vm_storage_path())
+        snapshot_location = self.config_manager.get_global_config("snapshot_location") \
+            or str(Path.home() / ".ltwin" / "snapshots")
+        if os.path.abspath(vm_storage_path) == os.path.abspath(snapshot_location):
+            return [_normalize_pool({'name': 'default', 'path': vm_storage_path, 'roles': ['disks', 'snapshots']})]
+        return [
+            _normalize_pool({'name': 'default', 'path': vm_storage_path, 'roles': ['disks']}),
+            _normalize_pool({'name': 'snapshots', 'path': snapshot_location, 'roles': ['snapshots']})
+        ]
+
+    def _save_pools(self, pools: List[Dict]) -> bool:
+        """保存存储池配置"""
+        return self.config_manager.set_global_config("storage_pools", pools)
+
+    def get_pool(self, name: str) -> Optional[Dict]:
+        """按名称获取存储池"""
+        for pool in self.list_pools():
+            if pool['name'] == name:
+                return pool
+        return None
+
+    def add_pool(self, name: str, path: str, roles: List[str] = None, device_class: str = 'auto',
+                 capacity_gb: int = 0, reserve_percent: int = 5) -> bool:
+        """添加存储池"""
+        try:
+            if not name:
+                raise ValueError("存储池名称不能为空")
+            if self.get_pool(name):
+                raise ValueError(f"存储池 '{name}' 已存在")
+            if device_class not in DEVICE_CLASS_NAMES:
+                raise ValueError(f"不支持的设备类型: {device_class}")
+            Path(path).expanduser().mkdir(parents=True, exist_ok=True)
+
+            pools = self.list_pools()  # 首次添加时把默认存储池一并写入配置
+            pools.append(_normalize_pool({
+                'name': name, 'path': path, 'roles': roles, 'device_class': device_class,
+                'capacity_gb': capacity_gb, 'reserve_percent': reserve_percent
+            }))
+            return self._save_pools(pools)
+        except Exception as e:
+            print(f"添加存储池失败: {e}")
+            return False
+
+    def update_pool(self, name: str, **changes) -> bool:
+        """更新存储池属性"""
+        pools = self.list_pools()
+        for pool in pools:
+            if pool['name'] == name:
+                pool.update({key: value for key, value in changes.items() if key != 'name'})
+                return self._save_pools([_normalize_pool(pool) for pool in pools])
+        print(f"更新存储池失败: 存储池 '{name}' 不存在")
+        return False
+
+    def remove_pool(self, name: str) -> bool:
+        """移除存储池（不删除目录中的文件）"""
+        try:
+            pool = self.get_pool(name)
+            if pool is None:
+                raise ValueError(f"存储池 '{name}' 不存在")
+            users = [vm_name for vm_name in self.config_manager.list_vms()
+                     if self.pool_for_path((self.config_manager.get_vm_config(vm_name) or {}).get('disk_path', ''))
+                     == pool['name']]
+            if users:
+                raise ValueError(f"存储池仍被虚拟机使用: {', '.join(users)}")
+            return self._save_pools([p for p in self.list_pools() if p['name'] != name])
+        except Exception as e:
+            print(f"移除存储池失败: {e}")
+            return False
+
+    def record_throughput(self, name: str, read_mb_s: float = None, write_mb_s: float = None,
+                          iops: float = None) -> bool:
+        """记录存储池的实测吞吐量（只更新给出的值）"""
+        changes = {'measured_at': time.strftime("%Y-%m-%d %H:%M:%S")}
+        if read_mb_s is not None:
+            changes['read_mb_s'] = round(read_mb_s, 1)
+        if write_mb_s is not None:
+            changes['write_mb_s'] = round(write_mb_s, 1)
+        if iops is not None:
+            changes['iops'] = round(iops, 0)
+        return self.update_pool(name, **changes)
+
+    def pool_for_path(self, path: str) -> Optional[str]:
+        """获取路径所属的存储池名称（按最长路径匹配）"""
+        if not path:
+            return None
+        path = os.path.abspath(os.path.expanduser(path))
+        best_name, best_length = None, -1
+        for pool in self.list_pools():
+            pool_path = os.path.abspath(pool['path']).rstrip(os.sep)
+            if (path == pool_path or path.startswith(pool_path + os.sep)) and len(pool_path) > best_length:
+                best_name, best_length = pool['name'], len(pool_path)
+        return best_name
+
+    def get_pool_status(self, pool: Dict, device_metrics: Dict[str, Dict] = None,
+                        scan: bool = True) -> PoolStatus:
+        """
+        获取存储池的占用、可用空间和设备负载
+
+        Args:
+            pool: 存储池
+            device_metrics: DiskStatsSampler.sample() 的结果（以 'pool:<名称>' 为用途）
+            scan: 扫描池目录统计占用；为 False 时只有设置了容量上限的存储池才扫描（计算可用空间需要）
+        """
+        device_class = pool['device_class']
+        if device_class == 'auto':
+            device_class = get_device_class(pool['path'])
+        status = PoolStatus(pool=pool, device_class=device_class)
+
+        path = Path(pool['path'])
+        if path.exists() and (scan or pool['capacity_gb']):
+            status.used_bytes = self.indexer.scan(path).total_allocated
+        # 目录尚未创建时按最近的已存在父目录所在文件系统计算
+        usage_path = path
+        while not usage_path.exists() and usage_path != usage_path.parent:
+            usage_path = usage_path.parent
+        try:
+            usage = psutil.disk_usage(str(usage_path))
+        except OSError:
+            usage = None
+        if usage is not None:
+            status.capacity_bytes = usage.total
+            free = usage.free - usage.total * pool['reserve_percent'] / 100
+            if pool['capacity_gb']:
+                status.capacity_bytes = pool['capacity_gb'] * 1024**3
+                free = min(free, status.capacity_bytes - status.used_bytes)
+            status.free_bytes = max(int(free), 0)
+
+        role = f"pool:{pool['name']}"
+        for metrics in (device_metrics or {}).values():
+            if role in metrics.get('roles', '').split(','):
+                status.util_percent = metrics['util_percent']
+                status.current_iops = metrics['read_iops'] + metrics['write_iops']
+        return status
+
+    def _sample_device_load(self, pools: List[Dict]) -> Dict[str, Dict]:
+        """
+        采样各存储池所在设备的当前负载（两次采样间隔0.2秒，反映当前而非历史平均负载）
+
+        会阻塞调用线程，只在后台线程中调用；结果同时作为 device_load() 的缓存
+        """
+        if not self.disk_stats_sampler.is_supported():
+            return {}
+        role_paths = {f"pool:{pool['name']}": pool['path'] for pool in pools}
+        self.disk_stats_sampler.sample(role_paths)
+        time.sleep(0.2)
+        metrics = self.disk_stats_sampler.sample(role_paths)
+        with self._load_lock:
+            self._device_load = (time.monotonic(), metrics)
+        return metrics
+
+    def device_load(self) -> Dict[str, Dict]:
+        """
+        最近一次采样的各存储池设备负载（不阻塞调用方）
+
+        结果超过 DEVICE_LOAD_MAX_AGE 秒时在后台线程中重新采样，本次仍返回旧结果
+        （还没有采样过时为空，按设备空闲计算 IOPS 余量）
+        """
+        with self._load_lock:
+            sampled_at, metrics = self._device_load
+            refreshing = self._load_thread is not None and self._load_thread.is_alive()
+            if time.monotonic() - sampled_at > DEVICE_LOAD_MAX_AGE and not refreshing:
+                self._load_thread = threading.Thread(
+                    target=lambda: self._sample_device_load(self.list_pools()),
+                    name="StoragePoolLoadSampler", daemon=True
+                )
+                self._load_thread.start()
+        return metrics
+
+    def list_pool_status(self) -> List[PoolStatus]:
+        """获取所有存储池的状态（扫描池目录并采样设备负载，在后台线程中调用）"""
+        pools = self.list_pools()
+        device_metrics = self._sample_device_load(pools)
+        return [self.get_pool_status(pool, device_metrics) for pool in pools]
+
+    def place(self, role: str, size_bytes: int = 0, vm_name: str = None,
+              affinity: str = None, exclude: List[str] = None) -> Optional[PoolStatus]:
+        """
+        为新磁盘或快照选择存储池
+
+        可以在GUI线程中调用：设备负载使用后台采样的结果，只有设置了容量上限的存储池才扫描目录
+
+        Args:
+            role: 'disks' 或 'snapshots'
+            size_bytes: 预计需要的空间
+            vm_name: 所属虚拟机（读取其 storage_pool 固定存储池和 storage_tier 亲和性）
+            affinity: 'hot'、'cold' 或 None，覆盖虚拟机配置
+            exclude: 不参与选择的存储池名称
+
+        Returns:
+            选中的存储池状态（包含评分和原因），没有可用存储池时返回None
+        """
+        vm_config = (self.config_manager.get_vm_config(vm_name) or {}) if vm_name else {}
+        if affinity is None:
+            if role == 'snapshots':
+                affinity = self.config_manager.get_global_config("snapshot_pool_affinity")
+            else:
+                affinity = vm_config.get('storage_tier')
+
+        pools = [pool for pool in self.list_pools()
+                 if pool['enabled'] and role in pool['roles'] and pool['name'] not in (exclude or [])]
+        if not pools:
+            return None
+        device_metrics = self.device_load()
+        candidates = [status for status in (self.get_pool_status(pool, device_metrics, scan=False)
+                                            for pool in pools)
+                      if status.free_bytes >= size_bytes]
+        if not candidates:
+            return None
+
+        # 虚拟机固定了存储池时优先使用（空间足够的前提下）
+        pinned = vm_config.get('storage_pool') if role == 'disks' else None
+        for status in candidates:
+            if status.name == pinned:
+                status.score, status.reason = 1.0, "虚拟机指定的存储池"
+                return status
+
+        policy = self.config_manager.get_global_config("storage_placement_policy")
+        free_weight, iops_weight, affinity_weight = PLACEMENT_POLICIES.get(policy, PLACEMENT_POLICIES['balanced'])
+        preferred_classes = AFFINITY_DEVICE_CLASSES.get(affinity, ())
+        # 有基准测试结果时按实测IOPS相对最快存储池的比例加权，未测量的存储池按一半计算
+        best_iops = max((status.pool.get('iops', 0) for status in candidates), default=0)
+        for status in candidates:
+            free_ratio = (status.free_bytes - size_bytes) / status.capacity_bytes if status.capacity_bytes else 0.0
+            affinity_match = 1.0 if status.device_class in preferred_classes else 0.0
+            speed_ratio = 1.0
+            if best_iops:
+                speed_ratio = status.pool['iops'] / best_iops if status.pool.get('iops') else 0.5
+            status.score = (free_weight * free_ratio + iops_weight * status.iops_headroom * speed_ratio
+                            + affinity_weight * affinity_match)
+            reasons = [f"可用 {status.free_bytes / (1024**3):.1f} GB", f"IOPS余量 {status.iops_headroom:.0%}"]
+            if status.pool.get('iops'):
+                reasons.append(f"实测 {status.pool['iops']:.0f} IOPS")
+            if affinity_match:
+                reasons.append(f"{affinity} 亲和 {DEVICE_CLASS_NAMES.get(status.device_class, status.device_class)}")
+            status.reason = "，".join(reasons)
+        return max(candidates, key=lambda status: status.score)
+
+    def disk_path_for_vm(self, vm_name: str, size_bytes: int = 0, extension: str = 'qcow2') -> Optional[str]:
+        """为新虚拟机磁盘选择存储池并生成路径: <池>/<虚拟机>/<虚拟机>.<扩展名>"""
+        status = self.place('disks', size_bytes, vm_name)
+        if status is None:
+            return None
+        return str(Path(status.path) / vm_name / f"{vm_name}.{extension}")
+
+    def snapshot_dir_for(self, vm_name: str, snapshot_id: str, size_bytes: int = 0) -> Optional[Path]:
+        """为新快照选择存储池并生成目录: <池>/<虚拟机>/<快照ID>"""
+        status = self.place('snapshots', size_bytes, vm_name)
+        if status is None:
+            return None
+        return Path(status.path) / vm_name / snapshot_id
+
+
+# 全局存储池管理器实例
+storage_pool_manager = None
+
+
+def get_storage_pool_manager(config_manager) -> StoragePoolManager:
+    """获取存储池管理器实例"""
+    global storage_pool_manager
+    if storage_pool_manager is None:
+        storage_pool_manager = StoragePoolManager(config_manager)
+    return storage_pool_manager
@@ -7,22 +7,61 @@
 import psutil
 import threading
 import time
+from pathlib import Path
 from PyQt6.QtCore import QObject, pyqtSignal, QTimer
 from datetime import datetime
 
+from ltwin_manager.utils.signal_throttler import SignalThrottler, flatten_payload
+from ltwin_manager.utils.metrics_store import get_metrics_store, select_host_metrics, VM_METRICS
+from ltwin_manager.utils.capacity_planner import get_capacity_planner
+from ltwin_manager.utils.disk_stats import DiskStatsSampler, check_disk_alerts
+from ltwin_manager.utils.pressure_monitor import PressureMonitor
+from ltwin_manager.utils.profiler import timed
+
 
 class SystemMonitor(QObject):
     # 自定义信号，用于更新UI
-    resource_updated = pyqtSignal(dict)  # 传递包含所有系统信息的字典
+    resource_updated = pyqtSignal(dict)  # 传递包含所有系统信息的字典（每帧合并后最多一次）
+    resource_delta = pyqtSignal(dict)  # 增量更新: {主题: {扁平字段名: 新值}}，主题为 'host' 或 'vm:<名称>'
     system_check_failed = pyqtSignal(str)  # 错误信息
+    disk_alert = pyqtSignal(str, str)  # 磁盘IO告警: (设备名, 告警信息)
+    pressure_alert = pyqtSignal(str, str)  # 资源压力告警: (告警键, 告警信息)
     
-    def __init__(self):
+    def __init__(self, config_manager=None):
         super().__init__()
+        if config_manager is None:
+            from ltwin_manager.utils.config_manager import get_config_manager
+            config_manager = get_config_manager()
+        self.config_manager = config_manager
         self.monitoring = False
         self.monitor_thread = None
         self.check_interval = 2  # 监控间隔（秒）
         self.last_cpu_times = None
         self.last_cpu_timestamp = None
+        
+        # 合并跨线程投递，GUI线程每帧只处理一次增量
+        self.publisher = SignalThrottler(parent=self)
+        self.publisher.batch_ready.connect(self._on_batch_ready)
+        self._latest_host_info = {}
+        
+        # 虚拟机进程来源: 返回 {虚拟机名称: pid} 的可调用对象
+        self.vm_process_source = None
+        self._vm_processes = {}  # 虚拟机名称 -> psutil.Process（保留对象以便计算CPU增量）
+        
+        # VM存储和快照所在设备的IO速率采样
+        self.disk_stats_sampler = DiskStatsSampler()
+        self._alerting_devices = set()
+        
+        # PSI和steal/iowait采样
+        self.pressure_monitor = PressureMonitor()
+        
+        # 历史指标持久化
+        self.metrics_store = None
+        self._last_record_time = 0.0
+    
+    def set_vm_process_source(self, source):
+        """设置虚拟机进程来源，用于采集每台虚拟机的资源占用"""
+        self.vm_process_source = source
     
     def start_monitoring(self):
         """开始系统资源监控"""
@@ -48,8 +87,13 @@ class SystemMonitor(QObject):
                 # 获取系统信息
                 system_info = self._get_comprehensive_system_info()
                 
-                # 发送信号更新UI
-                self.resource_updated.emit(system_info)
+                # 提交给节流器，由GUI线程按帧合并投递
+                self._latest_host_info = system_info
+                self.publisher.publish('host', system_info)
+                vm_metrics = self._publish_vm_metrics()
+                self._record_metrics(system_info, vm_metrics)
+                self._check_disk_alerts(system_info.get('disk_io', {}))
+                self._check_pressure_alerts(system_info.get('pressure', {}))
                 
                 # 等待指定时间后继续监控
                 time.sleep(self.check_interval)
@@ -59,6 +103,117 @@ class SystemMonitor(QObject):
                 self.system_check_failed.emit(str(e))
                 time.sleep(5)  # 出错后等待5秒再继续
     
+    def _on_batch_ready(self, batch):
+        """节流器投递一帧数据（GUI线程）"""
+        self.resource_delta.emit(batch)
+        if 'host' in batch and batch['host'] is not None:
+            self.resource_updated.emit(self._latest_host_info)
+    
+    @timed("system_monitor.vm_metrics")
+    def _publish_vm_metrics(self):
+        """采集并提交每台虚拟机的资源占用，返回 {虚拟机名称: 指标}"""
+        collected = {}
+        if not self.vm_process_source:
+            return collected
+        
+        try:
+            vm_pids = self.vm_process_source() or {}
+        except Exception as e:
+            print(f"获取虚拟机进程失败: {e}")
+            return collected
+        
+        # 移除已停止的虚拟机
+        for vm_name in list(self._vm_processes.keys()):
+            if vm_name not in vm_pids:
+                del self._vm_processes[vm_name]
+                self.publisher.retire(f"vm:{vm_name}")
+        
+        for vm_name, pid in vm_pids.items():
+            process = self._vm_processes.get(vm_name)
+            try:
+                if process is None or process.pid != pid:
+                    process = psutil.Process(pid)
+                    process.cpu_percent(None)  # 第一次调用只建立基线
+                    self._vm_processes[vm_name] = process
+                
+                with process.oneshot():
+                    memory_info = process.memory_info()
+                    vm_info = {
+                        'cpu_percent': round(process.cpu_percent(None), 1),
+                        'memory_mb': round(memory_info.rss / (1024**2), 1),
+                        'threads': process.num_threads()
+                    }
+                    if hasattr(process, 'io_counters'):
+                        io = process.io_counters()
+                        vm_info['io_read_mb'] = round(io.read_bytes / (1024**2), 1)
+                        vm_info['io_write_mb'] = round(io.write_bytes / (1024**2), 1)
+                
+                self.publisher.publish(f"vm:{vm_name}", vm_info)
+                collected[vm_name] = vm_info
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                if self._vm_processes.pop(vm_name, None) is not None:
+                    self.publisher.retire(f"vm:{vm_name}")
+        
+        return collected
+    
+    @timed("system_monitor.record_metrics")
+    def _record_metrics(self, system_info, vm_metrics):
+        """按记录间隔把采样写入历史指标存储"""
+        now = time.time()
+        interval = self.config_manager.get_global_config("metrics_record_interval_seconds")
+        if now - self._last_record_time < interval:
+            return
+        self._last_record_time = now
+        
+        if self.metrics_store is None:
+            self.metrics_store = get_metrics_store(self.config_manager)
+        
+        scoped_metrics = {'host': select_host_metrics(flatten_payload(system_info))}
+        for vm_name, vm_info in vm_metrics.items():
+            scoped_metrics[f"vm:{vm_name}"] = {
+                metric: value for metric, value in vm_info.items() if metric in VM_METRICS
+            }
+        self.metrics_store.record(scoped_metrics, now)
+        
+        # 按容量采样间隔记录各存储池的实际占用，用于增长预测
+        get_capacity_planner(self.config_manager).sample_growth()
+    
+    def _storage_role_paths(self):
+        """获取需要监控IO的存储路径: {用途: 路径}"""
+        role_paths = {
+            'vm_storage': self.config_manager.get_global_config("vm_storage_path"),
+            'snapshots': self.config_manager.get_global_config("snapshot_location")
+        }
+        for pool in self.config_manager.get_global_config("storage_pools") or []:
+            role_paths[f"pool:{pool['name']}"] = pool['path']
+        return role_paths
+    
+    def _check_disk_alerts(self, device_metrics):
+        """检查磁盘IO阈值，设备进入告警状态时发出一次信号"""
+        thresholds = {
+            'latency_ms': self.config_manager.get_global_config("disk_latency_alert_ms"),
+            'util_percent': self.config_manager.get_global_config("disk_util_alert_percent"),
+            'queue_depth': self.config_manager.get_global_config("disk_queue_alert_depth")
+        }
+        alerts = check_disk_alerts(device_metrics, thresholds)
+        
+        for device, message in alerts.items():
+            if device not in self._alerting_devices:
+                self.disk_alert.emit(device, message)
+        self._alerting_devices = set(alerts.keys())
+    
+    def _check_pressure_alerts(self, pressure):
+        """检查持续的资源压力"""
+        thresholds = {
+            'psi_percent': self.config_manager.get_global_config("psi_alert_percent"),
+            'steal_percent': self.config_manager.get_global_config("steal_alert_percent"),
+            'iowait_percent': self.config_manager.get_global_config("iowait_alert_percent"),
+            'sustain_seconds': self.config_manager.get_global_config("pressure_sustain_seconds")
+        }
+        for key, message in self.pressure_monitor.check_alerts(pressure, thresholds).items():
+            self.pressure_alert.emit(key, message)
+    
+    @timed("system_monitor.sample")
     def _get_comprehensive_system_info(self):
         """获取综合系统信息"""
         # 获取CPU使用率
@@ -81,15 +236,12 @@ class SystemMonitor(QObject):
         swap_used_gb = swap.used / (1024**3)
         swap_percent = swap.percent
         
-        # 获取磁盘信息（使用C盘或主分区）
-        disk_partitions = psutil.disk_partitions()
-        main_disk = disk_partitions[0]  # 默认使用第一个分区
-        for partition in disk_partitions:
-            if 'C:' in partition.mountpoint.upper() or partition.mountpoint == '/' or '/home' in partition.mountpoint:
-                main_disk = partition
-                break
+        # 获取磁盘信息（使用虚拟机存储所在的卷）
+        vm_storage_path = Path(self.config_manager.get_global_config("vm_storage_path"))
+        while not vm_storage_path.exists() and vm_storage_path != vm_storage_path.parent:
+            vm_storage_path = vm_storage_path.parent
         
-        disk_usage = psutil.disk_usage(main_disk.mountpoint)
+        disk_usage = psutil.disk_usage(str(vm_storage_path))
         disk_total_gb = disk_usage.total / (1024**3)
         disk_used_gb = disk_usage.used / (1024**3)
         disk_percent = disk_usage.percent
@@ -99,10 +251,11 @@ class SystemMonitor(QObject):
         net_sent = net_io.bytes_sent / (1024**2)  # MB
         net_recv = net_io.bytes_recv / (1024**2)  # MB
         
-        # 获取磁盘IO信息
-        disk_io = psutil.disk_io_counters()
-        disk_read = disk_io.read_bytes / (1024**2) if disk_io else 0  # MB
-        disk_write = disk_io.write_bytes / (1024**2) if disk_io else 0  # MB
+        # 获取VM存储和快照所在设备的IO速率（IOPS、吞吐量、延迟、队列深度）
+        disk_io = self.disk_stats_sampler.sample(self._storage_role_paths())
+        
+        # 获取资源压力（PSI、steal、iowait）
+        pressure = self.pressure_monitor.sample()
         
         # 获取进程数量
         process_count = len(psutil.pids())
@@ -134,10 +287,8 @@ class SystemMonitor(QObject):
                 'sent_mb': round(net_sent, 2),
                 'recv_mb': round(net_recv, 2)
             },
-            'disk_io': {
-                'read_mb': round(disk_read, 2),
-                'write_mb': round(disk_write, 2)
-            },
+            'disk_io': disk_io,
+            'pressure': pressure,
             'process_count': process_count,
             'boot_time': boot_time,
             'timestamp': datetime.now().strftime("%H:%M:%S")
@@ -183,6 +334,8 @@ class SystemMonitor(QObject):
                 'system_processor': platform.processor(),
                 'system_node': platform.node(),
                 'process_count': len(psutil.pids()),
+                'cpu_count': psutil.cpu_count(logical=False),
+                'cpu_logical_count': psutil.cpu_count(logical=True),
                 'users': [user.name for user in psutil.users()]
             }
             return info
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具
+每个测试使用独立的主目录（配置、快照索引、容量台账都在其中），并重置各管理器的全局实例。
+PATH 中放入一个假的 qemu-img：create/rebase 按参数写出最小的 qcow2 镜像，其他子命令只记录参数。
+"""
+
+import importlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+TESTS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(TESTS_DIR.parent))
+sys.path.insert(0, str(TESTS_DIR))
+
+# 导入 config_manager 时会在主目录下创建配置，先指向临时目录
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ltwin-test-home-')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+SINGLETONS = {
+    'ltwin_manager.utils.backup_manager': 'backup_manager',
+    'ltwin_manager.utils.capacity_planner': 'capacity_planner',
+    'ltwin_manager.utils.chain_maintenance': 'chain_maintenance_service',
+    'ltwin_manager.utils.clone_manager': 'clone_manager',
+    'ltwin_manager.utils.disk_conversion': 'conversion_planner',
+    'ltwin_manager.utils.disk_job_queue': 'disk_job_queue',
+    'ltwin_manager.utils.image_library': 'image_library',
+    'ltwin_manager.utils.snapshot_manager': 'snapshot_manager',
+    'ltwin_manager.utils.snapshot_retention': 'snapshot_retention_engine',
+    'ltwin_manager.utils.snapshot_scheduler': 'snapshot_scheduler',
+    'ltwin_manager.utils.storage_index': 'storage_indexer',
+    'ltwin_manager.utils.storage_manager': 'storage_manager',
+    'ltwin_manager.utils.storage_pools': 'storage_pool_manager',
+}
+
+FAKE_QEMU_IMG = '''#!{python}
+import os, shutil, sys
+sys.path.insert(0, {tests_dir!r})
+from helpers import make_qcow2
+
+args = sys.argv[1:]
+with open(os.environ['FAKE_QEMU_IMG_LOG'], 'a', encoding='utf-8') as log:
+    log.write(' '.join(args) + '\\n')
+
+def option(name):
+    return args[args.index(name) + 1] if name in args else ''
+
+command = args[0]
+if command == 'create':
+    target = args[-2] if args[-1][:1].isdigit() else args[-1]
+    make_qcow2(target, backing=option('-b'))
+elif command == 'rebase':
+    make_qcow2(args[-1], backing=option('-b'))
+elif command == 'convert':
+    shutil.copyfile(args[-2], args[-1])
+elif command == 'info':
+    sys.exit(1)
+sys.exit(0)
+'''
+
+
+def reset_singletons():
+    for module_name, attribute in SINGLETONS.items():
+        setattr(importlib.import_module(module_name), attribute, None)
+    from ltwin_manager.utils.disk_inspector import get_disk_inspector
+    get_disk_inspector().invalidate()
+
+
+@pytest.fixture
+def qemu_log(tmp_path, monkeypatch):
+    """假 qemu-img 的调用记录文件（每行一次调用的参数）"""
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'qemu-img'
+    script.write_text(FAKE_QEMU_IMG.format(python=sys.executable, tests_dir=str(TESTS_DIR)), encoding='utf-8')
+    script.chmod(0o755)
+    log = tmp_path / 'qemu-img.log'
+    log.write_text('', encoding='utf-8')
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setenv('FAKE_QEMU_IMG_LOG', str(log))
+    return log
+
+
+@pytest.fixture
+def config_manager(tmp_path, monkeypatch, qemu_log):
+    """独立主目录下的配置管理器"""
+    home = tmp_path / 'home'
+    home.mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    reset_singletons()
+    from ltwin_manager.utils.config_manager import ConfigManager
+    manager = ConfigManager()
+    yield manager
+    queue_module = importlib.import_module('ltwin_manager.utils.disk_job_queue')
+    if queue_module.disk_job_queue is not None:
+        queue_module.disk_job_queue.cancel_all()
+    reset_singletons()
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    """界面测试使用的 QApplication（offscreen 平台）"""
+    from PyQt6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def disks(tmp_path):
+    """存放测试镜像的目录"""
+    path = tmp_path / 'disks'
+    path.mkdir()
+    return path
+
+
+def add_vm(config_manager, vm_name: str, disk_path, **fields):
+    """添加一台已停止的虚拟机"""
+    config_manager.set_vm_config(vm_name, {
+        'name': vm_name, 'disk_path': str(disk_path), 'memory': 512, 'cpu_cores': 1, 'status': 'stopped',
+        **fields
+    })
+
+
+def wait_for_job(job_queue, job_id: str, timeout: float = 10.0) -> dict:
+    """等待后台任务结束，返回任务信息"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get_job(job_id)
+        if job and job['status'] in ('completed', 'failed', 'cancelled'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"任务 {job_id} 没有在 {timeout} 秒内结束")
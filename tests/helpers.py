@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+测试辅助函数
+生成最小的 qcow2 镜像（只有头部、后端文件名和一张空的 L1/L2 表），足够 qcow2_reader 解析后端链
+"""
+
+import struct
+
+CLUSTER_SIZE = 1 << 16
+
+
+def make_qcow2(path, backing: str = '', virtual_size: int = 1 << 30, data_clusters: int = 0):
+    """
+    写入 qcow2 v3 镜像
+
+    Args:
+        backing: 后端文件路径（原样写入头部）
+        data_clusters: 指向同一个数据簇的 L2 表项数（用于占用统计）
+    """
+    backing_bytes = str(backing).encode() if backing else b''
+    image = bytearray(CLUSTER_SIZE * 5)
+    # 头部扩展：后端格式 qcow2，之后是结束标记
+    extension = struct.pack('>II', 0xE2792ACA, 5) + b'qcow2' + b'\0' * 3 if backing else b''
+    extension += struct.pack('>II', 0, 0)
+    backing_offset = 104 + len(extension) if backing else 0
+    struct.pack_into('>IIQIIQIIQQIIQ', image, 0, 0x514649fb, 3, backing_offset, len(backing_bytes), 16,
+                     virtual_size, 0, 1, CLUSTER_SIZE, 0, 0, 0, 0)
+    struct.pack_into('>QQQII', image, 72, 0, 0, 0, 4, 104)
+    image[104:104 + len(extension)] = extension
+    if backing_bytes:
+        image[backing_offset:backing_offset + len(backing_bytes)] = backing_bytes
+    # L1 表在第1个簇，指向第2个簇的 L2 表
+    struct.pack_into('>Q', image, CLUSTER_SIZE, (2 * CLUSTER_SIZE) | (1 << 63))
+    for index in range(data_clusters):
+        struct.pack_into('>Q', image, 2 * CLUSTER_SIZE + 8 * index, (4 * CLUSTER_SIZE) | (1 << 63))
+    with open(path, 'wb') as f:
+        f.write(image)
+    return str(path)
+
+
+def backing_of(path) -> str:
+    """读取镜像头部记录的后端文件（不解析相对路径）"""
+    with open(path, 'rb') as f:
+        header = f.read(CLUSTER_SIZE)
+    offset, size = struct.unpack_from('>QI', header, 8)
+    return header[offset:offset + size].decode() if offset else ''
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""备份清单：磁盘条目中不残留内部使用的 incremental 标记"""
+
+from conftest import add_vm
+from helpers import make_qcow2
+
+
+def test_full_backup_manifest_has_no_incremental_flags(config_manager, disks):
+    from ltwin_manager.utils.backup_manager import get_backup_manager
+    extras = [make_qcow2(disks / f'extra{index}.qcow2', virtual_size=1 << 20) for index in range(2)]
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2', virtual_size=1 << 20), extra_disks=extras)
+
+    manifest = get_backup_manager(config_manager).backup_vm('a')
+    assert manifest['type'] == 'full'
+    assert len(manifest['drives']) == 3
+    for drive in manifest['drives'].values():
+        assert 'incremental' not in drive
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""压缩磁盘：不能改写运行中的虚拟机链上的镜像，不能丢弃内部快照"""
+
+import struct
+
+import pytest
+
+from conftest import add_vm, wait_for_job
+from helpers import make_qcow2, CLUSTER_SIZE
+
+
+@pytest.fixture
+def storage_manager(config_manager):
+    from ltwin_manager.utils.storage_manager import get_storage_manager
+    return get_storage_manager(config_manager)
+
+
+def test_compact_refuses_running_vm_extra_disk(config_manager, storage_manager, disks, qemu_log):
+    extra = make_qcow2(disks / 'extra.qcow2')
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2'), status='running', extra_disks=[extra])
+    with pytest.raises(ValueError):
+        storage_manager.compact_disk_image_async(extra)
+    assert 'convert' not in qemu_log.read_text(encoding='utf-8')
+
+
+def test_compact_refuses_backing_layer_of_running_vm(config_manager, storage_manager, disks, qemu_log):
+    base = make_qcow2(disks / 'base.qcow2')
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2', backing=base), status='running')
+    with pytest.raises(ValueError):
+        storage_manager.compact_disk_image_async(base)
+    assert 'convert' not in qemu_log.read_text(encoding='utf-8')
+
+
+def test_compact_refuses_image_with_internal_snapshots(config_manager, storage_manager, disks, qemu_log):
+    path = make_qcow2(disks / 'a.qcow2')
+    with open(path, 'r+b') as f:
+        f.seek(60)
+        f.write(struct.pack('>IQ', 1, 3 * CLUSTER_SIZE))
+    add_vm(config_manager, 'a', path)
+    with pytest.raises(ValueError):
+        storage_manager.compact_disk_image_async(path)
+    assert 'convert' not in qemu_log.read_text(encoding='utf-8')
+
+
+def test_compact_stopped_vm_disk(config_manager, storage_manager, disks, qemu_log):
+    base = make_qcow2(disks / 'base.qcow2')
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2', backing=base))
+    job = wait_for_job(storage_manager.job_queue, storage_manager.compact_disk_image_async(base))
+    assert job['status'] == 'completed'
+    assert 'convert' in qemu_log.read_text(encoding='utf-8')
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""磁盘检查器：后端链循环引用时不会无限递归"""
+
+import os
+
+from helpers import make_qcow2
+
+
+def test_backing_cycle_stops_at_repeated_file(disks):
+    from ltwin_manager.utils.disk_inspector import DiskInspector
+    a, b = str(disks / 'a.qcow2'), str(disks / 'b.qcow2')
+    make_qcow2(a, backing=b)
+    make_qcow2(b, backing=a)
+
+    info = DiskInspector(qemu_img='missing-qemu-img').inspect(a)
+    assert [os.path.abspath(item['path']) for item in info.backing_chain] == [b, a]
+
+
+def test_backing_chain_is_followed(disks):
+    from ltwin_manager.utils.disk_inspector import DiskInspector
+    base = make_qcow2(disks / 'base.qcow2')
+    top = make_qcow2(disks / 'top.qcow2', backing=make_qcow2(disks / 'mid.qcow2', backing=base))
+
+    info = DiskInspector(qemu_img='missing-qemu-img').inspect(top)
+    assert [item['path'] for item in info.backing_chain] == [str(disks / 'mid.qcow2'), base]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""磁盘任务队列：失败或取消时只删除任务自己创建的目标文件"""
+
+import sys
+
+import pytest
+
+from conftest import wait_for_job
+from helpers import make_qcow2
+
+FAIL = [sys.executable, '-c', 'import sys; sys.exit(1)']
+
+
+def create_then_fail(path):
+    return [sys.executable, '-c', f"open({str(path)!r}, 'wb').write(b'partial'); import sys; sys.exit(1)"]
+
+
+@pytest.fixture
+def job_queue(config_manager):
+    from ltwin_manager.utils.disk_job_queue import get_disk_job_queue
+    return get_disk_job_queue(config_manager)
+
+
+def test_failed_job_keeps_existing_target(job_queue, disks):
+    target = make_qcow2(disks / 'user.qcow2')
+    job = wait_for_job(job_queue, job_queue.submit('create', '失败的任务', FAIL, target_path=target,
+                                                   remove_target_on_failure=True))
+    assert job['status'] == 'failed'
+    assert (disks / 'user.qcow2').exists()
+
+
+def test_failed_job_removes_target_it_created(job_queue, disks):
+    target = disks / 'new.qcow2'
+    job = wait_for_job(job_queue, job_queue.submit('create', '失败的任务', create_then_fail(target),
+                                                   target_path=str(target), remove_target_on_failure=True))
+    assert job['status'] == 'failed'
+    assert not target.exists()
+
+
+def test_create_rejects_existing_target(config_manager, disks, qemu_log):
+    from ltwin_manager.utils.storage_manager import get_storage_manager
+    target = make_qcow2(disks / 'user.qcow2')
+    original = open(target, 'rb').read()
+    with pytest.raises(ValueError):
+        get_storage_manager(config_manager).create_disk_image_async(target, 10)
+    assert open(target, 'rb').read() == original
+    assert 'create' not in qemu_log.read_text(encoding='utf-8')
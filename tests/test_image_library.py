@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""镜像库：库文件仍在某台虚拟机的后端链中时不能删除"""
+
+import os
+
+import pytest
+
+from conftest import add_vm
+from helpers import make_qcow2
+
+
+@pytest.fixture
+def image_library(config_manager, tmp_path):
+    from ltwin_manager.utils.image_library import get_image_library
+    config_manager.set_global_config("image_library_path", str(tmp_path / 'library'))
+    return get_image_library(config_manager)
+
+
+def test_remove_image_keeps_blob_behind_snapshot_overlay(config_manager, image_library, disks):
+    from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+
+    blob = image_library.import_image(make_qcow2(disks / 'base.qcow2'), 'base')['path']
+    add_vm(config_manager, 'vm', image_library.create_overlay('base', str(disks / 'vm.qcow2'), 'vm'))
+    # 外部快照后当前磁盘是覆盖层的覆盖层，库文件不再是直接后端
+    assert get_snapshot_manager(config_manager).create_snapshot('vm', 's1')
+    assert config_manager.get_vm_config('vm')['disk_path'] != str(disks / 'vm.qcow2')
+
+    assert image_library.overlay_users(blob) == ['vm']
+    with pytest.raises(ValueError):
+        image_library.remove_image('base')
+    assert os.path.exists(blob)
+    assert [entry['vms'] for entry in image_library.list_entries()] == [['vm']]
+
+
+def test_remove_image_checks_extra_disks(config_manager, image_library, disks):
+    blob = image_library.import_image(make_qcow2(disks / 'base.qcow2'), 'base')['path']
+    overlay = image_library.create_overlay('base', str(disks / 'data.qcow2'), 'vm')
+    add_vm(config_manager, 'vm', make_qcow2(disks / 'vm.qcow2'), extra_disks=[overlay])
+
+    with pytest.raises(ValueError):
+        image_library.remove_image('base')
+    assert os.path.exists(blob)
+
+
+def test_remove_unused_image_deletes_blob(config_manager, image_library, disks):
+    blob = image_library.import_image(make_qcow2(disks / 'base.qcow2'), 'base')['path']
+    add_vm(config_manager, 'vm', make_qcow2(disks / 'vm.qcow2'))
+
+    assert image_library.remove_image('base')
+    assert not os.path.exists(blob)
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""性能报告：累计IO计数器按相邻样本的速率统计"""
+
+import pytest
+
+
+def test_io_counters_reported_as_rates(tmp_path):
+    from ltwin_manager.utils.metrics_store import MetricsStore
+    from ltwin_manager.utils.performance_report import ReportEngine
+    store = MetricsStore(tmp_path / 'metrics.db')
+    # 每10秒读取 10 MB、50 MB、10 MB；之后虚拟机重启，计数器归零
+    for ts, read_mb in ((100, 1000), (110, 1100), (120, 1600), (130, 1700), (140, 5)):
+        store.record({'vm:a': {'io_read_mb': read_mb, 'cpu_percent': 10}}, timestamp=ts)
+
+    report = ReportEngine(store).generate(0, 1000)
+    stats = report.vms['a']['io_read_mb']
+    assert stats['count'] == 3
+    assert stats['min'] == pytest.approx(10, rel=0.05)
+    assert stats['max'] == pytest.approx(50, rel=0.05)
+    assert report.vms['a']['cpu_percent']['count'] == 5
+    assert report.sample_rows == 10
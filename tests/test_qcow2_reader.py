@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""qcow2读取器：扩展L2表（子簇）镜像按子簇位图统计零簇"""
+
+import struct
+
+from helpers import make_qcow2, CLUSTER_SIZE
+
+INCOMPAT_EXTL2 = 1 << 4
+
+
+def make_extended_l2(path, entries):
+    """写入扩展L2表镜像，entries 为 [(表项前64位, 子簇位图)]"""
+    make_qcow2(path)
+    with open(path, 'r+b') as f:
+        f.seek(72)
+        f.write(struct.pack('>Q', INCOMPAT_EXTL2))
+        f.seek(2 * CLUSTER_SIZE)
+        for entry, bitmap in entries:
+            f.write(struct.pack('>QQ', entry, bitmap))
+    return str(path)
+
+
+def test_extended_l2_counts_zero_subclusters(disks):
+    from ltwin_manager.utils.qcow2_reader import Qcow2Image
+    data = (4 * CLUSTER_SIZE) | (1 << 63)
+    path = make_extended_l2(disks / 'a.qcow2', [
+        (data, 0xffffffff),  # 全部子簇已分配
+        (0, 0xffffffff << 32),  # 全部子簇读作零
+        (0, 0x00000003),  # 没有宿主簇时分配位无效，按未分配处理
+        (0, 1 << 32),  # 一个子簇读作零
+    ])
+    with Qcow2Image(path) as image:
+        counts = image.count_allocated_clusters()
+        assert counts['allocated'] == 1
+        assert counts['zero'] == 2
+        assert list(image.allocated_clusters()) == [0, 1, 3]
+        assert list(image.allocated_clusters(data_only=True)) == [0]
+
+
+def test_standard_l2_zero_flag(disks):
+    from ltwin_manager.utils.qcow2_reader import Qcow2Image
+    path = make_qcow2(disks / 'a.qcow2', data_clusters=2)
+    with open(path, 'r+b') as f:
+        f.seek(2 * CLUSTER_SIZE + 16)
+        f.write(struct.pack('>Q', 1))
+    with Qcow2Image(path) as image:
+        counts = image.count_allocated_clusters()
+        assert (counts['allocated'], counts['zero']) == (2, 1)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""外部快照后端：恢复和删除快照时不能删除其他虚拟机仍在使用的镜像"""
+
+import os
+
+import pytest
+
+from conftest import add_vm
+from helpers import make_qcow2
+
+
+@pytest.fixture
+def snapshot_manager(config_manager):
+    from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+    return get_snapshot_manager(config_manager)
+
+
+def test_restore_without_backup_keeps_disk_used_by_linked_clone(config_manager, snapshot_manager, disks):
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2'))
+    assert snapshot_manager.create_snapshot('a', 's1')
+    active = config_manager.get_vm_config('a')['disk_path']
+    snapshot_id = snapshot_manager.list_snapshots('a')[0]['id']
+    # b 是 a 当前磁盘的链接克隆
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b.qcow2', backing=active))
+
+    assert snapshot_manager.restore_snapshot('a', snapshot_id, backup='none')
+    assert config_manager.get_vm_config('a')['disk_path'] != active
+    assert os.path.exists(active)
+
+
+def test_restore_without_backup_removes_unused_disk(config_manager, snapshot_manager, disks):
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2'))
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b.qcow2'))
+    assert snapshot_manager.create_snapshot('a', 's1')
+    active = config_manager.get_vm_config('a')['disk_path']
+    snapshot_id = snapshot_manager.list_snapshots('a')[0]['id']
+
+    assert snapshot_manager.restore_snapshot('a', snapshot_id, backup='none')
+    assert not os.path.exists(active)
+
+
+def add_snapshot(snapshot_manager, vm_name, snapshot_id, disk_path):
+    snapshot_manager.snapshots_metadata.put(vm_name, {
+        'id': snapshot_id, 'name': snapshot_id, 'description': '', 'created_at': '2026-01-01 00:00:00',
+        'backend': 'external', 'parent_id': None, 'disk_path': str(disk_path), 'disks': {'disk0': str(disk_path)}
+    })
+
+
+def test_delete_refuses_snapshot_used_by_other_vm(config_manager, snapshot_manager, disks):
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2'))
+    frozen = make_qcow2(disks / 'a-frozen.qcow2')
+    add_snapshot(snapshot_manager, 'a', 'a_snap', frozen)
+    # b 克隆自 a 的快照层，a 自己的当前磁盘已经不再使用它
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b.qcow2', backing=frozen))
+
+    assert not snapshot_manager.delete_snapshot('a', 'a_snap')
+    assert os.path.exists(frozen)
+    assert snapshot_manager.get_snapshot_info('a', 'a_snap')
+
+
+def test_delete_removes_unused_snapshot(config_manager, snapshot_manager, disks):
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2'))
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b.qcow2'))
+    frozen = make_qcow2(disks / 'a-frozen.qcow2')
+    add_snapshot(snapshot_manager, 'a', 'a_snap', frozen)
+
+    assert snapshot_manager.delete_snapshot('a', 'a_snap')
+    assert not os.path.exists(frozen)
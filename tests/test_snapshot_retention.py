@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""快照保留策略：删除快照层前把数据合并到所有虚拟机中以它为后端的镜像"""
+
+import os
+
+import pytest
+
+from conftest import add_vm
+from helpers import make_qcow2, backing_of
+
+
+@pytest.fixture
+def engine(config_manager):
+    from ltwin_manager.utils.snapshot_retention import get_snapshot_retention_engine
+    return get_snapshot_retention_engine(config_manager)
+
+
+def add_snapshot(config_manager, vm_name, snapshot_id, disk_path, created_at):
+    from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+    get_snapshot_manager(config_manager).snapshots_metadata.put(vm_name, {
+        'id': snapshot_id, 'name': snapshot_id, 'description': '', 'created_at': created_at,
+        'backend': 'external', 'parent_id': None, 'disk_path': str(disk_path), 'disks': {'disk0': str(disk_path)}
+    })
+
+
+@pytest.fixture
+def clone_of_old_layer(config_manager, disks):
+    """a 有新旧两个快照层，b 是 a 旧快照层的链接克隆"""
+    base = make_qcow2(disks / 'a-base.qcow2')
+    old = make_qcow2(disks / 'a-old.qcow2', backing=base)
+    new = make_qcow2(disks / 'a-new.qcow2', backing=old)
+    add_vm(config_manager, 'a', make_qcow2(disks / 'a.qcow2', backing=new))
+    add_snapshot(config_manager, 'a', 'old', old, '2026-01-01 00:00:00')
+    add_snapshot(config_manager, 'a', 'new', new, '2026-01-02 00:00:00')
+    clone = make_qcow2(disks / 'b.qcow2', backing=old)
+    add_vm(config_manager, 'b', clone)
+    return base, old, clone
+
+
+def test_plan_lists_other_vm_clone_as_child(engine, clone_of_old_layer):
+    from ltwin_manager.utils.snapshot_retention import RetentionPolicy
+    _, old, clone = clone_of_old_layer
+    plan = engine.plan('a', RetentionPolicy(keep_last=1))
+    assert [action.snapshot_id for action in plan.deletions] == ['old']
+    assert set(plan.deletions[0].children) == {os.path.abspath(clone), os.path.abspath(old.replace('old', 'new'))}
+
+
+def test_plan_keeps_layer_under_running_clone(config_manager, engine, clone_of_old_layer):
+    from ltwin_manager.utils.snapshot_retention import RetentionPolicy
+    vm_config = config_manager.get_vm_config('b')
+    vm_config['status'] = 'running'
+    config_manager.set_vm_config('b', vm_config)
+    assert not engine.plan('a', RetentionPolicy(keep_last=1)).deletions
+
+
+def test_execute_rebases_other_vm_clone(engine, clone_of_old_layer):
+    from ltwin_manager.utils.snapshot_retention import RetentionPolicy
+    base, old, clone = clone_of_old_layer
+    result = engine.execute(engine.plan('a', RetentionPolicy(keep_last=1)))
+    assert result['errors'] == []
+    assert result['deleted'] == 1
+    assert backing_of(clone) == base
+    assert not os.path.exists(old)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""存储管理对话框：放弃后台计算时不在GUI线程中等待"""
+
+import threading
+import time
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+
+class BlockedWorker(QThread):
+    """模拟正在等待虚拟机锁的占用计算"""
+
+    vm_ready = pyqtSignal(str, list)
+
+    def __init__(self, gate):
+        super().__init__()
+        self.gate = gate
+
+    def run(self):
+        self.gate.wait(5)
+        self.vm_ready.emit('vm', [])
+
+
+def test_release_worker_does_not_wait(qapp):
+    from ltwin_manager.ui import storage_management_dialog
+
+    gate = threading.Event()
+    results = []
+    worker = BlockedWorker(gate)
+    worker.vm_ready.connect(lambda vm_name, rows: results.append(vm_name))
+    worker.start()
+
+    started = time.monotonic()
+    storage_management_dialog.release_worker(worker, worker.vm_ready)
+    assert time.monotonic() - started < 0.5
+    assert worker.isRunning()
+
+    gate.set()
+    deadline = time.monotonic() + 5
+    while storage_management_dialog._released_workers and time.monotonic() < deadline:
+        qapp.processEvents()
+        time.sleep(0.01)
+    assert not storage_management_dialog._released_workers
+    assert results == []  # 断开后的结果不再送到对话框
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""迁移磁盘到存储池：原文件仍被其他虚拟机的后端链使用时不能删除"""
+
+import pytest
+
+from conftest import add_vm, wait_for_job
+from helpers import make_qcow2
+
+
+@pytest.fixture
+def storage_manager(config_manager, tmp_path):
+    from ltwin_manager.utils.storage_manager import get_storage_manager
+    manager = get_storage_manager(config_manager)
+    assert manager.pool_manager.add_pool('fast', str(tmp_path / 'fast'), ['disks'], 'ssd')
+    return manager
+
+
+def add_snapshot(config_manager, vm_name, snapshot_id, disk_path):
+    from ltwin_manager.utils.snapshot_manager import get_snapshot_manager
+    get_snapshot_manager(config_manager).snapshots_metadata.put(vm_name, {
+        'id': snapshot_id, 'name': snapshot_id, 'description': '', 'created_at': '2026-01-01 00:00:00',
+        'backend': 'external', 'parent_id': None, 'disk_path': str(disk_path), 'disks': {'disk0': str(disk_path)}
+    })
+
+
+def migrate(storage_manager, vm_name):
+    return wait_for_job(storage_manager.job_queue, storage_manager.migrate_disk_to_pool_async(vm_name, 'fast'))
+
+
+def test_migrate_refuses_disk_used_by_linked_clone(config_manager, storage_manager, disks, tmp_path):
+    source = make_qcow2(disks / 'a.qcow2')
+    add_vm(config_manager, 'a', source)
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b.qcow2', backing=source))
+
+    job = migrate(storage_manager, 'a')
+    assert job['status'] == 'failed'
+    assert 'b' in job['message']
+    assert (disks / 'a.qcow2').exists()
+    assert not (tmp_path / 'fast' / 'a' / 'a.qcow2').exists()
+    assert config_manager.get_vm_config('a')['disk_path'] == source
+
+
+def test_migrate_refuses_disk_used_by_other_vm_snapshot_chain(config_manager, storage_manager, disks):
+    """克隆已经展开（当前磁盘不再有后端），但它的快照层仍以原磁盘为后端"""
+    source = make_qcow2(disks / 'a.qcow2')
+    add_vm(config_manager, 'a', source)
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b-flat.qcow2'))
+    add_snapshot(config_manager, 'b', 'b_snap', make_qcow2(disks / 'b-snap.qcow2', backing=source))
+
+    from ltwin_manager.utils.chain_maintenance import get_chain_maintenance
+    assert get_chain_maintenance(config_manager).chain_users([source], exclude_vm='a') == {source: {'b'}}
+
+    job = migrate(storage_manager, 'a')
+    assert job['status'] == 'failed'
+    assert (disks / 'a.qcow2').exists()
+
+
+def test_migrate_removes_unused_source(config_manager, storage_manager, disks, tmp_path):
+    source = make_qcow2(disks / 'a.qcow2')
+    add_vm(config_manager, 'a', source)
+    add_vm(config_manager, 'b', make_qcow2(disks / 'b.qcow2'))
+
+    job = migrate(storage_manager, 'a')
+    assert job['status'] == 'completed', job['message']
+    target = tmp_path / 'fast' / 'a' / 'a.qcow2'
+    assert target.exists()
+    assert not (disks / 'a.qcow2').exists()
+    assert config_manager.get_vm_config('a')['disk_path'] == str(target)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""虚拟机控制器：恢复含内存的快照后，界面启动入口从保存的内存状态继续运行"""
+
+import subprocess
+
+import pytest
+
+from conftest import add_vm
+from helpers import make_qcow2
+
+
+class FakeProcess:
+    def __init__(self, cmd, **kwargs):
+        self.cmd = cmd
+
+    def poll(self):
+        return None
+
+
+@pytest.fixture
+def launched(monkeypatch):
+    commands = []
+
+    def popen(cmd, **kwargs):
+        commands.append(cmd)
+        return FakeProcess(cmd)
+
+    monkeypatch.setattr(subprocess, 'Popen', popen)
+    return commands
+
+
+def test_start_vm_with_config_resumes_memory_state(config_manager, disks, launched):
+    from ltwin_manager.controllers.vm_controller import VMController
+
+    memory_state = disks / 'vm.mem'
+    memory_state.write_bytes(b'state')
+    add_vm(config_manager, 'vm', make_qcow2(disks / 'vm.qcow2'), vnc_port=5901,
+           resume_state={'memory_state': str(memory_state)})
+    controller = VMController(config_manager)
+
+    ui_config = dict(config_manager.get_vm_config('vm'))  # 界面持有的配置副本
+    assert controller.start_vm_with_config(ui_config)
+    assert launched[-1][launched[-1].index('-incoming') + 1] == f"exec:cat {memory_state}"
+    assert 'resume_state' not in config_manager.get_vm_config('vm')
+    assert 'resume_state' not in ui_config
+
+    # 只在恢复后的第一次启动时使用
+    assert controller.start_vm_with_config(dict(config_manager.get_vm_config('vm')))
+    assert '-incoming' not in launched[-1]
+
+
+def test_start_vm_with_config_loads_internal_snapshot(config_manager, disks, launched):
+    from ltwin_manager.controllers.vm_controller import VMController
+
+    add_vm(config_manager, 'vm', make_qcow2(disks / 'vm.qcow2'), vnc_port=5901, resume_state={'loadvm': 'snap1'})
+    controller = VMController(config_manager)
+    assert controller.start_vm_with_config(config_manager.get_vm_config('vm'))
+    assert launched[-1][launched[-1].index('-loadvm') + 1] == 'snap1'